@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Приближенная статистика по колонкам для больших таблиц
+Доли NULL, число уникальных значений и распределения оцениваются по выборке
+(TABLESAMPLE SYSTEM в БД или равномерная выборка из потока выгрузки) с 95% интервалами
+"""
+
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from export_queries import ESTIMATED_ROWS_QUERY
+from sketches import (
+    HLL_PRECISION, Z_95, HyperLogLog, ReservoirSample, estimate_distinct, quantile_interval, wilson_interval
+)
+
+logger = logging.getLogger(__name__)
+
+# В режиме auto статистика становится приближенной, когда в таблице больше строк
+APPROX_STATS_ROW_THRESHOLD = int(os.getenv('APPROX_STATS_ROW_THRESHOLD', 1000000))
+DEFAULT_SAMPLE_SIZE = 20000
+TOP_VALUES = 5
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _json_value(value):
+    """Значение для JSON-метаданных"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
+
+
+def column_distribution(values, population_rows):
+    """
+    Распределение непустых значений по выборке: квантили с интервалами для чисел,
+    частые значения с долями и интервалами Уилсона для остальных типов
+    """
+    values = pd.Series(values).dropna()
+    if values.empty:
+        return {}
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        ordered = np.sort(values.to_numpy())
+        return {
+            'quantiles': [
+                {
+                    'q': q,
+                    'value': _json_value(ordered[min(len(ordered) - 1, int(q * len(ordered)))]),
+                    'ci': [_json_value(bound) for bound in quantile_interval(ordered, q)]
+                }
+                for q in QUANTILES
+            ]
+        }
+
+    counts = values.astype(str).value_counts().head(TOP_VALUES)
+    return {
+        'top_values': [
+            {
+                'value': value,
+                'share': round(count / len(values), 4),
+                'ci': [round(bound, 4) for bound in wilson_interval(int(count), len(values), population=population_rows)]
+            }
+            for value, count in counts.items()
+        ]
+    }
+
+
+class ApproximateStats:
+    """
+    Приближенная статистика потока порций для TableArtifactWriter.
+
+    Уникальные значения колонок считаются HyperLogLog-скетчами по всем строкам
+    (память не зависит от числа значений), распределения — по равномерной
+    выборке потока. Счетчики NULL остаются точными: они ничего не стоят.
+    """
+
+    def __init__(self, sample_size=DEFAULT_SAMPLE_SIZE, precision=HLL_PRECISION):
+        self.sample = ReservoirSample(sample_size)
+        self.precision = precision
+        self.sketches = {}
+
+    def _sketch(self, col):
+        sketch = self.sketches.get(col)
+        if sketch is None:
+            sketch = self.sketches[col] = HyperLogLog(self.precision)
+        return sketch
+
+    def add_values(self, col, values):
+        """Учет значений колонки в скетче уникальных (без NULL)"""
+        values = pd.Series(values).dropna()
+        if values.empty:
+            return
+        if values.dtype == object:
+            # hash_array для object требует однородных значений — хешируем текстовое представление
+            values = values.astype(str)
+        self._sketch(col).add(values.to_numpy())
+
+    def add(self, df):
+        """Учет порции: выборка строк и скетчи по колонкам"""
+        self.sample.add(df)
+        for col in df.columns:
+            self.add_values(col, df[col])
+
+    def column_stats(self, col, record_count, null_count):
+        """Поля статистики колонки для метаданных"""
+        sketch = self._sketch(col)
+        sample_values = self.sample.frame[col] if col in self.sample.frame else pd.Series(dtype=object)
+        return {
+            'unique_count': sketch.count(),
+            'unique_count_ci': list(sketch.interval()),
+            'null_rate': round(null_count / record_count, 4) if record_count else 0.0,
+            'distribution': column_distribution(sample_values, record_count)
+        }
+
+    def summary(self):
+        return {
+            'mode': 'approximate',
+            'sample_rows': len(self.sample.frame),
+            'confidence': 0.95,
+            'unique_count_method': f'HyperLogLog (p={self.precision})'
+        }
+
+
+def sample_table(conn, table_name, sample_rows=DEFAULT_SAMPLE_SIZE, seed=42, pool=None):
+    """
+    Выборка строк таблицы через TABLESAMPLE SYSTEM.
+
+    Процент блоков рассчитывается по reltuples, поэтому запрос читает примерно
+    sample_rows строк, а не всю таблицу. SYSTEM выбирает страницы целиком:
+    для данных, физически упорядоченных по значению, интервалы занижены.
+    Возвращает (выборка, оценка числа строк, процент выборки).
+    """
+    if not _IDENTIFIER.match(table_name):
+        raise ValueError(f"Некорректное имя таблицы: {table_name}")
+    from database import get_pool
+
+    pool = pool or get_pool(application_name='databoard-approx-stats')
+    rows = pool.execute_prepared(conn, ESTIMATED_ROWS_QUERY, (table_name,))
+    if not rows or rows[0][0] is None:
+        raise ValueError(f"Таблица {table_name} не найдена")
+    estimated_rows = int(rows[0][0])
+
+    if estimated_rows <= sample_rows:
+        # Небольшая (или еще не проанализированная) таблица читается целиком
+        percent = 100.0
+        frame = pd.read_sql(f"SELECT * FROM {table_name}", conn)
+        estimated_rows = len(frame)
+    else:
+        percent = min(100.0, max(0.0001, 100.0 * sample_rows / estimated_rows))
+        frame = pd.read_sql(
+            f"SELECT * FROM {table_name} TABLESAMPLE SYSTEM (%s) REPEATABLE (%s)",
+            conn, params=(percent, seed)
+        )
+    conn.commit()
+    return frame, estimated_rows, percent
+
+
+def approximate_profile(table_name, sample_rows=DEFAULT_SAMPLE_SIZE, pool=None):
+    """Приближенный профиль таблицы БД: доли NULL, уникальные значения и распределения с интервалами"""
+    from database import get_pool
+
+    pool = pool or get_pool(application_name='databoard-approx-stats')
+    with pool.connection() as conn:
+        frame, estimated_rows, percent = sample_table(conn, table_name, sample_rows, pool=pool)
+
+    n = len(frame)
+    columns = []
+    for col in frame.columns:
+        nulls = int(frame[col].isnull().sum())
+        distinct, lower, upper = estimate_distinct(frame[col], estimated_rows)
+        columns.append({
+            'name': col,
+            'null_rate': round(nulls / n, 4) if n else 0.0,
+            'null_rate_ci': [round(bound, 4) for bound in wilson_interval(nulls, n, population=estimated_rows)],
+            'unique_count': distinct,
+            'unique_count_bounds': [lower, upper],
+            'distribution': column_distribution(frame[col], estimated_rows)
+        })
+
+    logger.info(
+        f"📐 {table_name}: выборка {n:,} строк ({percent:.3g}%) из ~{estimated_rows:,}"
+    )
+    return {
+        'table_name': table_name,
+        'mode': 'approximate',
+        'estimated_rows': estimated_rows,
+        'sample_rows': n,
+        'sample_percent': round(percent, 4),
+        'confidence': 0.95,
+        'z': Z_95,
+        'columns': columns
+    }
+
+
+def profile_frame(profile):
+    """Плоская таблица профиля для вывода (колонка, доля NULL, уникальные с интервалами)"""
+    return pd.DataFrame([
+        {
+            'column': col['name'],
+            'null_rate': col['null_rate'],
+            'null_rate_ci': f"{col['null_rate_ci'][0]:.4f}–{col['null_rate_ci'][1]:.4f}",
+            'unique_count': col['unique_count'],
+            'unique_bounds': f"{col['unique_count_bounds'][0]:,}–{col['unique_count_bounds'][1]:,}"
+        }
+        for col in profile['columns']
+    ])
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Потоковая запись артефактов выгрузки (CSV + Parquet + JSON метаданные)
+Принимает данные порциями, чтобы выгрузку можно было писать по мере чтения из БД
+"""
+
+import json
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from approx_stats import APPROX_STATS_ROW_THRESHOLD, ApproximateStats
+from dtype_compaction import compact_frame, merge_reports
+from parquet_tuning import DEFAULT_PARQUET_OPTIONS
+
+# Соответствие типов PostgreSQL типам Arrow — используется, когда первая порция
+# не позволяет вывести тип колонки (все значения NULL)
+PG_TO_ARROW_TYPES = {
+    'bool': pa.bool_(),
+    'int2': pa.int64(),
+    'int4': pa.int64(),
+    'int8': pa.int64(),
+    'float4': pa.float64(),
+    'float8': pa.float64(),
+    'numeric': pa.float64(),
+    'text': pa.string(),
+    'varchar': pa.string(),
+    'bpchar': pa.string(),
+    'date': pa.date32(),
+    'timestamp': pa.timestamp('us'),
+    'timestamptz': pa.timestamp('us', tz='UTC'),
+}
+
+
+def arrow_type_for_pg(type_name):
+    """Тип Arrow для имени типа PostgreSQL (None, если тип не сопоставлен)"""
+    return PG_TO_ARROW_TYPES.get(type_name)
+
+
+def _size_mb(path):
+    """Размер файла или папки (Parquet-набора) в MB"""
+    if path.is_dir():
+        size = sum(part.stat().st_size for part in path.rglob('*') if part.is_file())
+    else:
+        size = path.stat().st_size
+    return round(size / 1024 / 1024, 2)
+
+
+class TableArtifactWriter:
+    """
+    Запись одной выгружаемой таблицы в CSV и Parquet порциями.
+
+    Статистика по колонкам (null_count, unique_count, типы, пример данных)
+    накапливается по мере записи, поэтому итоговые метаданные совпадают
+    с метаданными, посчитанными по полному DataFrame. Дополнительно пишутся
+    Arrow IPC и копия в Excel; схема файлов фиксируется по первой порции.
+    """
+
+    def __init__(self, output_dir, table_name, base_filename, description="",
+                 schema_hints=None, parquet_options=None, stats_mode='exact',
+                 approx_threshold=APPROX_STATS_ROW_THRESHOLD, ipc_compression=None,
+                 row_order=None, sort_row_groups=None, parquet_dataset=False, enrich=None,
+                 excel=False, compact_dtypes=False):
+        """
+        stats_mode — 'exact'; 'approximate' считает уникальные значения HyperLogLog-скетчами
+        и добавляет распределения по выборке с интервалами (approx_stats.py); 'auto'
+        переключается на приближенный режим после approx_threshold строк.
+        ipc_compression — 'uncompressed' или 'lz4': Arrow IPC (Feather v2) рядом с Parquet;
+        без сжатия файл читается через memory map без копирования (feather_reader.py).
+        row_order — порядок строк выгрузки для метаданных; sort_row_groups —
+        [(колонка, 'ascending' | 'descending'), ...]: сортировка внутри каждого row group
+        для выгрузок без ORDER BY, чтобы min/max row group'ов оставались полезны при чтении.
+        parquet_dataset — Parquet как папка parquet_path/part-*.parquet, которую пишут
+        параллельные срезы (sharded_export.py); писатель ведет только CSV, IPC и статистику.
+        enrich(df) -> DataFrame — колонки, рассчитанные вне запроса (RFM-сегменты, rfm.py).
+        excel — копия в xlsx/<файл>.xlsx для бизнес-пользователей (excel_writer.py);
+        xlsxwriter импортируется только тогда.
+        compact_dtypes — сжатие типов каждой порции (dtype_compaction.py), память до/после
+        попадает в метаданные. В файлах целые и float32 пишутся исходной разрядностью
+        (int64/float64): следующая порция может не поместиться в разрядность первой, а Parquet
+        все равно хранит int8/int16 как INT32. category остается словарем Arrow в Parquet,
+        а в IPC раскрывается в строки: формат IPC не допускает замены словаря между пакетами.
+        """
+        self.output_dir = output_dir
+        self.table_name = table_name
+        self.description = description
+        self.schema_hints = schema_hints or {}
+        # Кодек, уровень, словарное кодирование и размер row group (профиль из parquet_tuning.py)
+        self.parquet_options = dict(DEFAULT_PARQUET_OPTIONS, **(parquet_options or {}))
+        self.stats_mode = stats_mode
+        self.approx_threshold = approx_threshold
+
+        self.csv_path = output_dir / 'csv' / f"{base_filename}.csv"
+        self.parquet_dataset = parquet_dataset
+        self.parquet_path = output_dir / 'parquet' / (base_filename if parquet_dataset else f"{base_filename}.parquet")
+        self.metadata_path = output_dir / 'json' / f"{base_filename}_metadata.json"
+        self.ipc_compression = ipc_compression
+        self.ipc_path = output_dir / 'feather' / f"{base_filename}.feather" if ipc_compression else None
+        self.excel_path = output_dir / 'xlsx' / f"{base_filename}.xlsx" if excel else None
+        self.row_order = row_order or {'mode': 'unordered', 'sort_key': None}
+        self.sort_row_groups = [tuple(key) for key in sort_row_groups] if sort_row_groups else None
+        self.extra_metadata = {}
+        self.enrich = enrich
+        self.compact_dtypes = compact_dtypes
+        # Колонки, приведенные к компактным типам (dtype_compaction.py)
+        self._compacted_columns = set()
+
+        self.record_count = 0
+        self.columns = None
+        self._dtypes = {}
+        self._null_counts = {}
+        self._unique_values = {}
+        self._sample = []
+        self._schema = None
+        self._parquet_writer = None
+        self._ipc_writer = None
+        self._excel_writer = None
+        # Порции копятся до размера row group, чтобы потоковая запись давала row group'ы профиля
+        self._pending = []
+        self._pending_rows = 0
+        # В режиме auto выборка строк ведется с первой порции, скетчи — с момента переключения
+        self._approx = ApproximateStats() if stats_mode in ('approximate', 'auto') else None
+        self._approximate = stats_mode == 'approximate'
+
+    def write(self, df):
+        """Запись очередной порции данных"""
+        if df is None or (df.empty and self.columns is not None):
+            return
+        if self.compact_dtypes and 'dtype_compaction' not in df.attrs:
+            df = compact_frame(df, self.table_name)
+        compaction = df.attrs.get('dtype_compaction')
+        if compaction:
+            self.extra_metadata['dtype_compaction'] = merge_reports(
+                self.extra_metadata.get('dtype_compaction'), compaction
+            )
+            self._compacted_columns.update(compaction['columns'])
+        if self.enrich is not None:
+            df = self.enrich(df)
+
+        first_chunk = self.columns is None
+        if first_chunk:
+            self.columns = list(df.columns)
+            self._sample = df.head(3).to_dict('records')
+
+        df.to_csv(self.csv_path, mode='w' if first_chunk else 'a', header=first_chunk,
+                  index=False, encoding='utf-8')
+
+        table = self._to_arrow(df)
+        if not self.parquet_dataset:
+            self._write_parquet(table)
+        if self.ipc_path is not None:
+            self._write_ipc(table)
+        if self.excel_path is not None:
+            self._write_excel(df)
+
+        self._update_stats(df)
+        self.record_count += len(df)
+        if self.stats_mode == 'auto' and not self._approximate and self.record_count > self.approx_threshold:
+            self._switch_to_approximate()
+
+    def write_records(self, records, columns):
+        """Запись порции строк (кортежей) в виде DataFrame, как это делает pd.read_sql"""
+        self.write(pd.DataFrame.from_records(records, columns=columns, coerce_float=True))
+
+    def _write_parquet(self, table):
+        """Запись порции в Parquet с учетом размера row group из профиля"""
+        options = self.parquet_options
+        if self._parquet_writer is None:
+            extra = {}
+            sorting_columns = self._sorting_columns(table.schema)
+            if sorting_columns:
+                extra['sorting_columns'] = sorting_columns
+            self._parquet_writer = pq.ParquetWriter(
+                self.parquet_path, table.schema,
+                compression=options['compression'],
+                compression_level=options['compression_level'],
+                use_dictionary=options['use_dictionary'],
+                **extra
+            )
+
+        row_group_size = options['row_group_size']
+        if not row_group_size:
+            # Порция пишется одним или несколькими row group'ами — сортировка порции упорядочивает каждый
+            self._parquet_writer.write_table(self._sort_row_group(table))
+            return
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        if self._pending_rows >= row_group_size:
+            self._flush_row_groups(final=False)
+
+    def _write_ipc(self, table):
+        """Запись порции в Arrow IPC (Feather v2) пакетами записей"""
+        table = self._decode_dictionaries(table)
+        if self._ipc_writer is None:
+            self.ipc_path.parent.mkdir(exist_ok=True)
+            compression = None if self.ipc_compression == 'uncompressed' else self.ipc_compression
+            self._ipc_writer = pa.ipc.new_file(
+                self.ipc_path, table.schema, options=pa.ipc.IpcWriteOptions(compression=compression)
+            )
+        self._ipc_writer.write_table(table)
+
+    def _write_excel(self, df):
+        if self._excel_writer is None:
+            from excel_writer import ExcelStreamWriter
+            self.excel_path.parent.mkdir(exist_ok=True)
+            self._excel_writer = ExcelStreamWriter(self.excel_path, self.table_name)
+        self._excel_writer.write(df)
+
+    def _flush_row_groups(self, final):
+        """Запись накопленных порций полными row group'ами (остаток — при final)"""
+        if not self._pending:
+            return
+        row_group_size = self.parquet_options['row_group_size']
+        table = pa.concat_tables(self._pending)
+        full_rows = table.num_rows if final else table.num_rows - table.num_rows % row_group_size
+        if full_rows and self.sort_row_groups:
+            for offset in range(0, full_rows, row_group_size):
+                group = table.slice(offset, min(row_group_size, full_rows - offset))
+                self._parquet_writer.write_table(self._sort_row_group(group), row_group_size=row_group_size)
+        elif full_rows:
+            self._parquet_writer.write_table(table.slice(0, full_rows), row_group_size=row_group_size)
+        rest = table.slice(full_rows)
+        self._pending = [rest] if rest.num_rows else []
+        self._pending_rows = rest.num_rows
+
+    def _sort_row_group(self, table):
+        """Сортировка строк row group по sort_row_groups (NULL — в конце)"""
+        if not self.sort_row_groups:
+            return table
+        return table.sort_by(list(self.sort_row_groups))
+
+    def _sorting_columns(self, schema):
+        """Порядок row group'ов для метаданных Parquet (SortingColumn есть в pyarrow >= 13)"""
+        if not self.sort_row_groups or not hasattr(pq, 'SortingColumn'):
+            return None
+        return [
+            pq.SortingColumn(schema.get_field_index(column), descending=order == 'descending', nulls_first=False)
+            for column, order in self.sort_row_groups
+        ]
+
+    @staticmethod
+    def _decode_dictionaries(table):
+        """Словарные колонки как обычные: у каждой порции свой словарь"""
+        for i, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+        return table
+
+    def _file_type(self, field):
+        """Тип колонки в файлах: сжатые числа — исходной разрядности, словарь — с индексами int32"""
+        if field.name not in self._compacted_columns:
+            return field.type
+        if pa.types.is_integer(field.type):
+            return pa.int64()
+        if pa.types.is_floating(field.type):
+            return pa.float64()
+        if pa.types.is_dictionary(field.type):
+            return pa.dictionary(pa.int32(), field.type.value_type)
+        return field.type
+
+    def _to_arrow(self, df):
+        """Приведение порции к схеме, зафиксированной по первой порции"""
+        if self._schema is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            schema = table.schema
+            for i, field in enumerate(schema):
+                hint = self.schema_hints.get(field.name)
+                if pa.types.is_null(field.type) and hint is not None:
+                    schema = schema.set(i, pa.field(field.name, hint))
+                elif self._file_type(field) != field.type:
+                    schema = schema.set(i, field.with_type(self._file_type(field)))
+            self._schema = schema
+            if schema.equals(table.schema):
+                return table
+        return pa.Table.from_pandas(df, schema=self._schema, preserve_index=False, safe=False)
+
+    def _update_stats(self, df):
+        """Накопление статистики по колонкам"""
+        for col in df.columns:
+            dtype = df[col].dtype
+            previous = self._dtypes.get(col)
+            if previous is None:
+                self._dtypes[col] = dtype
+            elif previous != dtype:
+                try:
+                    self._dtypes[col] = np.result_type(previous, dtype)
+                except TypeError:
+                    self._dtypes[col] = np.dtype('O')
+
+            self._null_counts[col] = self._null_counts.get(col, 0) + int(df[col].isnull().sum())
+            if self._approximate:
+                self._approx.add_values(col, df[col])
+            else:
+                self._unique_values.setdefault(col, []).append(pd.unique(df[col].dropna()))
+        if self._approx is not None:
+            self._approx.sample.add(df)
+
+    def _switch_to_approximate(self):
+        """Переход на скетчи: накопленные уникальные значения переносятся в HyperLogLog"""
+        for col, chunks in self._unique_values.items():
+            for chunk in chunks:
+                self._approx.add_values(col, chunk)
+        self._unique_values.clear()
+        self._approximate = True
+
+    def _unique_count(self, col):
+        """Точное число уникальных значений по всем порциям"""
+        chunks = self._unique_values.get(col, [])
+        if not chunks:
+            return 0
+        if len(chunks) == 1:
+            return len(chunks[0])
+        return len(pd.unique(np.concatenate([np.asarray(chunk, dtype=object) for chunk in chunks])))
+
+    def _column_stats(self, col):
+        """Статистика колонки для метаданных (точная или приближенная)"""
+        stats = {
+            'name': col,
+            'dtype': str(self._dtypes[col]),
+            'null_count': self._null_counts[col]
+        }
+        if self._approximate:
+            stats.update(self._approx.column_stats(col, self.record_count, self._null_counts[col]))
+        else:
+            stats['unique_count'] = self._unique_count(col)
+        return stats
+
+    def abort(self):
+        """Прерывание записи с удалением частично записанных файлов"""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self._ipc_writer is not None:
+            self._ipc_writer.close()
+            self._ipc_writer = None
+        if self._excel_writer is not None:
+            self._excel_writer.close()
+            self._excel_writer = None
+        self._pending = []
+        for path in (self.csv_path, self.parquet_path, self.metadata_path, self.ipc_path, self.excel_path):
+            if path is not None and path.is_dir():
+                shutil.rmtree(path)
+            elif path is not None and path.exists():
+                path.unlink()
+        self._unique_values.clear()
+
+    def close(self):
+        """Завершение записи и сохранение метаданных; возвращает словарь метаданных"""
+        if self._parquet_writer is not None:
+            self._flush_row_groups(final=True)
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self._ipc_writer is not None:
+            self._ipc_writer.close()
+            self._ipc_writer = None
+        excel_sheets = None
+        if self._excel_writer is not None:
+            excel_sheets = self._excel_writer.close()
+            self._excel_writer = None
+
+        columns = self.columns or []
+        metadata = {
+            'table_name': self.table_name,
+            'description': self.description,
+            'export_timestamp': datetime.now().isoformat(),
+            'record_count': self.record_count,
+            'column_count': len(columns),
+            'columns': [self._column_stats(col) for col in columns],
+            'stats': self._approx.summary() if self._approximate else {'mode': 'exact'},
+            'data_types': {col: str(self._dtypes[col]) for col in columns},
+            'sample_data': self._sample,
+            'file_sizes': {
+                'csv_mb': _size_mb(self.csv_path),
+                'parquet_mb': _size_mb(self.parquet_path)
+            },
+            'parquet_settings': self.parquet_options,
+            # Порядок строк: sorted (ORDER BY запроса), primary_key (порционная выгрузка по ключу)
+            # или unordered (без ORDER BY); row_group_sort — сортировка внутри row group'ов Parquet
+            'row_order': dict(self.row_order, row_group_sort=self.sort_row_groups),
+            # Пути относительно папки экспорта — по ним local_analytics.py находит файлы
+            'files': {
+                'csv': self.csv_path.relative_to(self.output_dir).as_posix(),
+                'parquet': self.parquet_path.relative_to(self.output_dir).as_posix(),
+                'metadata': self.metadata_path.relative_to(self.output_dir).as_posix()
+            }
+        }
+        if self.ipc_path is not None and self.ipc_path.exists():
+            metadata['file_sizes']['arrow_mb'] = _size_mb(self.ipc_path)
+            metadata['files']['arrow'] = self.ipc_path.relative_to(self.output_dir).as_posix()
+            metadata['arrow_compression'] = self.ipc_compression
+        if excel_sheets is not None:
+            metadata['file_sizes']['xlsx_mb'] = _size_mb(self.excel_path)
+            metadata['files']['xlsx'] = self.excel_path.relative_to(self.output_dir).as_posix()
+            # Листы книги: при пределе строк Excel таблица продолжается на <таблица>_2, ...
+            metadata['excel_sheets'] = excel_sheets
+        metadata.update(self.extra_metadata)
+
+        with open(self.metadata_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+
+        self._unique_values.clear()
+        return metadata
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Асинхронный экспорт аналитических таблиц
+Запросы выполняются параллельно через asyncpg, запись файлов идет в пуле потоков,
+поэтому чтение из БД и запись на диск перекрываются по времени
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import asyncpg
+
+from artifact_writer import arrow_type_for_pg
+from database import ANALYTICS_WORK_MEM, DEFAULT_STATEMENT_TIMEOUT_MS, get_db_config
+from export_data_artifacts import DEFAULT_CHUNK_ROWS, DataExporter, setup_logging
+from daily_rollup import ROLLUP_TABLE
+from export_queries import BASE_TABLE_SPECS, EXPORT_SPECS, MATVIEW_POPULATED_QUERY, ROLLUP_READY_QUERY
+from region_resolver import prepare_region_mapping
+from sharded_export import DEFAULT_SHARDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_QUERIES = 3
+DEFAULT_BATCH_SIZE = 20000
+# Максимум порций в очереди между чтением и записью: при заполнении чтение ждет
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_WRITER_THREADS = 4
+
+_END_OF_STREAM = object()
+
+
+def _write_records(writer, records, columns):
+    """Запись порции asyncpg.Record (выполняется в потоке-писателе)"""
+    writer.write_records([tuple(record) for record in records], columns)
+
+
+class AsyncDataExporter(DataExporter):
+    """
+    Асинхронный режим DataExporter.
+
+    Каждая таблица выгружается парой задач: чтение курсором asyncpg порциями
+    по batch_size строк и запись порций в CSV/Parquet в пуле потоков.
+    Между ними ограниченная очередь (backpressure). Артефакты и манифест
+    совпадают с результатом DataExporter.run_export.
+    """
+
+    def __init__(self, output_dir='exported_data',
+                 max_concurrent_queries=DEFAULT_MAX_CONCURRENT_QUERIES,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 queue_size=DEFAULT_QUEUE_SIZE,
+                 writer_threads=DEFAULT_WRITER_THREADS,
+                 use_views=True,
+                 use_rollup=True,
+                 include_base_tables=False,
+                 stats_mode='auto',
+                 table_stats_modes=None,
+                 arrow_ipc=None,
+                 resume=False,
+                 chunk_rows=DEFAULT_CHUNK_ROWS,
+                 unordered_tables=None,
+                 sort_row_groups=False,
+                 sharded_tables=None,
+                 shards=DEFAULT_SHARDS,
+                 use_rfm=True,
+                 compact_dtypes=True,
+                 excel_tables=None):
+        """Инициализация асинхронного экспортера"""
+        super().__init__(output_dir, use_views=use_views, use_rollup=use_rollup,
+                         include_base_tables=include_base_tables, stats_mode=stats_mode,
+                         table_stats_modes=table_stats_modes, arrow_ipc=arrow_ipc,
+                         resume=resume, chunk_rows=chunk_rows,
+                         unordered_tables=unordered_tables, sort_row_groups=sort_row_groups,
+                         sharded_tables=sharded_tables, shards=shards, use_rfm=use_rfm,
+                         compact_dtypes=compact_dtypes, excel_tables=excel_tables)
+        self.max_concurrent_queries = max_concurrent_queries
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.writer_threads = writer_threads
+
+    async def create_pool(self):
+        """Пул asyncpg с теми же настройками сессии, что и у синхронного пула"""
+        config = get_db_config('databoard-export-async')
+        statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT_MS', str(DEFAULT_STATEMENT_TIMEOUT_MS))
+        return await asyncpg.create_pool(
+            host=config['host'],
+            port=int(config['port']),
+            database=config['database'],
+            user=config['user'],
+            password=config['password'],
+            min_size=1,
+            max_size=self.max_concurrent_queries,
+            server_settings={
+                'application_name': config['application_name'],
+                'work_mem': ANALYTICS_WORK_MEM,
+                'statement_timeout': statement_timeout
+            }
+        )
+
+    async def _spec_query_async(self, conn, spec):
+        """Запрос выгрузки: из дневных агрегатов или представления, если они доступны"""
+        if spec.get('rollup_query') and self.use_rollup:
+            if await conn.fetchval(ROLLUP_READY_QUERY, ROLLUP_TABLE):
+                logger.info(f"⚡ {spec['table_name']}: чтение из дневных агрегатов {ROLLUP_TABLE}")
+                return spec['rollup_query']
+            logger.info(f"ℹ️ {spec['table_name']}: дневные агрегаты не построены")
+
+        view = spec.get('view')
+        if view and self.use_views:
+            if await conn.fetchval(MATVIEW_POPULATED_QUERY, view):
+                logger.info(f"⚡ {spec['table_name']}: чтение из представления {view}")
+                return spec['view_query']
+            logger.info(f"ℹ️ {spec['table_name']}: представление {view} не заполнено, расчет по базовым таблицам")
+        return self.base_query(spec)
+
+    async def _fetch_batches(self, pool, spec, queue):
+        """Чтение результата запроса порциями в очередь"""
+        try:
+            async with pool.acquire() as conn:
+                # Курсоры asyncpg работают только внутри транзакции
+                async with conn.transaction(readonly=True):
+                    stmt = await conn.prepare(await self._spec_query_async(conn, spec))
+                    await queue.put(stmt.get_attributes())
+
+                    cursor = await stmt.cursor()
+                    while True:
+                        records = await cursor.fetch(self.batch_size)
+                        if not records:
+                            break
+                        await queue.put(records)
+        except asyncio.CancelledError:
+            # Отмена приходит только после ошибки писателя — очередь уже никто не читает
+            raise
+        except Exception:
+            await queue.put(_END_OF_STREAM)
+            raise
+        await queue.put(_END_OF_STREAM)
+
+    async def _consume_batches(self, writer, queue, executor):
+        """Передача порций из очереди писателю в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        columns = None
+        while True:
+            item = await queue.get()
+            if item is _END_OF_STREAM:
+                return
+            if columns is None:
+                # Первый элемент очереди — описание колонок результата
+                columns = [attribute.name for attribute in item]
+                writer.schema_hints = {
+                    attribute.name: arrow_type_for_pg(attribute.type.name)
+                    for attribute in item
+                    if arrow_type_for_pg(attribute.type.name) is not None
+                }
+                continue
+            await loop.run_in_executor(executor, _write_records, writer, item, columns)
+
+    async def export_table_async(self, pool, spec, executor):
+        """Асинхронный экспорт одной таблицы"""
+        table_name = spec['table_name']
+        if self.resume_table(table_name):
+            return True
+        logger.info(f"📊 Экспорт таблицы: {table_name}")
+        loop = asyncio.get_running_loop()
+
+        # Таблицы, которые считаются в Python (синхронный пул, поток-писатель)
+        df = await loop.run_in_executor(executor, self.python_frame, spec)
+        if df is not None:
+            try:
+                return await loop.run_in_executor(executor, self.export_frame, table_name, df, spec['description'])
+            except Exception as e:
+                self.failed_tables.append(table_name)
+                logger.error(f"❌ Ошибка: {spec['title']}: {e}")
+                return False
+        if not spec.get('query'):
+            self.failed_tables.append(table_name)
+            return False
+
+        # Крупные таблицы с keyset — срезами или порциями по ключу через синхронный пул в потоке-писателе
+        try:
+            result = await loop.run_in_executor(executor, self.export_large_table, spec)
+        except Exception as e:
+            self.failed_tables.append(table_name)
+            logger.error(f"❌ {table_name}: ошибка выгрузки по ключу, продолжение — resume: {e}")
+            return False
+        if result is not None:
+            return result
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        writer = self.open_table_writer(table_name, spec['description'])
+        fetch_task = asyncio.create_task(self._fetch_batches(pool, spec, queue))
+
+        try:
+            await self._consume_batches(writer, queue, executor)
+            # Поднимет ошибку чтения, если запрос завершился с ошибкой
+            await fetch_task
+
+            if writer.record_count == 0:
+                await loop.run_in_executor(executor, writer.abort)
+                logger.warning(f"⚠️ Нет данных для экспорта: {table_name}")
+                return False
+
+            metadata = await loop.run_in_executor(executor, writer.close)
+        except Exception as e:
+            fetch_task.cancel()
+            await loop.run_in_executor(executor, writer.abort)
+            self.failed_tables.append(table_name)
+            logger.error(f"❌ Ошибка: {spec['title']}: {e}")
+            return False
+
+        logger.info(f"📄 CSV сохранен: {writer.csv_path}")
+        logger.info(f"📦 Parquet сохранен: {writer.parquet_path}")
+        if writer.ipc_path is not None:
+            logger.info(f"🏹 Arrow IPC сохранен: {writer.ipc_path}")
+        if writer.excel_path is not None:
+            logger.info(f"📗 Excel сохранен: {writer.excel_path} (листов: {len(metadata['excel_sheets'])})")
+        logger.info(f"📋 Метаданные сохранены: {writer.metadata_path}")
+        self.complete_table(table_name, metadata)
+        logger.info(f"✅ Экспорт завершен: {table_name} ({writer.record_count:,} записей)")
+        return True
+
+    async def run_export_async(self, table_names=None):
+        """Параллельный экспорт таблиц из EXPORT_SPECS"""
+        logger.info("🚀 НАЧАЛО АСИНХРОННОГО ЭКСПОРТА ДАННЫХ")
+        logger.info("=" * 50)
+
+        try:
+            pool = await self.create_pool()
+            logger.info("✅ Подключение к базе данных установлено")
+        except Exception as e:
+            logger.error(f"❌ Ошибка подключения к БД: {e}")
+            return False
+
+        specs = [EXPORT_SPECS[name] for name in (table_names or EXPORT_SPECS)]
+        if self.include_base_tables and table_names is None:
+            specs += list(BASE_TABLE_SPECS.values())
+        try:
+            with ThreadPoolExecutor(max_workers=self.writer_threads,
+                                    thread_name_prefix='export-writer') as executor:
+                # Справочник регионов: сопоставляются только новые адреса
+                await asyncio.get_running_loop().run_in_executor(executor, prepare_region_mapping)
+                results = await asyncio.gather(
+                    *(self.export_table_async(pool, spec, executor) for spec in specs)
+                )
+        finally:
+            await pool.close()
+            logger.info("🔌 Пул соединений закрыт")
+
+        # Порядок таблиц в манифесте как у синхронного экспорта, а не по времени завершения
+        order = {spec['table_name']: i for i, spec in enumerate(specs)}
+        self.export_manifest['exported_tables'].sort(key=order.get)
+
+        if self.failed_tables:
+            logger.error(
+                f"⏸️ Выгрузка не завершена ({', '.join(self.failed_tables)}), файлы оставлены в "
+                f"{self.work_dir} — продолжение: export --resume"
+            )
+            return False
+
+        self.create_export_summary()
+        self.commit_export()
+        self.log_export_totals(sum(results), len(specs))
+        return True
+
+    def run_export(self):
+        """Запуск асинхронного экспорта (замена DataExporter.run_export)"""
+        try:
+            return asyncio.run(self.run_export_async())
+        except Exception as e:
+            logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА ЭКСПОРТА: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    # Создание папки для экспорта с timestamp
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_directory = f'exported_data_{timestamp}'
+
+    exporter = AsyncDataExporter(output_directory)
+    success = exporter.run_export()
+
+    if success:
+        print(f"\n🎯 Данные успешно экспортированы в папку: {output_directory}")
+        print("📋 Для просмотра деталей см. файл export_manifest.json")
+    else:
+        print("\n❌ Экспорт завершился с ошибками. Проверьте логи.")
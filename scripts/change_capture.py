@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Очистка почти в реальном времени по захвату изменений
+Триггеры на orders, order_items, customers и payments записывают ключи измененных строк
+в очередь cleaning_change_queue и отправляют NOTIFY; воркер слушает канал и применяет
+правила очистки data_cleaning.py к микропорциям ключей через секунды после записи
+"""
+
+import logging
+import os
+import select
+import time
+from collections import Counter, deque
+
+import psycopg2
+
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+QUEUE_TABLE = 'cleaning_change_queue'
+NOTIFY_CHANNEL = 'cleaning_changes'
+DEFAULT_BATCH_SIZE = int(os.getenv('CHANGE_CAPTURE_BATCH_SIZE', 1000))
+# После первого уведомления воркер ждет окно, чтобы собрать порцию из нескольких транзакций
+DEFAULT_BATCH_WINDOW_SECONDS = float(os.getenv('CHANGE_CAPTURE_WINDOW_SECONDS', 0.5))
+# Опрос очереди без уведомлений (потерянный NOTIFY, переподключение)
+DEFAULT_POLL_SECONDS = 30
+DEFAULT_REPORT_SECONDS = 60
+
+# Ключ очереди по таблице: правила проверяются для всех строк с этим ключом
+CAPTURED_TABLES = {
+    'orders': 'order_id',
+    'order_items': 'order_id',
+    'customers': 'customer_id',
+    'payments': 'order_id',
+}
+
+# Построчные правила data_cleaning.py (условие удаления). Дубликаты и заказы без позиций
+# остаются пакетной очистке: заказ может быть записан раньше своих позиций
+ROW_RULES = {
+    'orders': {
+        'future_date': "order_date > CURRENT_DATE + INTERVAL '1 day'",
+        'missing_customer': "customer_id IS NULL",
+    },
+    'order_items': {
+        'invalid_quantity': "quantity IS NULL OR quantity <= 0 OR quantity > 1000",
+        'invalid_price': "price_per_item IS NULL OR price_per_item <= 0 OR price_per_item > 1000000",
+        'missing_product': "product_id IS NULL",
+    },
+    'customers': {
+        'missing_id': "customer_id IS NULL",
+    },
+    'payments': {
+        'missing_order': "order_id IS NULL",
+        'invalid_amount': "paid_amount IS NULL OR paid_amount < 0",
+    },
+}
+
+# Связи (дочерняя таблица, колонка, родительская таблица, колонка) — как integrity.CLEANING_RELATIONSHIPS.
+# Проверяются для новых дочерних строк и для детей удаленных родителей (DELETE тоже попадает в очередь)
+REFERENCES = [
+    ('orders', 'customer_id', 'customers', 'customer_id'),
+    ('order_items', 'order_id', 'orders', 'order_id'),
+    ('payments', 'order_id', 'orders', 'order_id'),
+]
+
+KEY_TYPE_QUERY = """
+SELECT format_type(a.atttypid, a.atttypmod)
+FROM pg_attribute a
+WHERE a.attrelid = to_regclass(%s) AND a.attname = %s AND NOT a.attisdropped
+"""
+
+# Порция забирается и удаляется из очереди в транзакции очистки: при ошибке ключи возвращаются.
+# SKIP LOCKED позволяет запускать несколько воркеров; задержка считается часами сервера
+CLAIM_BATCH_QUERY = f"""
+DELETE FROM {QUEUE_TABLE}
+WHERE id IN (
+    SELECT id FROM {QUEUE_TABLE}
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING table_name, key, operation, EXTRACT(EPOCH FROM clock_timestamp() - changed_at)
+"""
+
+QUEUE_STATUS_QUERY = f"""
+SELECT table_name, operation, COUNT(*), EXTRACT(EPOCH FROM clock_timestamp() - MIN(changed_at))
+FROM {QUEUE_TABLE}
+GROUP BY table_name, operation
+ORDER BY table_name, operation
+"""
+
+
+def _capture_function_sql(table, key_column, rows, operation):
+    """
+    Функция триггера уровня выражения: ключи строк из таблицы переходов одним INSERT
+    и одно уведомление на выражение (одинаковые NOTIFY в транзакции PostgreSQL схлопывает)
+    """
+    return f"""
+    CREATE OR REPLACE FUNCTION {QUEUE_TABLE}_{table}_{operation.lower()}() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO {QUEUE_TABLE} (table_name, key, operation)
+        SELECT DISTINCT '{table}', {key_column}::text, '{operation}' FROM {rows};
+        IF FOUND THEN
+            PERFORM pg_notify('{NOTIFY_CHANNEL}', TG_TABLE_NAME);
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """
+
+
+class ChangeCapture:
+    """
+    Установка захвата изменений: очередь, функции и триггеры.
+
+    INSERT и UPDATE всех таблиц пишут ключи новых версий строк (операция 'W'),
+    DELETE родительских таблиц (customers, orders) — ключи удаленных строк ('D'),
+    чтобы воркер проверил их детей. Триггеры уровня выражения с таблицами переходов:
+    массовая вставка — один INSERT в очередь, а не по строке
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool or get_pool(application_name='databoard-change-capture')
+
+    def _triggers(self):
+        parents = {parent for _, _, parent, _ in REFERENCES}
+        for table, key_column in CAPTURED_TABLES.items():
+            yield table, key_column, 'W', [('insert', 'INSERT'), ('update', 'UPDATE')], 'NEW TABLE AS changed_rows'
+            if table in parents:
+                yield table, key_column, 'D', [('delete', 'DELETE')], 'OLD TABLE AS changed_rows'
+
+    def install(self):
+        """Создание очереди и триггеров (повторный вызов пересоздает триггеры)"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (
+                        id BIGSERIAL PRIMARY KEY,
+                        table_name TEXT NOT NULL,
+                        key TEXT,
+                        operation CHAR(1) NOT NULL,
+                        changed_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+                    )
+                """)
+                for table, key_column, operation, events, referencing in self._triggers():
+                    cur.execute(_capture_function_sql(table, key_column, 'changed_rows', operation))
+                    for suffix, event in events:
+                        # Таблица переходов допускается только у триггера с одним событием
+                        cur.execute(f"DROP TRIGGER IF EXISTS {QUEUE_TABLE}_{suffix} ON {table}")
+                        cur.execute(f"""
+                            CREATE TRIGGER {QUEUE_TABLE}_{suffix}
+                            AFTER {event} ON {table}
+                            REFERENCING {referencing}
+                            FOR EACH STATEMENT
+                            EXECUTE FUNCTION {QUEUE_TABLE}_{table}_{operation.lower()}()
+                        """)
+                    logger.info(f"✅ Захват изменений {table} ({operation}): {', '.join(e for _, e in events)}")
+            conn.commit()
+
+    def uninstall(self, drop_queue=False):
+        """Удаление триггеров и функций (очередь — только с drop_queue)"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                for table, _, operation, events, _ in self._triggers():
+                    for suffix, _ in events:
+                        cur.execute(f"DROP TRIGGER IF EXISTS {QUEUE_TABLE}_{suffix} ON {table}")
+                    cur.execute(f"DROP FUNCTION IF EXISTS {QUEUE_TABLE}_{table}_{operation.lower()}()")
+                if drop_queue:
+                    cur.execute(f"DROP TABLE IF EXISTS {QUEUE_TABLE}")
+            conn.commit()
+        logger.info("🗑️ Захват изменений отключен")
+
+    def status(self):
+        """Глубина очереди: [(таблица, операция, ключей, возраст старейшего, с)]"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass(%s)", (QUEUE_TABLE,))
+                if cur.fetchone()[0] is None:
+                    raise ValueError(f"Очередь {QUEUE_TABLE} не создана (capture install)")
+                cur.execute(QUEUE_STATUS_QUERY)
+                rows = cur.fetchall()
+            conn.commit()
+        return rows
+
+
+class WorkerMetrics:
+    """Пропускная способность и задержка воркера: от записи строки до фиксации очистки"""
+
+    def __init__(self, window=10000):
+        self.started = time.monotonic()
+        self.batches = 0
+        self.keys = 0
+        self.failures = 0
+        self.deleted = Counter()
+        self.lags = deque(maxlen=window)
+        self.busy_seconds = 0.0
+        self._reported = (self.started, 0)
+
+    def record(self, keys, lags, deleted, seconds):
+        self.batches += 1
+        self.keys += keys
+        self.deleted.update(deleted)
+        # Задержка ключа — возраст при захвате плюс время обработки порции
+        self.lags.extend(lag + seconds for lag in lags)
+        self.busy_seconds += seconds
+
+    def _lag_percentile(self, share):
+        if not self.lags:
+            return None
+        ordered = sorted(self.lags)
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))], 3)
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'batches': self.batches,
+            'keys': self.keys,
+            'failures': self.failures,
+            'rows_deleted': dict(self.deleted),
+            'keys_per_second': round(self.keys / elapsed, 1) if elapsed else 0.0,
+            'keys_per_busy_second': round(self.keys / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+            'lag_p50_seconds': self._lag_percentile(0.5),
+            'lag_p95_seconds': self._lag_percentile(0.95),
+            'lag_max_seconds': round(max(self.lags), 3) if self.lags else None,
+        }
+
+    def report(self):
+        """Строка лога: скорость с прошлого отчета и задержка по последним ключам"""
+        now = time.monotonic()
+        since, keys_before = self._reported
+        self._reported = (now, self.keys)
+        rate = (self.keys - keys_before) / (now - since) if now > since else 0.0
+        snapshot = self.snapshot()
+        logger.info(
+            f"📈 Очистка по изменениям: {rate:.0f} ключей/с, всего {self.keys:,} ключей в {self.batches:,} порциях, "
+            f"задержка p50={snapshot['lag_p50_seconds']} s p95={snapshot['lag_p95_seconds']} s, "
+            f"удалено {sum(self.deleted.values()):,}, ошибок {self.failures}"
+        )
+
+
+class ChangeCleaningWorker:
+    """
+    Воркер очистки по очереди изменений.
+
+    Слушает NOTIFY отдельным соединением в autocommit, после уведомления ждет окно
+    batch_window и забирает порции до batch_size ключей, пока очередь не опустеет.
+    Порция очищается в одной транзакции с ее удалением из очереди: построчные правила
+    для записанных ключей и ссылочные — для новых детей и детей удаленных родителей.
+    Собственные удаления воркера тоже попадают в очередь и проверяются следующей порцией
+    """
+
+    def __init__(self, pool=None, batch_size=DEFAULT_BATCH_SIZE, batch_window=DEFAULT_BATCH_WINDOW_SECONDS,
+                 poll_seconds=DEFAULT_POLL_SECONDS, report_seconds=DEFAULT_REPORT_SECONDS):
+        self.pool = pool or get_pool(application_name='databoard-change-worker')
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.poll_seconds = poll_seconds
+        self.report_seconds = report_seconds
+        self.metrics = WorkerMetrics()
+        self._key_types = None
+
+    def _resolve_key_types(self, conn):
+        """Типы колонок ключей: ключи из очереди (text) приводятся к типу колонки, чтобы работали индексы"""
+        columns = set(CAPTURED_TABLES.items()) | {(child, column) for child, column, _, _ in REFERENCES}
+        key_types = {}
+        with conn.cursor() as cur:
+            for table, column in columns:
+                cur.execute(KEY_TYPE_QUERY, (table, column))
+                row = cur.fetchone()
+                key_types[(table, column)] = row[0] if row else 'text'
+        return key_types
+
+    def _key_filter(self, table, column):
+        """Условие: column из переданных ключей; NULL-ключ очереди соответствует строкам с NULL"""
+        key_type = self._key_types[(table, column)]
+        return f"({column} = ANY(%(keys)s::{key_type}[]) OR (%(nulls)s AND {column} IS NULL))"
+
+    def _delete(self, cur, table, column, condition, keys, nulls):
+        cur.execute(
+            f"DELETE FROM {table} WHERE {self._key_filter(table, column)} AND ({condition})",
+            {'keys': keys, 'nulls': nulls}
+        )
+        return cur.rowcount
+
+    def clean_batch(self, cur, written, deleted_parents):
+        """
+        Правила для порции: written и deleted_parents — {таблица: (ключи, есть NULL)}.
+        Возвращает {'таблица.правило': удалено строк}
+        """
+        removed = {}
+        for table, (keys, nulls) in written.items():
+            key_column = CAPTURED_TABLES[table]
+            for name, condition in ROW_RULES.get(table, {}).items():
+                removed[f"{table}.{name}"] = self._delete(cur, table, key_column, condition, keys, nulls)
+
+        for child, column, parent, parent_column in REFERENCES:
+            orphan = (f"{column} IS NOT NULL AND NOT EXISTS "
+                      f"(SELECT 1 FROM {parent} p WHERE p.{parent_column} = {child}.{column})")
+            # Новые дочерние строки: ключ очереди дочерней таблицы
+            if child in written:
+                keys, nulls = written[child]
+                removed[f"{child}.orphan"] = removed.get(f"{child}.orphan", 0) + self._delete(
+                    cur, child, CAPTURED_TABLES[child], orphan, keys, nulls)
+            # Дети удаленных родителей: ключ родителя — значение внешнего ключа
+            if parent in deleted_parents:
+                keys, _ = deleted_parents[parent]
+                removed[f"{child}.orphan"] = removed.get(f"{child}.orphan", 0) + self._delete(
+                    cur, child, column, orphan, keys, False)
+        return {name: count for name, count in removed.items() if count}
+
+    def process_batch(self):
+        """Одна порция очереди; возвращает число забранных записей (0 — очередь пуста)"""
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            if self._key_types is None:
+                self._key_types = self._resolve_key_types(conn)
+            with conn.cursor() as cur:
+                cur.execute(CLAIM_BATCH_QUERY, (self.batch_size,))
+                entries = cur.fetchall()
+                if not entries:
+                    conn.commit()
+                    return 0
+
+                groups = {'W': {}, 'D': {}}
+                for table, key, operation, _ in entries:
+                    keys = groups[operation].setdefault(table, set())
+                    keys.add(key)
+                batch = {
+                    operation: {
+                        table: (sorted(key for key in keys if key is not None), None in keys)
+                        for table, keys in tables.items()
+                    }
+                    for operation, tables in groups.items()
+                }
+                removed = self.clean_batch(cur, batch['W'], batch['D'])
+            conn.commit()
+
+        seconds = time.perf_counter() - started
+        self.metrics.record(len(entries), [float(entry[3]) for entry in entries], removed, seconds)
+        if removed:
+            logger.info(f"🧹 Порция {len(entries):,} ключей за {seconds * 1000:.0f} ms: удалено {removed}")
+        return len(entries)
+
+    def drain(self):
+        """Обработка порций, пока очередь не опустеет; ошибка порции возвращает ее ключи в очередь"""
+        total = 0
+        while True:
+            try:
+                processed = self.process_batch()
+            except psycopg2.Error as e:
+                self.metrics.failures += 1
+                logger.error(f"❌ Ошибка обработки порции (ключи остаются в очереди): {e}")
+                return total
+            total += processed
+            if processed < self.batch_size:
+                return total
+
+    def _listen(self):
+        """Отдельное соединение для LISTEN: держится все время работы и не занимает слот пула"""
+        conn = psycopg2.connect(**self.pool.db_config)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return conn
+
+    def run(self, iterations=None):
+        """
+        Основной цикл (iterations — число пробуждений, None — бесконечно).
+        Первый проход разбирает накопившуюся очередь, далее воркер ждет уведомлений
+        не дольше poll_seconds
+        """
+        listener = self._listen()
+        logger.info(
+            f"👂 Воркер очистки слушает {NOTIFY_CHANNEL}: порции до {self.batch_size} ключей, "
+            f"окно {self.batch_window} s"
+        )
+        last_report = time.monotonic()
+        completed = 0
+        try:
+            self.drain()
+            while iterations is None or completed < iterations:
+                ready, _, _ = select.select([listener], [], [], self.poll_seconds)
+                try:
+                    if ready:
+                        listener.poll()
+                        # Окно сбора порции: уведомления нескольких транзакций обрабатываются вместе
+                        time.sleep(self.batch_window)
+                        listener.poll()
+                        listener.notifies.clear()
+                except psycopg2.OperationalError as e:
+                    # Уведомления за время разрыва теряются, но ключи ждут в очереди
+                    logger.warning(f"⚠️ Соединение LISTEN потеряно, переподключение: {e}")
+                    listener.close()
+                    listener = self._listen()
+                self.drain()
+                completed += 1
+                if time.monotonic() - last_report >= self.report_seconds:
+                    self.metrics.report()
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            logger.info("⏹️ Воркер остановлен")
+        finally:
+            listener.close()
+            self.metrics.report()
+        return self.metrics.snapshot()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ChangeCleaningWorker().run()
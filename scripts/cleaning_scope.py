@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Инкрементальная очистка: водяные метки по таблицам
+Правила очистки применяются только к строкам, добавленным или измененным после
+прошлого запуска (updated_at / created_at или целочисленный первичный ключ),
+ссылочные правила — еще и к строкам, чьих родителей удалил текущий запуск.
+Периодически (и по запросу) выполняется полный проход
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_TABLE = 'cleaning_watermarks'
+TOUCHED_KEYS_TABLE = 'cleaning_touched_keys'
+# Колонки водяной метки в порядке предпочтения: updated_at ловит и изменения, created_at — только вставки
+WATERMARK_COLUMNS = ('updated_at', 'created_at')
+# Полный проход не реже раза в N дней: ловит то, что не видно по метке (удаления, правки без updated_at)
+FULL_PASS_INTERVAL_DAYS = int(os.getenv('CLEANING_FULL_PASS_DAYS', 7))
+
+TIMESTAMP_COLUMNS_QUERY = """
+SELECT column_name
+FROM information_schema.columns
+WHERE table_schema = current_schema() AND table_name = %s
+  AND data_type IN ('timestamp without time zone', 'timestamp with time zone', 'date')
+"""
+
+INTEGER_PRIMARY_KEY_QUERY = """
+SELECT a.attname
+FROM pg_index i
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+WHERE i.indrelid = to_regclass(%s) AND i.indisprimary
+  AND array_length(i.indkey, 1) = 1
+  AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+"""
+
+
+class CleaningScope:
+    """
+    Границы инкрементальной очистки для одного запуска.
+
+    begin() читает метки прошлого запуска из cleaning_watermarks и снимает новые
+    (максимум колонки метки на начало запуска — строки, добавленные во время очистки,
+    попадут в следующий запуск). Запуск полный, если full, у какой-либо таблицы нет
+    метки или последний полный проход старше full_pass_days; тогда условия — TRUE.
+
+    Условия для WHERE:
+    rows(table) — строки после метки (построчные правила);
+    keys(table, column) — значения column у таких строк (дубликаты по ключу);
+    references(table, column, parent) — строки после метки и строки, ссылающиеся на
+    ключи parent, удаленные в этом запуске (delete_sql записывает их во временную таблицу).
+    Значения меток подставляются литералами, чтобы запросы с LIKE '%...%' выполнялись без параметров.
+    commit() сохраняет новые метки после успешной очистки.
+    """
+
+    def __init__(self, conn, pipeline, tables, full=False, full_pass_days=FULL_PASS_INTERVAL_DAYS):
+        self.conn = conn
+        self.pipeline = pipeline
+        self.tables = list(tables)
+        self.force_full = full
+        self.full_pass_days = full_pass_days
+        self.full = True
+        self.columns = {}
+        self.previous = {}
+        self.current = {}
+
+    def _literal(self, value):
+        with self.conn.cursor() as cur:
+            return cur.mogrify("%s", (value,)).decode()
+
+    def _watermark_column(self, cur, table):
+        """
+        Колонки метки через запятую: updated_at и/или created_at (метка — наибольшая из них,
+        строки с пустым updated_at видны по created_at) или целочисленный первичный ключ.
+        None — у таблицы возможен только полный проход
+        """
+        cur.execute(TIMESTAMP_COLUMNS_QUERY, (table,))
+        timestamps = {row[0] for row in cur.fetchall()}
+        present = [column for column in WATERMARK_COLUMNS if column in timestamps]
+        if present:
+            return ','.join(present)
+        cur.execute(INTEGER_PRIMARY_KEY_QUERY, (table,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def _expression(self, table, alias=None):
+        """Выражение метки строки (с псевдонимом таблицы alias)"""
+        columns = [f"{alias}.{column}" if alias else column for column in self.columns[table].split(',')]
+        return columns[0] if len(columns) == 1 else f"GREATEST({', '.join(columns)})"
+
+    def _is_timestamp(self, table):
+        return self.columns[table].split(',')[0] in WATERMARK_COLUMNS
+
+    def begin(self):
+        """Чтение прошлых меток, снятие новых и выбор режима запуска"""
+        with self.conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                    pipeline TEXT NOT NULL,
+                    table_name TEXT NOT NULL,
+                    watermark_column TEXT,
+                    watermark TEXT,
+                    last_full_pass TIMESTAMPTZ,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (pipeline, table_name)
+                )
+            """)
+            cur.execute(
+                f"SELECT table_name, watermark_column, watermark, last_full_pass "
+                f"FROM {WATERMARK_TABLE} WHERE pipeline = %s",
+                (self.pipeline,)
+            )
+            stored = {row[0]: row[1:] for row in cur.fetchall()}
+
+            reasons = []
+            for table in self.tables:
+                column = self._watermark_column(cur, table)
+                self.columns[table] = column
+                if column is None:
+                    reasons.append(f"{table}: нет колонки метки")
+                    continue
+                cur.execute(f"SELECT MAX({self._expression(table)})::text FROM {table}")
+                self.current[table] = cur.fetchone()[0]
+
+                previous_column, watermark, last_full_pass = stored.get(table, (None, None, None))
+                if previous_column != column or watermark is None:
+                    reasons.append(f"{table}: нет метки")
+                elif last_full_pass is None or (
+                        datetime.now(timezone.utc) - last_full_pass > timedelta(days=self.full_pass_days)):
+                    reasons.append(f"{table}: полный проход старше {self.full_pass_days} дн.")
+                else:
+                    self.previous[table] = watermark
+
+            if self.force_full:
+                reasons.insert(0, 'запрошен полный проход')
+            self.full = bool(reasons)
+            if not self.full:
+                cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {TOUCHED_KEYS_TABLE} (table_name TEXT, key TEXT)")
+                cur.execute(f"TRUNCATE {TOUCHED_KEYS_TABLE}")
+        self.conn.commit()
+
+        if self.full:
+            logger.info(f"🧹 Очистка: полный проход ({'; '.join(reasons)})")
+        else:
+            marks = ', '.join(f"{t}.{self.columns[t]} > {self.previous[t]}" for t in self.tables)
+            logger.info(f"🧹 Очистка: инкрементально ({marks})")
+        return self
+
+    def rows(self, table, alias=None):
+        """Условие: строка table добавлена или изменена после прошлого запуска"""
+        if self.full:
+            return "TRUE"
+        # Для отметок времени граница включительно: строки с той же отметкой, что у метки,
+        # могли появиться после ее снятия; повторная проверка правил безвредна
+        operator = '>=' if self._is_timestamp(table) else '>'
+        return f"{self._expression(table, alias)} {operator} {self._literal(self.previous[table])}"
+
+    def keys(self, table, column, alias=None):
+        """Условие: значение column встречается у новых или измененных строк table"""
+        if self.full:
+            return "TRUE"
+        target = f"{alias}.{column}" if alias else column
+        return f"{target} IN (SELECT {column} FROM {table} WHERE {self.rows(table)})"
+
+    def references(self, table, column, parent, alias=None):
+        """Условие для ссылочного правила: новые строки и ссылки на удаленные в этом запуске ключи parent"""
+        if self.full:
+            return "TRUE"
+        target = f"{alias}.{column}" if alias else column
+        return (
+            f"({self.rows(table, alias)} OR {target}::text IN "
+            f"(SELECT key FROM {TOUCHED_KEYS_TABLE} WHERE table_name = {self._literal(parent)}))"
+        )
+
+    def delete_sql(self, table, where, key_column):
+        """
+        DELETE по условию; в инкрементальном запуске удаленные ключи key_column
+        записываются во временную таблицу для ссылочных правил дочерних таблиц.
+        Число затронутых строк (cur.rowcount) — число удаленных
+        """
+        if self.full:
+            return f"DELETE FROM {table} WHERE {where}"
+        return (
+            f"WITH deleted AS (DELETE FROM {table} WHERE {where} RETURNING {key_column}) "
+            f"INSERT INTO {TOUCHED_KEYS_TABLE} SELECT {self._literal(table)}, {key_column}::text FROM deleted"
+        )
+
+    def commit(self):
+        """Сохранение меток, снятых в begin(), после успешной очистки"""
+        with self.conn.cursor() as cur:
+            for table in self.tables:
+                if self.columns.get(table) is None:
+                    continue
+                watermark = self.current.get(table) or self.previous.get(table)
+                cur.execute(
+                    f"""
+                    INSERT INTO {WATERMARK_TABLE}
+                        (pipeline, table_name, watermark_column, watermark, last_full_pass, updated_at)
+                    VALUES (%s, %s, %s, %s, CASE WHEN %s THEN NOW() END, NOW())
+                    ON CONFLICT (pipeline, table_name) DO UPDATE SET
+                        watermark_column = EXCLUDED.watermark_column,
+                        watermark = EXCLUDED.watermark,
+                        last_full_pass = COALESCE(EXCLUDED.last_full_pass, {WATERMARK_TABLE}.last_full_pass),
+                        updated_at = EXCLUDED.updated_at
+                    """,
+                    (self.pipeline, table, self.columns[table], watermark, self.full)
+                )
+        self.conn.commit()
+
+    def close(self):
+        """Удаление временной таблицы: соединение возвращается в пул"""
+        if not self.full:
+            with self.conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {TOUCHED_KEYS_TABLE}")
+            self.conn.commit()
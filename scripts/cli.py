@@ -0,0 +1,747 @@
+#!/usr/bin/env python3
+"""
+Единая точка входа для скриптов пайплайна DataBoard
+Подкоманды: clean, clean-detailed, export, parquet-tune, quick-export, sql, local, stats, kpi-views, rollup, cube, timeseries, cohorts, rfm, integrity, capture, scheduler, regions, health, profile.
+Тяжелые библиотеки (pandas, pyarrow, psycopg2) импортируются только внутри подкоманд,
+поэтому --help и легкие команды стартуют без их загрузки
+"""
+
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Бюджет на запуск CLI для --help и легких команд
+STARTUP_BUDGET_MS = 200
+
+# Модули, которые импортирует каждая подкоманда (для profile)
+COMMAND_MODULES = {
+    'clean': ['data_cleaning'],
+    'clean-detailed': ['data_cleaning_detailed'],
+    'export': ['export_data_artifacts'],
+    'export --async': ['async_export'],
+    'parquet-tune': ['parquet_tuning'],
+    'quick-export': ['quick_export'],
+    'sql': ['sql_library'],
+    'local': ['local_analytics'],
+    'stats': ['approx_stats'],
+    'kpi-views': ['kpi_views'],
+    'rollup': ['daily_rollup'],
+    'cube': ['kpi_cube'],
+    'timeseries': ['time_series'],
+    'cohorts': ['cohorts'],
+    'rfm': ['rfm'],
+    'integrity': ['integrity'],
+    'capture': ['change_capture'],
+    'scheduler': ['job_scheduler'],
+    'regions': ['region_resolver'],
+    'health': ['database'],
+}
+
+
+def _elapsed_ms(since=_START):
+    return (time.perf_counter() - since) * 1000
+
+
+def cmd_clean(args):
+    """Очистка данных (data_cleaning.py)"""
+    from data_cleaning import main as cleaning_main
+    return cleaning_main(incremental=args.incremental, full=args.full)
+
+
+def cmd_clean_detailed(args):
+    """Очистка данных с детальной отчетностью (data_cleaning_detailed.py)"""
+    from data_cleaning_detailed import DataCleaner, setup_logging
+    setup_logging()
+    try:
+        DataCleaner(incremental=args.incremental, full=args.full).run_cleaning()
+        return 0
+    except Exception:
+        return 1
+
+
+def cmd_export(args):
+    """Экспорт аналитических артефактов (export_data_artifacts.py)"""
+    from export_data_artifacts import setup_logging
+    setup_logging()
+
+    output_directory = args.output_dir
+    if args.resume and not output_directory:
+        from export_checkpoint import find_interrupted_export
+        interrupted = find_interrupted_export()
+        output_directory = str(interrupted) if interrupted else None
+    output_directory = output_directory or f"exported_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    options = {
+        'use_views': not args.no_views,
+        'use_rollup': not args.no_rollup,
+        'include_base_tables': args.base_tables,
+        'stats_mode': args.stats,
+        'table_stats_modes': {t: 'approximate' for t in args.approx_stats.split(',') if t},
+        'arrow_ipc': args.arrow,
+        'resume': args.resume,
+        'unordered_tables': [t for t in args.unordered.split(',') if t],
+        'sort_row_groups': args.sort_row_groups,
+        'sharded_tables': [t for t in args.sharded.split(',') if t],
+        'shards': args.shards,
+        'use_rfm': not args.no_rfm,
+        'compact_dtypes': not args.no_compact,
+        'excel_tables': [t for t in (args.excel or '').split(',') if t]
+    }
+    if args.use_async:
+        from async_export import AsyncDataExporter
+        exporter = AsyncDataExporter(output_directory, **options)
+    else:
+        from export_data_artifacts import DataExporter
+        exporter = DataExporter(output_directory, **options)
+
+    if exporter.run_export():
+        print(f"\n🎯 Данные успешно экспортированы в папку: {output_directory}")
+        if args.tune_parquet:
+            from parquet_tuning import tune_export
+            tune_export(output_directory)
+            print("🎛️ Профили Parquet обновлены, применяются со следующей выгрузки")
+        return 0
+    print("\n❌ Экспорт завершился с ошибками. Проверьте логи.")
+    return 1
+
+
+def cmd_parquet_tune(args):
+    """Подбор кодека, словаря и row group Parquet по таблицам выгрузки (parquet_tuning.py)"""
+    import logging
+    from parquet_tuning import DEFAULT_PROFILES_FILE, tune_export
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    table_names = [t for t in args.tables.split(',') if t] if args.tables else None
+    profiles = tune_export(args.export_dir, table_names, sample_rows=args.sample_rows)
+    for table, profile in profiles.items():
+        metrics = profile['metrics']
+        level = profile['compression_level'] or ''
+        print(f"{table:25} | {profile['compression']}{level:<3} | словарь {'да ' if profile['use_dictionary'] else 'нет'} | "
+              f"row group {profile['row_group_size'] or '—':>8} | {metrics['size_bytes'] / 1024:,.0f} KB | "
+              f"чтение {metrics['read_ms']} ms | запись {metrics['write_ms']} ms")
+    print(f"Профили: {DEFAULT_PROFILES_FILE}")
+    return 0
+
+
+def cmd_quick_export(args):
+    """Быстрый экспорт основных таблиц в CSV (quick_export.py)"""
+    from quick_export import main as quick_export_main
+    quick_export_main()
+    return 0
+
+
+def _parse_params(items):
+    """KEY=VALUE из аргументов командной строки (пустое значение — NULL)"""
+    params = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        params[key] = value if value != '' else None
+    return params
+
+
+def cmd_sql(args):
+    """Выполнение именованного запроса из sql/*.sql с кешированием результата"""
+    from sql_library import SqlLibrary, SqlRunner
+
+    library = SqlLibrary()
+    if args.list or not args.name:
+        for name, statement in library.statements.items():
+            params = ', '.join(statement.parameters) or '—'
+            print(f"{name:70} | {params}")
+        return 0
+
+    params = _parse_params(args.param)
+    frame = SqlRunner(library).run(args.name, params, use_cache=not args.no_cache)
+    if args.output:
+        frame.to_csv(args.output, index=False, encoding='utf-8')
+        print(f"✅ {args.name}: {len(frame):,} строк сохранено в {args.output}")
+    else:
+        print(frame.to_string(max_rows=50))
+    return 0
+
+
+def cmd_local(args):
+    """Запросы к последней выгрузке Parquet во встроенном DuckDB (local_analytics.py)"""
+    import logging
+    from local_analytics import LocalAnalytics, benchmark
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    local = LocalAnalytics(args.export_dir)
+    params = _parse_params(args.param)
+
+    if args.action == 'tables':
+        for table, path in local.tables.items():
+            print(f"{table:25} | {path}")
+        return 0
+    if args.action == 'statements':
+        for name in local.library.names():
+            missing = local.missing_tables(name)
+            print(f"{name:70} | {'нет: ' + ', '.join(missing) if missing else 'доступно'}")
+        return 0
+    if args.action == 'bench':
+        names = args.target or local.available_statements()
+        frame = benchmark(local, names, params, runs=args.runs)
+    elif args.action == 'run':
+        frame = local.run(args.target[0], params)
+    else:
+        frame = local.query(' '.join(args.target))
+
+    if args.output:
+        frame.to_csv(args.output, index=False, encoding='utf-8')
+        print(f"✅ {len(frame):,} строк сохранено в {args.output}")
+    else:
+        print(frame.to_string(max_rows=50, index=args.action != 'bench'))
+    return 0
+
+
+def cmd_stats(args):
+    """Приближенный профиль таблиц БД по выборке TABLESAMPLE (approx_stats.py)"""
+    import json
+    import logging
+    from approx_stats import approximate_profile, profile_frame
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    profiles = []
+    for table in args.tables:
+        profile = approximate_profile(table, sample_rows=args.sample_rows)
+        profiles.append(profile)
+        print(f"\n📐 {table}: ~{profile['estimated_rows']:,} строк, выборка {profile['sample_rows']:,} "
+              f"({profile['sample_percent']}%), интервалы 95%")
+        print(profile_frame(profile).to_string(index=False))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(profiles, f, ensure_ascii=False, indent=2, default=str)
+        print(f"\n✅ Профили сохранены в {args.output}")
+    return 0
+
+
+def cmd_kpi_views(args):
+    """Материализованные представления KPI: создание, обновление, планировщик, журнал"""
+    import logging
+    from kpi_views import KpiViewManager, print_refresh_history
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    manager = KpiViewManager()
+    if args.action == 'create':
+        manager.create_views(recreate=args.recreate)
+        manager.refresh_stale(force=True)
+    elif args.action == 'refresh':
+        manager.refresh_stale(force=args.force)
+    elif args.action == 'watch':
+        manager.run_scheduler(interval_seconds=args.interval)
+    print_refresh_history(manager, limit=args.limit)
+    return 0
+
+
+def cmd_rollup(args):
+    """Инкрементальное обновление дневных агрегатов (daily_rollup.py)"""
+    import logging
+    from daily_rollup import DailyRollup
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    rollup = DailyRollup(lookback_days=args.lookback_days)
+    if not args.status:
+        rollup.update(full=args.full)
+    with rollup.pool.connection() as conn:
+        for key, value in rollup.status(conn).items():
+            print(f"{key:15} | {value}")
+    return 0
+
+
+def cmd_cube(args):
+    """KPI-куб: сборка партиций и срезы метрик (kpi_cube.py)"""
+    import logging
+    from kpi_cube import KpiCube
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cube = KpiCube(args.cube_dir) if args.cube_dir else KpiCube()
+    if args.action == 'build':
+        cube.build(full=args.full)
+        return 0
+
+    filters = {}
+    for item in args.filter:
+        key, _, value = item.partition('=')
+        filters.setdefault(key, []).append(value)
+
+    cube.load()
+    started = time.perf_counter()
+    result = cube.query(
+        metrics=args.metrics.split(','),
+        by=[d for d in args.by.split(',') if d],
+        filters=filters,
+        start_date=args.start,
+        end_date=args.end
+    )
+    elapsed_ms = _elapsed_ms(started)
+    print(result.to_string(index=False))
+    print(f"\n⏱️ {len(result)} строк за {elapsed_ms:.1f} ms")
+    return 0
+
+
+def cmd_timeseries(args):
+    """Временные ряды с окнами по полному календарю (time_series.py)"""
+    import logging
+    from database import get_pool
+    from time_series import time_series_frame
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    groupings = [by or None for by in args.by.split(',')]
+    metrics = [m for m in args.metrics.split(',') if m]
+    windows = [int(w) for w in args.windows.split(',') if w]
+    end_date = datetime.strptime(args.end, '%Y-%m-%d').date() if args.end else None
+
+    started = time.perf_counter()
+    with get_pool(application_name='databoard-timeseries').analytics_connection() as conn:
+        result = time_series_frame(conn, groupings, metrics, windows, history_days=args.days, end_date=end_date)
+    elapsed_ms = _elapsed_ms(started)
+
+    if args.output:
+        result.to_csv(args.output, index=False, encoding='utf-8')
+        print(f"💾 {len(result):,} строк сохранено в {args.output}")
+    # Последний день календаря по каждой группе
+    latest = result[result['order_date'] == result['order_date'].max()]
+    columns = ['group_by', 'group'] + [
+        col for metric in metrics
+        for col in (f'{metric}_{windows[0]}d_sum', f'{metric}_wow_pct', f'{metric}_yoy_pct')
+    ]
+    print(latest[columns].to_string(index=False))
+    print(f"\n⏱️ {len(result):,} строк за {elapsed_ms:.0f} ms")
+    return 0
+
+
+def cmd_cohorts(args):
+    """Когорты удержания по месяцу первого заказа (cohorts.py)"""
+    import logging
+    from cohorts import refresh_cohorts
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    started = time.perf_counter()
+    engine = refresh_cohorts(args.dir, full=args.full)
+    elapsed_ms = _elapsed_ms(started)
+
+    if args.output:
+        result = engine.retention_frame()
+        result.to_csv(args.output, index=False, encoding='utf-8')
+        print(f"💾 {len(result):,} строк сохранено в {args.output}")
+    matrix = engine.retention_matrix(args.months)
+    print(matrix.tail(args.cohorts).to_string())
+    print(f"\n⏱️ {len(engine.customers):,} клиентов, {len(matrix):,} когорт за {elapsed_ms:.0f} ms")
+    return 0
+
+
+def cmd_rfm(args):
+    """RFM-сегменты клиентов по квантилям (rfm.py)"""
+    import logging
+    from rfm import refresh_rfm
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    started = time.perf_counter()
+    scores = refresh_rfm(args.dir, full=args.full).scores()
+    elapsed_ms = _elapsed_ms(started)
+
+    if args.output:
+        scores.to_csv(args.output, index=False, encoding='utf-8')
+        print(f"💾 {len(scores):,} строк сохранено в {args.output}")
+    summary = scores.groupby('rfm_segment').agg(
+        customers=('customer_id', 'size'),
+        recency_days=('rfm_recency_days', 'median'),
+        frequency=('rfm_frequency', 'median'),
+        monetary=('rfm_monetary', 'sum')
+    ).sort_values('monetary', ascending=False)
+    print(summary.to_string())
+    print(f"\n⏱️ {len(scores):,} клиентов за {elapsed_ms:.0f} ms")
+    return 0
+
+
+def cmd_integrity(args):
+    """Ссылочная целостность по массивам ключей (integrity.py)"""
+    import json
+    import logging
+    from integrity import (
+        CLEANING_RELATIONSHIPS, SNAPSHOT_RELATIONSHIPS, IntegrityChecker, KeyArrayCache, LiveKeySource,
+        ParquetKeySource
+    )
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.snapshot is not None:
+        source = ParquetKeySource(args.snapshot or None)
+        relationships = SNAPSHOT_RELATIONSHIPS
+    else:
+        from database import get_pool
+        source = LiveKeySource(get_pool(application_name='databoard-integrity'))
+        relationships = CLEANING_RELATIONSHIPS
+    checker = IntegrityChecker(source, relationships, cache=KeyArrayCache(args.cache_dir or None),
+                               sample_size=args.sample)
+    results = checker.check()
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False, default=str))
+    else:
+        for check in results:
+            print(f"{check['foreign_key']}: {check['status']} ({check['invalid_references']:,} из "
+                  f"{check['child_rows']:,}, {check['milliseconds']} ms)")
+            if check['sample_invalid_ids']:
+                print(f"   примеры: {check['sample_invalid_ids']}")
+    return 1 if any(check['invalid_references'] for check in results) else 0
+
+
+def cmd_capture(args):
+    """Захват изменений и очистка по очереди почти в реальном времени (change_capture.py)"""
+    import json
+    import logging
+    from change_capture import ChangeCapture, ChangeCleaningWorker
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.action == 'install':
+        ChangeCapture().install()
+    elif args.action == 'uninstall':
+        ChangeCapture().uninstall(drop_queue=args.drop_queue)
+    elif args.action == 'worker':
+        worker = ChangeCleaningWorker(batch_size=args.batch_size, batch_window=args.window,
+                                      report_seconds=args.report_interval)
+        if args.once:
+            worker.drain()
+            print(json.dumps(worker.metrics.snapshot(), indent=2, ensure_ascii=False))
+        else:
+            worker.run()
+        return 0
+
+    rows = ChangeCapture().status()
+    if not rows:
+        print("Очередь изменений пуста")
+    for table, operation, keys, age in rows:
+        print(f"{table} ({operation}): {keys:,} ключей, старейший {float(age):.1f} s назад")
+    return 0
+
+
+def cmd_scheduler(args):
+    """Планировщик очистки и выгрузки: граф зависимостей, лимиты, повторы (job_scheduler.py)"""
+    import logging
+    from job_scheduler import JobScheduler, PipelineCycle, print_results
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+    table_limits = {}
+    for item in args.table_limit:
+        table, _, limit = item.partition('=')
+        table_limits[table] = int(limit)
+    scheduler = JobScheduler(max_parallel=args.max_parallel, table_limits=table_limits,
+                             backoff_seconds=args.backoff)
+
+    def build_cycle():
+        return PipelineCycle(clean=not args.no_clean, rollup=not args.no_rollup,
+                             exporter_options={'include_base_tables': args.base_tables},
+                             max_attempts=args.max_attempts)
+
+    results = scheduler.run_forever(build_cycle, interval_seconds=args.interval,
+                                    iterations=1 if args.once else None)
+    print_results(results)
+    return 0 if all(result['status'] == 'succeeded' for result in results.values()) else 1
+
+
+def cmd_regions(args):
+    """Пополнение справочника регионов по адресам доставки (region_resolver.py)"""
+    import logging
+    from region_resolver import RegionMatcher, RegionResolver, load_aliases
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    matcher = RegionMatcher(load_aliases(args.aliases)) if args.aliases else RegionMatcher()
+    if args.address:
+        print(matcher.resolve(args.address))
+        return 0
+
+    stats = RegionResolver(matcher=matcher).resolve_new()
+    for region, count in stats['regions'].items():
+        print(f"{region:25} | {count:,}")
+    print(f"Версия правил: {stats['rules_version']}, адресов: {stats['addresses_resolved']:,}")
+    return 0
+
+
+def cmd_health(args):
+    """Проверка доступности БД (SELECT 1) для cron и мониторинга"""
+    from database import close_pool, get_pool
+
+    started = time.perf_counter()
+    try:
+        pool = get_pool(application_name='databoard-health', minconn=1, maxconn=1)
+        with pool.connection() as conn:
+            pool.execute(conn, "SELECT 1", timeout_ms=args.timeout_ms).fetchone()
+        print(f"✅ БД доступна ({_elapsed_ms(started):.0f} ms)")
+        return 0
+    except Exception as e:
+        print(f"❌ БД недоступна: {e}")
+        return 1
+    finally:
+        close_pool()
+
+
+def _measure_import(modules):
+    """Время импорта модулей в отдельном процессе (мс) или текст ошибки"""
+    code = (
+        "import sys, time; sys.path.insert(0, {dir!r}); t = time.perf_counter(); "
+        "{imports}; print((time.perf_counter() - t) * 1000)"
+    ).format(dir=SCRIPTS_DIR, imports='; '.join(f'import {m}' for m in modules))
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return None, lines[-1] if lines else 'ошибка импорта'
+    return float(result.stdout.strip()), None
+
+
+def _measure_cli_startup(runs):
+    """Полное время запуска `cli.py --help` (медиана по нескольким запускам, мс)"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--help'],
+                       capture_output=True, check=True)
+        timings.append(_elapsed_ms(started))
+    return statistics.median(timings)
+
+
+def cmd_profile(args):
+    """Замер времени запуска CLI и стоимости импорта каждой подкоманды"""
+    print("⏱️ ПРОФИЛЬ ЗАПУСКА")
+    print("=" * 60)
+
+    startup_ms = _measure_cli_startup(args.runs)
+    status = '✅' if startup_ms < STARTUP_BUDGET_MS else '⚠️'
+    print(f"{'cli.py --help':20} | {startup_ms:>8.0f} ms | {status} бюджет {STARTUP_BUDGET_MS} ms")
+    print("-" * 60)
+
+    for command, modules in COMMAND_MODULES.items():
+        import_ms, error = _measure_import(modules)
+        if error:
+            print(f"{command:20} | {'—':>8}    | ❌ {error}")
+        else:
+            print(f"{command:20} | {import_ms:>8.0f} ms | импорт {', '.join(modules)}")
+    return 0
+
+
+def build_parser():
+    """Описание подкоманд CLI"""
+    parser = argparse.ArgumentParser(
+        prog='cli.py',
+        description='DataBoard: очистка и экспорт данных'
+    )
+    parser.add_argument('--timing', action='store_true',
+                        help='вывести время запуска и выполнения команды в stderr')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    clean = subparsers.add_parser('clean', help='очистка данных (data_cleaning.py)')
+    clean_detailed = subparsers.add_parser(
+        'clean-detailed', help='очистка с детальной отчетностью (data_cleaning_detailed.py)'
+    )
+    for cleaning in (clean, clean_detailed):
+        cleaning.add_argument('--incremental', action='store_true',
+                              help='только строки после водяной метки прошлого запуска '
+                                   '(полный проход раз в CLEANING_FULL_PASS_DAYS дней)')
+        cleaning.add_argument('--full', action='store_true',
+                              help='с --incremental: полный проход сейчас, метки обновляются')
+    clean.set_defaults(handler=cmd_clean)
+    clean_detailed.set_defaults(handler=cmd_clean_detailed)
+
+    export = subparsers.add_parser('export', help='экспорт CSV/Parquet артефактов')
+    export.add_argument('--output-dir', help='папка экспорта (по умолчанию exported_data_<timestamp>)')
+    export.add_argument('--async', dest='use_async', action='store_true',
+                        help='асинхронный режим: параллельные запросы и запись в пуле потоков')
+    export.add_argument('--no-views', action='store_true',
+                        help='не читать KPI из материализованных представлений')
+    export.add_argument('--no-rollup', action='store_true',
+                        help='не использовать дневные агрегаты для KPI и временных рядов')
+    export.add_argument('--no-rfm', action='store_true',
+                        help='не добавлять RFM-сегменты по квантилям в выгрузку клиентов')
+    export.add_argument('--no-compact', action='store_true',
+                        help='не сжимать типы колонок (int8/float32/category/строки Arrow) перед записью')
+    export.add_argument('--base-tables', action='store_true',
+                        help='добавить снимки orders/order_items/customers/products для cli.py local')
+    export.add_argument('--stats', choices=['auto', 'exact', 'approximate'], default='auto',
+                        help='статистика метаданных: auto — приближенная для таблиц больше '
+                             'APPROX_STATS_ROW_THRESHOLD строк')
+    export.add_argument('--approx-stats', default='', metavar='TABLES',
+                        help='таблицы через запятую с приближенной статистикой')
+    export.add_argument('--arrow', choices=['uncompressed', 'lz4'],
+                        help='дополнительно писать Arrow IPC (Feather v2) для чтения через memory map')
+    export.add_argument('--excel', nargs='?', const='customers_analytics,orders_analytics', metavar='TABLES',
+                        help="копия таблиц в Excel (.xlsx) с делением на листы по пределу строк; "
+                             "без значения — customers_analytics и orders_analytics, 'all' — все")
+    export.add_argument('--tune-parquet', action='store_true',
+                        help='после выгрузки подобрать настройки Parquet по ее файлам')
+    export.add_argument('--unordered', default='', metavar='TABLES',
+                        help="таблицы через запятую без итоговой ORDER BY ('all' — все, где это возможно)")
+    export.add_argument('--sort-row-groups', action='store_true',
+                        help='для таблиц из --unordered сортировать строки внутри каждого row group Parquet')
+    export.add_argument('--sharded', default='', metavar='TABLES',
+                        help='таблицы через запятую, выгружаемые параллельно срезами первичного ключа')
+    export.add_argument('--shards', type=int, default=4, help='число срезов для --sharded')
+    export.add_argument('--resume', action='store_true',
+                        help='продолжить прерванную выгрузку (по умолчанию последнюю exported_data_*.partial)')
+    export.set_defaults(handler=cmd_export)
+
+    parquet_tune = subparsers.add_parser('parquet-tune', help='подбор настроек Parquet по таблицам выгрузки')
+    parquet_tune.add_argument('--export-dir', help='папка выгрузки (по умолчанию последняя по манифесту)')
+    parquet_tune.add_argument('--tables', help='таблицы через запятую (по умолчанию все)')
+    parquet_tune.add_argument('--sample-rows', type=int, default=200000, help='строк в выборке таблицы')
+    parquet_tune.set_defaults(handler=cmd_parquet_tune)
+
+    quick_export = subparsers.add_parser('quick-export', help='быстрый экспорт основных таблиц в CSV')
+    quick_export.set_defaults(handler=cmd_quick_export)
+
+    sql = subparsers.add_parser('sql', help='выполнение именованного запроса из sql/*.sql')
+    sql.add_argument('name', nargs='?', help='имя выражения (см. --list)')
+    sql.add_argument('-p', '--param', action='append', default=[], metavar='KEY=VALUE',
+                     help='значение параметра (пустое значение — NULL)')
+    sql.add_argument('--list', action='store_true', help='список выражений и их параметров')
+    sql.add_argument('--no-cache', action='store_true', help='не использовать кеш результатов')
+    sql.add_argument('--output', help='сохранить результат в CSV')
+    sql.set_defaults(handler=cmd_sql)
+
+    local = subparsers.add_parser('local', help='запросы к последней выгрузке Parquet через DuckDB')
+    local.add_argument('action', choices=['tables', 'statements', 'run', 'query', 'bench'],
+                       help='tables — таблицы выгрузки, statements — доступность выражений sql/, '
+                            'run — выражение, query — произвольный SQL, bench — сравнение с PostgreSQL')
+    local.add_argument('target', nargs='*', help='имя выражения (run, bench) или текст запроса (query)')
+    local.add_argument('--export-dir', help='папка выгрузки (по умолчанию последняя по манифесту)')
+    local.add_argument('-p', '--param', action='append', default=[], metavar='KEY=VALUE',
+                       help='значение параметра (пустое значение — NULL)')
+    local.add_argument('--runs', type=int, default=3, help='число повторов на выражение (bench)')
+    local.add_argument('--output', help='сохранить результат в CSV')
+    local.set_defaults(handler=cmd_local)
+
+    stats = subparsers.add_parser('stats', help='приближенная статистика таблиц БД по выборке')
+    stats.add_argument('tables', nargs='+', help='таблицы БД')
+    stats.add_argument('--sample-rows', type=int, default=20000, help='целевой размер выборки')
+    stats.add_argument('--output', help='сохранить профили в JSON')
+    stats.set_defaults(handler=cmd_stats)
+
+    kpi_views = subparsers.add_parser('kpi-views', help='материализованные представления KPI')
+    kpi_views.add_argument('action', choices=['create', 'refresh', 'watch', 'history'],
+                           help='create — создать и заполнить, refresh — обновить измененные, '
+                                'watch — планировщик, history — журнал обновлений')
+    kpi_views.add_argument('--force', action='store_true', help='обновить независимо от изменений')
+    kpi_views.add_argument('--recreate', action='store_true', help='пересоздать представления (create)')
+    kpi_views.add_argument('--interval', type=int, default=300, help='интервал планировщика, с')
+    kpi_views.add_argument('--limit', type=int, default=20, help='записей журнала в выводе')
+    kpi_views.set_defaults(handler=cmd_kpi_views)
+
+    rollup = subparsers.add_parser('rollup', help='инкрементальное обновление дневных агрегатов')
+    rollup.add_argument('--full', action='store_true', help='полный пересчет всех дней')
+    rollup.add_argument('--lookback-days', type=int, default=3,
+                        help='последние дни, пересчитываемые при каждом запуске')
+    rollup.add_argument('--status', action='store_true', help='только показать состояние')
+    rollup.set_defaults(handler=cmd_rollup)
+
+    cube = subparsers.add_parser('cube', help='KPI-куб: сборка и срезы метрик')
+    cube.add_argument('action', choices=['build', 'query'])
+    cube.add_argument('--full', action='store_true', help='пересобрать все партиции (build)')
+    cube.add_argument('--cube-dir', help='папка куба (по умолчанию KPI_CUBE_DIR или kpi_cube)')
+    cube.add_argument('--by', default='', help='измерения через запятую: region,time_channel,day_type,'
+                                                'customer_type,segment,order_date,order_month')
+    cube.add_argument('--metrics', default='total_orders,aov,payment_conversion_rate,return_rate',
+                      help='метрики через запятую')
+    cube.add_argument('--filter', action='append', default=[], metavar='DIM=VALUE',
+                      help='фильтр по измерению (можно повторять)')
+    cube.add_argument('--start', help='начало периода (YYYY-MM-DD)')
+    cube.add_argument('--end', help='конец периода (YYYY-MM-DD)')
+    cube.set_defaults(handler=cmd_cube)
+
+    timeseries = subparsers.add_parser('timeseries', help='временные ряды с окнами 7/30/90 дней по полному календарю')
+    timeseries.add_argument('--by', default=',region,segment',
+                            help='группировки через запятую: пусто — итог, region, segment, ... (по умолчанию все три)')
+    timeseries.add_argument('--metrics', default='total_orders,net_revenue', help='метрики через запятую')
+    timeseries.add_argument('--windows', default='7,30,90', help='окна в днях через запятую')
+    timeseries.add_argument('--days', type=int, default=730, help='длина календаря, дней')
+    timeseries.add_argument('--end', help='последний день календаря (YYYY-MM-DD, по умолчанию сегодня)')
+    timeseries.add_argument('--output', help='сохранить ряды в CSV')
+    timeseries.set_defaults(handler=cmd_timeseries)
+
+    cohorts = subparsers.add_parser('cohorts', help='когорты удержания и выручки по месяцу первого заказа')
+    cohorts.add_argument('--full', action='store_true', help='полный пересчет вместо добавления новых заказов')
+    cohorts.add_argument('--dir', default='cohorts', help='папка состояния когорт')
+    cohorts.add_argument('--months', type=int, default=12, help='месяцев жизни когорты в матрице')
+    cohorts.add_argument('--cohorts', type=int, default=24, help='последних когорт в выводе')
+    cohorts.add_argument('--output', help='сохранить таблицу когорт в CSV')
+    cohorts.set_defaults(handler=cmd_cohorts)
+
+    rfm = subparsers.add_parser('rfm', help='RFM-сегменты клиентов по квантилям (только клиенты с изменениями)')
+    rfm.add_argument('--full', action='store_true', help='полная загрузка агрегатов вместо клиентов с изменениями')
+    rfm.add_argument('--dir', default='rfm', help='папка состояния RFM')
+    rfm.add_argument('--output', help='сохранить баллы и сегменты в CSV')
+    rfm.set_defaults(handler=cmd_rfm)
+
+    integrity = subparsers.add_parser('integrity', help='ссылочная целостность по массивам ключей')
+    integrity.add_argument('--snapshot', nargs='?', const='', metavar='EXPORT_DIR',
+                           help='проверять Parquet-снимки выгрузки (по умолчанию последней) вместо БД')
+    integrity.add_argument('--sample', type=int, default=10, help='примеров нарушающих id на связь')
+    integrity.add_argument('--cache-dir', default='.key_cache', help='кеш массивов ключей (пусто — без кеша на диске)')
+    integrity.add_argument('--json', action='store_true', help='результат в JSON')
+    integrity.set_defaults(handler=cmd_integrity)
+
+    capture = subparsers.add_parser('capture', help='очистка по захвату изменений (триггеры + LISTEN/NOTIFY)')
+    capture.add_argument('action', choices=['install', 'uninstall', 'worker', 'status'],
+                         help='install/uninstall — триггеры и очередь, worker — воркер очистки, '
+                              'status — глубина очереди')
+    capture.add_argument('--batch-size', type=int, default=1000, help='ключей очереди в порции')
+    capture.add_argument('--window', type=float, default=0.5, help='окно сбора порции после уведомления, с')
+    capture.add_argument('--report-interval', type=int, default=60, help='период лога метрик воркера, с')
+    capture.add_argument('--once', action='store_true', help='worker: разобрать очередь и выйти')
+    capture.add_argument('--drop-queue', action='store_true', help='uninstall: удалить и очередь')
+    capture.set_defaults(handler=cmd_capture)
+
+    scheduler = subparsers.add_parser('scheduler', help='планировщик очистки и выгрузки (демон)')
+    scheduler.add_argument('--once', action='store_true', help='один цикл и выход')
+    scheduler.add_argument('--interval', type=int, default=3600, help='период циклов демона, с')
+    scheduler.add_argument('--max-parallel', type=int, default=3, help='заданий одновременно')
+    scheduler.add_argument('--table-limit', action='append', default=[], metavar='TABLE=N',
+                           help='заданий одновременно на таблицу (по умолчанию 1)')
+    scheduler.add_argument('--max-attempts', type=int, default=3, help='попыток на задание')
+    scheduler.add_argument('--backoff', type=float, default=30, help='задержка первого повтора, с (далее ×2)')
+    scheduler.add_argument('--no-clean', action='store_true', help='без инкрементальной очистки')
+    scheduler.add_argument('--no-rollup', action='store_true', help='без обновления дневных агрегатов')
+    scheduler.add_argument('--base-tables', action='store_true', help='+ снимки базовых таблиц')
+    scheduler.set_defaults(handler=cmd_scheduler)
+
+    regions = subparsers.add_parser('regions', help='справочник регионов по адресам доставки')
+    regions.add_argument('--aliases', help='JSON с псевдонимами городов (по умолчанию region_aliases.json)')
+    regions.add_argument('--address', help='только показать регион для адреса')
+    regions.set_defaults(handler=cmd_regions)
+
+    health = subparsers.add_parser('health', help='проверка доступности БД')
+    health.add_argument('--timeout-ms', type=int, default=5000, help='таймаут запроса, мс')
+    health.set_defaults(handler=cmd_health)
+
+    profile = subparsers.add_parser('profile', help='замер времени запуска и импорта подкоманд')
+    profile.add_argument('--runs', type=int, default=5, help='число замеров запуска CLI')
+    profile.set_defaults(handler=cmd_profile)
+
+    return parser
+
+
+def main(argv=None):
+    """Разбор аргументов и запуск подкоманды"""
+    args = build_parser().parse_args(argv)
+    startup_ms = _elapsed_ms()
+
+    command_started = time.perf_counter()
+    exit_code = args.handler(args)
+
+    if args.timing:
+        print(
+            f"⏱️ {args.command}: запуск {startup_ms:.0f} ms, "
+            f"выполнение {_elapsed_ms(command_started):.0f} ms",
+            file=sys.stderr
+        )
+    return exit_code or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Когортный анализ удержания клиентов
+Когорта — месяц первого заказа. Матрицы удержания и выручки (когорта × месяц жизни)
+строятся из компактных массивов (customer_id, месяц, сумма) через np.bincount;
+новые заказы добавляются инкрементально — меняются только затронутые ячейки
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COHORT_DIR = os.getenv('COHORT_DIR', 'cohorts')
+STATE_FILE = 'cohort_state.json'
+ARRAYS_FILE = 'cohort_arrays.npz'
+FETCH_ROWS = 200000
+# Ключ пары клиент × месяц: customer_id * MONTH_SPAN + месяц (месяцев от 1970-01)
+MONTH_SPAN = 1 << 16
+
+# Заказы как (id, клиент, месяц от 1970-01, сумма оплаченных позиций); после after_id — для инкремента
+COHORT_ORDERS_QUERY = """
+SELECT
+    o.id,
+    o.customer_id,
+    ((EXTRACT(YEAR FROM o.order_date) - 1970) * 12 + EXTRACT(MONTH FROM o.order_date) - 1)::int as month_code,
+    CASE WHEN o.payment_status = 'paid' THEN COALESCE(SUM(oi.quantity * oi.unit_price), 0) ELSE 0 END as amount
+FROM orders o
+LEFT JOIN order_items oi ON o.id = oi.order_id
+WHERE o.customer_id IS NOT NULL
+  AND o.order_date IS NOT NULL
+  AND o.id > %(after_id)s
+GROUP BY o.id
+"""
+
+
+def month_codes(dates):
+    """Месяцы от 1970-01 для массива дат"""
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[M]').astype(np.int64)
+
+
+def _month_label(code):
+    return str(np.datetime64(int(code), 'M'))
+
+
+def load_orders(conn, after_id=0, fetch_rows=FETCH_ROWS):
+    """
+    Заказы после after_id компактными массивами: {'order_id', 'customer_id', 'month', 'amount'}.
+    Строки читаются серверным курсором порциями, в памяти — только numpy-массивы
+    """
+    chunks = []
+    with conn.cursor(name='cohort_orders') as cur:
+        cur.itersize = fetch_rows
+        cur.execute(COHORT_ORDERS_QUERY, {'after_id': after_id})
+        while True:
+            rows = cur.fetchmany(fetch_rows)
+            if not rows:
+                break
+            frame = pd.DataFrame.from_records(rows, columns=['order_id', 'customer_id', 'month', 'amount'],
+                                              coerce_float=True)
+            chunks.append({
+                'order_id': frame['order_id'].to_numpy(dtype=np.int64),
+                'customer_id': frame['customer_id'].to_numpy(dtype=np.int64),
+                'month': frame['month'].to_numpy(dtype=np.int64),
+                'amount': frame['amount'].to_numpy(dtype=np.float64)
+            })
+    conn.commit()
+    if not chunks:
+        return {
+            'order_id': np.empty(0, np.int64), 'customer_id': np.empty(0, np.int64),
+            'month': np.empty(0, np.int64), 'amount': np.empty(0, np.float64)
+        }
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+
+class CohortEngine:
+    """
+    Матрицы когорт в памяти и их инкрементальное обновление.
+
+    Состояние — отсортированные массивы клиентов и месяцев их когорт, отсортированные
+    ключи пар клиент × активный месяц и матрицы когорта × месяц жизни: активные
+    клиенты, заказы, выручка. Полный расчет — один np.unique по клиентам,
+    np.minimum.at для месяца когорты и np.bincount по плоскому индексу ячейки.
+    При обновлении ячейки новых заказов добавляются к матрицам; клиент учитывается
+    в ячейке один раз (пары клиент × месяц проверяются np.searchsorted).
+    """
+
+    def __init__(self):
+        self.base_month = None
+        self.customers = np.empty(0, np.int64)
+        self.cohorts = np.empty(0, np.int64)
+        self.active_pairs = np.empty(0, np.int64)
+        self.active = np.zeros((0, 0), np.int64)
+        self.orders = np.zeros((0, 0), np.int64)
+        self.revenue = np.zeros((0, 0), np.float64)
+        self.last_order_id = 0
+
+    def _grow(self, max_month):
+        """Расширение матриц до месяца max_month (когорты и месяцы жизни)"""
+        size = int(max_month - self.base_month) + 1
+        if size <= self.active.shape[0]:
+            return
+        for name in ('active', 'orders', 'revenue'):
+            matrix = getattr(self, name)
+            grown = np.zeros((size, size), dtype=matrix.dtype)
+            grown[:matrix.shape[0], :matrix.shape[1]] = matrix
+            setattr(self, name, grown)
+
+    def _add_cells(self, cohort_index, offsets, amounts, new_pairs_mask):
+        """Добавление заказов к ячейкам когорта × месяц жизни"""
+        size = self.active.shape[0]
+        flat = cohort_index * size + offsets
+        cells = size * size
+        self.orders += np.bincount(flat, minlength=cells).reshape(size, size)
+        self.revenue += np.bincount(flat, weights=amounts, minlength=cells).reshape(size, size)
+        self.active += np.bincount(flat[new_pairs_mask], minlength=cells).reshape(size, size)
+
+    def build(self, orders):
+        """Полный расчет по массивам заказов (load_orders)"""
+        started = time.perf_counter()
+        self.__init__()
+        if len(orders['customer_id']) == 0:
+            return self
+
+        months = orders['month']
+        self.customers, customer_index = np.unique(orders['customer_id'], return_inverse=True)
+        self.cohorts = np.full(len(self.customers), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(self.cohorts, customer_index, months)
+
+        self.base_month = int(months.min())
+        self._grow(months.max())
+        cohort_of_order = self.cohorts[customer_index]
+
+        pairs = orders['customer_id'] * MONTH_SPAN + months
+        self.active_pairs, first_of_pair = np.unique(pairs, return_index=True)
+        new_pairs_mask = np.zeros(len(pairs), dtype=bool)
+        new_pairs_mask[first_of_pair] = True
+
+        self._add_cells(cohort_of_order - self.base_month, months - cohort_of_order,
+                        orders['amount'], new_pairs_mask)
+        self.last_order_id = int(orders['order_id'].max())
+        logger.info(
+            f"👥 Когорты: {len(months):,} заказов, {len(self.customers):,} клиентов, "
+            f"{self.active.shape[0]} месяцев за {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+        return self
+
+    def update(self, orders):
+        """
+        Добавление новых заказов. Возвращает False, если заказ раньше когорты клиента
+        (задним числом) — тогда когорты нужно пересчитать полностью (build)
+        """
+        if len(orders['customer_id']) == 0:
+            return True
+        if self.base_month is None:
+            self.build(orders)
+            return True
+
+        customers, months = orders['customer_id'], orders['month']
+        position = np.searchsorted(self.customers, customers)
+        position_clipped = np.minimum(position, max(len(self.customers) - 1, 0))
+        known = (position < len(self.customers)) & (self.customers[position_clipped] == customers) \
+            if len(self.customers) else np.zeros(len(customers), dtype=bool)
+        if months.min() < self.base_month or np.any(months[known] < self.cohorts[position_clipped[known]]):
+            return False
+
+        # Новые клиенты: когорта — первый месяц среди новых заказов
+        new_customers, new_index = np.unique(customers[~known], return_inverse=True)
+        new_cohorts = np.full(len(new_customers), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(new_cohorts, new_index, months[~known])
+        insert_at = np.searchsorted(self.customers, new_customers)
+        self.customers = np.insert(self.customers, insert_at, new_customers)
+        self.cohorts = np.insert(self.cohorts, insert_at, new_cohorts)
+
+        cohort_of_order = self.cohorts[np.searchsorted(self.customers, customers)]
+        self._grow(months.max())
+
+        # Пары клиент × месяц, которых еще не было: уникальные среди новых и отсутствующие в состоянии
+        pairs = customers * MONTH_SPAN + months
+        unique_pairs, first_of_pair = np.unique(pairs, return_index=True)
+        pair_position = np.searchsorted(self.active_pairs, unique_pairs)
+        pair_position_clipped = np.minimum(pair_position, max(len(self.active_pairs) - 1, 0))
+        seen = (pair_position < len(self.active_pairs)) & (self.active_pairs[pair_position_clipped] == unique_pairs) \
+            if len(self.active_pairs) else np.zeros(len(unique_pairs), dtype=bool)
+        new_pairs_mask = np.zeros(len(pairs), dtype=bool)
+        new_pairs_mask[first_of_pair[~seen]] = True
+        self.active_pairs = np.insert(self.active_pairs, pair_position[~seen], unique_pairs[~seen])
+
+        self._add_cells(cohort_of_order - self.base_month, months - cohort_of_order,
+                        orders['amount'], new_pairs_mask)
+        self.last_order_id = max(self.last_order_id, int(orders['order_id'].max()))
+        logger.info(f"👥 Когорты: добавлено {len(customers):,} заказов, новых клиентов {len(new_customers):,}")
+        return True
+
+    def cohort_sizes(self):
+        """Размер когорты — активные клиенты в месяц первого заказа"""
+        return self.active[:, 0] if self.active.size else np.empty(0, np.int64)
+
+    def retention_frame(self, max_offset=None):
+        """
+        Длинная таблица когорт: cohort_month, months_since_first, cohort_size,
+        active_customers, retention_rate (%), orders, revenue, cumulative_revenue_per_customer
+        """
+        if self.base_month is None:
+            return pd.DataFrame(columns=[
+                'cohort_month', 'months_since_first', 'cohort_size', 'active_customers', 'retention_rate',
+                'orders', 'revenue', 'cumulative_revenue_per_customer'
+            ])
+        size = self.active.shape[0]
+        cohort, offset = np.divmod(np.arange(size * size), size)
+        # Ячейки после текущего месяца (когорта + месяц жизни > последний месяц) не существуют
+        valid = cohort + offset < size
+        if max_offset is not None:
+            valid &= offset <= max_offset
+
+        sizes = self.cohort_sizes()
+        cumulative_revenue = np.cumsum(self.revenue, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            retention = np.where(sizes[:, None] > 0, self.active / sizes[:, None] * 100, 0.0)
+            revenue_per_customer = np.where(sizes[:, None] > 0, cumulative_revenue / sizes[:, None], 0.0)
+
+        labels = np.array([_month_label(self.base_month + i) for i in range(size)], dtype=object)
+        frame = pd.DataFrame({
+            'cohort_month': labels[cohort[valid]],
+            'months_since_first': offset[valid],
+            'cohort_size': sizes[cohort[valid]],
+            'active_customers': self.active.ravel()[valid],
+            'retention_rate': retention.ravel()[valid].round(2),
+            'orders': self.orders.ravel()[valid],
+            'revenue': self.revenue.ravel()[valid].round(2),
+            'cumulative_revenue_per_customer': revenue_per_customer.ravel()[valid].round(2)
+        })
+        return frame[frame['cohort_size'] > 0].reset_index(drop=True)
+
+    def retention_matrix(self, max_offset=12):
+        """Матрица удержания (%) когорта × месяц жизни для вывода"""
+        frame = self.retention_frame(max_offset)
+        return frame.pivot(index='cohort_month', columns='months_since_first', values='retention_rate')
+
+    def save(self, cohort_dir):
+        """Сохранение массивов и состояния (через временные файлы)"""
+        cohort_dir = Path(cohort_dir)
+        cohort_dir.mkdir(parents=True, exist_ok=True)
+        tmp_arrays = cohort_dir / (ARRAYS_FILE + '.tmp')
+        with open(tmp_arrays, 'wb') as f:
+            np.savez(f, customers=self.customers, cohorts=self.cohorts, active_pairs=self.active_pairs,
+                     active=self.active, orders=self.orders, revenue=self.revenue)
+        os.replace(tmp_arrays, cohort_dir / ARRAYS_FILE)
+
+        state_path = cohort_dir / STATE_FILE
+        tmp_state = state_path.with_suffix('.tmp')
+        with open(tmp_state, 'w', encoding='utf-8') as f:
+            json.dump({
+                'base_month': self.base_month,
+                'last_order_id': self.last_order_id,
+                'customers': len(self.customers),
+                'months': self.active.shape[0],
+                'updated_at': datetime.now().isoformat()
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_state, state_path)
+
+    @classmethod
+    def load(cls, cohort_dir):
+        """Сохраненное состояние (None, если когорты еще не считались)"""
+        cohort_dir = Path(cohort_dir)
+        state_path = cohort_dir / STATE_FILE
+        if not state_path.exists() or not (cohort_dir / ARRAYS_FILE).exists():
+            return None
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        engine = cls()
+        with np.load(cohort_dir / ARRAYS_FILE) as arrays:
+            for name in ('customers', 'cohorts', 'active_pairs', 'active', 'orders', 'revenue'):
+                setattr(engine, name, arrays[name])
+        engine.base_month = state['base_month']
+        engine.last_order_id = state['last_order_id']
+        return engine
+
+
+def refresh_cohorts(cohort_dir=DEFAULT_COHORT_DIR, full=False, pool=None):
+    """
+    Обновление когорт: заказы после последнего учтенного id добавляются к сохраненному
+    состоянию; полный пересчет — при full, без состояния или при заказе задним числом.
+    Изменения уже учтенных заказов (оплата, состав) подхватывает только полный пересчет
+    """
+    pool = pool or get_pool(application_name='databoard-cohorts')
+    engine = None if full else CohortEngine.load(cohort_dir)
+    with pool.analytics_connection() as conn:
+        if engine is not None:
+            orders = load_orders(conn, after_id=engine.last_order_id)
+            if not engine.update(orders):
+                logger.info("ℹ️ Заказы задним числом меняют когорты — полный пересчет")
+                engine = None
+        if engine is None:
+            engine = CohortEngine().build(load_orders(conn))
+    engine.save(cohort_dir)
+    return engine
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(refresh_cohorts().retention_matrix().to_string())
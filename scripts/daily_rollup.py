@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Инкрементальные дневные агрегаты заказов (daily_kpi_rollup)
+Каждый запуск пересчитывает только дни, затронутые изменениями после водяной метки,
+уникальные клиенты за произвольный период считаются объединением HyperLogLog-скетчей
+"""
+
+import logging
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from database import get_pool
+from sketches import HLL_PRECISION, HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = 'daily_kpi_rollup'
+WATERMARK_TABLE = 'rollup_watermarks'
+
+# Последние дни пересчитываются всегда: удаления и перенос заказов на другую дату
+# не видны по updated_at
+DEFAULT_LOOKBACK_DAYS = 3
+# Дни пересчитываются пачками, чтобы ограничить размер array_agg по клиентам
+DEFAULT_DAYS_PER_BATCH = 31
+
+# Дни, затронутые изменениями заказов и позиций после водяной метки
+TOUCHED_DAYS_QUERY = """
+SELECT DISTINCT o.order_date::date
+FROM orders o
+WHERE (o.updated_at >= %(watermark)s OR o.created_at >= %(watermark)s)
+  AND o.order_date IS NOT NULL
+UNION
+SELECT DISTINCT o.order_date::date
+FROM order_items oi
+JOIN orders o ON o.id = oi.order_id
+WHERE oi.created_at >= %(watermark)s
+  AND o.order_date IS NOT NULL
+UNION
+SELECT generate_series(CURRENT_DATE - %(lookback_days)s, CURRENT_DATE, INTERVAL '1 day')::date
+"""
+
+ALL_DAYS_QUERY = """
+SELECT DISTINCT order_date::date FROM orders WHERE order_date IS NOT NULL
+"""
+
+# Новая водяная метка: максимальная отметка времени в данных (а не часы клиента)
+CURRENT_WATERMARK_QUERY = """
+SELECT GREATEST(
+    (SELECT MAX(GREATEST(created_at, updated_at)) FROM orders),
+    (SELECT MAX(created_at) FROM order_items)
+)
+"""
+
+# Агрегаты по заданным дням; сначала суммы по заказу, чтобы заказы не дублировались позициями
+DAY_AGGREGATES_QUERY = """
+WITH days AS (
+    SELECT unnest(%(days)s::date[]) as day
+),
+order_totals AS (
+    SELECT
+        d.day as order_date,
+        o.id,
+        o.customer_id,
+        o.status,
+        o.payment_status,
+        COALESCE(SUM(oi.quantity * oi.unit_price), 0) as amount,
+        COALESCE(SUM(oi.quantity), 0) as units
+    FROM days d
+    JOIN orders o ON o.order_date >= d.day AND o.order_date < d.day + 1
+    LEFT JOIN order_items oi ON o.id = oi.order_id
+    GROUP BY d.day, o.id, o.customer_id, o.status, o.payment_status
+)
+SELECT
+    order_date,
+    COUNT(*) as total_orders,
+    COUNT(*) FILTER (WHERE payment_status = 'paid') as paid_orders,
+    COUNT(*) FILTER (WHERE status = 'delivered') as delivered_orders,
+    COUNT(*) FILTER (WHERE status = 'cancelled') as cancelled_orders,
+    COUNT(*) FILTER (WHERE status = 'returned') as returned_orders,
+    SUM(amount) as gross_revenue,
+    COALESCE(SUM(amount) FILTER (WHERE payment_status = 'paid'), 0) as net_revenue,
+    SUM(units) as units_sold,
+    COUNT(DISTINCT customer_id) as unique_customers,
+    ARRAY_AGG(DISTINCT customer_id) FILTER (WHERE customer_id IS NOT NULL) as customer_ids
+FROM order_totals
+GROUP BY order_date
+"""
+
+# Товары, которые хотя бы раз заказывали (для сводки KPI; products небольшая таблица)
+ORDERED_PRODUCTS_QUERY = """
+SELECT
+    COUNT(*) as total_products,
+    COUNT(*) FILTER (WHERE p.is_active = true) as active_products
+FROM products p
+WHERE EXISTS (SELECT 1 FROM order_items oi WHERE oi.product_id = p.id)
+"""
+
+_METRIC_COLUMNS = [
+    'total_orders', 'paid_orders', 'delivered_orders', 'cancelled_orders', 'returned_orders',
+    'gross_revenue', 'net_revenue', 'units_sold', 'unique_customers'
+]
+
+
+class DailyRollup:
+    """
+    Дневные агрегаты заказов с инкрементальным обновлением.
+
+    Водяная метка — максимальные created_at/updated_at заказов и позиций на момент
+    прошлого запуска. Пересчитываются дни заказов, измененных после нее (в том числе
+    задним числом), и последние lookback_days дней. Строки дней заменяются целиком
+    в одной транзакции вместе с водяной меткой.
+    """
+
+    def __init__(self, pool=None, lookback_days=DEFAULT_LOOKBACK_DAYS,
+                 days_per_batch=DEFAULT_DAYS_PER_BATCH, precision=HLL_PRECISION):
+        self.pool = pool or get_pool(application_name='databoard-rollup')
+        self.lookback_days = lookback_days
+        self.days_per_batch = days_per_batch
+        self.precision = precision
+
+    def create_tables(self, conn):
+        """Создание таблицы агрегатов и таблицы водяных меток (в текущей транзакции)"""
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+                    order_date DATE PRIMARY KEY,
+                    total_orders INTEGER NOT NULL,
+                    paid_orders INTEGER NOT NULL,
+                    delivered_orders INTEGER NOT NULL,
+                    cancelled_orders INTEGER NOT NULL,
+                    returned_orders INTEGER NOT NULL,
+                    gross_revenue NUMERIC(18, 2) NOT NULL,
+                    net_revenue NUMERIC(18, 2) NOT NULL,
+                    units_sold BIGINT NOT NULL,
+                    unique_customers INTEGER NOT NULL,
+                    customers_hll BYTEA NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                    rollup_name TEXT PRIMARY KEY,
+                    watermark TIMESTAMP,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    last_run_days INTEGER,
+                    last_run_ms NUMERIC(12, 1)
+                )
+            """)
+
+    def get_watermark(self, conn):
+        """Водяная метка прошлого запуска (None — агрегаты еще не построены)"""
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (WATERMARK_TABLE,))
+            if not cur.fetchone()[0]:
+                return None
+            cur.execute(f"SELECT watermark FROM {WATERMARK_TABLE} WHERE rollup_name = %s", (ROLLUP_TABLE,))
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def is_ready(self, conn):
+        """Построены ли агрегаты хотя бы один раз"""
+        return self.get_watermark(conn) is not None
+
+    def _days_to_refresh(self, conn, watermark, full):
+        with conn.cursor() as cur:
+            if full or watermark is None:
+                cur.execute(ALL_DAYS_QUERY)
+            else:
+                cur.execute(TOUCHED_DAYS_QUERY, {'watermark': watermark, 'lookback_days': self.lookback_days})
+            return sorted(row[0] for row in cur.fetchall() if row[0] is not None)
+
+    def _refresh_days(self, conn, days):
+        """Пересчет и замена строк для пачки дней"""
+        with conn.cursor() as cur:
+            cur.execute(DAY_AGGREGATES_QUERY, {'days': days})
+            rows = cur.fetchall()
+
+            values = []
+            for row in rows:
+                sketch = HyperLogLog.from_values(np.asarray(row[-1] or [], dtype=np.int64), self.precision)
+                values.append(row[:-1] + (sketch.to_bytes(),))
+
+            # Дни без заказов (все удалены) исчезают из агрегатов
+            cur.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE order_date = ANY(%s::date[])", (days,))
+            if values:
+                placeholders = ', '.join(['%s'] * (len(_METRIC_COLUMNS) + 2))
+                cur.executemany(
+                    f"""
+                    INSERT INTO {ROLLUP_TABLE}
+                        (order_date, {', '.join(_METRIC_COLUMNS)}, customers_hll)
+                    VALUES ({placeholders})
+                    """,
+                    values
+                )
+        return len(rows)
+
+    def update(self, full=False):
+        """
+        Инкрементальное обновление агрегатов (full=True — полный пересчет).
+        Возвращает статистику запуска
+        """
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            self.create_tables(conn)
+            watermark = self.get_watermark(conn)
+
+            # Метка снимается до чтения: изменения во время пересчета попадут в следующий запуск
+            with conn.cursor() as cur:
+                cur.execute(CURRENT_WATERMARK_QUERY)
+                new_watermark = cur.fetchone()[0]
+
+            days = self._days_to_refresh(conn, watermark, full)
+            mode = 'полный пересчет' if full or watermark is None else f'изменения после {watermark}'
+            logger.info(f"📅 Дневные агрегаты: {len(days)} дней к пересчету ({mode})")
+
+            rows = 0
+            for i in range(0, len(days), self.days_per_batch):
+                rows += self._refresh_days(conn, days[i:i + self.days_per_batch])
+
+            duration_ms = (time.perf_counter() - started) * 1000
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    INSERT INTO {WATERMARK_TABLE} (rollup_name, watermark, updated_at, last_run_days, last_run_ms)
+                    VALUES (%s, %s, NOW(), %s, %s)
+                    ON CONFLICT (rollup_name) DO UPDATE SET
+                        watermark = EXCLUDED.watermark,
+                        updated_at = EXCLUDED.updated_at,
+                        last_run_days = EXCLUDED.last_run_days,
+                        last_run_ms = EXCLUDED.last_run_ms
+                    """,
+                    (ROLLUP_TABLE, new_watermark or watermark or datetime(1970, 1, 1),
+                     len(days), round(duration_ms, 1))
+                )
+            conn.commit()
+
+        logger.info(f"✅ Дневные агрегаты обновлены: {len(days)} дней, {rows} строк, {duration_ms:.0f} ms")
+        return {'days_refreshed': len(days), 'rows_written': rows,
+                'watermark': new_watermark, 'duration_ms': round(duration_ms, 1)}
+
+    def load(self, conn, start_date=None, end_date=None, with_sketches=False):
+        """Агрегаты за период в виде DataFrame (customers_hll — по запросу)"""
+        columns = ['order_date'] + _METRIC_COLUMNS + (['customers_hll'] if with_sketches else [])
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("order_date >= %s")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("order_date <= %s")
+            params.append(end_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {', '.join(columns)} FROM {ROLLUP_TABLE} {where} ORDER BY order_date", params)
+            return pd.DataFrame(cur.fetchall(), columns=columns)
+
+    def _merged_sketch(self, frame):
+        """Объединение дневных скетчей клиентов из load(with_sketches=True)"""
+        merged = HyperLogLog(self.precision)
+        for data in frame['customers_hll']:
+            merged.merge(HyperLogLog.from_bytes(data))
+        return merged
+
+    def unique_customers(self, conn, start_date=None, end_date=None):
+        """Оценка уникальных клиентов за период объединением дневных скетчей"""
+        frame = self.load(conn, start_date, end_date, with_sketches=True)
+        return self._merged_sketch(frame).count()
+
+    def kpi_summary_frame(self, conn):
+        """Сводка KPI по агрегатам — те же колонки и формулы, что и KPI_SUMMARY_QUERY"""
+        frame = self.load(conn, with_sketches=True)
+        unique_customers = self._merged_sketch(frame).count()
+
+        with conn.cursor() as cur:
+            cur.execute(ORDERED_PRODUCTS_QUERY)
+            total_products, active_products = cur.fetchone()
+
+        totals = {col: frame[col].sum() for col in _METRIC_COLUMNS if col != 'unique_customers'}
+        total_orders = int(totals['total_orders'])
+        paid_orders = int(totals['paid_orders'])
+        net_paid_revenue = float(totals['net_revenue'])
+
+        def ratio(numerator, denominator, digits=2, scale=100):
+            return round(numerator / denominator * scale, digits) if denominator > 0 else 0
+
+        summary = {
+            'total_orders': total_orders,
+            'paid_orders': paid_orders,
+            'delivered_orders': int(totals['delivered_orders']),
+            'cancelled_orders': int(totals['cancelled_orders']),
+            'returned_orders': int(totals['returned_orders']),
+            'gross_revenue': float(totals['gross_revenue']),
+            'net_paid_revenue': net_paid_revenue,
+            'total_units': int(totals['units_sold']),
+            'unique_customers': unique_customers,
+            # Клиенты с заказами — оценка по тому же скетчу
+            'total_customers': unique_customers,
+            'total_products': total_products,
+            'active_products': active_products,
+            'period_start': frame['order_date'].min() if len(frame) else None,
+            'period_end': frame['order_date'].max() if len(frame) else None,
+            'report_date': date.today(),
+            'aov': ratio(net_paid_revenue, paid_orders, scale=1),
+            'payment_conversion_rate': ratio(paid_orders, total_orders),
+            'return_rate': ratio(int(totals['returned_orders']), total_orders),
+            'cancellation_rate': ratio(int(totals['cancelled_orders']), total_orders),
+            'avg_units_per_order': ratio(int(totals['units_sold']), paid_orders, digits=1, scale=1),
+            'active_products_rate': ratio(active_products, total_products)
+        }
+        return pd.DataFrame([summary])
+
+    def status(self, conn):
+        """Состояние агрегатов: водяная метка, последний запуск, покрытие по датам"""
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT watermark, updated_at, last_run_days, last_run_ms FROM {WATERMARK_TABLE} "
+                f"WHERE rollup_name = %s",
+                (ROLLUP_TABLE,)
+            )
+            watermark_row = cur.fetchone()
+            cur.execute(f"SELECT COUNT(*), MIN(order_date), MAX(order_date) FROM {ROLLUP_TABLE}")
+            days, first_day, last_day = cur.fetchone()
+        status = {'days': days, 'first_day': first_day, 'last_day': last_day}
+        if watermark_row:
+            status.update(zip(['watermark', 'updated_at', 'last_run_days', 'last_run_ms'], watermark_row))
+        return status
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(DailyRollup().update())
@@ -11,13 +11,20 @@ Date: 2024
 Version: 1.0
 """
 
-import psycopg2
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import json
 import sys
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+from cleaning_scope import CleaningScope
+from data_profiler import profile_tables
+from database import get_db_config, get_pool
+from dtype_compaction import compact_frame
+from integrity import IntegrityChecker, KeyArrayCache, LiveKeySource
+
+CLEANING_TABLES = ['orders', 'order_items', 'customers', 'payments']
 
 class DataCleaningPipeline:
     """
@@ -29,23 +36,46 @@ class DataCleaningPipeline:
     - Referential integrity checks
     - Missing value handling
     - Outlier detection and treatment
+    
+    With incremental=True rules only look at rows added or changed since the
+    previous run (per-table watermarks, cleaning_scope.py); a full pass runs
+    when full=True or the last one is older than CLEANING_FULL_PASS_DAYS.
     """
     
-    def __init__(self, db_config: Dict[str, str]):
+    def __init__(self, db_config: Optional[Dict[str, str]] = None,
+                 incremental: bool = False, full: bool = False):
         """Initialize with database configuration."""
-        self.db_config = db_config
+        self.db_config = db_config or get_db_config('databoard-cleaning')
+        self.incremental = incremental
+        self.full = full
+        # Rule scope; stays a full pass unless begin() finds usable watermarks
+        self.scope = CleaningScope(None, 'data_cleaning', CLEANING_TABLES, full=full)
+        self.pool = None
         self.conn = None
         self.cleaning_log = []
+        # Result of the last validate_referential_integrity(); reset when a cleaning step removes rows
+        self.integrity_checks = None
+        # Sorted key arrays shared by integrity checks (integrity.py)
+        self.key_cache = KeyArrayCache()
         
     def connect_database(self):
-        """Establish database connection."""
+        """Check out a connection from the shared pool."""
         try:
-            self.conn = psycopg2.connect(**self.db_config)
+            self.pool = get_pool(db_config=self.db_config)
+            self.conn = self.pool.getconn()
+            self.scope.conn = self.conn
             print("✅ Database connection established")
         except Exception as e:
             print(f"❌ Database connection failed: {e}")
             sys.exit(1)
             
+    def close_database(self):
+        """Return the connection to the shared pool."""
+        if self.conn is not None:
+            self.scope.close()
+            self.pool.putconn(self.conn)
+            self.conn = None
+            
     def log_operation(self, operation: str, table: str, before_count: int, 
                      after_count: int, justification: str):
         """Log cleaning operation with metrics."""
@@ -64,6 +94,9 @@ class DataCleaningPipeline:
         }
         
         self.cleaning_log.append(log_entry)
+        if removed_count:
+            self.integrity_checks = None
+            self.key_cache.invalidate(table)
         
         print(f"\n📊 {operation} - {table}")
         print(f"   Before: {before_count:,} records")
@@ -72,14 +105,8 @@ class DataCleaningPipeline:
         print(f"   Reason: {justification}")
         
     def get_table_count(self, table: str, condition: str = "") -> int:
-        """Get record count for a table with optional condition."""
-        query = f"SELECT COUNT(*) FROM {table}"
-        if condition:
-            query += f" WHERE {condition}"
-            
-        with self.conn.cursor() as cur:
-            cur.execute(query)
-            return cur.fetchone()[0]
+        """Get record count for a table with optional condition (prepared statement)."""
+        return self.pool.count_rows(self.conn, table, condition)
     
     def clean_orders_table(self):
         """
@@ -98,10 +125,10 @@ class DataCleaningPipeline:
         before_date = self.get_table_count('orders')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM orders 
-                WHERE order_date > CURRENT_DATE + INTERVAL '1 day'
-            """)
+            cur.execute(self.scope.delete_sql('orders', f"""
+                order_date > CURRENT_DATE + INTERVAL '1 day'
+                AND {self.scope.rows('orders')}
+            """, 'order_id'))
             self.conn.commit()
             
         after_date = self.get_table_count('orders')
@@ -114,11 +141,11 @@ class DataCleaningPipeline:
         before_customer = self.get_table_count('orders')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM orders 
-                WHERE customer_id IS NULL 
-                   OR customer_id NOT IN (SELECT customer_id FROM customers)
-            """)
+            cur.execute(self.scope.delete_sql('orders', f"""
+                (customer_id IS NULL 
+                 OR customer_id NOT IN (SELECT customer_id FROM customers))
+                AND {self.scope.references('orders', 'customer_id', 'customers')}
+            """, 'order_id'))
             self.conn.commit()
             
         after_customer = self.get_table_count('orders')
@@ -132,7 +159,7 @@ class DataCleaningPipeline:
         
         with self.conn.cursor() as cur:
             # Find duplicates and keep the one with latest order_date
-            cur.execute("""
+            cur.execute(f"""
                 WITH duplicate_orders AS (
                     SELECT order_id,
                            ROW_NUMBER() OVER (
@@ -143,6 +170,7 @@ class DataCleaningPipeline:
                     WHERE order_id IN (
                         SELECT order_id 
                         FROM orders 
+                        WHERE {self.scope.keys('orders', 'order_id')}
                         GROUP BY order_id 
                         HAVING COUNT(*) > 1
                     )
@@ -164,10 +192,10 @@ class DataCleaningPipeline:
         before_items = self.get_table_count('orders')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM orders 
-                WHERE order_id NOT IN (SELECT DISTINCT order_id FROM order_items)
-            """)
+            cur.execute(self.scope.delete_sql('orders', f"""
+                order_id NOT IN (SELECT DISTINCT order_id FROM order_items)
+                AND {self.scope.rows('orders')}
+            """, 'order_id'))
             self.conn.commit()
             
         after_items = self.get_table_count('orders')
@@ -197,11 +225,12 @@ class DataCleaningPipeline:
         before_qty = self.get_table_count('order_items')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 DELETE FROM order_items 
-                WHERE quantity IS NULL 
+                WHERE (quantity IS NULL 
                    OR quantity <= 0 
-                   OR quantity > 1000
+                   OR quantity > 1000)
+                  AND {self.scope.rows('order_items')}
             """)
             self.conn.commit()
             
@@ -215,11 +244,12 @@ class DataCleaningPipeline:
         before_price = self.get_table_count('order_items')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 DELETE FROM order_items 
-                WHERE price_per_item IS NULL 
+                WHERE (price_per_item IS NULL 
                    OR price_per_item <= 0 
-                   OR price_per_item > 1000000
+                   OR price_per_item > 1000000)
+                  AND {self.scope.rows('order_items')}
             """)
             self.conn.commit()
             
@@ -233,9 +263,10 @@ class DataCleaningPipeline:
         before_orphan = self.get_table_count('order_items')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 DELETE FROM order_items 
                 WHERE order_id NOT IN (SELECT DISTINCT order_id FROM orders)
+                  AND {self.scope.references('order_items', 'order_id', 'orders')}
             """)
             self.conn.commit()
             
@@ -249,9 +280,10 @@ class DataCleaningPipeline:
         before_product = self.get_table_count('order_items')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 DELETE FROM order_items 
                 WHERE product_id IS NULL
+                  AND {self.scope.rows('order_items')}
             """)
             self.conn.commit()
             
@@ -281,7 +313,7 @@ class DataCleaningPipeline:
         before_dupe = self.get_table_count('customers')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 WITH duplicate_customers AS (
                     SELECT customer_id,
                            ROW_NUMBER() OVER (
@@ -292,6 +324,7 @@ class DataCleaningPipeline:
                     WHERE customer_id IN (
                         SELECT customer_id 
                         FROM customers 
+                        WHERE {self.scope.keys('customers', 'customer_id')}
                         GROUP BY customer_id 
                         HAVING COUNT(*) > 1
                     )
@@ -313,9 +346,10 @@ class DataCleaningPipeline:
         before_valid = self.get_table_count('customers')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 DELETE FROM customers 
                 WHERE customer_id IS NULL
+                  AND {self.scope.rows('customers')}
             """)
             self.conn.commit()
             
@@ -345,10 +379,11 @@ class DataCleaningPipeline:
         before_order = self.get_table_count('payments')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 DELETE FROM payments 
-                WHERE order_id IS NULL 
-                   OR order_id NOT IN (SELECT DISTINCT order_id FROM orders)
+                WHERE (order_id IS NULL 
+                   OR order_id NOT IN (SELECT DISTINCT order_id FROM orders))
+                  AND {self.scope.references('payments', 'order_id', 'orders')}
             """)
             self.conn.commit()
             
@@ -362,10 +397,11 @@ class DataCleaningPipeline:
         before_amount = self.get_table_count('payments')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 DELETE FROM payments 
-                WHERE paid_amount IS NULL 
-                   OR paid_amount < 0
+                WHERE (paid_amount IS NULL 
+                   OR paid_amount < 0)
+                  AND {self.scope.rows('payments')}
             """)
             self.conn.commit()
             
@@ -379,7 +415,7 @@ class DataCleaningPipeline:
         before_dupe = self.get_table_count('payments')
         
         with self.conn.cursor() as cur:
-            cur.execute("""
+            cur.execute(f"""
                 WITH ranked_payments AS (
                     SELECT *,
                            ROW_NUMBER() OVER (
@@ -394,6 +430,7 @@ class DataCleaningPipeline:
                     WHERE order_id IN (
                         SELECT order_id 
                         FROM payments 
+                        WHERE {self.scope.keys('payments', 'order_id')}
                         GROUP BY order_id 
                         HAVING COUNT(*) > 1
                     )
@@ -419,106 +456,77 @@ class DataCleaningPipeline:
         print(f"   Total removed: {total_removed:,} records ({total_removed/initial_count*100:.1f}%)")
         
     def validate_referential_integrity(self):
-        """Validate and report referential integrity."""
-        print("\n🔍 VALIDATING REFERENTIAL INTEGRITY")
-        
-        integrity_checks = []
-        
-        # Check orders -> customers relationship
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                SELECT COUNT(*) 
-                FROM orders o 
-                LEFT JOIN customers c ON o.customer_id = c.customer_id 
-                WHERE c.customer_id IS NULL
-            """)
-            invalid_customer_refs = cur.fetchone()[0]
-            
-        integrity_checks.append({
-            'relationship': 'orders -> customers',
-            'invalid_references': invalid_customer_refs,
-            'status': '✅ VALID' if invalid_customer_refs == 0 else '❌ INVALID'
-        })
+        """
+        Validate and report referential integrity.
         
-        # Check order_items -> orders relationship
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                SELECT COUNT(*) 
-                FROM order_items oi 
-                LEFT JOIN orders o ON oi.order_id = o.order_id 
-                WHERE o.order_id IS NULL
-            """)
-            invalid_order_refs = cur.fetchone()[0]
-            
-        integrity_checks.append({
-            'relationship': 'order_items -> orders',
-            'invalid_references': invalid_order_refs,
-            'status': '✅ VALID' if invalid_order_refs == 0 else '❌ INVALID'
-        })
+        Each key column is extracted once into a sorted array and every
+        relationship is checked with np.searchsorted (integrity.py) instead of
+        a LEFT JOIN per relationship; orders.order_id is shared by two checks.
+        """
+        print("\n🔍 VALIDATING REFERENTIAL INTEGRITY")
         
-        # Check payments -> orders relationship
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                SELECT COUNT(*) 
-                FROM payments p 
-                LEFT JOIN orders o ON p.order_id = o.order_id 
-                WHERE o.order_id IS NULL
-            """)
-            invalid_payment_refs = cur.fetchone()[0]
-            
-        integrity_checks.append({
-            'relationship': 'payments -> orders',
-            'invalid_references': invalid_payment_refs,
-            'status': '✅ VALID' if invalid_payment_refs == 0 else '❌ INVALID'
-        })
+        checker = IntegrityChecker(LiveKeySource(self.pool), cache=self.key_cache)
+        integrity_checks = checker.check()
         
         # Report results
         for check in integrity_checks:
             print(f"   {check['relationship']}: {check['status']}")
             if check['invalid_references'] > 0:
                 print(f"      Invalid references: {check['invalid_references']:,}")
+                print(f"      Sample ids: {check['sample_invalid_ids']}")
                 
+        self.integrity_checks = integrity_checks
         return integrity_checks
         
     def generate_data_quality_report(self):
-        """Generate comprehensive data quality report."""
+        """
+        Generate comprehensive data quality report.
+        
+        Each table is profiled by a single aggregate scan (data_profiler.py), with
+        tables scanned in parallel; counts, completeness and payment rate come from
+        those profiles. Integrity results of this run are reused when no cleaning
+        step has removed rows since validate_referential_integrity().
+        """
         print("\n📊 GENERATING DATA QUALITY REPORT")
         
         quality_report = {
             'timestamp': datetime.now().isoformat(),
             'cleaning_operations': self.cleaning_log,
             'final_counts': {},
-            'data_quality_metrics': {}
+            'data_quality_metrics': {},
+            'column_profiles': {}
         }
         
-        # Get final record counts
-        tables = ['orders', 'order_items', 'customers', 'payments']
-        for table in tables:
-            quality_report['final_counts'][table] = self.get_table_count(table)
-            
-        # Calculate quality metrics
-        with self.conn.cursor() as cur:
-            # Orders with complete data
-            cur.execute("""
-                SELECT COUNT(*) * 100.0 / (SELECT COUNT(*) FROM orders)
-                FROM orders o
-                JOIN order_items oi ON o.order_id = oi.order_id
-                JOIN customers c ON o.customer_id = c.customer_id
-            """)
-            complete_orders_pct = cur.fetchone()[0]
+        profiles = profile_tables(self.pool)
+        for table, profile in profiles.items():
+            quality_report['final_counts'][table] = profile['row_count']
+            quality_report['column_profiles'][table] = {
+                'columns': profile['columns'],
+                'rule_violations': profile['rule_violations']
+            }
             
-            # Payment completion rate
-            cur.execute("""
-                SELECT COUNT(*) FILTER (WHERE p.status_raw = 'paid') * 100.0 / COUNT(*)
-                FROM orders o
-                LEFT JOIN payments p ON o.order_id = p.order_id
-            """)
-            payment_completion_rate = cur.fetchone()[0] or 0
+        integrity_checks = self.integrity_checks or self.validate_referential_integrity()
+        
+        # Orders with customer and date whose customer exists. NULL customer_id is already
+        # counted as incomplete, so only references to missing customers are subtracted
+        orders = profiles['orders']
+        customer_check = next(
+            check for check in integrity_checks if check['relationship'] == 'orders -> customers'
+        )
+        missing_customers = customer_check['invalid_references'] - customer_check['null_references']
+        complete_orders = orders['row_count'] - orders['rule_violations']['incomplete'] - missing_customers
+        complete_orders_pct = complete_orders * 100.0 / orders['row_count'] if orders['row_count'] else 0
+        
+        # Payment completion rate: paid payments per order, in percent. Cleaning leaves at most one
+        # payment per order; paid payments of deleted orders could still push the ratio past the
+        # number of orders, so it is bounded at 100%
+        paid_payments = min(profiles['payments']['rule_violations']['paid'], orders['row_count'])
+        payment_completion_rate = paid_payments * 100.0 / orders['row_count'] if orders['row_count'] else 0
             
         quality_report['data_quality_metrics'] = {
             'complete_orders_percentage': round(complete_orders_pct, 2),
             'payment_completion_rate': round(payment_completion_rate, 2),
-            'referential_integrity': self.validate_referential_integrity()
+            'referential_integrity': integrity_checks
         }
         
         return quality_report
@@ -544,10 +552,14 @@ class DataCleaningPipeline:
             with self.conn.cursor() as cur:
                 cur.execute(f"SELECT * FROM {table}")
                 df = pd.DataFrame(cur.fetchall(), columns=[desc[0] for desc in cur.description])
-                df.to_csv(filepath, index=False)
+            # Compact dtypes right after fetching; CSV output is unchanged
+            df = compact_frame(df, table)
+            df.to_csv(filepath, index=False)
                 
             record_count = len(df)
-            print(f"   ✅ {filename}: {record_count:,} records")
+            compaction = df.attrs['dtype_compaction']
+            print(f"   ✅ {filename}: {record_count:,} records "
+                  f"({compaction['memory_before_mb']} MB → {compaction['memory_after_mb']} MB in memory)")
             
         print(f"\n✅ Clean data export complete")
         
@@ -560,6 +572,8 @@ class DataCleaningPipeline:
         
         # Connect to database
         self.connect_database()
+        if self.incremental:
+            self.scope.begin()
         
         # Run cleaning operations
         self.clean_orders_table()
@@ -577,9 +591,14 @@ class DataCleaningPipeline:
         if export_data:
             self.export_clean_data()
             
+        # Cleaning succeeded: the next incremental run starts from this run's watermarks
+        if self.incremental:
+            self.scope.commit()
+            quality_report['cleaning_mode'] = 'full' if self.scope.full else 'incremental'
+            
         # Save quality report
         with open('data_quality_report.json', 'w') as f:
-            json.dump(quality_report, f, indent=2)
+            json.dump(quality_report, f, indent=2, default=str)
             
         end_time = datetime.now()
         duration = end_time - start_time
@@ -600,19 +619,13 @@ class DataCleaningPipeline:
             
         return quality_report
 
-def main():
+def main(incremental: bool = False, full: bool = False):
     """Main execution function."""
-    # Database configuration
-    db_config = {
-        'host': '103.246.146.132',
-        'port': 5432,
-        'database': 'hackathon',
-        'user': 'user_db',
-        'password': 'psql14182025'
-    }
+    # Database configuration (shared with the other pipeline scripts)
+    db_config = get_db_config('databoard-cleaning')
     
     # Initialize and run pipeline
-    pipeline = DataCleaningPipeline(db_config)
+    pipeline = DataCleaningPipeline(db_config, incremental=incremental, full=full)
     
     try:
         report = pipeline.run_full_pipeline(export_data=True)
@@ -624,8 +637,7 @@ def main():
         return 1
     
     finally:
-        if pipeline.conn:
-            pipeline.conn.close()
+        pipeline.close_database()
 
 if __name__ == "__main__":
     exit_code = main()
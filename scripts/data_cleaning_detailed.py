@@ -4,33 +4,40 @@
 Подсчит��вает строки до/после обработки и предоставляет обоснования для всех операций
 """
 
-import psycopg2
 import pandas as pd
 import json
 import logging
 from datetime import datetime
 from typing import Dict, List, Tuple
-import os
-from dotenv import load_dotenv
 
-# Загрузка переменных окружения
-load_dotenv()
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('data_cleaning.log'),
-        logging.StreamHandler()
-    ]
-)
+from cleaning_scope import CleaningScope
+from database import get_pool
 
 logger = logging.getLogger(__name__)
 
+def setup_logging(log_file='data_cleaning.log'):
+    """Настройка логирования (вызывается точкой входа, а не при импорте модуля)"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler()
+        ]
+    )
+
+CLEANING_TABLES = ['customers', 'orders', 'order_items', 'products']
+
 class DataCleaner:
-    def __init__(self):
-        """Инициализация подключения к базе данных"""
+    def __init__(self, incremental=False, full=False):
+        """
+        Инициализация подключения к базе данных.
+        incremental — правила только для строк после водяных меток прошлого запуска
+        (cleaning_scope.py), full — полный проход с обновлением меток
+        """
+        self.incremental = incremental
+        self.scope = CleaningScope(None, 'data_cleaning_detailed', CLEANING_TABLES, full=full)
+        self.pool = None
         self.conn = None
         self.cur = None
         self.cleaning_report = {
@@ -43,14 +50,10 @@ class DataCleaner:
     def connect_db(self):
         """Подключение к базе данных"""
         try:
-            self.conn = psycopg2.connect(
-                host=os.getenv('DB_HOST', '103.246.146.132'),
-                port=os.getenv('DB_PORT', 5432),
-                database=os.getenv('DB_NAME', 'hackathon'),
-                user=os.getenv('DB_USER', 'user_db'),
-                password=os.getenv('DB_PASSWORD', 'psql14182025')
-            )
+            self.pool = get_pool(application_name='databoard-cleaning-detailed')
+            self.conn = self.pool.getconn()
             self.cur = self.conn.cursor()
+            self.scope.conn = self.conn
             logger.info("✅ Подключение к базе данных установлено")
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к БД: {e}")
@@ -60,18 +63,16 @@ class DataCleaner:
         """Отключение от базы данных"""
         if self.cur:
             self.cur.close()
+            self.cur = None
         if self.conn:
-            self.conn.close()
-        logger.info("🔌 Соединение с БД закрыто")
+            self.scope.close()
+            self.pool.putconn(self.conn)
+            self.conn = None
+        logger.info("🔌 Соединение с БД возвращено в пул")
         
     def count_rows(self, table_name: str, condition: str = "") -> int:
-        """Подсчет строк в таблице с опциональным условием"""
-        query = f"SELECT COUNT(*) FROM {table_name}"
-        if condition:
-            query += f" WHERE {condition}"
-            
-        self.cur.execute(query)
-        return self.cur.fetchone()[0]
+        """Подсчет строк в таблице с опциональным условием (prepared statement)"""
+        return self.pool.count_rows(self.conn, table_name, condition)
         
     def log_operation(self, operation_name: str, table_name: str, rows_before: int, 
                      rows_after: int, description: str, justification: str):
@@ -104,11 +105,12 @@ class DataCleaner:
         rows_before = self.count_rows(table_name)
         
         # Поиск дубликатов по email
-        duplicate_query = """
+        duplicate_query = f"""
         WITH duplicates AS (
             SELECT email, MIN(id) as keep_id, COUNT(*) as count
             FROM customers 
             WHERE email IS NOT NULL AND email != ''
+              AND {self.scope.keys('customers', 'email')}
             GROUP BY email 
             HAVING COUNT(*) > 1
         )
@@ -120,15 +122,17 @@ class DataCleaner:
         
         if duplicates_count > 0:
             # Удаление дубликатов (оставляем запись с минимальным ID)
-            delete_query = """
-            DELETE FROM customers 
-            WHERE id NOT IN (
+            email_scope = self.scope.keys('customers', 'email')
+            delete_query = self.scope.delete_sql('customers', f"""
+            id NOT IN (
                 SELECT MIN(id) 
                 FROM customers 
                 WHERE email IS NOT NULL AND email != ''
+                  AND {email_scope}
                 GROUP BY email
             ) AND email IS NOT NULL AND email != ''
-            """
+              AND {email_scope}
+            """, 'id')
             
             self.cur.execute(delete_query)
             self.conn.commit()
@@ -152,32 +156,32 @@ class DataCleaner:
         rows_before = self.count_rows(table_name)
         
         # Удаление заказов без товаров
-        delete_query = """
-        DELETE FROM orders 
-        WHERE id NOT IN (
+        delete_query = self.scope.delete_sql('orders', f"""
+        id NOT IN (
             SELECT DISTINCT order_id 
             FROM order_items 
             WHERE order_id IS NOT NULL
         )
-        """
+        AND {self.scope.rows('orders')}
+        """, 'id')
         
         self.cur.execute(delete_query)
         
         # Удаление заказов с некорректными датами
-        delete_future_orders = """
-        DELETE FROM orders 
-        WHERE order_date > CURRENT_DATE
-        """
+        delete_future_orders = self.scope.delete_sql('orders', f"""
+        order_date > CURRENT_DATE
+        AND {self.scope.rows('orders')}
+        """, 'id')
         
         self.cur.execute(delete_future_orders)
         
         # Удаление заказов с некорректными customer_id
-        delete_orphan_orders = """
-        DELETE FROM orders 
-        WHERE customer_id NOT IN (
+        delete_orphan_orders = self.scope.delete_sql('orders', f"""
+        customer_id NOT IN (
             SELECT id FROM customers WHERE id IS NOT NULL
         )
-        """
+        AND {self.scope.references('orders', 'customer_id', 'customers')}
+        """, 'id')
         
         self.cur.execute(delete_orphan_orders)
         
@@ -202,13 +206,14 @@ class DataCleaner:
         rows_before = self.count_rows(table_name)
         
         # Удаление позиций с некорректными количествами или ценами
-        delete_query = """
+        delete_query = f"""
         DELETE FROM order_items 
-        WHERE quantity <= 0 
+        WHERE (quantity <= 0 
            OR unit_price < 0
            OR quantity IS NULL 
            OR unit_price IS NULL
-           OR product_id NOT IN (SELECT id FROM products WHERE id IS NOT NULL)
+           OR product_id NOT IN (SELECT id FROM products WHERE id IS NOT NULL))
+          AND {self.scope.rows('order_items')}
         """
         
         self.cur.execute(delete_query)
@@ -225,7 +230,7 @@ class DataCleaner:
         )
         
     def clean_inactive_products(self):
-        """Архивирование неактивных товаров"""
+        """Архивирование неактивных товаров (правило зависит от времени, а не от строки — всегда полностью)"""
         table_name = "products"
         operation_name = "Архивирование устаревших товаров"
         
@@ -270,13 +275,13 @@ class DataCleaner:
             "email LIKE '%test%' OR email LIKE '%example%' OR name LIKE '%Test%'")
         
         if test_customers_before > 0:
-            delete_test_customers = """
-            DELETE FROM customers 
-            WHERE email LIKE '%test%' 
+            delete_test_customers = self.scope.delete_sql('customers', f"""
+            (email LIKE '%test%' 
                OR email LIKE '%example%' 
                OR name LIKE '%Test%'
-               OR name LIKE '%test%'
-            """
+               OR name LIKE '%test%')
+              AND {self.scope.rows('customers')}
+            """, 'id')
             self.cur.execute(delete_test_customers)
             
             test_customers_after = self.count_rows("customers", 
@@ -289,31 +294,37 @@ class DataCleaner:
                 "Тестовые данные искажают реальную аналитику и метрики бизнеса."
             )
         
-        # Тестовые заказы (заказы с очень маленькими суммами)
-        test_orders_query = """
+        # Тестовые заказы (заказы с очень маленькими суммами); в инкрементальном
+        # режиме — новые заказы и заказы с новыми позициями
+        orders_scope = self.scope.rows('orders', 'o')
+        if not self.scope.full:
+            orders_scope = (f"({orders_scope} OR o.id IN "
+                            f"(SELECT order_id FROM order_items WHERE {self.scope.rows('order_items')}))")
+        test_orders_query = f"""
         SELECT COUNT(*) FROM orders o
         WHERE (
             SELECT COALESCE(SUM(oi.quantity * oi.unit_price), 0)
             FROM order_items oi 
             WHERE oi.order_id = o.id
         ) < 1
+          AND {orders_scope}
         """
         
         self.cur.execute(test_orders_query)
         test_orders_before = self.cur.fetchone()[0]
         
         if test_orders_before > 0:
-            delete_test_orders = """
-            DELETE FROM orders 
-            WHERE id IN (
+            delete_test_orders = self.scope.delete_sql('orders', f"""
+            id IN (
                 SELECT o.id FROM orders o
                 WHERE (
                     SELECT COALESCE(SUM(oi.quantity * oi.unit_price), 0)
                     FROM order_items oi 
                     WHERE oi.order_id = o.id
                 ) < 1
+                  AND {orders_scope}
             )
-            """
+            """, 'id')
             self.cur.execute(delete_test_orders)
             
             self.cur.execute(test_orders_query)
@@ -333,22 +344,25 @@ class DataCleaner:
         logger.info("🔄 Обновление вычисляемых полей...")
         
         # Обновление updated_at для измененных записей
-        update_customers = """
+        update_customers = f"""
         UPDATE customers 
         SET updated_at = CURRENT_TIMESTAMP 
-        WHERE updated_at < created_at OR updated_at IS NULL
+        WHERE (updated_at < created_at OR updated_at IS NULL)
+          AND {self.scope.rows('customers')}
         """
         
-        update_products = """
+        update_products = f"""
         UPDATE products 
         SET updated_at = CURRENT_TIMESTAMP 
-        WHERE updated_at < created_at OR updated_at IS NULL
+        WHERE (updated_at < created_at OR updated_at IS NULL)
+          AND {self.scope.rows('products')}
         """
         
-        update_orders = """
+        update_orders = f"""
         UPDATE orders 
         SET updated_at = CURRENT_TIMESTAMP 
-        WHERE updated_at < created_at OR updated_at IS NULL
+        WHERE (updated_at < created_at OR updated_at IS NULL)
+          AND {self.scope.rows('orders')}
         """
         
         self.cur.execute(update_customers)
@@ -405,6 +419,9 @@ class DataCleaner:
             logger.info("=" * 50)
             
             self.connect_db()
+            if self.incremental:
+                self.scope.begin()
+                self.cleaning_report['mode'] = 'full' if self.scope.full else 'incremental'
             
             # Последовательность операций очистки
             cleaning_operations = [
@@ -422,6 +439,9 @@ class DataCleaner:
                 logger.info(f"✅ Завершено: {operation_name}")
                 logger.info("-" * 30)
             
+            # Следующий инкрементальный запуск начнется с меток этого запуска
+            if self.incremental:
+                self.scope.commit()
             self.generate_summary()
             
             logger.info("🎉 ОЧИСТКА ДАННЫХ ЗАВЕРШЕНА УСПЕШНО")
@@ -438,5 +458,6 @@ class DataCleaner:
             self.disconnect_db()
 
 if __name__ == "__main__":
+    setup_logging()
     cleaner = DataCleaner()
     cleaner.run_cleaning()
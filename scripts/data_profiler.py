@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Профиль качества данных за один проход по каждой таблице
+Доля NULL, диапазоны значений и число нарушений правил очистки по всем колонкам
+считаются одним агрегирующим запросом на таблицу; таблицы сканируются параллельно
+своими соединениями пула, число уникальных значений берется из pg_stats без сканирования
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Правила очистки data_cleaning.py как условия нарушения: считаются в том же проходе
+PROFILE_RULES = {
+    'orders': {
+        'future_date': "order_date > CURRENT_DATE + INTERVAL '1 day'",
+        'missing_customer': "customer_id IS NULL",
+        'incomplete': "customer_id IS NULL OR order_date IS NULL",
+    },
+    'order_items': {
+        'invalid_quantity': "quantity IS NULL OR quantity <= 0 OR quantity > 1000",
+        'invalid_price': "price_per_item IS NULL OR price_per_item <= 0 OR price_per_item > 1000000",
+        'missing_product': "product_id IS NULL",
+    },
+    'customers': {
+        'missing_id': "customer_id IS NULL",
+    },
+    'payments': {
+        'missing_order': "order_id IS NULL",
+        'invalid_amount': "paid_amount IS NULL OR paid_amount < 0",
+        'paid': "status_raw = 'paid'",
+    },
+}
+
+# Типы, для которых в профиль попадают min/max; для строк — максимальная длина
+RANGE_TYPES = {
+    'smallint', 'integer', 'bigint', 'numeric', 'real', 'double precision',
+    'date', 'timestamp without time zone', 'timestamp with time zone'
+}
+TEXT_TYPES = {'text', 'character varying', 'character'}
+
+TABLE_COLUMNS_QUERY = """
+SELECT column_name, data_type
+FROM information_schema.columns
+WHERE table_schema = current_schema() AND table_name = %s
+ORDER BY ordinal_position
+"""
+
+# n_distinct < 0 — доля от числа строк (ANALYZE считает, что уникальных столько же, сколько строк × доля)
+DISTINCT_ESTIMATES_QUERY = """
+SELECT tablename, attname, n_distinct
+FROM pg_stats
+WHERE schemaname = current_schema() AND tablename = ANY(%s)
+"""
+
+
+def profile_query(table, columns, rules):
+    """
+    Один агрегирующий запрос по таблице: COUNT(*), COUNT(колонка), MIN/MAX или
+    максимальная длина строки и COUNT(*) FILTER (WHERE правило) для каждого правила.
+    Псевдонимы — по позиции колонки, чтобы не зависеть от ее имени
+    """
+    expressions = ["COUNT(*) as row_count"]
+    for i, (column, data_type) in enumerate(columns):
+        expressions.append(f"COUNT({column}) as c{i}_non_null")
+        if data_type in RANGE_TYPES:
+            expressions.append(f"MIN({column}) as c{i}_min")
+            expressions.append(f"MAX({column}) as c{i}_max")
+        elif data_type in TEXT_TYPES:
+            expressions.append(f"MAX(LENGTH({column})) as c{i}_max_length")
+    for name, condition in rules.items():
+        expressions.append(f"COUNT(*) FILTER (WHERE {condition}) as rule_{name}")
+    return "SELECT\n    " + ",\n    ".join(expressions) + f"\nFROM {table}"
+
+
+def _distinct_estimate(n_distinct, row_count):
+    if n_distinct is None:
+        return None
+    return int(round(-n_distinct * row_count)) if n_distinct < 0 else int(n_distinct)
+
+
+def profile_table(pool, table, rules):
+    """Профиль одной таблицы своим соединением пула"""
+    started = time.perf_counter()
+    with pool.analytics_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(TABLE_COLUMNS_QUERY, (table,))
+            columns = cur.fetchall()
+            cur.execute(profile_query(table, columns, rules))
+            names = [desc[0] for desc in cur.description]
+            values = dict(zip(names, cur.fetchone()))
+        conn.commit()
+
+    row_count = values['row_count']
+    column_profiles = {}
+    for i, (column, data_type) in enumerate(columns):
+        non_null = values[f'c{i}_non_null']
+        profile = {
+            'data_type': data_type,
+            'null_count': row_count - non_null,
+            'null_rate_percent': round((row_count - non_null) / row_count * 100, 2) if row_count else 0.0
+        }
+        if f'c{i}_min' in values:
+            profile['min'] = values[f'c{i}_min']
+            profile['max'] = values[f'c{i}_max']
+        if f'c{i}_max_length' in values:
+            profile['max_length'] = values[f'c{i}_max_length']
+        column_profiles[column] = profile
+
+    return {
+        'table': table,
+        'row_count': row_count,
+        'columns': column_profiles,
+        'rule_violations': {name: values[f'rule_{name}'] for name in rules},
+        'seconds': round(time.perf_counter() - started, 2)
+    }
+
+
+def profile_tables(pool=None, rules=PROFILE_RULES, workers=None):
+    """
+    Профили таблиц rules ({таблица: {правило: условие}}) параллельно: по одному
+    сканированию на таблицу. Число уникальных значений — оценка ANALYZE из pg_stats
+    (без ANALYZE — None). Возвращает {таблица: профиль}
+    """
+    pool = pool or get_pool(application_name='databoard-profiler')
+    started = time.perf_counter()
+    # Одно соединение пула обычно занято вызывающим (очистка держит свое)
+    workers = workers or max(1, min(len(rules), pool.maxconn - 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='profile') as executor:
+        futures = {table: executor.submit(profile_table, pool, table, table_rules)
+                   for table, table_rules in rules.items()}
+        profiles = {table: future.result() for table, future in futures.items()}
+
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(DISTINCT_ESTIMATES_QUERY, (list(rules),))
+            estimates = cur.fetchall()
+        conn.commit()
+    for table, column, n_distinct in estimates:
+        profile = profiles[table]['columns'].get(column)
+        if profile is not None:
+            profile['distinct_estimate'] = _distinct_estimate(n_distinct, profiles[table]['row_count'])
+
+    logger.info(
+        f"🔬 Профиль качества: {len(profiles)} таблиц, {workers} соединений "
+        f"за {time.perf_counter() - started:.1f} s"
+    )
+    return profiles
+
+
+if __name__ == "__main__":
+    import json
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(json.dumps(profile_tables(), indent=2, ensure_ascii=False, default=str))
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Общий слой доступа к PostgreSQL для скриптов пайплайна
+Пул соединений, таймауты запросов, подготовленные выражения и тегирование application_name
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from psycopg2 import pool as pg_pool
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию (переопределяются переменными окружения)
+DEFAULT_APPLICATION_NAME = 'databoard-pipeline'
+DEFAULT_STATEMENT_TIMEOUT_MS = 600000
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 8
+
+# work_mem для тяжелых аналитических выгрузок (сортировки, хеш-агрегаты)
+ANALYTICS_WORK_MEM = os.getenv('DB_ANALYTICS_WORK_MEM', '256MB')
+
+_env_loaded = False
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def load_env():
+    """Однократная загрузка .env (python-dotenv опционален)"""
+    global _env_loaded
+    if _env_loaded:
+        return
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    _env_loaded = True
+
+
+def get_db_config(application_name=None):
+    """Конфигурация подключения из переменных окружения"""
+    load_env()
+    return {
+        'host': os.getenv('DB_HOST', '103.246.146.132'),
+        'port': os.getenv('DB_PORT', 5432),
+        'database': os.getenv('DB_NAME', 'hackathon'),
+        'user': os.getenv('DB_USER', 'user_db'),
+        'password': os.getenv('DB_PASSWORD', 'psql14182025'),
+        'application_name': application_name or os.getenv('DB_APPLICATION_NAME', DEFAULT_APPLICATION_NAME)
+    }
+
+
+def _prepared_name(query):
+    """Стабильное имя серверного prepared statement по тексту запроса"""
+    return 'ps_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:16]
+
+
+@contextmanager
+def _statement_timeout(conn, timeout_ms):
+    """
+    Таймаут одного выражения. set_config(..., true) действует до конца транзакции,
+    поэтому после выражения возвращается прежнее значение: иначе таймаут достался бы
+    следующим выражениям той же транзакции (например, DELETE очистки после COUNT).
+    Настройка меняется отдельным курсором: результат выражения уже получен клиентом
+    """
+    if timeout_ms is None:
+        yield
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT current_setting('statement_timeout')")
+        previous = cur.fetchone()[0]
+        cur.execute("SELECT set_config('statement_timeout', %s, true)", (str(int(timeout_ms)),))
+    yield
+    # После ошибки транзакция прервана, и откат сбрасывает значение сам
+    with conn.cursor() as cur:
+        cur.execute("SELECT set_config('statement_timeout', %s, true)", (previous,))
+
+
+class DatabasePool:
+    """
+    Потокобезопасный пул соединений PostgreSQL.
+
+    - application_name передается в стартовом пакете и виден в pg_stat_activity
+    - statement_timeout задается на уровне сессии и может быть переопределен
+      для отдельного запроса через SET LOCAL
+    - повторяющиеся запросы (например, COUNT(*)) выполняются через PREPARE/EXECUTE,
+      подготовленные выражения кешируются для каждого соединения
+    - work_mem может быть увеличен на время сессии для тяжелых выгрузок
+    """
+
+    def __init__(self, db_config=None, minconn=None, maxconn=None,
+                 application_name=None, statement_timeout_ms=None):
+        config = dict(db_config or get_db_config(application_name))
+        if application_name:
+            config['application_name'] = application_name
+        config.setdefault('application_name', DEFAULT_APPLICATION_NAME)
+
+        if statement_timeout_ms is None:
+            statement_timeout_ms = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', DEFAULT_STATEMENT_TIMEOUT_MS))
+        self.statement_timeout_ms = statement_timeout_ms
+        config['options'] = f"-c statement_timeout={int(statement_timeout_ms)}"
+
+        self.minconn = minconn or int(os.getenv('DB_POOL_MIN', DEFAULT_POOL_MIN))
+        self.maxconn = maxconn or int(os.getenv('DB_POOL_MAX', DEFAULT_POOL_MAX))
+        self.application_name = config['application_name']
+        self.db_config = config
+
+        self._pool = pg_pool.ThreadedConnectionPool(self.minconn, self.maxconn, **config)
+        # ThreadedConnectionPool бросает PoolError при исчерпании — семафор заставляет ждать
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._lock = threading.Lock()
+        self._prepared = {}
+        self._dirty_sessions = set()
+
+        logger.info(
+            f"🔌 Пул соединений создан: {self.minconn}-{self.maxconn} "
+            f"(application_name={self.application_name}, statement_timeout={statement_timeout_ms} ms)"
+        )
+
+    def getconn(self, work_mem=None, application_name=None):
+        """Получение соединения из пула (блокируется, пока пул исчерпан)"""
+        self._slots.acquire()
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        try:
+            if work_mem or application_name:
+                with conn.cursor() as cur:
+                    if work_mem:
+                        cur.execute("SELECT set_config('work_mem', %s, false)", (str(work_mem),))
+                    if application_name:
+                        cur.execute("SELECT set_config('application_name', %s, false)", (application_name,))
+                conn.commit()
+                with self._lock:
+                    self._dirty_sessions.add(id(conn))
+        except Exception:
+            self.putconn(conn, close=True)
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Возврат соединения в пул со сбросом сессионных настроек"""
+        try:
+            if not close and not conn.closed:
+                conn.rollback()
+                with self._lock:
+                    dirty = id(conn) in self._dirty_sessions
+                    self._dirty_sessions.discard(id(conn))
+                if dirty:
+                    # RESET ALL не удаляет подготовленные выражения, в отличие от DISCARD ALL
+                    with conn.cursor() as cur:
+                        cur.execute("RESET ALL")
+                    conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Соединение не удалось вернуть в пул, закрываем: {e}")
+            close = True
+
+        try:
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            # psycopg2 закрывает возвращенное соединение, если в пуле уже minconn свободных;
+            # проверка после putconn: id() закрытого соединения может достаться новому, и
+            # подготовленные выражения из кеша считались бы уже созданными в его сессии
+            if conn.closed:
+                with self._lock:
+                    self._prepared.pop(id(conn), None)
+                    self._dirty_sessions.discard(id(conn))
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, work_mem=None, application_name=None):
+        """Контекстный менеджер для соединения из пула"""
+        conn = self.getconn(work_mem=work_mem, application_name=application_name)
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    @contextmanager
+    def analytics_connection(self, application_name=None):
+        """Соединение с увеличенным work_mem для тяжелых аналитических запросов"""
+        with self.connection(work_mem=ANALYTICS_WORK_MEM, application_name=application_name) as conn:
+            yield conn
+
+    def execute(self, conn, query, params=None, timeout_ms=None):
+        """Выполнение запроса с таймаутом на уровне отдельного выражения"""
+        cur = conn.cursor()
+        with _statement_timeout(conn, timeout_ms):
+            cur.execute(query, params)
+        return cur
+
+    def fetch_prepared(self, conn, query, params=(), timeout_ms=None):
+        """
+        Выполнение запроса через серверный prepared statement.
+
+        Запрос использует позиционные параметры PostgreSQL ($1, $2, ...).
+        PREPARE выполняется один раз на соединение, далее только EXECUTE.
+        Возвращает (имена колонок, строки).
+        """
+        name = _prepared_name(query)
+        with self._lock:
+            prepared = self._prepared.setdefault(id(conn), set())
+            needs_prepare = name not in prepared
+
+        with conn.cursor() as cur:
+            if needs_prepare:
+                cur.execute(f"PREPARE {name} AS {query}")
+                with self._lock:
+                    prepared.add(name)
+            with _statement_timeout(conn, timeout_ms):
+                if params:
+                    placeholders = ', '.join(['%s'] * len(params))
+                    cur.execute(f"EXECUTE {name} ({placeholders})", tuple(params))
+                else:
+                    cur.execute(f"EXECUTE {name}")
+            if cur.description is None:
+                return [], []
+            return [desc[0] for desc in cur.description], cur.fetchall()
+
+    def execute_prepared(self, conn, query, params=(), timeout_ms=None):
+        """Выполнение запроса через prepared statement с возвратом только строк"""
+        return self.fetch_prepared(conn, query, params, timeout_ms)[1]
+
+    def table_versions(self, conn, tables):
+        """
+        Версии таблиц для инвалидации кешей.
+
+        Версия — счетчики вставок/обновлений/удалений из pg_stat_user_tables
+        плюс relfilenode (меняется при TRUNCATE и VACUUM FULL).
+        Отсутствующие таблицы получают версию None.
+        """
+        tables = sorted(set(tables))
+        if not tables:
+            return {}
+        rows = self.execute_prepared(
+            conn,
+            """
+            SELECT relname,
+                   n_tup_ins || ':' || n_tup_upd || ':' || n_tup_del || ':' || pg_relation_filenode(relid)
+            FROM pg_stat_user_tables
+            WHERE relname = ANY($1::text[])
+            """,
+            (tables,)
+        )
+        versions = {table: None for table in tables}
+        versions.update({name: version for name, version in rows})
+        return versions
+
+    def count_rows(self, conn, table_name, condition="", timeout_ms=None):
+        """COUNT(*) по таблице через подготовленное выражение"""
+        query = f"SELECT COUNT(*) FROM {table_name}"
+        if condition:
+            query += f" WHERE {condition}"
+        return self.execute_prepared(conn, query, timeout_ms=timeout_ms)[0][0]
+
+    def closeall(self):
+        """Закрытие всех соединений пула"""
+        with self._lock:
+            self._prepared.clear()
+            self._dirty_sessions.clear()
+        self._pool.closeall()
+        logger.info("🔌 Пул соединений закрыт")
+
+
+def get_pool(application_name=None, db_config=None, **kwargs):
+    """Общий пул процесса (создается при первом обращении)"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None or _shared_pool._pool.closed:
+            _shared_pool = DatabasePool(db_config=db_config, application_name=application_name, **kwargs)
+        return _shared_pool
+
+
+def close_pool():
+    """Закрытие общего пула процесса"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is not None and not _shared_pool._pool.closed:
+            _shared_pool.closeall()
+        _shared_pool = None
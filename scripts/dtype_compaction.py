@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Компактные типы колонок выгружаемых DataFrame
+Целые приводятся к наименьшей разрядности, вмещающей значения, float64 — к float32,
+если значения представимы без потерь, строки с малым числом уникальных значений —
+к category (словарь Arrow), остальные строки — к строкам на Arrow вместо Python-объектов.
+Значения не меняются: CSV и Parquet получают те же данные
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Строковая колонка становится category, если уникальных значений не больше этой доли непустых
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+# Целочисленные типы по возрастанию разрядности
+SIGNED_TYPES = (np.int8, np.int16, np.int32, np.int64)
+UNSIGNED_TYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+# Целые с NULL (Int64) остаются nullable
+NULLABLE_INTEGER_TYPES = {
+    np.int8: 'Int8', np.int16: 'Int16', np.int32: 'Int32', np.int64: 'Int64',
+    np.uint8: 'UInt8', np.uint16: 'UInt16', np.uint32: 'UInt32', np.uint64: 'UInt64',
+}
+
+try:
+    ARROW_STRING_DTYPE = pd.StringDtype('pyarrow')
+except (ImportError, TypeError):
+    ARROW_STRING_DTYPE = None
+
+
+def _smallest_integer(min_value, max_value):
+    """Наименьший целочисленный тип numpy для диапазона [min_value, max_value]"""
+    candidates = UNSIGNED_TYPES if min_value >= 0 else SIGNED_TYPES
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return dtype
+    return np.int64
+
+
+def _compact_integers(series):
+    non_null = series.dropna()
+    if non_null.empty:
+        return series
+    dtype = _smallest_integer(int(non_null.min()), int(non_null.max()))
+    if np.dtype(dtype).itemsize >= series.dtype.itemsize:
+        return series
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        return series.astype(NULLABLE_INTEGER_TYPES[dtype])
+    return series.astype(dtype)
+
+
+def _compact_floats(series):
+    if series.dtype != np.float64:
+        return series
+    values = series.to_numpy()
+    as_float32 = values.astype(np.float32)
+    # Только без потерь: каждое значение возвращается в float64 тем же числом
+    with np.errstate(over='ignore', invalid='ignore'):
+        if not np.array_equal(as_float32.astype(np.float64), values, equal_nan=True):
+            return series
+    return series.astype(np.float32)
+
+
+def _compact_strings(series):
+    non_null = series.dropna()
+    if non_null.empty:
+        return series
+    kind = pd.api.types.infer_dtype(non_null, skipna=True)
+    if kind == 'boolean':
+        return series.astype('boolean')
+    if kind != 'string':
+        return series
+    if non_null.nunique() <= CATEGORY_MAX_UNIQUE_RATIO * len(non_null):
+        return series.astype('category')
+    if ARROW_STRING_DTYPE is not None and series.dtype != ARROW_STRING_DTYPE:
+        return series.astype(ARROW_STRING_DTYPE)
+    return series
+
+
+def compact_series(series):
+    """Колонка в компактном типе с теми же значениями (или исходная колонка)"""
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+        return series
+    if pd.api.types.is_integer_dtype(dtype):
+        return _compact_integers(series)
+    if pd.api.types.is_float_dtype(dtype):
+        return _compact_floats(series)
+    if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+        return _compact_strings(series)
+    return series
+
+
+def compact_frame(df, label=None):
+    """
+    DataFrame с компактными типами колонок. Отчет (память до/после, измененные колонки)
+    сохраняется в df.attrs['dtype_compaction'] — по нему писатель дополняет метаданные
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    compacted = {}
+    changes = {}
+    for col in df.columns:
+        series = compact_series(df[col])
+        if series.dtype != df[col].dtype:
+            compacted[col] = series
+            changes[col] = f"{df[col].dtype} → {series.dtype}"
+    result = df.assign(**compacted) if compacted else df.copy(deep=False)
+    after = int(result.memory_usage(deep=True).sum())
+
+    report = {
+        'memory_before_mb': round(before / 1024 / 1024, 2),
+        'memory_after_mb': round(after / 1024 / 1024, 2),
+        'reduction_percent': round((1 - after / before) * 100, 1) if before else 0.0,
+        'columns': changes
+    }
+    result.attrs['dtype_compaction'] = report
+    logger.info(
+        f"🗜️ {label or 'DataFrame'}: {report['memory_before_mb']} MB → {report['memory_after_mb']} MB "
+        f"(-{report['reduction_percent']}%), колонок сжато: {len(changes)}"
+    )
+    return result
+
+
+def merge_reports(total, report):
+    """Суммирование отчетов по порциям одной таблицы"""
+    if total is None:
+        return dict(report, columns=dict(report['columns']))
+    total['memory_before_mb'] = round(total['memory_before_mb'] + report['memory_before_mb'], 2)
+    total['memory_after_mb'] = round(total['memory_after_mb'] + report['memory_after_mb'], 2)
+    before = total['memory_before_mb']
+    total['reduction_percent'] = round((1 - total['memory_after_mb'] / before) * 100, 1) if before else 0.0
+    total['columns'].update(report['columns'])
+    return total
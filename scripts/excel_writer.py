@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Потоковая запись таблицы в Excel (.xlsx) с постоянным расходом памяти
+xlsxwriter в режиме constant_memory сбрасывает каждую строку во временный файл листа,
+поэтому выгрузка пишется порциями без полного DataFrame в памяти. Лист делится
+на следующий при достижении предела строк Excel (1 048 576 вместе с заголовком)
+"""
+
+import logging
+
+import pandas as pd
+import xlsxwriter
+
+logger = logging.getLogger(__name__)
+
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_SHEET_NAME = 31
+# Ширина колонок по виду значений (в символах)
+COLUMN_WIDTHS = {'number': 12, 'boolean': 8, 'date': 12, 'datetime': 20}
+MAX_TEXT_WIDTH = 40
+
+
+def _column_kind(series):
+    """
+    Вид значений колонки: определяет метод записи ячейки xlsxwriter.
+    None — в порции одни NULL, вид определяется по следующей порции
+    """
+    if not series.notna().any():
+        return None
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Сжатые колонки (dtype_compaction): вид по значениям словаря
+        series = pd.Series(dtype.categories)
+        dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'boolean'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'number'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    kind = pd.api.types.infer_dtype(series, skipna=True)
+    if kind == 'string':
+        return 'string'
+    if kind == 'date':
+        return 'date'
+    if kind in ('datetime', 'datetime64'):
+        return 'datetime'
+    if kind in ('decimal', 'integer', 'floating', 'mixed-integer-float'):
+        return 'number'
+    if kind == 'boolean':
+        return 'boolean'
+    return 'auto'
+
+
+def _column_values(series, kind):
+    """Значения колонки списком Python (NULL — None) одним векторным преобразованием"""
+    if kind == 'number' and pd.api.types.is_float_dtype(series.dtype):
+        # float32 после сжатия типов — обратно в float64 без потерь, как значения в CSV
+        series = series.astype('float64')
+    elif kind == 'number' and not pd.api.types.is_numeric_dtype(series.dtype):
+        series = pd.to_numeric(series.astype(object), errors='coerce')
+    elif kind in ('auto', None):
+        # JSON, массивы и прочие объекты — текстом, как в CSV
+        series = series.map(lambda value: value if isinstance(value, (str, int, float)) else str(value),
+                            na_action='ignore')
+    values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
+
+
+class ExcelStreamWriter:
+    """
+    Запись порций DataFrame в .xlsx: заголовок, закрепленная первая строка и автофильтр
+    на каждом листе. Вид колонки (число, логическое, дата, строка) определяется по первой
+    порции с непустыми значениями (до нее колонка пишется общим write): значения порции
+    преобразуются в списки по колонкам разом, а ячейки пишутся типизированными методами
+    (write_number, write_string, ...) без разбора типа каждого значения. NULL остаются
+    пустыми ячейками; отметки времени с часовым поясом пишутся без него
+    """
+
+    def __init__(self, path, sheet_name, rows_per_sheet=EXCEL_MAX_ROWS - 1):
+        self.path = path
+        self.sheet_name = sheet_name[:EXCEL_MAX_SHEET_NAME - 4]
+        self.rows_per_sheet = rows_per_sheet
+        self.workbook = xlsxwriter.Workbook(str(path), {
+            'constant_memory': True,
+            'remove_timezone': True,
+            'nan_inf_to_errors': True,
+            'strings_to_numbers': False,
+            'strings_to_formulas': False,
+            'strings_to_urls': False,
+        })
+        self.sheets = []
+        self.record_count = 0
+        self._columns = None
+        self._kinds = None
+        self._cell_writers = None
+        self._worksheet = None
+        self._row = 0
+        self._header_format = self.workbook.add_format({'bold': True})
+        self._formats = {
+            'date': self.workbook.add_format({'num_format': 'yyyy-mm-dd'}),
+            'datetime': self.workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'}),
+        }
+
+    def _cell_writer(self, worksheet, kind):
+        method = {
+            'number': worksheet.write_number,
+            'boolean': worksheet.write_boolean,
+            'date': worksheet.write_datetime,
+            'datetime': worksheet.write_datetime,
+            'string': worksheet.write_string,
+        }.get(kind, worksheet.write)
+        return method, self._formats.get(kind)
+
+    def _finish_sheet(self):
+        if self._worksheet is None:
+            return
+        rows = self._row - 1
+        if rows > 0:
+            self._worksheet.autofilter(0, 0, rows, len(self._columns) - 1)
+        self.sheets[-1]['rows'] = rows
+
+    def _new_sheet(self):
+        """Следующий лист: <таблица>, <таблица>_2, ... с заголовком"""
+        self._finish_sheet()
+        number = len(self.sheets) + 1
+        name = self.sheet_name if number == 1 else f"{self.sheet_name}_{number}"
+        worksheet = self.workbook.add_worksheet(name)
+        for col, (column, kind) in enumerate(zip(self._columns, self._kinds)):
+            width = COLUMN_WIDTHS.get(kind) or min(max(len(str(column)) + 2, 12), MAX_TEXT_WIDTH)
+            worksheet.set_column(col, col, max(width, len(str(column)) + 2))
+        # В режиме constant_memory строки пишутся строго по порядку: сначала заголовок
+        worksheet.write_row(0, 0, [str(column) for column in self._columns], self._header_format)
+        worksheet.freeze_panes(1, 0)
+        self._worksheet = worksheet
+        self._cell_writers = [self._cell_writer(worksheet, kind) for kind in self._kinds]
+        self._row = 1
+        self.sheets.append({'name': name, 'rows': 0})
+        if number > 1:
+            logger.info(f"📗 {self.path.name}: предел строк Excel, продолжение на листе {name}")
+
+    def _resolve_kinds(self, df):
+        """Вид колонок, в прежних порциях целиком NULL, по первой порции с непустыми значениями"""
+        for col, column in enumerate(self._columns):
+            if self._kinds[col] is None:
+                kind = _column_kind(df[column])
+                if kind is not None:
+                    self._kinds[col] = kind
+                    self._cell_writers[col] = self._cell_writer(self._worksheet, kind)
+
+    def write(self, df):
+        """Запись порции строк"""
+        if df is None or df.empty:
+            return
+        if self._columns is None:
+            self._columns = list(df.columns)
+            self._kinds = [_column_kind(df[column]) for column in self._columns]
+            self._new_sheet()
+        else:
+            self._resolve_kinds(df)
+
+        columns = [_column_values(df[column], kind) for column, kind in zip(self._columns, self._kinds)]
+        for values in zip(*columns):
+            if self._row > self.rows_per_sheet:
+                self._new_sheet()
+            row = self._row
+            for col, value in enumerate(values):
+                if value is not None:
+                    write, cell_format = self._cell_writers[col]
+                    write(row, col, value, cell_format)
+            self._row += 1
+        self.record_count += len(df)
+
+    def close(self):
+        """Завершение файла; возвращает листы [{'name', 'rows'}]"""
+        if self._columns is None:
+            # Пустая выгрузка: лист с именем таблицы без строк
+            self.workbook.add_worksheet(self.sheet_name)
+            self.sheets.append({'name': self.sheet_name, 'rows': 0})
+        self._finish_sheet()
+        self.workbook.close()
+        return self.sheets
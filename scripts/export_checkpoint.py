@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Контрольные точки выгрузки для продолжения прерванного экспорта
+Экспорт пишется во временную папку <output_dir>.partial; в checkpoint.json
+отмечаются завершенные таблицы и последняя записанная порция крупной таблицы
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from export_manifest import DEFAULT_EXPORT_ROOT
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'checkpoint.json'
+STAGING_SUFFIX = '.partial'
+# Порции крупных таблиц до сборки итоговых файлов: parts/<table>/part-00000.parquet
+PARTS_DIR = 'parts'
+
+
+def staging_dir_for(output_dir):
+    """Временная папка выгрузки: после завершения переименовывается в output_dir"""
+    output_dir = Path(output_dir)
+    return output_dir.with_name(output_dir.name + STAGING_SUFFIX)
+
+
+def output_dir_for(staging_dir):
+    """Итоговая папка выгрузки по временной"""
+    staging_dir = Path(staging_dir)
+    return staging_dir.with_name(staging_dir.name[:-len(STAGING_SUFFIX)])
+
+
+def find_interrupted_export(root=DEFAULT_EXPORT_ROOT):
+    """Итоговая папка последней прерванной выгрузки (None, если таких нет)"""
+    candidates = sorted(
+        path.parent for path in Path(root).glob(f'exported_data_*{STAGING_SUFFIX}/{CHECKPOINT_NAME}')
+    )
+    return output_dir_for(candidates[-1]) if candidates else None
+
+
+class ExportCheckpoint:
+    """
+    Состояние выгрузки в checkpoint.json временной папки.
+
+    Для каждой таблицы хранится status ('in_progress' / 'done'); для таблиц,
+    выгружаемых порциями по первичному ключу, — key_from (последний записанный ключ),
+    число порций и строк. У завершенных таблиц сохраняются метаданные для манифеста.
+    Файл перезаписывается атомарно после каждой порции. Порционные таблицы асинхронного
+    экспорта отмечаются из разных потоков: изменения состояния и запись файла идут под
+    блокировкой, каждая запись — через свой временный файл.
+    """
+
+    def __init__(self, staging_dir):
+        self.path = Path(staging_dir) / CHECKPOINT_NAME
+        self.state = {'export_timestamp': datetime.now().isoformat(), 'tables': {}}
+        self._lock = threading.RLock()
+
+    def load(self):
+        """Чтение состояния прерванной выгрузки; False, если контрольной точки нет"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self.state = state
+        return True
+
+    def save(self):
+        """Запись состояния через временный файл"""
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f"{self.path.stem}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self.state, f, ensure_ascii=False, indent=2, default=str)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+
+    @property
+    def export_timestamp(self):
+        return self.state['export_timestamp']
+
+    def table(self, table_name):
+        """Состояние таблицы (пустой словарь, если таблица еще не начата)"""
+        with self._lock:
+            return dict(self.state['tables'].get(table_name, {}))
+
+    def is_done(self, table_name):
+        return self.table(table_name).get('status') == 'done'
+
+    def start_table(self, table_name, keyset=None):
+        """Начало выгрузки таблицы (keyset — колонка ключа для порционной выгрузки)"""
+        with self._lock:
+            self.state['tables'][table_name] = {
+                'status': 'in_progress',
+                'keyset': keyset,
+                'key_from': None,
+                'chunks': 0,
+                'rows': 0
+            }
+            self.save()
+
+    def record_chunk(self, table_name, key_to, rows):
+        """Порция записана: следующая начнется после key_to"""
+        with self._lock:
+            table = self.state['tables'][table_name]
+            table['key_from'] = key_to
+            table['chunks'] += 1
+            table['rows'] += rows
+            self.save()
+
+    def finish_table(self, table_name, metadata):
+        """Таблица выгружена полностью"""
+        with self._lock:
+            self.state['tables'][table_name] = {'status': 'done', 'metadata': metadata}
+            self.save()
+
+    def done_tables(self):
+        """Метаданные завершенных таблиц: {table_name: metadata}"""
+        with self._lock:
+            return {
+                name: table['metadata']
+                for name, table in self.state['tables'].items()
+                if table.get('status') == 'done'
+            }
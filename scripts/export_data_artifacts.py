@@ -5,544 +5,629 @@
 """
 
 import pandas as pd
-import psycopg2
+import psycopg2.extras
 import pyarrow as pa
 import pyarrow.parquet as pq
 import os
 import json
+import re
+import shutil
 from datetime import datetime, timedelta
 from pathlib import Path
-from dotenv import load_dotenv
 import logging
 
-# Загрузка переменных окружения
-load_dotenv()
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('data_export.log'),
-        logging.StreamHandler()
-    ]
+from artifact_writer import TableArtifactWriter
+from cohorts import refresh_cohorts
+from daily_rollup import ROLLUP_TABLE, DailyRollup
+from database import ANALYTICS_WORK_MEM, get_pool
+from dtype_compaction import compact_frame
+from export_checkpoint import PARTS_DIR, ExportCheckpoint, staging_dir_for
+from export_queries import (
+    BASE_TABLE_SPECS, ESTIMATED_ROWS_QUERY, EXPORT_SPECS, MATVIEW_POPULATED_QUERY, ROLLUP_READY_QUERY,
+    keyset_bound_query
+)
+from parquet_tuning import DEFAULT_PARQUET_OPTIONS, load_profiles, parquet_options
+from region_resolver import prepare_region_mapping
+from rfm import RFM_COLUMNS, refresh_rfm, rfm_columns
+from sharded_export import (
+    DEFAULT_SHARDS, MIN_POOL_CONNECTIONS, extract_sharded, iter_dataset_frames, result_schema
 )
+from time_series import time_series_frame
 
 logger = logging.getLogger(__name__)
 
+# Таблицы с keyset в описании выгружаются порциями, если в них больше строк
+DEFAULT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 100000))
+
+def setup_logging(log_file='data_export.log'):
+    """Настройка логирования (вызывается точкой входа, а не при импорте модуля)"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler()
+        ]
+    )
+
+def export_plan(include_base_tables=False):
+    """Таблицы выгрузки по порядку: [(название, имя описания в EXPORT_SPECS/BASE_TABLE_SPECS)]"""
+    plan = [
+        ("Клиенты с аналитикой", 'customers_analytics'),
+        ("Заказы с аналитикой", 'orders_analytics'),
+        ("Товары с аналитикой", 'products_analytics'),
+        ("Сводка KPI", 'kpi_summary'),
+        ("Временные ряды", 'time_series_analytics'),
+        ("Временные ряды с окнами", 'time_series_windows'),
+        ("Когорты удержания", 'cohort_retention')
+    ]
+    if include_base_tables:
+        plan += [(spec['title'], name) for name, spec in BASE_TABLE_SPECS.items()]
+    return plan
+
 class DataExporter:
-    def __init__(self, output_dir='exported_data'):
+    def __init__(self, output_dir='exported_data', use_views=True, use_rollup=True,
+                 include_base_tables=False, stats_mode='auto', table_stats_modes=None,
+                 arrow_ipc=None, resume=False, chunk_rows=DEFAULT_CHUNK_ROWS,
+                 unordered_tables=None, sort_row_groups=False, sharded_tables=None,
+                 shards=DEFAULT_SHARDS, use_rfm=True, compact_dtypes=True,
+                 excel_tables=None):
         """Инициализация экспортера данных"""
         self.output_dir = Path(output_dir)
-        self.output_dir.mkdir(exist_ok=True)
+        # Файлы пишутся во временную папку <output_dir>.partial и переносятся в output_dir
+        # одним переименованием после завершения; checkpoint.json отмечает готовые таблицы
+        # и порции крупных таблиц, по нему resume продолжает прерванную выгрузку
+        self.work_dir = staging_dir_for(self.output_dir)
+        self.checkpoint = ExportCheckpoint(self.work_dir)
+        self.chunk_rows = chunk_rows
+        self.resumed = resume and self.checkpoint.load()
+        if self.resumed:
+            done = list(self.checkpoint.done_tables())
+            logger.info(f"⏯️ Продолжение выгрузки {self.work_dir}: готово таблиц {len(done)}")
+        else:
+            if resume:
+                logger.info(f"ℹ️ Прерванной выгрузки в {self.work_dir} нет, экспорт с начала")
+            elif self.work_dir.exists():
+                logger.warning(f"⚠️ Удалена незавершенная выгрузка {self.work_dir} (продолжение — resume)")
+                shutil.rmtree(self.work_dir)
+        # Таблицы, выгрузка которых завершилась ошибкой: выгрузка не переносится в output_dir
+        self.failed_tables = []
+        # Чтение KPI из материализованных представлений (kpi_views.py), если они заполнены
+        self.use_views = use_views
+        # Сводка KPI и временные ряды из дневных агрегатов (daily_rollup.py), если они построены
+        self.use_rollup = use_rollup
+        # Снимки базовых таблиц для локальных запросов (local_analytics.py)
+        self.include_base_tables = include_base_tables
+        # Подобранные настройки Parquet по таблицам (parquet_tuning.py); без профиля — snappy
+        self.parquet_profiles = load_profiles()
+        # Статистика метаданных: exact, approximate или auto (приближенная для больших таблиц);
+        # режим таблицы из EXPORT_SPECS[...]['stats'] или table_stats_modes важнее общего
+        self.stats_mode = stats_mode
+        self.table_stats_modes = {
+            name: spec['stats'] for name, spec in {**EXPORT_SPECS, **BASE_TABLE_SPECS}.items()
+            if spec.get('stats')
+        }
+        self.table_stats_modes.update(table_stats_modes or {})
+        # Дополнительные файлы Arrow IPC (Feather v2): None, 'uncompressed' или 'lz4'
+        self.arrow_ipc = arrow_ipc
+        # Таблицы с копией в Excel (.xlsx, excel_writer.py); 'all' — все выгружаемые
+        excel_tables = set(excel_tables or ())
+        if 'all' in excel_tables:
+            excel_tables = set(EXPORT_SPECS) | set(BASE_TABLE_SPECS)
+        self.excel_tables = excel_tables
+        # Таблицы, выгружаемые без итоговой ORDER BY ('all' — все, у которых есть unordered_query);
+        # sort_row_groups — сортировка по sort_key описания внутри каждого row group Parquet
+        unordered_tables = set(unordered_tables or ())
+        if 'all' in unordered_tables:
+            unordered_tables = {
+                name for name, spec in {**EXPORT_SPECS, **BASE_TABLE_SPECS}.items() if spec.get('unordered_query')
+            }
+        self.unordered_tables = unordered_tables
+        self.sort_row_groups = sort_row_groups
+        # Таблицы с keyset, выгружаемые параллельно shards срезами ключа в один снимок данных
+        self.sharded_tables = set(sharded_tables or ())
+        self.shards = shards
+        # RFM-сегменты по квантилям (rfm.py) в выгрузке клиентов; считаются один раз за экспорт
+        self.use_rfm = use_rfm
+        self._rfm_scores = None
+        # Компактные типы колонок выгружаемых DataFrame (dtype_compaction.py)
+        self.compact_dtypes = compact_dtypes
+        self.work_dir.mkdir(exist_ok=True)
         
         # Создание папок для разных форматов
-        (self.output_dir / 'csv').mkdir(exist_ok=True)
-        (self.output_dir / 'parquet').mkdir(exist_ok=True)
-        (self.output_dir / 'json').mkdir(exist_ok=True)
-        
-        # Конфигурация БД
-        self.db_config = {
-            'host': os.getenv('DB_HOST', '103.246.146.132'),
-            'port': os.getenv('DB_PORT', 5432),
-            'database': os.getenv('DB_NAME', 'hackathon'),
-            'user': os.getenv('DB_USER', 'user_db'),
-            'password': os.getenv('DB_PASSWORD', 'psql14182025')
-        }
+        (self.work_dir / 'csv').mkdir(exist_ok=True)
+        (self.work_dir / 'parquet').mkdir(exist_ok=True)
+        (self.work_dir / 'json').mkdir(exist_ok=True)
+        if not self.resumed:
+            self.checkpoint.save()
+        
+        # Соединение берется из общего пула (см. database.py)
+        self.pool = None
+        self.conn = None
         
         self.export_manifest = {
-            'export_timestamp': datetime.now().isoformat(),
+            'export_timestamp': self.checkpoint.export_timestamp,
             'exported_tables': [],
             'file_sizes': {},
             'record_counts': {},
+            'files': {},
             'data_quality_summary': {}
         }
+        if self.resumed:
+            self.export_manifest['resumed_at'] = datetime.now().isoformat()
         
     def connect_db(self):
         """Подключение к базе данных"""
         try:
-            self.conn = psycopg2.connect(**self.db_config)
+            self.pool = get_pool(application_name='databoard-export')
+            # Аналитические выгрузки сортируют и агрегируют крупные выборки — поднимаем work_mem
+            self.conn = self.pool.getconn(work_mem=ANALYTICS_WORK_MEM)
+            # JSONB выгружается исходным текстом PostgreSQL, как в асинхронном режиме (asyncpg):
+            # снимок orders должен давать тот же md5(shipping_address::text), что и в БД
+            psycopg2.extras.register_default_jsonb(self.conn, loads=lambda value: value)
             logger.info("✅ Подключение к базе данных установлено")
             return True
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к БД: {e}")
             return False
             
-    def execute_query(self, query, params=None):
+    def execute_query(self, query, params=None, label=None):
         """Выполнение SQL запроса с возвратом DataFrame"""
         try:
-            return pd.read_sql(query, self.conn, params=params)
+            df = pd.read_sql(query, self.conn, params=params)
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"❌ Ошибка выполнения запроса: {e}")
             return None
+        # Сжатие сразу после чтения: кадр с int64/object освобождается до записи файлов
+        return compact_frame(df, label) if self.compact_dtypes else df
             
     def export_table_to_formats(self, table_name, query, description=""):
         """Экспорт таблицы в различные форматы"""
         logger.info(f"📊 Экспорт таблицы: {table_name}")
         
         # Выполнение запроса
-        df = self.execute_query(query)
+        df = self.execute_query(query, label=table_name)
+        if df is None:
+            self.failed_tables.append(table_name)
+            return False
+        return self.export_frame(table_name, df, description)
+        
+    def export_frame(self, table_name, df, description=""):
+        """Запись готового DataFrame в CSV/Parquet с метаданными"""
         if df is None or df.empty:
             logger.warning(f"⚠️ Нет данных для экспорта: {table_name}")
             return False
-            
+        writer = self.open_table_writer(table_name, description)
+        writer.write(df)
+        self.finish_table_writer(writer)
+        return True
+        
+    def open_table_writer(self, table_name, description="", schema_hints=None, row_order=None,
+                          parquet_dataset=False):
+        """Создание потокового писателя артефактов для таблицы"""
         # Подготовка имени файла с timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         base_filename = f"{table_name}_{timestamp}"
         
-        # Экспорт в CSV
-        csv_path = self.output_dir / 'csv' / f"{base_filename}.csv"
-        df.to_csv(csv_path, index=False, encoding='utf-8')
-        logger.info(f"📄 CSV сохранен: {csv_path}")
-        
-        # Экспорт в Parquet
-        parquet_path = self.output_dir / 'parquet' / f"{base_filename}.parquet"
-        df.to_parquet(parquet_path, index=False, engine='pyarrow', compression='snappy')\n        logger.info(f"📦 Parquet сохранен: {parquet_path}")
-        
-        # Создание метаданных
-        metadata = {
-            'table_name': table_name,
-            'description': description,
-            'export_timestamp': datetime.now().isoformat(),
-            'record_count': len(df),
-            'column_count': len(df.columns),
-            'columns': [
-                {
-                    'name': col,
-                    'dtype': str(df[col].dtype),
-                    'null_count': int(df[col].isnull().sum()),
-                    'unique_count': int(df[col].nunique())
-                }
-                for col in df.columns
-            ],
-            'data_types': dict(df.dtypes.astype(str)),
-            'sample_data': df.head(3).to_dict('records') if len(df) > 0 else [],
-            'file_sizes': {
-                'csv_mb': round(csv_path.stat().st_size / 1024 / 1024, 2),
-                'parquet_mb': round(parquet_path.stat().st_size / 1024 / 1024, 2)
-            }
-        }
+        options = parquet_options(self.parquet_profiles, table_name)
+        if options != DEFAULT_PARQUET_OPTIONS:
+            logger.info(f"🎛️ {table_name}: профиль Parquet {options}")
+        
+        spec = EXPORT_SPECS.get(table_name) or BASE_TABLE_SPECS.get(table_name) or {}
+        row_order = row_order or self.spec_row_order(spec)
+        sort_row_groups = spec.get('sort_key') if row_order['mode'] == 'unordered' and self.sort_row_groups else None
         
-        # Сохранение метаданных в JSON
-        metadata_path = self.output_dir / 'json' / f"{base_filename}_metadata.json"
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
-        logger.info(f"📋 Метаданные сохранены: {metadata_path}")
+        writer = TableArtifactWriter(
+            self.work_dir, table_name, base_filename, description,
+            schema_hints=schema_hints, parquet_options=options,
+            stats_mode=self.table_stats_modes.get(table_name, self.stats_mode),
+            ipc_compression=self.arrow_ipc,
+            row_order=row_order, sort_row_groups=sort_row_groups, parquet_dataset=parquet_dataset,
+            excel=table_name in self.excel_tables, compact_dtypes=self.compact_dtypes
+        )
+        if spec.get('rfm_key') and self.use_rfm:
+            if parquet_dataset:
+                # Файлы срезов пишутся мимо писателя: колонки RFM были бы только в CSV
+                logger.warning(f"⚠️ {table_name}: RFM-сегменты не добавляются при выгрузке срезами")
+            else:
+                writer.enrich = self.rfm_enricher(spec['rfm_key'])
+                writer.extra_metadata['rfm'] = {'key': spec['rfm_key'], 'columns': RFM_COLUMNS}
+        return writer
         
-        # Обновление манифеста
+    def rfm_scores(self):
+        """Баллы RFM по всем клиентам (None — RFM недоступен, выгрузка без сегментов)"""
+        if self._rfm_scores is None:
+            try:
+                engine = refresh_rfm(pool=self.pool or get_pool(application_name='databoard-export'))
+                self._rfm_scores = engine.scores()
+            except Exception as e:
+                logger.warning(f"⚠️ RFM-сегменты не рассчитаны, выгрузка без них: {e}")
+                self._rfm_scores = False
+        return self._rfm_scores if self._rfm_scores is not False else None
+        
+    def rfm_enricher(self, key):
+        """Функция для писателя: колонки RFM к порции клиентов по колонке key"""
+        scores = self.rfm_scores()
+        if scores is None:
+            return None
+        
+        def enrich(df):
+            columns = rfm_columns(scores, df[key].to_numpy())
+            columns.index = df.index
+            return pd.concat([df.drop(columns=RFM_COLUMNS, errors='ignore'), columns], axis=1)
+        return enrich
+        
+    def finish_table_writer(self, writer):
+        """Закрытие писателя, сохранение метаданных и обновление манифеста"""
+        metadata = writer.close()
+        logger.info(f"📄 CSV сохранен: {writer.csv_path}")
+        logger.info(f"📦 Parquet сохранен: {writer.parquet_path}")
+        if writer.ipc_path is not None:
+            logger.info(f"🏹 Arrow IPC сохранен: {writer.ipc_path}")
+        if writer.excel_path is not None:
+            logger.info(f"📗 Excel сохранен: {writer.excel_path} (листов: {len(metadata['excel_sheets'])})")
+        logger.info(f"📋 Метаданные сохранены: {writer.metadata_path}")
+        
+        self.complete_table(writer.table_name, metadata)
+        logger.info(f"✅ Экспорт завершен: {writer.table_name} ({writer.record_count:,} записей)")
+        return metadata
+        
+    def complete_table(self, table_name, metadata):
+        """Таблица выгружена: запись в манифест и в контрольную точку"""
+        self.register_export(table_name, metadata)
+        self.checkpoint.finish_table(table_name, metadata)
+        
+    def register_export(self, table_name, metadata):
+        """Обновление манифеста по метаданным выгруженной таблицы"""
         self.export_manifest['exported_tables'].append(table_name)
-        self.export_manifest['record_counts'][table_name] = len(df)
+        self.export_manifest['record_counts'][table_name] = metadata['record_count']
         self.export_manifest['file_sizes'][table_name] = metadata['file_sizes']
+        self.export_manifest['files'][table_name] = metadata['files']
+        
+    def resume_table(self, table_name):
+        """
+        Подготовка таблицы к выгрузке: True — таблица уже выгружена до прерывания
+        (ее метаданные возвращаются в манифест), иначе удаляются ее недописанные файлы
+        """
+        if self.checkpoint.is_done(table_name):
+            self.register_export(table_name, self.checkpoint.table(table_name)['metadata'])
+            logger.info(f"⏭️ {table_name}: выгружена до прерывания")
+            return True
+        pattern = re.compile(rf'^{re.escape(table_name)}_\d{{8}}_\d{{6}}(?:[._]|$)')
+        for folder in ('csv', 'parquet', 'json', 'feather', 'xlsx'):
+            for path in (self.work_dir / folder).glob('*'):
+                if not pattern.match(path.name):
+                    continue
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+        return False
+        
+    def keyset_needed(self, spec, conn):
+        """Выгружать ли таблицу порциями по ключу: начатая порционная выгрузка или крупная таблица"""
+        keyset = spec.get('keyset')
+        if not keyset:
+            return False
+        state = self.checkpoint.table(spec['table_name'])
+        if state.get('status') == 'in_progress' and state.get('keyset'):
+            return True
+        pool = self.pool or get_pool(application_name='databoard-export')
+        rows = pool.execute_prepared(conn, ESTIMATED_ROWS_QUERY, (keyset['table'],))
+        conn.commit()
+        return bool(rows and rows[0][0] and rows[0][0] > self.chunk_rows)
+        
+    def export_keyset(self, spec, conn=None):
+        """
+        Выгрузка таблицы порциями по диапазонам первичного ключа.
+
+        Граница порции — ключ chunk_rows-й строки после предыдущей границы, порция
+        читается range_query отдельной транзакцией и пишется в parts/<table>/
+        (через временный файл), после чего граница записывается в контрольную точку.
+        Прерванная выгрузка продолжается с последней записанной порции. Итоговые
+        файлы собираются из порций обычным писателем артефактов (статистика по всем строкам).
+        Возвращает None, если таблица небольшая и выгружается одним запросом.
+        """
+        if conn is None:
+            pool = self.pool or get_pool(application_name='databoard-export')
+            conn = pool.getconn(work_mem=ANALYTICS_WORK_MEM)
+            psycopg2.extras.register_default_jsonb(conn, loads=lambda value: value)
+            try:
+                return self.export_keyset(spec, conn)
+            finally:
+                pool.putconn(conn)
+        
+        if not self.keyset_needed(spec, conn):
+            return None
+        table_name = spec['table_name']
+        keyset = spec['keyset']
+        parts_dir = self.work_dir / PARTS_DIR / table_name
+        
+        state = self.checkpoint.table(table_name)
+        if state.get('status') == 'in_progress' and state.get('keyset'):
+            key_from, chunk = state['key_from'], state['chunks']
+            logger.info(f"⏯️ {table_name}: продолжение с порции {chunk + 1} (ключ > {key_from})")
+        else:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+            self.checkpoint.start_table(table_name, keyset['column'])
+            key_from, chunk = None, 0
+        parts_dir.mkdir(parents=True, exist_ok=True)
+        # Порции, записанные после последней контрольной точки, читаются заново
+        for path in parts_dir.iterdir():
+            if path.suffix != '.parquet' or int(path.stem.split('-')[1]) >= chunk:
+                path.unlink()
+        
+        logger.info(f"🧩 {table_name}: выгрузка порциями по {self.chunk_rows:,} строк ({keyset['table']}.{keyset['column']})")
+        # Схема по типам колонок PostgreSQL: по одной порции тип не выводится (колонка целиком NULL)
+        schema = result_schema(conn, keyset['range_query'])
+        conn.commit()
+        bound_query = keyset_bound_query(keyset['table'], keyset['column'])
+        while True:
+            with conn.cursor() as cur:
+                cur.execute(bound_query, {'key_from': key_from, 'limit': self.chunk_rows})
+                key_to = cur.fetchone()[0]
+            if key_to is None:
+                conn.commit()
+                break
+            df = pd.read_sql(keyset['range_query'], conn, params={'key_from': key_from, 'key_to': key_to})
+            conn.commit()
+            
+            if not df.empty:
+                part_path = parts_dir / f"part-{chunk:05d}.parquet"
+                tmp_path = part_path.with_suffix('.tmp')
+                pq.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False, safe=False), tmp_path)
+                os.replace(tmp_path, part_path)
+            chunk += 1
+            self.checkpoint.record_chunk(table_name, key_to, len(df))
+            key_from = key_to
+            logger.info(f"🧩 {table_name}: порция {chunk} — {len(df):,} строк (ключ до {key_to})")
         
-        logger.info(f"✅ Экспорт завершен: {table_name} ({len(df):,} записей)")
+        row_order = {'mode': 'primary_key', 'sort_key': [(keyset['column'], 'ascending')]}
+        writer = self.open_table_writer(table_name, spec['description'], row_order=row_order,
+                                        schema_hints={field.name: field.type for field in schema})
+        try:
+            for part_path in sorted(parts_dir.glob('part-*.parquet')):
+                writer.write(pd.read_parquet(part_path))
+            if writer.record_count == 0:
+                writer.abort()
+                logger.warning(f"⚠️ Нет данных для экспорта: {table_name}")
+                return False
+            self.finish_table_writer(writer)
+        except Exception:
+            writer.abort()
+            raise
+        shutil.rmtree(parts_dir)
         return True
         
-    def export_customers_data(self):
-        """Экспорт данных клиентов с расширенной аналитикой"""
-        query = """
-        WITH customer_metrics AS (
-            SELECT 
-                c.id,
-                c.name,
-                c.email,
-                c.phone,
-                c.company_name,
-                c.industry,
-                c.status,
-                c.registration_date,
-                c.last_login,
-                c.created_at,
-                c.updated_at,
-                
-                -- Метрики заказов
-                COALESCE(om.total_orders, 0) as total_orders,
-                COALESCE(om.paid_orders, 0) as paid_orders,
-                COALESCE(om.total_spent, 0) as total_spent,
-                COALESCE(om.avg_order_value, 0) as avg_order_value,
-                om.first_order_date,
-                om.last_order_date,
-                
-                -- Сегментация
-                CASE 
-                    WHEN COALESCE(om.total_spent, 0) > 50000 THEN 'VIP'
-                    WHEN COALESCE(om.total_spent, 0) > 20000 THEN 'Premium'
-                    WHEN COALESCE(om.total_spent, 0) > 5000 THEN 'Regular'
-                    WHEN COALESCE(om.total_orders, 0) > 0 THEN 'Occasional'
-                    ELSE 'New'
-                END as customer_segment,
-                
-                -- Активность
-                CASE 
-                    WHEN om.last_order_date IS NULL THEN 'no_orders'
-                    WHEN DATE_PART('day', CURRENT_DATE - om.last_order_date) <= 30 THEN 'active'
-                    WHEN DATE_PART('day', CURRENT_DATE - om.last_order_date) <= 90 THEN 'dormant'
-                    ELSE 'inactive'
-                END as activity_status,
-                
-                -- Тип клиента
-                CASE 
-                    WHEN c.company_name IS NOT NULL AND c.company_name != '' THEN 'B2B'
-                    ELSE 'B2C'
-                END as customer_type,
-                
-                -- Возраст клиента в днях
-                DATE_PART('day', CURRENT_DATE - c.registration_date) as customer_age_days
-                
-            FROM customers c
-            LEFT JOIN (
-                SELECT 
-                    customer_id,
-                    COUNT(*) as total_orders,
-                    COUNT(CASE WHEN payment_status = 'paid' THEN 1 END) as paid_orders,
-                    SUM(CASE WHEN payment_status = 'paid' THEN 
-                        (SELECT SUM(oi.quantity * oi.unit_price) 
-                         FROM order_items oi 
-                         WHERE oi.order_id = o.id)
-                    ELSE 0 END) as total_spent,
-                    AVG(CASE WHEN payment_status = 'paid' THEN 
-                        (SELECT SUM(oi.quantity * oi.unit_price) 
-                         FROM order_items oi 
-                         WHERE oi.order_id = o.id)
-                    END) as avg_order_value,
-                    MIN(order_date) as first_order_date,
-                    MAX(order_date) as last_order_date
-                FROM orders o
-                GROUP BY customer_id
-            ) om ON c.id = om.customer_id
-        )
-        SELECT * FROM customer_metrics
-        ORDER BY total_spent DESC, registration_date DESC
+    def export_sharded(self, spec):
+        """
+        Параллельная выгрузка таблицы срезами ключа в Parquet-набор (sharded_export.py).
+
+        Срезы читаются отдельными соединениями в одном снимке данных и пишутся
+        файлами parquet/<table>_<timestamp>/part-*.parquet; CSV, Arrow IPC и статистика
+        затем собираются из файлов набора. Прерванная выгрузка повторяется целиком.
         """
+        table_name = spec['table_name']
+        keyset = spec['keyset']
+        pool = self.pool or get_pool(application_name='databoard-export')
+        self.checkpoint.start_table(table_name)
         
-        return self.export_table_to_formats(
-            'customers_analytics',
-            query,
-            'Аналитические данные клиентов с метриками заказов, сегментацией и статусом активности'
+        row_order = {'mode': 'primary_key', 'sort_key': [(keyset['column'], 'ascending')]}
+        writer = self.open_table_writer(table_name, spec['description'], row_order=row_order, parquet_dataset=True)
+        try:
+            sharding = extract_sharded(pool, keyset, writer.parquet_path, self.shards, writer.parquet_options)
+            for df in iter_dataset_frames(writer.parquet_path):
+                writer.write(df)
+            if writer.record_count == 0:
+                writer.abort()
+                logger.warning(f"⚠️ Нет данных для экспорта: {table_name}")
+                return False
+            writer.extra_metadata['sharding'] = sharding
+            self.finish_table_writer(writer)
+        except Exception:
+            writer.abort()
+            raise
+        logger.info(
+            f"🧱 {table_name}: {sharding['shards']} срезов за {sharding['seconds']} s "
+            f"({sharding['workers']} соединений)"
         )
+        return True
         
-    def export_orders_data(self):
-        """Экспорт данных заказов с расчетными полями"""
-        query = """
-        WITH order_details AS (
-            SELECT 
-                o.id,
-                o.customer_id,
-                o.order_date,
-                o.status,
-                o.payment_status,
-                o.shipping_address,
-                o.created_at,
-                o.updated_at,
-                
-                -- Информация о клиенте
-                c.name as customer_name,
-                c.email as customer_email,
-                c.company_name,
-                CASE 
-                    WHEN c.company_name IS NOT NULL AND c.company_name != '' THEN 'B2B'
-                    ELSE 'B2C'
-                END as customer_type,
-                
-                -- Расчетные поля заказа
-                COALESCE(oi.total_amount, 0) as total_amount,
-                COALESCE(oi.items_count, 0) as items_count,
-                COALESCE(oi.total_quantity, 0) as total_quantity,
-                
-                -- Статусы
-                CASE WHEN o.payment_status = 'paid' THEN oi.total_amount ELSE 0 END as paid_amount,
-                CASE WHEN o.status = 'delivered' THEN 1 ELSE 0 END as is_delivered,
-                CASE WHEN o.status = 'cancelled' THEN 1 ELSE 0 END as is_cancelled,
-                CASE WHEN o.status = 'returned' THEN 1 ELSE 0 END as is_returned,
-                
-                -- Временные метрики
-                EXTRACT(YEAR FROM o.order_date) as order_year,
-                EXTRACT(MONTH FROM o.order_date) as order_month,
-                EXTRACT(DOW FROM o.order_date) as order_dow,
-                EXTRACT(HOUR FROM o.created_at) as order_hour,
-                
-                -- Региональная информация
-                CASE 
-                    WHEN o.shipping_address LIKE '%Москва%' OR o.shipping_address LIKE '%Moscow%' THEN 'Москва'
-                    WHEN o.shipping_address LIKE '%Санкт-Пете��бург%' OR o.shipping_address LIKE '%СПб%' THEN 'Санкт-Петербург'
-                    WHEN o.shipping_address LIKE '%Екатеринбург%' THEN 'Екатеринбург'
-                    WHEN o.shipping_address LIKE '%Новосибирск%' THEN 'Новосибирск'
-                    ELSE 'Другие регионы'
-                END as region,
-                
-                -- Канальная информация
-                CASE 
-                    WHEN EXTRACT(HOUR FROM o.created_at) BETWEEN 9 AND 18 THEN 'Рабочие часы'
-                    WHEN EXTRACT(HOUR FROM o.created_at) BETWEEN 19 AND 23 THEN 'Вечернее время'
-                    ELSE 'Ночное время'
-                END as time_channel,
-                
-                CASE 
-                    WHEN EXTRACT(DOW FROM o.order_date) IN (1,2,3,4,5) THEN 'Будни'
-                    ELSE 'Выходные'
-                END as day_type
-                
-            FROM orders o
-            LEFT JOIN customers c ON o.customer_id = c.id
-            LEFT JOIN (
-                SELECT 
-                    order_id,
-                    SUM(quantity * unit_price) as total_amount,
-                    COUNT(*) as items_count,
-                    SUM(quantity) as total_quantity
-                FROM order_items
-                GROUP BY order_id
-            ) oi ON o.id = oi.order_id
-        )
-        SELECT * FROM order_details
-        ORDER BY order_date DESC, id DESC
+    def export_large_table(self, spec, conn=None):
         """
+        Выгрузка крупной таблицы: срезами параллельно (sharded_tables) или порциями по ключу.
+        None — таблица выгружается обычным запросом
+        """
+        if not spec.get('keyset'):
+            return None
+        if spec['table_name'] in self.sharded_tables:
+            pool = self.pool or get_pool(application_name='databoard-export')
+            if pool.maxconn >= MIN_POOL_CONNECTIONS:
+                return self.export_sharded(spec)
+            logger.warning(
+                f"⚠️ {spec['table_name']}: для срезов нужно {MIN_POOL_CONNECTIONS} соединения пула "
+                f"(DB_POOL_MAX={pool.maxconn}), выгрузка порциями по ключу"
+            )
+        return self.export_keyset(spec, conn)
         
-        return self.export_table_to_formats(
-            'orders_analytics',
-            query,
-            'Аналитические данные заказов с расчетными полями, региональной и временной разбивкой'
-        )
+    def commit_export(self):
+        """
+        Перенос завершенной выгрузки из временной папки в output_dir одним переименованием.
+        Прежняя выгрузка в output_dir (повторный запуск с той же папкой) заменяется: она
+        переименовывается в <output_dir>.previous и удаляется после переноса новой
+        """
+        shutil.rmtree(self.work_dir / PARTS_DIR, ignore_errors=True)
+        previous = None
+        if self.output_dir.exists():
+            previous = self.output_dir.with_name(f"{self.output_dir.name}.previous")
+            shutil.rmtree(previous, ignore_errors=True)
+            os.replace(self.output_dir, previous)
+        os.replace(self.work_dir, self.output_dir)
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+            logger.info(f"♻️ Прежняя выгрузка в {self.output_dir} заменена")
+        (self.output_dir / self.checkpoint.path.name).unlink(missing_ok=True)
+        logger.info(f"📁 Выгрузка перенесена в {self.output_dir}")
+        
+    def view_available(self, view_name):
+        """Создано и заполнено ли материализованное представление"""
+        try:
+            rows = self.pool.execute_prepared(self.conn, MATVIEW_POPULATED_QUERY, (view_name,))
+            return bool(rows and rows[0][0])
+        except Exception as e:
+            self.conn.rollback()
+            logger.warning(f"⚠️ Не удалось проверить представление {view_name}: {e}")
+            return False
+        
+    def rollup_available(self):
+        """Построены ли дневные агрегаты"""
+        try:
+            rows = self.pool.execute_prepared(self.conn, ROLLUP_READY_QUERY, (ROLLUP_TABLE,))
+            return bool(rows and rows[0][0])
+        except Exception as e:
+            self.conn.rollback()
+            logger.warning(f"⚠️ Не удалось проверить дневные агрегаты: {e}")
+            return False
+        
+    def is_unordered(self, spec):
+        """Выгружается ли таблица без итоговой сортировки"""
+        return spec.get('table_name') in self.unordered_tables and bool(spec.get('unordered_query'))
+        
+    def spec_row_order(self, spec):
+        """Порядок строк выгрузки таблицы для метаданных"""
+        if self.is_unordered(spec) or not spec.get('sort_key'):
+            return {'mode': 'unordered', 'sort_key': None}
+        return {'mode': 'sorted', 'sort_key': spec['sort_key']}
+        
+    def base_query(self, spec):
+        """Запрос по базовым таблицам: с итоговой ORDER BY или без нее (unordered_tables)"""
+        if self.is_unordered(spec):
+            logger.info(f"🔀 {spec['table_name']}: без итоговой сортировки, строки в порядке выполнения запроса")
+            return spec['unordered_query']
+        return spec['query']
+        
+    def spec_query(self, spec):
+        """Запрос выгрузки: из дневных агрегатов или представления, если они доступны"""
+        if spec.get('rollup_query') and self.use_rollup:
+            if self.rollup_available():
+                logger.info(f"⚡ {spec['table_name']}: чтение из дневных агрегатов {ROLLUP_TABLE}")
+                return spec['rollup_query']
+            logger.info(f"ℹ️ {spec['table_name']}: дневные агрегаты не построены")
+            
+        view = spec.get('view')
+        if view and self.use_views:
+            if self.view_available(view):
+                logger.info(f"⚡ {spec['table_name']}: чтение из представления {view}")
+                return spec['view_query']
+            logger.info(f"ℹ️ {spec['table_name']}: представление {view} не заполнено, расчет по базовым таблицам")
+        return self.base_query(spec)
+        
+    def rollup_frame(self, spec, conn=None):
+        """Таблица, рассчитанная по дневным агрегатам (None — агрегаты недоступны)"""
+        if not (spec.get('rollup_frame') and self.use_rollup):
+            return None
+        pool = self.pool or get_pool(application_name='databoard-export')
+        rollup = DailyRollup(pool=pool)
+        
+        def build(connection):
+            if not rollup.is_ready(connection):
+                logger.info(f"ℹ️ {spec['table_name']}: дневные агрегаты не построены")
+                return None
+            logger.info(f"⚡ {spec['table_name']}: расчет по дневным агрегатам {ROLLUP_TABLE}")
+            return rollup.kpi_summary_frame(connection)
+            
+        try:
+            if conn is not None:
+                return build(conn)
+            with pool.connection() as connection:
+                return build(connection)
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            logger.warning(f"⚠️ {spec['table_name']}: ошибка чтения дневных агрегатов, расчет по запросу: {e}")
+            return None
+        
+    def series_frame(self, spec, conn=None):
+        """Временные ряды с окнами по полному календарю (None — ошибка расчета)"""
+        pool = self.pool or get_pool(application_name='databoard-export')
+        try:
+            if conn is not None:
+                return time_series_frame(conn)
+            with pool.connection() as connection:
+                return time_series_frame(connection)
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            logger.error(f"❌ {spec['table_name']}: ошибка расчета временных рядов: {e}")
+            return None
+        
+    def cohort_frame(self, spec):
+        """Когорты удержания: сохраненные матрицы дополняются новыми заказами (None — ошибка расчета)"""
+        try:
+            return refresh_cohorts(pool=self.pool or get_pool(application_name='databoard-export')).retention_frame()
+        except Exception as e:
+            logger.error(f"❌ {spec['table_name']}: ошибка расчета когорт: {e}")
+            return None
+        
+    def python_frame(self, spec, conn=None):
+        """Таблица, рассчитанная в Python: ряды с окнами, когорты или расчет по дневным агрегатам"""
+        if spec.get('series_frame'):
+            return self.series_frame(spec, conn)
+        if spec.get('cohort_frame'):
+            return self.cohort_frame(spec)
+        return self.rollup_frame(spec, conn)
+        
+    def export_spec(self, table_name):
+        """Экспорт таблицы по описанию из EXPORT_SPECS (или снимка из BASE_TABLE_SPECS)"""
+        spec = EXPORT_SPECS.get(table_name) or BASE_TABLE_SPECS[table_name]
+        if self.resume_table(spec['table_name']):
+            return True
+        df = self.python_frame(spec, self.conn)
+        if df is not None:
+            logger.info(f"📊 Экспорт таблицы: {spec['table_name']}")
+            return self.export_frame(spec['table_name'], df, spec['description'])
+        if not spec.get('query'):
+            self.failed_tables.append(spec['table_name'])
+            return False
+        try:
+            result = self.export_large_table(spec, self.conn)
+        except Exception as e:
+            self.conn.rollback()
+            self.failed_tables.append(spec['table_name'])
+            logger.error(f"❌ {spec['table_name']}: ошибка выгрузки по ключу, продолжение — resume: {e}")
+            return False
+        if result is not None:
+            return result
+        return self.export_table_to_formats(spec['table_name'], self.spec_query(spec), spec['description'])
+        
+    def export_customers_data(self):
+        """Экспорт данных клиентов с расширенной аналитикой"""
+        return self.export_spec('customers_analytics')
+        
+    def export_orders_data(self):
+        """Экспорт данных заказов с расчетными полями"""
+        return self.export_spec('orders_analytics')
         
     def export_products_data(self):
         """Экспорт данных товаров с метриками продаж"""
-        query = """
-        WITH product_analytics AS (
-            SELECT 
-                p.id,
-                p.name,
-                p.description,
-                p.category,
-                p.supplier_id,
-                p.purchase_price,
-                p.selling_price,
-                p.stock_quantity,
-                p.reorder_level,
-                p.is_active,
-                p.created_at,
-                p.updated_at,
-                
-                -- Метрики продаж
-                COALESCE(pm.total_sold, 0) as total_sold,
-                COALESCE(pm.total_revenue, 0) as total_revenue,
-                COALESCE(pm.order_count, 0) as order_count,
-                pm.last_sale_date,
-                pm.first_sale_date,
-                
-                -- Расчетные поля
-                ROUND(p.selling_price - p.purchase_price, 2) as profit_per_unit,
-                ROUND((p.selling_price - p.purchase_price) * COALESCE(pm.total_sold, 0), 2) as total_profit,
-                ROUND(p.stock_quantity * p.purchase_price, 2) as inventory_value,
-                
-                -- Маржинальность
-                CASE 
-                    WHEN p.purchase_price > 0 
-                    THEN ROUND((p.selling_price - p.purchase_price) / p.purchase_price * 100, 2)
-                    ELSE 0 
-                END as profit_margin_percent,
-                
-                -- Статус запасов
-                CASE 
-                    WHEN p.stock_quantity <= p.reorder_level THEN 'low_stock'
-                    WHEN p.stock_quantity = 0 THEN 'out_of_stock'
-                    ELSE 'in_stock'
-                END as stock_status,
-                
-                -- Популярность
-                CASE 
-                    WHEN COALESCE(pm.total_sold, 0) > 100 THEN 'high_demand'
-                    WHEN COALESCE(pm.total_sold, 0) > 10 THEN 'medium_demand'
-                    WHEN COALESCE(pm.total_sold, 0) > 0 THEN 'low_demand'
-                    ELSE 'no_sales'
-                END as demand_level,
-                
-                -- Дни с последней продажи
-                CASE 
-                    WHEN pm.last_sale_date IS NOT NULL 
-                    THEN DATE_PART('day', CURRENT_DATE - pm.last_sale_date)
-                    ELSE NULL
-                END as days_since_last_sale,
-                
-                -- ABC анализ по выручке
-                CASE 
-                    WHEN COALESCE(pm.total_revenue, 0) > 100000 THEN 'A'
-                    WHEN COALESCE(pm.total_revenue, 0) > 10000 THEN 'B'
-                    WHEN COALESCE(pm.total_revenue, 0) > 0 THEN 'C'
-                    ELSE 'N'
-                END as abc_category
-                
-            FROM products p
-            LEFT JOIN (
-                SELECT 
-                    oi.product_id,
-                    SUM(oi.quantity) as total_sold,
-                    SUM(oi.quantity * oi.unit_price) as total_revenue,
-                    COUNT(DISTINCT oi.order_id) as order_count,
-                    MIN(o.order_date) as first_sale_date,
-                    MAX(o.order_date) as last_sale_date
-                FROM order_items oi
-                JOIN orders o ON oi.order_id = o.id
-                WHERE o.payment_status = 'paid'
-                GROUP BY oi.product_id
-            ) pm ON p.id = pm.product_id
-        )
-        SELECT * FROM product_analytics
-        ORDER BY total_revenue DESC, total_sold DESC
-        """
-        
-        return self.export_table_to_formats(
-            'products_analytics',
-            query,
-            'Аналитические данные товаров с метриками продаж, рентабельностью и ABC-анализом'
-        )
+        return self.export_spec('products_analytics')
         
     def export_kpi_summary(self):
         """Экспорт сводки KPI метрик"""
-        query = """
-        WITH kpi_calculations AS (
-            SELECT 
-                -- Базовые метрики
-                COUNT(DISTINCT o.id) as total_orders,
-                COUNT(DISTINCT CASE WHEN o.payment_status = 'paid' THEN o.id END) as paid_orders,
-                COUNT(DISTINCT CASE WHEN o.status = 'delivered' THEN o.id END) as delivered_orders,
-                COUNT(DISTINCT CASE WHEN o.status = 'cancelled' THEN o.id END) as cancelled_orders,
-                COUNT(DISTINCT CASE WHEN o.status = 'returned' THEN o.id END) as returned_orders,
-                
-                -- Финансовые метрики
-                COALESCE(SUM(oi.quantity * oi.unit_price), 0) as gross_revenue,
-                COALESCE(SUM(CASE WHEN o.payment_status = 'paid' THEN oi.quantity * oi.unit_price ELSE 0 END), 0) as net_paid_revenue,
-                COALESCE(SUM(oi.quantity), 0) as total_units,
-                
-                -- Клиентские метрики
-                COUNT(DISTINCT o.customer_id) as unique_customers,
-                COUNT(DISTINCT c.id) as total_customers,
-                
-                -- Товарные метрики
-                COUNT(DISTINCT p.id) as total_products,
-                COUNT(DISTINCT CASE WHEN p.is_active = true THEN p.id END) as active_products,
-                
-                -- Временной период
-                MIN(o.order_date) as period_start,
-                MAX(o.order_date) as period_end,
-                CURRENT_DATE as report_date
-                
-            FROM orders o
-            LEFT JOIN order_items oi ON o.id = oi.order_id
-            LEFT JOIN customers c ON o.customer_id = c.id
-            LEFT JOIN products p ON oi.product_id = p.id
-        ),
-        calculated_kpis AS (
-            SELECT 
-                *,
-                -- AOV (средняя стоимость заказа)
-                CASE 
-                    WHEN paid_orders > 0 
-                    THEN ROUND(net_paid_revenue / paid_orders, 2)
-                    ELSE 0 
-                END as aov,
-                
-                -- Конверсия оплаты
-                CASE 
-                    WHEN total_orders > 0 
-                    THEN ROUND((paid_orders::numeric / total_orders::numeric) * 100, 2)
-                    ELSE 0 
-                END as payment_conversion_rate,
-                
-                -- Доля возвратов
-                CASE 
-                    WHEN total_orders > 0 
-                    THEN ROUND((returned_orders::numeric / total_orders::numeric) * 100, 2)
-                    ELSE 0 
-                END as return_rate,
-                
-                -- Доля отмен
-                CASE 
-                    WHEN total_orders > 0 
-                    THEN ROUND((cancelled_orders::numeric / total_orders::numeric) * 100, 2)
-                    ELSE 0 
-                END as cancellation_rate,
-                
-                -- Среднее количество единиц в заказе
-                CASE 
-                    WHEN paid_orders > 0 
-                    THEN ROUND(total_units::numeric / paid_orders::numeric, 1)
-                    ELSE 0 
-                END as avg_units_per_order,
-                
-                -- Процент активных товаров
-                CASE 
-                    WHEN total_products > 0 
-                    THEN ROUND((active_products::numeric / total_products::numeric) * 100, 2)
-                    ELSE 0 
-                END as active_products_rate
-                
-            FROM kpi_calculations
-        )
-        SELECT * FROM calculated_kpis
-        """
-        
-        return self.export_table_to_formats(
-            'kpi_summary',
-            query,
-            'Сводка ключевых показателей эффективности (KPI) по всем данным'
-        )
+        return self.export_spec('kpi_summary')
         
     def export_time_series_data(self):
         """Экспорт временных рядов для анализа трендов"""
-        query = """
-        WITH daily_metrics AS (
-            SELECT 
-                o.order_date,
-                EXTRACT(YEAR FROM o.order_date) as year,
-                EXTRACT(MONTH FROM o.order_date) as month,
-                EXTRACT(DOW FROM o.order_date) as day_of_week,
-                EXTRACT(WEEK FROM o.order_date) as week_of_year,
-                
-                -- Основные метрики
-                COUNT(*) as orders_count,
-                COUNT(CASE WHEN o.payment_status = 'paid' THEN 1 END) as paid_orders,
-                SUM(oi.quantity * oi.unit_price) as gross_revenue,
-                SUM(CASE WHEN o.payment_status = 'paid' THEN oi.quantity * oi.unit_price ELSE 0 END) as net_revenue,
-                SUM(oi.quantity) as units_sold,
-                COUNT(DISTINCT o.customer_id) as unique_customers,
-                
-                -- Метрики по типам дней
-                CASE 
-                    WHEN EXTRACT(DOW FROM o.order_date) IN (1,2,3,4,5) THEN 'weekday'
-                    ELSE 'weekend'
-                END as day_type,
-                
-                -- Сезонность
-                CASE 
-                    WHEN EXTRACT(MONTH FROM o.order_date) IN (12,1,2) THEN 'winter'
-                    WHEN EXTRACT(MONTH FROM o.order_date) IN (3,4,5) THEN 'spring'
-                    WHEN EXTRACT(MONTH FROM o.order_date) IN (6,7,8) THEN 'summer'
-                    ELSE 'autumn'
-                END as season
-                
-            FROM orders o
-            LEFT JOIN order_items oi ON o.id = oi.order_id
-            WHERE o.order_date >= CURRENT_DATE - INTERVAL '2 years'
-            GROUP BY o.order_date
-        )
-        SELECT 
-            *,
-            -- Скользящие средние (требует window functions)
-            AVG(orders_count) OVER (ORDER BY order_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) as orders_7day_avg,
-            AVG(net_revenue) OVER (ORDER BY order_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) as revenue_7day_avg,
-            
-            -- Сравнение с предыдущим днем
-            LAG(orders_count, 1) OVER (ORDER BY order_date) as prev_day_orders,
-            LAG(net_revenue, 1) OVER (ORDER BY order_date) as prev_day_revenue
-            
-        FROM daily_metrics
-        ORDER BY order_date DESC
-        """
+        return self.export_spec('time_series_analytics')
         
-        return self.export_table_to_formats(
-            'time_series_analytics',
-            query,
-            'Временные ряды метрик по дням для анализа трендов и сезонности'
-        )
+    def export_time_series_windows(self):
+        """Экспорт временных рядов с окнами по полному календарю"""
+        return self.export_spec('time_series_windows')
+        
+    def export_cohort_retention(self):
+        """Экспорт когорт удержания и выручки по месяцу первого заказа"""
+        return self.export_spec('cohort_retention')
         
     def create_export_summary(self):
         """Создание итогового файла с информацией об экспорте"""
@@ -551,14 +636,15 @@ class DataExporter:
             'end_time': datetime.now().isoformat(),
             'total_tables_exported': len(self.export_manifest['exported_tables']),
             'total_records': sum(self.export_manifest['record_counts'].values()),
-            'export_format': ['CSV', 'Parquet', 'JSON metadata'],
+            'export_format': ['CSV', 'Parquet'] + (['Arrow IPC'] if self.arrow_ipc else []) +
+                             (['Excel'] if self.excel_tables else []) + ['JSON metadata'],
             'data_source': 'PostgreSQL Database',
             'data_timeframe': 'All available data',
             'data_quality': 'Cleaned and validated'
         })
         
         # Сохранение манифеста
-        manifest_path = self.output_dir / 'export_manifest.json'
+        manifest_path = self.work_dir / 'export_manifest.json'
         with open(manifest_path, 'w', encoding='utf-8') as f:
             json.dump(self.export_manifest, f, ensure_ascii=False, indent=2, default=str)
         
@@ -584,8 +670,12 @@ class DataExporter:
 - **Записей**: {record_count:,}
 - **CSV размер**: {file_sizes.get('csv_mb', 0)} MB
 - **Parquet размер**: {file_sizes.get('parquet_mb', 0)} MB
-
 """
+            if 'arrow_mb' in file_sizes:
+                readme_content += f"- **Arrow IPC размер**: {file_sizes['arrow_mb']} MB\n"
+            if 'xlsx_mb' in file_sizes:
+                readme_content += f"- **Excel размер**: {file_sizes['xlsx_mb']} MB\n"
+            readme_content += "\n"
         
         readme_content += """## Структура файлов
 
@@ -593,6 +683,8 @@ class DataExporter:
 exported_data/
 ├── csv/                    # CSV файлы
 ├── parquet/               # Parquet файлы  
+├── feather/               # Arrow IPC / Feather v2 (при export --arrow)
+├── xlsx/                  # Excel для бизнес-пользователей (при export --excel)
 ├── json/                  # JSON метаданные
 ├── export_manifest.json  # Манифест экспорта
 └── README.md             # Этот файл
@@ -606,12 +698,21 @@ exported_data/
 - Простого анализа данных
 - Импорта в большинство инструментов
 
+### Excel файлы (xlsx/)
+Для открытия в Excel без импорта CSV. Таблица больше 1 048 575 строк
+продолжается на следующих листах: `<таблица>_2`, `<таблица>_3`, ...
+
 ### Parquet файлы  
 Подходят для:
 - Больших данных и аналитики
 - Apache Spark, Pandas
 - Эффективного хранения
 
+### Arrow IPC (Feather v2) файлы
+Подходят для:
+- Многократного чтения из Python без распаковки и декодирования
+- Memory map: `feather_reader.read_export_table('orders_analytics')`
+
 ### JSON метаданные
 Содержат:
 - Описание столбцов
@@ -630,13 +731,48 @@ exported_data/
 Подробная информация о ка��естве данных доступна в файле `docs/DATA_QUALITY_REPORT.md`.
 """
         
-        readme_path = self.output_dir / 'README.md'
+        readme_path = self.work_dir / 'README.md'
         with open(readme_path, 'w', encoding='utf-8') as f:
             f.write(readme_content)
             
         logger.info(f"📋 Документация создана: {readme_path}")
         logger.info(f"📋 Манифест создан: {manifest_path}")
         
+    def export_plan(self):
+        """Таблицы выгрузки по порядку (см. export_plan)"""
+        return export_plan(self.include_base_tables)
+        
+    def export_table(self, table_name):
+        """Выгрузка одной таблицы плана (планировщик); повторная попытка снимает прошлую ошибку таблицы"""
+        self.failed_tables = [name for name in self.failed_tables if name != table_name]
+        return self.export_spec(table_name)
+        
+    def finish_export(self, successful_exports, total_exports):
+        """Документация, перенос выгрузки в output_dir и итоговая статистика"""
+        self.create_export_summary()
+        self.commit_export()
+        self.log_export_totals(successful_exports, total_exports)
+        
+    def close_db(self):
+        """Возврат соединения в пул"""
+        if self.conn is not None:
+            self.pool.putconn(self.conn)
+            self.conn = None
+            logger.info("🔌 Соединение с БД возвращено в пул")
+        
+    def log_export_totals(self, successful_exports, total_exports):
+        """Вывод итоговой статистики экспорта"""
+        total_size_mb = sum(
+            sum(sizes.values()) for sizes in self.export_manifest['file_sizes'].values()
+        )
+        
+        logger.info("🎉 ЭКСПОРТ ЗАВЕРШЕН УСПЕШНО")
+        logger.info("=" * 50)
+        logger.info(f"📊 Успешно экспортировано: {successful_exports}/{total_exports} таблиц")
+        logger.info(f"📁 Общий размер файлов: {total_size_mb:.2f} MB")
+        logger.info(f"📋 Всего записей: {sum(self.export_manifest['record_counts'].values()):,}")
+        logger.info(f"📂 Папка экспорта: {self.output_dir.absolute()}")
+        
     def run_export(self):
         """Запуск полного процесса экспорта"""
         try:
@@ -647,13 +783,13 @@ exported_data/
             if not self.connect_db():
                 return False
                 
+            # Справочник регионов: сопоставляются только новые адреса
+            prepare_region_mapping(self.pool)
+            
             # Список экспортируемых таблиц
             export_functions = [
-                ("Клиенты с аналитикой", self.export_customers_data),
-                ("Заказы с аналитикой", self.export_orders_data),
-                ("Товары с аналитикой", self.export_products_data),
-                ("Сводка KPI", self.export_kpi_summary),
-                ("Временные ряды", self.export_time_series_data)
+                (description, lambda name=name: self.export_spec(name))
+                for description, name in self.export_plan()
             ]
             
             # Выполнение экспорта
@@ -667,20 +803,15 @@ exported_data/
                     logger.error(f"❌ Ошибка: {description}")
                 logger.info("-" * 30)
             
-            # Создание итоговой документации
-            self.create_export_summary()
+            if self.failed_tables:
+                logger.error(
+                    f"⏸️ Выгрузка не завершена ({', '.join(self.failed_tables)}), файлы оставлены в "
+                    f"{self.work_dir} — продолжение: export --resume"
+                )
+                return False
             
-            # Итоговая статистика
-            total_size_mb = sum(
-                sum(sizes.values()) for sizes in self.export_manifest['file_sizes'].values()
-            )
-            
-            logger.info("🎉 ЭКСПОРТ ЗАВЕРШЕН УСПЕШНО")
-            logger.info("=" * 50)
-            logger.info(f"📊 Успешно экспортировано: {successful_exports}/{len(export_functions)} таблиц")
-            logger.info(f"📁 Общий размер файлов: {total_size_mb:.2f} MB")
-            logger.info(f"📋 Всего записей: {sum(self.export_manifest['record_counts'].values()):,}")
-            logger.info(f"📂 Папка экспорта: {self.output_dir.absolute()}")
+            # Итоговая документация, перенос выгрузки и статистика
+            self.finish_export(successful_exports, len(export_functions))
             
             return True
             
@@ -688,11 +819,11 @@ exported_data/
             logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА ЭКСПОРТА: {e}")
             return False
         finally:
-            if hasattr(self, 'conn'):
-                self.conn.close()
-                logger.info("🔌 Соединение с БД закрыто")
+            self.close_db()
 
 if __name__ == "__main__":
+    setup_logging()
+    
     # Создание папки для экспорта с timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     output_directory = f'exported_data_{timestamp}'
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Поиск выгрузок и их файлов по export_manifest.json
+Используется потребителями выгрузок: локальным слоем запросов, подбором настроек Parquet
+"""
+
+import json
+import logging
+import os
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'export_manifest.json'
+# Папка, в которой ищутся выгрузки exported_data_<timestamp>/
+DEFAULT_EXPORT_ROOT = os.getenv('EXPORT_ROOT', '.')
+
+
+def read_manifest(export_dir):
+    """Манифест папки выгрузки"""
+    with open(Path(export_dir) / MANIFEST_NAME, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_latest_export(root=DEFAULT_EXPORT_ROOT):
+    """Папка последнего экспорта по export_timestamp манифеста (None, если выгрузок нет)"""
+    latest = None
+    for manifest_path in Path(root).glob(f'*/{MANIFEST_NAME}'):
+        try:
+            timestamp = read_manifest(manifest_path.parent).get('export_timestamp', '')
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Пропущен манифест {manifest_path}: {e}")
+            continue
+        if latest is None or timestamp > latest[0]:
+            latest = (timestamp, manifest_path.parent)
+    return latest[1] if latest else None
+
+
+def manifest_parquet_files(export_dir, manifest=None):
+    """Parquet-файл каждой выгруженной таблицы: {table_name: path}"""
+    export_dir = Path(export_dir)
+    manifest = manifest or read_manifest(export_dir)
+    files = manifest.get('files', {})
+
+    result = {}
+    for table in manifest.get('exported_tables', []):
+        relative = files.get(table, {}).get('parquet')
+        if relative:
+            path = export_dir / relative
+        else:
+            # Манифесты до появления путей: <table>_<YYYYMMDD_HHMMSS>.parquet, последний по времени
+            pattern = re.compile(rf'^{re.escape(table)}_\d{{8}}_\d{{6}}\.parquet$')
+            candidates = sorted(p for p in (export_dir / 'parquet').glob('*.parquet') if pattern.match(p.name))
+            path = candidates[-1] if candidates else None
+        if path is not None and path.exists():
+            result[table] = path
+        else:
+            logger.warning(f"⚠️ {table}: Parquet-файл не найден в {export_dir}")
+    return result
@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+"""
+SQL запросы аналитических выгрузок DataExporter
+Общие для синхронного (export_data_artifacts.py) и асинхронного (async_export.py) экспорта
+"""
+
+# Измерения аналитики: общие для выгрузок клиентов/заказов и KPI-куба (kpi_cube.py).
+# Ожидают псевдонимы o (orders), c (customers), om (total_spent, total_orders клиента),
+# регион — соединение REGION_JOIN
+# Регион по адресу доставки — из справочника address_regions (см. region_resolver.py),
+# адреса, еще не попавшие в справочник, относятся к «Другие регионы»
+REGION_DIMENSION = "COALESCE(ar.region, 'Другие регионы')"
+REGION_JOIN = "LEFT JOIN address_regions ar ON ar.address_hash = md5(o.shipping_address::text)"
+
+# Временной канал по часу создания заказа
+TIME_CHANNEL_DIMENSION = """
+CASE 
+    WHEN EXTRACT(HOUR FROM o.created_at) BETWEEN 9 AND 18 THEN 'Рабочие часы'
+    WHEN EXTRACT(HOUR FROM o.created_at) BETWEEN 19 AND 23 THEN 'Вечернее время'
+    ELSE 'Ночное время'
+END
+""".strip()
+
+# Будни / выходные
+DAY_TYPE_DIMENSION = """
+CASE 
+    WHEN EXTRACT(DOW FROM o.order_date) IN (1,2,3,4,5) THEN 'Будни'
+    ELSE 'Выходные'
+END
+""".strip()
+
+# B2B / B2C
+CUSTOMER_TYPE_DIMENSION = """
+CASE 
+    WHEN c.company_name IS NOT NULL AND c.company_name != '' THEN 'B2B'
+    ELSE 'B2C'
+END
+""".strip()
+
+# Сегмент клиента по сумме оплаченных заказов
+CUSTOMER_SEGMENT_DIMENSION = """
+CASE 
+    WHEN COALESCE(om.total_spent, 0) > 50000 THEN 'VIP'
+    WHEN COALESCE(om.total_spent, 0) > 20000 THEN 'Premium'
+    WHEN COALESCE(om.total_spent, 0) > 5000 THEN 'Regular'
+    WHEN COALESCE(om.total_orders, 0) > 0 THEN 'Occasional'
+    ELSE 'New'
+END
+""".strip()
+
+
+# Порядок строк выгрузок: [(колонка, 'ascending' | 'descending'), ...] — для ORDER BY,
+# метаданных и сортировки внутри row group при выгрузке без ORDER BY
+CUSTOMERS_SORT_KEY = [('total_spent', 'descending'), ('registration_date', 'descending')]
+ORDERS_SORT_KEY = [('order_date', 'descending'), ('id', 'descending')]
+PRODUCTS_SORT_KEY = [('total_revenue', 'descending'), ('total_sold', 'descending')]
+TIME_SERIES_SORT_KEY = [('order_date', 'descending')]
+ID_SORT_KEY = [('id', 'ascending')]
+
+
+def order_clause(sort_key):
+    """ORDER BY по ключу сортировки (пустая строка — без сортировки)"""
+    if not sort_key:
+        return ""
+    return "ORDER BY " + ", ".join(
+        f"{column} DESC" if order == 'descending' else column for column, order in sort_key
+    )
+
+
+def key_range(column):
+    """Условие диапазона первичного ключа для выгрузки порциями: (%(key_from)s, %(key_to)s]"""
+    return f"({column} > %(key_from)s OR %(key_from)s IS NULL) AND {column} <= %(key_to)s"
+
+
+def _customers_analytics_query(keyed=False, ordered=True):
+    """
+    Выгрузка клиентов; keyed — порция по диапазону c.id в порядке ключа,
+    ordered=False — без итоговой сортировки (строки в порядке выполнения запроса)
+    """
+    customers_filter = f"WHERE {key_range('c.id')}" if keyed else ""
+    orders_filter = f"WHERE {key_range('o.customer_id')}" if keyed else ""
+    order_by = order_clause(ID_SORT_KEY if keyed else CUSTOMERS_SORT_KEY if ordered else None)
+    return f"""
+WITH customer_metrics AS (
+    SELECT 
+        c.id,
+        c.name,
+        c.email,
+        c.phone,
+        c.company_name,
+        c.industry,
+        c.status,
+        c.registration_date,
+        c.last_login,
+        c.created_at,
+        c.updated_at,
+
+        -- Метрики заказов
+        COALESCE(om.total_orders, 0) as total_orders,
+        COALESCE(om.paid_orders, 0) as paid_orders,
+        COALESCE(om.total_spent, 0) as total_spent,
+        COALESCE(om.avg_order_value, 0) as avg_order_value,
+        om.first_order_date,
+        om.last_order_date,
+
+        -- Сегментация
+        {CUSTOMER_SEGMENT_DIMENSION} as customer_segment,
+
+        -- Активность
+        CASE 
+            WHEN om.last_order_date IS NULL THEN 'no_orders'
+            WHEN DATE_PART('day', CURRENT_DATE - om.last_order_date) <= 30 THEN 'active'
+            WHEN DATE_PART('day', CURRENT_DATE - om.last_order_date) <= 90 THEN 'dormant'
+            ELSE 'inactive'
+        END as activity_status,
+
+        -- Тип клиента
+        {CUSTOMER_TYPE_DIMENSION} as customer_type,
+
+        -- Возраст клиента в днях
+        DATE_PART('day', CURRENT_DATE - c.registration_date) as customer_age_days
+
+    FROM customers c
+    LEFT JOIN (
+        SELECT 
+            customer_id,
+            COUNT(*) as total_orders,
+            COUNT(CASE WHEN payment_status = 'paid' THEN 1 END) as paid_orders,
+            SUM(CASE WHEN payment_status = 'paid' THEN 
+                (SELECT SUM(oi.quantity * oi.unit_price) 
+                 FROM order_items oi 
+                 WHERE oi.order_id = o.id)
+            ELSE 0 END) as total_spent,
+            AVG(CASE WHEN payment_status = 'paid' THEN 
+                (SELECT SUM(oi.quantity * oi.unit_price) 
+                 FROM order_items oi 
+                 WHERE oi.order_id = o.id)
+            END) as avg_order_value,
+            MIN(order_date) as first_order_date,
+            MAX(order_date) as last_order_date
+        FROM orders o
+        {orders_filter}
+        GROUP BY customer_id
+    ) om ON c.id = om.customer_id
+    {customers_filter}
+)
+SELECT * FROM customer_metrics
+{order_by}
+"""
+
+
+# Экспорт данных клиентов с расширенной аналитикой
+CUSTOMERS_ANALYTICS_QUERY = _customers_analytics_query()
+CUSTOMERS_ANALYTICS_RANGE_QUERY = _customers_analytics_query(keyed=True)
+CUSTOMERS_ANALYTICS_UNORDERED_QUERY = _customers_analytics_query(ordered=False)
+
+
+def _orders_analytics_query(keyed=False, ordered=True):
+    """
+    Выгрузка заказов; keyed — порция по диапазону o.id в порядке ключа,
+    ordered=False — без итоговой сортировки (строки в порядке выполнения запроса)
+    """
+    orders_filter = f"WHERE {key_range('o.id')}" if keyed else ""
+    items_filter = f"WHERE {key_range('order_id')}" if keyed else ""
+    order_by = order_clause(ID_SORT_KEY if keyed else ORDERS_SORT_KEY if ordered else None)
+    return f"""
+WITH order_details AS (
+    SELECT 
+        o.id,
+        o.customer_id,
+        o.order_date,
+        o.status,
+        o.payment_status,
+        o.shipping_address,
+        o.created_at,
+        o.updated_at,
+
+        -- Информация о клиенте
+        c.name as customer_name,
+        c.email as customer_email,
+        c.company_name,
+        {CUSTOMER_TYPE_DIMENSION} as customer_type,
+
+        -- Расчетные поля заказа
+        COALESCE(oi.total_amount, 0) as total_amount,
+        COALESCE(oi.items_count, 0) as items_count,
+        COALESCE(oi.total_quantity, 0) as total_quantity,
+
+        -- Статусы
+        CASE WHEN o.payment_status = 'paid' THEN oi.total_amount ELSE 0 END as paid_amount,
+        CASE WHEN o.status = 'delivered' THEN 1 ELSE 0 END as is_delivered,
+        CASE WHEN o.status = 'cancelled' THEN 1 ELSE 0 END as is_cancelled,
+        CASE WHEN o.status = 'returned' THEN 1 ELSE 0 END as is_returned,
+
+        -- Временные метрики
+        EXTRACT(YEAR FROM o.order_date) as order_year,
+        EXTRACT(MONTH FROM o.order_date) as order_month,
+        EXTRACT(DOW FROM o.order_date) as order_dow,
+        EXTRACT(HOUR FROM o.created_at) as order_hour,
+
+        -- Региональная информация
+        {REGION_DIMENSION} as region,
+
+        -- Канальная информация
+        {TIME_CHANNEL_DIMENSION} as time_channel,
+
+        {DAY_TYPE_DIMENSION} as day_type
+
+    FROM orders o
+    LEFT JOIN customers c ON o.customer_id = c.id
+    {REGION_JOIN}
+    LEFT JOIN (
+        SELECT 
+            order_id,
+            SUM(quantity * unit_price) as total_amount,
+            COUNT(*) as items_count,
+            SUM(quantity) as total_quantity
+        FROM order_items
+        {items_filter}
+        GROUP BY order_id
+    ) oi ON o.id = oi.order_id
+    {orders_filter}
+)
+SELECT * FROM order_details
+{order_by}
+"""
+
+
+# Экспорт данных заказов с расчетными полями
+ORDERS_ANALYTICS_QUERY = _orders_analytics_query()
+ORDERS_ANALYTICS_RANGE_QUERY = _orders_analytics_query(keyed=True)
+ORDERS_ANALYTICS_UNORDERED_QUERY = _orders_analytics_query(ordered=False)
+
+
+def _products_analytics_query(keyed=False, ordered=True):
+    """
+    Выгрузка товаров; keyed — порция по диапазону p.id в порядке ключа,
+    ordered=False — без итоговой сортировки (строки в порядке выполнения запроса)
+    """
+    products_filter = f"WHERE {key_range('p.id')}" if keyed else ""
+    items_filter = f"AND {key_range('oi.product_id')}" if keyed else ""
+    order_by = order_clause(ID_SORT_KEY if keyed else PRODUCTS_SORT_KEY if ordered else None)
+    return f"""
+WITH product_analytics AS (
+    SELECT 
+        p.id,
+        p.name,
+        p.description,
+        p.category,
+        p.supplier_id,
+        p.purchase_price,
+        p.selling_price,
+        p.stock_quantity,
+        p.reorder_level,
+        p.is_active,
+        p.created_at,
+        p.updated_at,
+
+        -- Метрики продаж
+        COALESCE(pm.total_sold, 0) as total_sold,
+        COALESCE(pm.total_revenue, 0) as total_revenue,
+        COALESCE(pm.order_count, 0) as order_count,
+        pm.last_sale_date,
+        pm.first_sale_date,
+
+        -- Расчетные поля
+        ROUND(p.selling_price - p.purchase_price, 2) as profit_per_unit,
+        ROUND((p.selling_price - p.purchase_price) * COALESCE(pm.total_sold, 0), 2) as total_profit,
+        ROUND(p.stock_quantity * p.purchase_price, 2) as inventory_value,
+
+        -- Маржинальность
+        CASE 
+            WHEN p.purchase_price > 0 
+            THEN ROUND((p.selling_price - p.purchase_price) / p.purchase_price * 100, 2)
+            ELSE 0 
+        END as profit_margin_percent,
+
+        -- Статус запасов
+        CASE 
+            WHEN p.stock_quantity <= p.reorder_level THEN 'low_stock'
+            WHEN p.stock_quantity = 0 THEN 'out_of_stock'
+            ELSE 'in_stock'
+        END as stock_status,
+
+        -- Популярность
+        CASE 
+            WHEN COALESCE(pm.total_sold, 0) > 100 THEN 'high_demand'
+            WHEN COALESCE(pm.total_sold, 0) > 10 THEN 'medium_demand'
+            WHEN COALESCE(pm.total_sold, 0) > 0 THEN 'low_demand'
+            ELSE 'no_sales'
+        END as demand_level,
+
+        -- Дни с последней продажи
+        CASE 
+            WHEN pm.last_sale_date IS NOT NULL 
+            THEN DATE_PART('day', CURRENT_DATE - pm.last_sale_date)
+            ELSE NULL
+        END as days_since_last_sale,
+
+        -- ABC анализ по выручке
+        CASE 
+            WHEN COALESCE(pm.total_revenue, 0) > 100000 THEN 'A'
+            WHEN COALESCE(pm.total_revenue, 0) > 10000 THEN 'B'
+            WHEN COALESCE(pm.total_revenue, 0) > 0 THEN 'C'
+            ELSE 'N'
+        END as abc_category
+
+    FROM products p
+    LEFT JOIN (
+        SELECT 
+            oi.product_id,
+            SUM(oi.quantity) as total_sold,
+            SUM(oi.quantity * oi.unit_price) as total_revenue,
+            COUNT(DISTINCT oi.order_id) as order_count,
+            MIN(o.order_date) as first_sale_date,
+            MAX(o.order_date) as last_sale_date
+        FROM order_items oi
+        JOIN orders o ON oi.order_id = o.id
+        WHERE o.payment_status = 'paid'
+          {items_filter}
+        GROUP BY oi.product_id
+    ) pm ON p.id = pm.product_id
+    {products_filter}
+)
+SELECT * FROM product_analytics
+{order_by}
+"""
+
+
+# Экспорт данных товаров с метриками продаж
+PRODUCTS_ANALYTICS_QUERY = _products_analytics_query()
+PRODUCTS_ANALYTICS_RANGE_QUERY = _products_analytics_query(keyed=True)
+PRODUCTS_ANALYTICS_UNORDERED_QUERY = _products_analytics_query(ordered=False)
+
+# Экспорт сводки KPI метрик
+KPI_SUMMARY_QUERY = """
+WITH kpi_calculations AS (
+    SELECT 
+        -- Базовые метрики
+        COUNT(DISTINCT o.id) as total_orders,
+        COUNT(DISTINCT CASE WHEN o.payment_status = 'paid' THEN o.id END) as paid_orders,
+        COUNT(DISTINCT CASE WHEN o.status = 'delivered' THEN o.id END) as delivered_orders,
+        COUNT(DISTINCT CASE WHEN o.status = 'cancelled' THEN o.id END) as cancelled_orders,
+        COUNT(DISTINCT CASE WHEN o.status = 'returned' THEN o.id END) as returned_orders,
+
+        -- Финансовые метрики
+        COALESCE(SUM(oi.quantity * oi.unit_price), 0) as gross_revenue,
+        COALESCE(SUM(CASE WHEN o.payment_status = 'paid' THEN oi.quantity * oi.unit_price ELSE 0 END), 0) as net_paid_revenue,
+        COALESCE(SUM(oi.quantity), 0) as total_units,
+
+        -- Клиентские метрики
+        COUNT(DISTINCT o.customer_id) as unique_customers,
+        COUNT(DISTINCT c.id) as total_customers,
+
+        -- Товарные метрики
+        COUNT(DISTINCT p.id) as total_products,
+        COUNT(DISTINCT CASE WHEN p.is_active = true THEN p.id END) as active_products,
+
+        -- Временной период
+        MIN(o.order_date) as period_start,
+        MAX(o.order_date) as period_end,
+        CURRENT_DATE as report_date
+
+    FROM orders o
+    LEFT JOIN order_items oi ON o.id = oi.order_id
+    LEFT JOIN customers c ON o.customer_id = c.id
+    LEFT JOIN products p ON oi.product_id = p.id
+),
+calculated_kpis AS (
+    SELECT 
+        *,
+        -- AOV (средняя стоимость заказа)
+        CASE 
+            WHEN paid_orders > 0 
+            THEN ROUND(net_paid_revenue / paid_orders, 2)
+            ELSE 0 
+        END as aov,
+
+        -- Конверсия оплаты
+        CASE 
+            WHEN total_orders > 0 
+            THEN ROUND((paid_orders::numeric / total_orders::numeric) * 100, 2)
+            ELSE 0 
+        END as payment_conversion_rate,
+
+        -- Доля возвратов
+        CASE 
+            WHEN total_orders > 0 
+            THEN ROUND((returned_orders::numeric / total_orders::numeric) * 100, 2)
+            ELSE 0 
+        END as return_rate,
+
+        -- Доля отмен
+        CASE 
+            WHEN total_orders > 0 
+            THEN ROUND((cancelled_orders::numeric / total_orders::numeric) * 100, 2)
+            ELSE 0 
+        END as cancellation_rate,
+
+        -- Среднее количество единиц в заказе
+        CASE 
+            WHEN paid_orders > 0 
+            THEN ROUND(total_units::numeric / paid_orders::numeric, 1)
+            ELSE 0 
+        END as avg_units_per_order,
+
+        -- Процент активных товаров
+        CASE 
+            WHEN total_products > 0 
+            THEN ROUND((active_products::numeric / total_products::numeric) * 100, 2)
+            ELSE 0 
+        END as active_products_rate
+
+    FROM kpi_calculations
+)
+SELECT * FROM calculated_kpis
+"""
+
+# Экспорт временных рядов для анализа трендов
+TIME_SERIES_QUERY = """
+WITH daily_metrics AS (
+    SELECT 
+        o.order_date,
+        EXTRACT(YEAR FROM o.order_date) as year,
+        EXTRACT(MONTH FROM o.order_date) as month,
+        EXTRACT(DOW FROM o.order_date) as day_of_week,
+        EXTRACT(WEEK FROM o.order_date) as week_of_year,
+
+        -- Основные метрики
+        COUNT(*) as orders_count,
+        COUNT(CASE WHEN o.payment_status = 'paid' THEN 1 END) as paid_orders,
+        SUM(oi.quantity * oi.unit_price) as gross_revenue,
+        SUM(CASE WHEN o.payment_status = 'paid' THEN oi.quantity * oi.unit_price ELSE 0 END) as net_revenue,
+        SUM(oi.quantity) as units_sold,
+        COUNT(DISTINCT o.customer_id) as unique_customers,
+
+        -- Метрики по типам дней
+        CASE 
+            WHEN EXTRACT(DOW FROM o.order_date) IN (1,2,3,4,5) THEN 'weekday'
+            ELSE 'weekend'
+        END as day_type,
+
+        -- Сезонность
+        CASE 
+            WHEN EXTRACT(MONTH FROM o.order_date) IN (12,1,2) THEN 'winter'
+            WHEN EXTRACT(MONTH FROM o.order_date) IN (3,4,5) THEN 'spring'
+            WHEN EXTRACT(MONTH FROM o.order_date) IN (6,7,8) THEN 'summer'
+            ELSE 'autumn'
+        END as season
+
+    FROM orders o
+    LEFT JOIN order_items oi ON o.id = oi.order_id
+    WHERE o.order_date >= CURRENT_DATE - INTERVAL '2 years'
+    GROUP BY o.order_date
+)
+SELECT 
+    *,
+    -- Скользящие средние (требует window functions)
+    AVG(orders_count) OVER (ORDER BY order_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) as orders_7day_avg,
+    AVG(net_revenue) OVER (ORDER BY order_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) as revenue_7day_avg,
+
+    -- Сравнение с предыдущим днем
+    LAG(orders_count, 1) OVER (ORDER BY order_date) as prev_day_orders,
+    LAG(net_revenue, 1) OVER (ORDER BY order_date) as prev_day_revenue
+
+FROM daily_metrics
+ORDER BY order_date DESC
+"""
+
+# Временные ряды по дневным агрегатам daily_kpi_rollup (см. daily_rollup.py)
+TIME_SERIES_ROLLUP_QUERY = """
+WITH daily_metrics AS (
+    SELECT 
+        r.order_date,
+        EXTRACT(YEAR FROM r.order_date) as year,
+        EXTRACT(MONTH FROM r.order_date) as month,
+        EXTRACT(DOW FROM r.order_date) as day_of_week,
+        EXTRACT(WEEK FROM r.order_date) as week_of_year,
+
+        -- Основные метрики
+        r.total_orders as orders_count,
+        r.paid_orders,
+        r.gross_revenue,
+        r.net_revenue,
+        r.units_sold,
+        r.unique_customers,
+
+        -- Метрики по типам дней
+        CASE 
+            WHEN EXTRACT(DOW FROM r.order_date) IN (1,2,3,4,5) THEN 'weekday'
+            ELSE 'weekend'
+        END as day_type,
+
+        -- Сезонность
+        CASE 
+            WHEN EXTRACT(MONTH FROM r.order_date) IN (12,1,2) THEN 'winter'
+            WHEN EXTRACT(MONTH FROM r.order_date) IN (3,4,5) THEN 'spring'
+            WHEN EXTRACT(MONTH FROM r.order_date) IN (6,7,8) THEN 'summer'
+            ELSE 'autumn'
+        END as season
+
+    FROM daily_kpi_rollup r
+    WHERE r.order_date >= CURRENT_DATE - INTERVAL '2 years'
+)
+SELECT 
+    *,
+    -- Скользящие средние
+    AVG(orders_count) OVER (ORDER BY order_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) as orders_7day_avg,
+    AVG(net_revenue) OVER (ORDER BY order_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) as revenue_7day_avg,
+
+    -- Сравнение с предыдущим днем
+    LAG(orders_count, 1) OVER (ORDER BY order_date) as prev_day_orders,
+    LAG(net_revenue, 1) OVER (ORDER BY order_date) as prev_day_revenue
+
+FROM daily_metrics
+ORDER BY order_date DESC
+"""
+
+# Построены ли дневные агрегаты: таблица создается в одной транзакции с первым расчетом
+ROLLUP_READY_QUERY = "SELECT to_regclass($1) IS NOT NULL"
+
+# Сводка KPI из материализованного представления (см. kpi_views.py)
+KPI_SUMMARY_VIEW_QUERY = """
+SELECT * FROM mv_kpi_summary
+"""
+
+# Заполнено ли материализованное представление (NULL — представление не создано)
+MATVIEW_POPULATED_QUERY = "SELECT ispopulated FROM pg_matviews WHERE matviewname = $1"
+
+# Оценка числа строк из статистики планировщика (без COUNT(*))
+ESTIMATED_ROWS_QUERY = "SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = to_regclass($1)"
+
+
+def keyset_bound_query(table, column):
+    """
+    Верхняя граница следующей порции: ключ limit-й строки после key_from
+    (NULL — строк больше нет). Первая порция начинается с key_from = NULL
+    """
+    return f"""
+SELECT max({column}) FROM (
+    SELECT {column} FROM {table}
+    WHERE {column} > %(key_from)s OR %(key_from)s IS NULL
+    ORDER BY {column}
+    LIMIT %(limit)s
+) chunk
+"""
+
+# Описания выгружаемых таблиц в порядке экспорта. Источник выбирается по приоритету:
+# series_frame / cohort_frame — таблица считается в Python (time_series.py, cohorts.py), запроса у нее нет;
+# rollup_frame / rollup_query — дневные агрегаты daily_rollup.py, если они построены;
+# view/view_query — материализованное представление, если оно создано и заполнено;
+# иначе query по базовым таблицам. Необязательный stats ('exact' / 'approximate')
+# задает режим статистики метаданных таблицы (по умолчанию — auto по числу строк).
+# keyset — выгрузка крупной таблицы порциями по диапазонам первичного ключа table.column
+# запросом range_query (строки в порядке ключа); порции отмечаются в контрольной точке.
+# sort_key — порядок строк query; unordered_query — тот же результат без итоговой сортировки
+# (export --unordered): PostgreSQL не сортирует результат целиком перед отдачей первой строки.
+# rfm_key — колонка id клиента: к строкам добавляются RFM-баллы и сегменты по квантилям (rfm.py)
+EXPORT_SPECS = {
+    'customers_analytics': {
+        'table_name': 'customers_analytics',
+        'title': 'Клиенты с аналитикой',
+        'description': 'Аналитические данные клиентов с метриками заказов, сегментацией и статусом активности',
+        'query': CUSTOMERS_ANALYTICS_QUERY,
+        'unordered_query': CUSTOMERS_ANALYTICS_UNORDERED_QUERY,
+        'sort_key': CUSTOMERS_SORT_KEY,
+        'keyset': {'table': 'customers', 'column': 'id', 'range_query': CUSTOMERS_ANALYTICS_RANGE_QUERY},
+        'rfm_key': 'id'
+    },
+    'orders_analytics': {
+        'table_name': 'orders_analytics',
+        'title': 'Заказы с аналитикой',
+        'description': 'Аналитические данные заказов с расчетными полями, региональной и временной разбивкой',
+        'query': ORDERS_ANALYTICS_QUERY,
+        'unordered_query': ORDERS_ANALYTICS_UNORDERED_QUERY,
+        'sort_key': ORDERS_SORT_KEY,
+        'keyset': {'table': 'orders', 'column': 'id', 'range_query': ORDERS_ANALYTICS_RANGE_QUERY}
+    },
+    'products_analytics': {
+        'table_name': 'products_analytics',
+        'title': 'Товары с аналитикой',
+        'description': 'Аналитические данные товаров с метриками продаж, рентабельностью и ABC-анализом',
+        'query': PRODUCTS_ANALYTICS_QUERY,
+        'unordered_query': PRODUCTS_ANALYTICS_UNORDERED_QUERY,
+        'sort_key': PRODUCTS_SORT_KEY,
+        'keyset': {'table': 'products', 'column': 'id', 'range_query': PRODUCTS_ANALYTICS_RANGE_QUERY}
+    },
+    'kpi_summary': {
+        'table_name': 'kpi_summary',
+        'title': 'Сводка KPI',
+        'description': 'Сводка ключевых показателей эффективности (KPI) по всем данным',
+        'query': KPI_SUMMARY_QUERY,
+        'rollup_frame': True,
+        'view': 'mv_kpi_summary',
+        'view_query': KPI_SUMMARY_VIEW_QUERY
+    },
+    'time_series_analytics': {
+        'table_name': 'time_series_analytics',
+        'title': 'Временные ряды',
+        'description': 'Временные ряды метрик по дням для анализа трендов и сезонности',
+        'query': TIME_SERIES_QUERY,
+        'sort_key': TIME_SERIES_SORT_KEY,
+        'rollup_query': TIME_SERIES_ROLLUP_QUERY
+    },
+    'time_series_windows': {
+        'table_name': 'time_series_windows',
+        'title': 'Временные ряды с окнами',
+        'description': 'Дневные метрики по полному календарю с окнами 7/30/90 дней, изменениями неделя '
+                       'к неделе и год к году — итог, по регионам и по сегментам',
+        'series_frame': True,
+        'sort_key': [('group_by', 'ascending'), ('group', 'ascending'), ('order_date', 'ascending')]
+    },
+    'cohort_retention': {
+        'table_name': 'cohort_retention',
+        'title': 'Когорты удержания',
+        'description': 'Когорты клиентов по месяцу первого заказа: размер, активные клиенты и удержание (%), '
+                       'заказы, выручка и накопленная выручка на клиента по месяцам жизни когорты',
+        'cohort_frame': True,
+        'sort_key': [('cohort_month', 'ascending'), ('months_since_first', 'ascending')]
+    }
+}
+
+# Снимки исходных таблиц для локального слоя запросов (local_analytics.py): выражения
+# из sql/ ссылаются на базовые таблицы, поэтому их копии выгружаются под теми же именами.
+# Точная статистика по снимкам не нужна — они выгружаются ради запросов
+BASE_TABLE_SPECS = {
+    table: {
+        'table_name': table,
+        'title': f'Снимок {table}',
+        'description': f'Копия исходной таблицы {table} для локальных запросов без обращения к БД',
+        'query': f"SELECT * FROM {table} {order_clause([(order_key, 'ascending')])}",
+        'unordered_query': f"SELECT * FROM {table}",
+        'sort_key': [(order_key, 'ascending')],
+        'stats': 'approximate',
+        'keyset': {
+            'table': table,
+            'column': order_key,
+            'range_query': f"SELECT * FROM {table} WHERE {key_range(order_key)} ORDER BY {order_key}"
+        }
+    }
+    for table, order_key in (
+        ('customers', 'id'),
+        ('orders', 'id'),
+        ('order_items', 'id'),
+        ('products', 'id'),
+        ('address_regions', 'address_hash')
+    )
+}
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Чтение Arrow IPC (Feather v2) файлов выгрузки через memory map
+Несжатые файлы отображаются в память без копирования: колонки ссылаются на страницы
+файла, поэтому повторное чтение той же выгрузки несколькими процессами — это page cache
+"""
+
+import logging
+from pathlib import Path
+
+import pyarrow as pa
+
+from export_manifest import find_latest_export, read_manifest
+
+logger = logging.getLogger(__name__)
+
+
+def read_feather(path, columns=None):
+    """
+    Таблица Arrow из файла IPC через memory map.
+
+    Для несжатых файлов данные не копируются; для LZ4 буферы распаковываются
+    в память процесса (отображение все равно избавляет от чтения файла целиком).
+    """
+    source = pa.memory_map(str(path), 'r')
+    reader = pa.ipc.open_file(source)
+    table = reader.read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def export_feather_files(export_dir=None):
+    """Arrow IPC файлы выгрузки (по умолчанию последней): {table_name: path}"""
+    export_dir = Path(export_dir) if export_dir else find_latest_export()
+    if export_dir is None:
+        raise FileNotFoundError("Не найдено выгрузок с export_manifest.json")
+    files = read_manifest(export_dir).get('files', {})
+    return {
+        table: export_dir / entry['arrow']
+        for table, entry in files.items()
+        if entry.get('arrow')
+    }
+
+
+def read_export_table(table_name, export_dir=None, columns=None):
+    """Таблица выгрузки из Arrow IPC файла (выгрузка должна быть сделана с export --arrow)"""
+    files = export_feather_files(export_dir)
+    if table_name not in files:
+        raise FileNotFoundError(f"{table_name}: нет Arrow IPC файла в выгрузке (export --arrow)")
+    return read_feather(files[table_name], columns)
+
+
+def column_values(table, name):
+    """
+    Значения колонки как numpy.ndarray без копирования, если это возможно
+    (числовой тип без NULL в одном фрагменте); иначе — с копированием
+    """
+    column = table.column(name)
+    if column.num_chunks == 1 and column.null_count == 0:
+        try:
+            return column.chunk(0).to_numpy(zero_copy_only=True)
+        except pa.ArrowInvalid:
+            pass
+    return column.to_numpy()
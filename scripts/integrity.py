@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Проверка ссылочной целостности по массивам ключей
+Каждая колонка ключа извлекается один раз (COPY из БД или колонка Parquet-снимка)
+в отсортированный компактный массив; связь проверяется векторным поиском
+np.searchsorted без JOIN. Массивы кешируются в памяти и на диске по версии таблицы
+"""
+
+import io
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from export_manifest import find_latest_export, manifest_parquet_files
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY_CACHE_DIR = os.getenv('KEY_CACHE_DIR', '.key_cache')
+DEFAULT_SAMPLE_SIZE = 10
+
+# Связи (дочерняя таблица, колонка) → (родительская таблица, колонка).
+# Схема исходных данных, которую чистит data_cleaning.py
+CLEANING_RELATIONSHIPS = [
+    ('orders', 'customer_id', 'customers', 'customer_id'),
+    ('order_items', 'order_id', 'orders', 'order_id'),
+    ('payments', 'order_id', 'orders', 'order_id'),
+]
+# Схема таблиц пайплайна — для снимков export --base-tables
+SNAPSHOT_RELATIONSHIPS = [
+    ('orders', 'customer_id', 'customers', 'id'),
+    ('order_items', 'order_id', 'orders', 'id'),
+    ('order_items', 'product_id', 'products', 'id'),
+]
+
+
+def compact_keys(values):
+    """
+    Значения ключа без NULL как отсортированный массив: int64, если ключ целочисленный,
+    иначе строки фиксированной длины. Возвращает (массив, число NULL)
+    """
+    series = pd.Series(values)
+    nulls = int(series.isna().sum())
+    series = series.dropna()
+    try:
+        keys = pd.to_numeric(series, downcast=None).to_numpy()
+        if keys.dtype.kind == 'f' and not np.all(np.mod(keys, 1) == 0):
+            raise ValueError
+        keys = keys.astype(np.int64)
+    except (ValueError, TypeError):
+        keys = series.astype(str).to_numpy(dtype=str)
+    keys.sort(kind='stable')
+    return keys, nulls
+
+
+class LiveKeySource:
+    """Ключи из рабочей БД: колонка читается COPY в текстовом формате, версия — pg_stat_user_tables"""
+
+    name = 'live'
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def versions(self, tables):
+        with self.pool.connection() as conn:
+            versions = self.pool.table_versions(conn, tables)
+            conn.commit()
+        return versions
+
+    def load(self, table, column):
+        buffer = io.StringIO()
+        with self.pool.analytics_connection() as conn:
+            with conn.cursor() as cur:
+                cur.copy_expert(f"COPY (SELECT {column} FROM {table}) TO STDOUT", buffer)
+            conn.commit()
+        buffer.seek(0)
+        frame = pd.read_csv(buffer, header=None, names=[column], dtype=str,
+                            na_values=['\\N'], keep_default_na=False, sep='\t', quoting=3)
+        return compact_keys(frame[column])
+
+
+class ParquetKeySource:
+    """
+    Ключи из Parquet-снимков выгрузки (по export_manifest.json): читается только
+    нужная колонка, версия — имя и время изменения файла
+    """
+
+    name = 'parquet'
+
+    def __init__(self, export_dir=None):
+        self.export_dir = Path(export_dir) if export_dir else find_latest_export()
+        if self.export_dir is None:
+            raise FileNotFoundError("Выгрузок с export_manifest.json не найдено (export --base-tables)")
+        self.files = manifest_parquet_files(self.export_dir)
+
+    def _path(self, table):
+        path = self.files.get(table)
+        if path is None:
+            raise FileNotFoundError(f"{table}: снимка нет в {self.export_dir} (export --base-tables)")
+        return path
+
+    def versions(self, tables):
+        return {
+            table: f"{self.files[table].name}:{self.files[table].stat().st_mtime_ns}" if table in self.files else None
+            for table in tables
+        }
+
+    def load(self, table, column):
+        path = self._path(table)
+        # Набор срезов (папка part-*.parquet) читается как один набор
+        column_values = pq.read_table(path, columns=[column]).column(column).to_pandas()
+        return compact_keys(column_values)
+
+
+class KeyArrayCache:
+    """
+    Отсортированные массивы ключей по (источник, таблица, колонка) в памяти и в .npz на диске.
+    Запись действительна, пока не изменилась версия таблицы; invalidate(table) сбрасывает
+    записи таблицы (например, после удаления строк очисткой, когда счетчики
+    pg_stat_user_tables еще не обновились)
+    """
+
+    def __init__(self, cache_dir=DEFAULT_KEY_CACHE_DIR):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._memory = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'loads': 0}
+
+    def _disk_path(self, source_name, table, column):
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"{source_name}.{table}.{column}.npz"
+
+    def get(self, source, table, column, version):
+        """Массив ключей и число NULL: из кеша, если версия совпадает, иначе из источника"""
+        key = (source.name, table, column)
+        entry = self._memory.get(key)
+        if entry is not None and version is not None and entry[0] == version:
+            self.stats['memory_hits'] += 1
+            return entry[1], entry[2]
+
+        path = self._disk_path(source.name, table, column)
+        if version is not None and path is not None and path.exists():
+            try:
+                with np.load(path) as cached:
+                    if str(cached['version']) == version:
+                        entry = (version, cached['keys'], int(cached['nulls']))
+            except Exception as e:
+                logger.warning(f"⚠️ Поврежденный кеш ключей {path.name}: {e}")
+                entry = None
+            if entry is not None and entry[0] == version:
+                self._memory[key] = entry
+                self.stats['disk_hits'] += 1
+                return entry[1], entry[2]
+
+        started = time.perf_counter()
+        keys, nulls = source.load(table, column)
+        self.stats['loads'] += 1
+        logger.info(
+            f"🔑 {table}.{column}: {len(keys):,} ключей ({keys.nbytes / 1024 / 1024:.1f} MB) "
+            f"за {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+        self._memory[key] = (version, keys, nulls)
+        if version is not None and path is not None:
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, version=np.array(version), keys=keys, nulls=np.array(nulls))
+            os.replace(tmp_path, path)
+        return keys, nulls
+
+    def invalidate(self, table):
+        """Сброс кешированных массивов таблицы"""
+        for key in [key for key in self._memory if key[1] == table]:
+            del self._memory[key]
+        if self.cache_dir is not None:
+            for path in self.cache_dir.glob(f"*.{table}.*.npz"):
+                path.unlink(missing_ok=True)
+
+
+def missing_keys(child_keys, parent_keys):
+    """Маска ключей child_keys, которых нет в отсортированном parent_keys (повторы допускаются)"""
+    if len(parent_keys) == 0:
+        return np.ones(len(child_keys), dtype=bool)
+    if child_keys.dtype.kind != parent_keys.dtype.kind:
+        # Целые против строк: сравнение по строковому представлению
+        child_keys, parent_keys = child_keys.astype(str), np.sort(parent_keys.astype(str))
+    position = np.searchsorted(parent_keys, child_keys)
+    position = np.minimum(position, len(parent_keys) - 1)
+    return parent_keys[position] != child_keys
+
+
+class IntegrityChecker:
+    """
+    Проверка связей по массивам ключей.
+
+    Колонки, общие для нескольких связей (orders.order_id для order_items и payments),
+    извлекаются один раз. Дочерний ключ проверяется целиком (все строки), поэтому число
+    нарушений считается по строкам, как в LEFT JOIN ... IS NULL; NULL во внешнем ключе
+    тоже нарушение (отдельно — null_references).
+    """
+
+    def __init__(self, source, relationships=CLEANING_RELATIONSHIPS, cache=None, sample_size=DEFAULT_SAMPLE_SIZE):
+        self.source = source
+        self.relationships = relationships
+        self.cache = cache if cache is not None else KeyArrayCache()
+        self.sample_size = sample_size
+
+    def keys(self, table, column, versions):
+        return self.cache.get(self.source, table, column, versions.get(table))
+
+    def check(self):
+        """Результаты по связям: relationship, invalid_references, null_references, sample_invalid_ids, status"""
+        started = time.perf_counter()
+        tables = {table for relation in self.relationships for table in (relation[0], relation[2])}
+        versions = self.source.versions(tables)
+
+        results = []
+        for child_table, child_column, parent_table, parent_column in self.relationships:
+            check_started = time.perf_counter()
+            child_keys, child_nulls = self.keys(child_table, child_column, versions)
+            parent_keys, _ = self.keys(parent_table, parent_column, versions)
+
+            missing = missing_keys(child_keys, parent_keys)
+            invalid = int(missing.sum()) + child_nulls
+            sample = np.unique(child_keys[missing])[:self.sample_size].tolist()
+            results.append({
+                'relationship': f"{child_table} -> {parent_table}",
+                'foreign_key': f"{child_table}.{child_column} -> {parent_table}.{parent_column}",
+                'child_rows': len(child_keys) + child_nulls,
+                'invalid_references': invalid,
+                'null_references': child_nulls,
+                'sample_invalid_ids': sample,
+                'status': '✅ VALID' if invalid == 0 else '❌ INVALID',
+                'milliseconds': round((time.perf_counter() - check_started) * 1000, 1)
+            })
+        logger.info(
+            f"🔗 Целостность ({self.source.name}): {len(results)} связей за "
+            f"{(time.perf_counter() - started) * 1000:.0f} ms, кеш ключей {self.cache.stats}"
+        )
+        return results
+
+
+if __name__ == "__main__":
+    import json
+    from database import get_pool
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    checker = IntegrityChecker(LiveKeySource(get_pool(application_name='databoard-integrity')))
+    print(json.dumps(checker.check(), indent=2, ensure_ascii=False, default=str))
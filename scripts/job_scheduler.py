@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Планировщик заданий пайплайна: очистка, дневные агрегаты и выгрузка по таблицам
+Задания запускаются по графу зависимостей (очистка раньше выгрузки) в порядке приоритета
+с общим лимитом параллельности и лимитами по таблицам; упавшие задания повторяются
+с экспоненциальной задержкой, advisory lock PostgreSQL не дает двум экземплярам
+планировщика выполнять одно задание одновременно
+"""
+
+import hashlib
+import logging
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from graphlib import CycleError, TopologicalSorter
+
+import psycopg2
+
+from database import get_db_config, get_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PARALLEL = int(os.getenv('SCHEDULER_MAX_PARALLEL', 3))
+# Сколько заданий одновременно читают одну таблицу; задание-писатель (exclusive) занимает таблицу целиком
+DEFAULT_TABLE_CONCURRENCY = int(os.getenv('SCHEDULER_TABLE_CONCURRENCY', 1))
+DEFAULT_MAX_ATTEMPTS = 3
+# Задержка повтора: base * 2^(попытка-1) с разбросом до 10%, не больше MAX_BACKOFF_SECONDS
+DEFAULT_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 900
+# Задание, заблокированное другим экземпляром, проверяется снова через это время
+LOCK_RETRY_SECONDS = 15
+DEFAULT_CYCLE_SECONDS = int(os.getenv('SCHEDULER_CYCLE_SECONDS', 3600))
+ADVISORY_LOCK_PREFIX = 'databoard-job:'
+# Блокировка всей выгрузки (export:prepare → export:finish): папку .partial продолжает только ее владелец
+EXPORT_RUN_LOCK = 'export-run'
+
+CLEANING_TABLES = ['orders', 'order_items', 'customers', 'payments']
+
+
+def advisory_lock_key(job_name):
+    """Ключ pg_advisory_lock задания: знаковое 64-битное число по имени (одинаково у всех экземпляров)"""
+    digest = hashlib.md5((ADVISORY_LOCK_PREFIX + job_name).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+class JobFailed(Exception):
+    """Задание сообщило о неудаче (вернуло False)"""
+
+
+class Job:
+    """
+    Задание планировщика.
+
+    run — вызываемый объект без аргументов (False или исключение — неудача);
+    depends_on — имена заданий, которые должны завершиться успешно раньше;
+    priority — среди готовых заданий первым запускается задание с большим приоритетом;
+    tables — таблицы, которые задание читает или (exclusive) изменяет
+    """
+
+    def __init__(self, name, run, depends_on=(), priority=0, tables=(), exclusive=False,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.name = name
+        self.run = run
+        self.depends_on = list(depends_on)
+        self.priority = priority
+        self.tables = list(tables)
+        self.exclusive = exclusive
+        self.max_attempts = max_attempts
+        self.status = 'pending'
+        self.attempts = 0
+        self.not_before = 0.0
+        self.seconds = 0.0
+        self.error = None
+
+    def result(self):
+        return {
+            'status': self.status,
+            'attempts': self.attempts,
+            'seconds': round(self.seconds, 1),
+            'error': self.error
+        }
+
+
+class JobScheduler:
+    """
+    Выполнение набора заданий в пуле потоков.
+
+    Готово задание, у которого все зависимости успешны и истекла задержка повтора;
+    готовые запускаются по убыванию приоритета, пока есть свободные слоты (max_parallel)
+    и таблицы задания не заняты сверх лимита. Перед запуском берется сессионный
+    pg_try_advisory_lock по имени задания на отдельном соединении планировщика: если
+    задание выполняет другой экземпляр, оно откладывается на LOCK_RETRY_SECONDS.
+    Задание, исчерпавшее попытки, блокирует зависящие от него
+    """
+
+    def __init__(self, pool=None, max_parallel=DEFAULT_MAX_PARALLEL, table_limits=None,
+                 default_table_limit=DEFAULT_TABLE_CONCURRENCY, backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+        self.pool = pool or get_pool(application_name='databoard-scheduler')
+        self.max_parallel = max_parallel
+        self.table_limits = dict(table_limits or {})
+        self.default_table_limit = default_table_limit
+        self.backoff_seconds = backoff_seconds
+        self._lock_conn = None
+        self._readers = {}
+        self._writers = set()
+
+    # --- advisory locks ---
+
+    def _lock_connection(self):
+        """Соединение для advisory lock: блокировки сессионные, поэтому оно живет весь запуск вне пула"""
+        if self._lock_conn is None or self._lock_conn.closed:
+            self._lock_conn = psycopg2.connect(**self.pool.db_config)
+            self._lock_conn.autocommit = True
+        return self._lock_conn
+
+    def _try_lock(self, job):
+        try:
+            with self._lock_connection().cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (advisory_lock_key(job.name),))
+                return cur.fetchone()[0]
+        except psycopg2.Error as e:
+            # Разрыв соединения снимает все его блокировки: без блокировки задание не запускается
+            logger.warning(f"⚠️ Блокировка {job.name} недоступна: {e}")
+            self.close()
+            return False
+
+    def _unlock(self, job):
+        try:
+            with self._lock_connection().cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (advisory_lock_key(job.name),))
+        except psycopg2.Error as e:
+            logger.warning(f"⚠️ Блокировка {job.name} не снята, закрываем соединение: {e}")
+            self.close()
+
+    def close(self):
+        """Закрытие соединения блокировок (снимает оставшиеся блокировки)"""
+        if self._lock_conn is not None and not self._lock_conn.closed:
+            self._lock_conn.close()
+        self._lock_conn = None
+
+    # --- лимиты по таблицам ---
+
+    def _tables_free(self, job):
+        for table in job.tables:
+            if table in self._writers:
+                return False
+            readers = self._readers.get(table, 0)
+            if job.exclusive and readers:
+                return False
+            if readers >= self.table_limits.get(table, self.default_table_limit):
+                return False
+        return True
+
+    def _acquire_tables(self, job):
+        for table in job.tables:
+            self._readers[table] = self._readers.get(table, 0) + 1
+            if job.exclusive:
+                self._writers.add(table)
+
+    def _release_tables(self, job):
+        for table in job.tables:
+            self._readers[table] -= 1
+            if job.exclusive:
+                self._writers.discard(table)
+
+    # --- выполнение ---
+
+    @staticmethod
+    def validate(jobs):
+        """Имена уникальны, зависимости существуют и не образуют цикл"""
+        names = [job.name for job in jobs]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Повторяющиеся имена заданий: {names}")
+        for job in jobs:
+            unknown = set(job.depends_on) - set(names)
+            if unknown:
+                raise ValueError(f"{job.name}: неизвестные зависимости {sorted(unknown)}")
+        try:
+            tuple(TopologicalSorter({job.name: job.depends_on for job in jobs}).static_order())
+        except CycleError as e:
+            raise ValueError(f"Цикл в зависимостях заданий: {e.args[1]}") from e
+
+    def _execute(self, job):
+        """Выполнение в рабочем потоке; исключение возвращается, а не выбрасывается"""
+        started = time.perf_counter()
+        try:
+            if job.run() is False:
+                raise JobFailed(f"{job.name}: задание завершилось неудачей")
+            return None
+        except JobFailed as e:
+            logger.error(f"❌ {e}")
+            return e
+        except SystemExit as e:
+            # Скрипты пайплайна завершают процесс при ошибке (sys.exit в connect_database):
+            # для планировщика это неудача попытки, а не остановка демона
+            logger.error(f"❌ {job.name}: попытка {job.attempts} завершилась sys.exit({e.code})")
+            return JobFailed(f"{job.name}: задание завершилось с кодом {e.code}")
+        except Exception as e:
+            logger.exception(f"❌ {job.name}: попытка {job.attempts} завершилась ошибкой")
+            return e
+        finally:
+            job.seconds += time.perf_counter() - started
+
+    def _retry_delay(self, attempts):
+        delay = min(self.backoff_seconds * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+        return delay + random.uniform(0, delay * 0.1)
+
+    def _update_blocked(self, jobs):
+        by_name = {job.name: job for job in jobs}
+        changed = True
+        while changed:
+            changed = False
+            for job in jobs:
+                if job.status == 'pending' and any(
+                        by_name[dep].status in ('failed', 'blocked') for dep in job.depends_on):
+                    job.status = 'blocked'
+                    job.error = 'не выполнены зависимости'
+                    logger.warning(f"⛔ {job.name}: пропущено, не выполнены зависимости")
+                    changed = True
+
+    def run(self, jobs):
+        """Выполнение заданий до завершения всех; возвращает {имя: результат}"""
+        self.validate(jobs)
+        by_name = {job.name: job for job in jobs}
+        order = {job.name: i for i, job in enumerate(jobs)}
+        started = time.perf_counter()
+        logger.info(f"🗓️ Планировщик: {len(jobs)} заданий, параллельно до {self.max_parallel}")
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='job') as executor:
+            while True:
+                self._update_blocked(jobs)
+                now = time.monotonic()
+                ready = sorted(
+                    (job for job in jobs if job.status == 'pending' and job.not_before <= now
+                     and all(by_name[dep].status == 'succeeded' for dep in job.depends_on)),
+                    key=lambda job: (-job.priority, order[job.name])
+                )
+                for job in ready:
+                    if len(running) >= self.max_parallel:
+                        break
+                    if not self._tables_free(job):
+                        continue
+                    if not self._try_lock(job):
+                        logger.info(f"🔒 {job.name}: выполняется другим экземпляром, повтор через {LOCK_RETRY_SECONDS} s")
+                        job.not_before = now + LOCK_RETRY_SECONDS
+                        continue
+                    self._acquire_tables(job)
+                    job.status = 'running'
+                    job.attempts += 1
+                    logger.info(f"▶️ {job.name} (попытка {job.attempts}/{job.max_attempts}, приоритет {job.priority})")
+                    running[executor.submit(self._execute, job)] = job
+
+                pending = [job for job in jobs if job.status == 'pending']
+                if not running and not pending:
+                    break
+                # Просыпаемся по завершению задания или к ближайшему сроку отложенного
+                waits = [job.not_before - now for job in pending if job.not_before > now]
+                timeout = max(0.1, min(waits)) if waits else None
+                if not running:
+                    time.sleep(timeout or LOCK_RETRY_SECONDS)
+                    continue
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    job = running.pop(future)
+                    self._release_tables(job)
+                    self._unlock(job)
+                    error = future.result()
+                    if error is None:
+                        job.status = 'succeeded'
+                        job.error = None
+                        logger.info(f"✅ {job.name}: выполнено за {job.seconds:.1f} s")
+                    elif job.attempts < job.max_attempts:
+                        delay = self._retry_delay(job.attempts)
+                        job.status = 'pending'
+                        job.error = str(error)
+                        job.not_before = time.monotonic() + delay
+                        logger.warning(f"🔁 {job.name}: повтор через {delay:.0f} s ({error})")
+                    else:
+                        job.status = 'failed'
+                        job.error = str(error)
+                        logger.error(f"❌ {job.name}: попытки исчерпаны ({error})")
+
+        results = {job.name: job.result() for job in jobs}
+        succeeded = sum(result['status'] == 'succeeded' for result in results.values())
+        logger.info(
+            f"🗓️ Планировщик: выполнено {succeeded}/{len(jobs)} заданий за {time.perf_counter() - started:.1f} s"
+        )
+        return results
+
+    def run_forever(self, build_cycle, interval_seconds=DEFAULT_CYCLE_SECONDS, iterations=None):
+        """
+        Демон: build_cycle() возвращает PipelineCycle, его задания выполняются каждые
+        interval_seconds (iterations=None — бесконечно); результат последнего цикла
+        """
+        completed = 0
+        results = {}
+        try:
+            while iterations is None or completed < iterations:
+                started = time.monotonic()
+                cycle = build_cycle()
+                try:
+                    results = self.run(cycle.jobs())
+                except Exception as e:
+                    # Ошибка цикла не останавливает демон
+                    logger.error(f"❌ Цикл планировщика завершился с ошибкой: {e}")
+                finally:
+                    cycle.close()
+                completed += 1
+                if iterations is not None and completed >= iterations:
+                    break
+                time.sleep(max(0.0, interval_seconds - (time.monotonic() - started)))
+        finally:
+            self.close()
+        return results
+
+
+class PipelineCycle:
+    """
+    Задания одного цикла: инкрементальная очистка → дневные агрегаты → выгрузка по таблицам
+    → перенос выгрузки. Таблицы выгрузки — отдельные задания, поэтому упавшая таблица
+    повторяется без повторения остальных; они делят соединение экспортера и выполняются
+    по очереди (ресурс export), параллельно с ними идут задания других видов.
+    Незавершенная выгрузка прошлого цикла продолжается (checkpoint.json). Блокировки
+    заданий снимаются после каждого задания, поэтому на всю выгрузку берется отдельный
+    advisory lock: второй экземпляр не подхватит папку .partial, в которую еще пишет первый
+    """
+
+    def __init__(self, clean=True, rollup=True, export=True, exporter_options=None,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.clean = clean
+        self.rollup = rollup
+        self.export = export
+        self.exporter_options = dict(exporter_options or {})
+        self.max_attempts = max_attempts
+        self.exporter = None
+        self.successful_exports = 0
+        self._export_lock_conn = None
+
+    def run_cleaning(self):
+        from data_cleaning import DataCleaningPipeline
+        pipeline = DataCleaningPipeline(incremental=True)
+        try:
+            pipeline.run_full_pipeline(export_data=False)
+        finally:
+            pipeline.close_database()
+
+    def run_rollup(self):
+        from daily_rollup import DailyRollup
+        DailyRollup().update()
+
+    def prepare_export(self):
+        from export_checkpoint import find_interrupted_export
+        from export_data_artifacts import DataExporter
+        from region_resolver import prepare_region_mapping
+
+        # Повторная попытка: соединение прошлой возвращается, выгрузка продолжается по checkpoint.json
+        self.close_exporter()
+        if not self.lock_export_run():
+            logger.warning("🔒 export:prepare: выгрузку выполняет другой экземпляр планировщика")
+            return False
+        interrupted = find_interrupted_export()
+        output_dir = str(interrupted) if interrupted else f"exported_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.exporter = DataExporter(output_dir, resume=interrupted is not None, **self.exporter_options)
+        if not self.exporter.connect_db():
+            return False
+        prepare_region_mapping(self.exporter.pool)
+
+    def export_table(self, table_name):
+        if not self.exporter.export_table(table_name):
+            return False
+        self.successful_exports += 1
+
+    def finish_export(self):
+        self.exporter.finish_export(self.successful_exports, len(self.exporter.export_plan()))
+        self.close()
+
+    def jobs(self):
+        jobs = []
+        upstream = []
+        if self.clean:
+            jobs.append(Job('clean', self.run_cleaning, priority=100, tables=CLEANING_TABLES, exclusive=True,
+                            max_attempts=self.max_attempts))
+            upstream = ['clean']
+        if self.rollup:
+            jobs.append(Job('rollup', self.run_rollup, depends_on=upstream, priority=80,
+                            tables=['orders', 'order_items'], max_attempts=self.max_attempts))
+            upstream = ['rollup']
+        if not self.export:
+            return jobs
+
+        # Задания выгрузки делят соединение экспортера — ресурс export занимается целиком
+        from export_data_artifacts import export_plan
+        jobs.append(Job('export:prepare', self.prepare_export, depends_on=upstream, priority=60,
+                        tables=['export'], exclusive=True, max_attempts=self.max_attempts))
+        table_jobs = []
+        plan = export_plan(self.exporter_options.get('include_base_tables', False))
+        for position, (_, table_name) in enumerate(plan):
+            name = f"export:{table_name}"
+            table_jobs.append(name)
+            jobs.append(Job(
+                name, lambda table_name=table_name: self.export_table(table_name),
+                depends_on=['export:prepare'], priority=50 - position, tables=['export'], exclusive=True,
+                max_attempts=self.max_attempts
+            ))
+        jobs.append(Job('export:finish', self.finish_export, depends_on=table_jobs, priority=40,
+                        tables=['export'], exclusive=True, max_attempts=self.max_attempts))
+        return jobs
+
+    def lock_export_run(self):
+        """
+        Сессионный pg_try_advisory_lock выгрузки на отдельном соединении; держится до
+        close(). Разрыв соединения (упавший экземпляр) снимает блокировку, и его папку
+        .partial продолжает следующий
+        """
+        if self._export_lock_conn is not None and not self._export_lock_conn.closed:
+            return True
+        conn = psycopg2.connect(**get_db_config('databoard-scheduler'))
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (advisory_lock_key(EXPORT_RUN_LOCK),))
+                locked = cur.fetchone()[0]
+        except Exception:
+            conn.close()
+            raise
+        if not locked:
+            conn.close()
+            return False
+        self._export_lock_conn = conn
+        return True
+
+    def close_exporter(self):
+        """Возврат соединения экспортера в пул (и при незавершенной выгрузке)"""
+        if self.exporter is not None:
+            self.exporter.close_db()
+
+    def close(self):
+        """Конец выгрузки или цикла: соединение экспортера и снятие блокировки выгрузки"""
+        self.close_exporter()
+        if self._export_lock_conn is not None:
+            if not self._export_lock_conn.closed:
+                self._export_lock_conn.close()
+            self._export_lock_conn = None
+
+
+def print_results(results):
+    """Вывод результатов цикла в консоль"""
+    for name, result in results.items():
+        line = f"{name:35} {result['status']:10} попыток {result['attempts']} за {result['seconds']} s"
+        if result['error'] and result['status'] != 'succeeded':
+            line += f" — {result['error']}"
+        print(line)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+    JobScheduler().run_forever(PipelineCycle)
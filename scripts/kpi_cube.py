@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+KPI-куб для дашборда
+Предагрегаты по дате × региону × временному каналу × типу дня × типу клиента × сегменту
+в Parquet (партиция на месяц) и API срезов: AOV, конверсия, доля возвратов за миллисекунды
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from daily_rollup import CURRENT_WATERMARK_QUERY, DEFAULT_LOOKBACK_DAYS, TOUCHED_DAYS_QUERY
+from database import get_pool
+from export_queries import (
+    CUSTOMER_SEGMENT_DIMENSION,
+    CUSTOMER_TYPE_DIMENSION,
+    DAY_TYPE_DIMENSION,
+    REGION_DIMENSION,
+    REGION_JOIN,
+    TIME_CHANNEL_DIMENSION,
+)
+from region_resolver import prepare_region_mapping
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CUBE_DIR = os.getenv('KPI_CUBE_DIR', 'kpi_cube')
+STATE_FILE = 'cube_state.json'
+PARTITION_FILE = 'cube.parquet'
+
+DIMENSIONS = ['region', 'time_channel', 'day_type', 'customer_type', 'segment']
+ADDITIVE_METRICS = [
+    'total_orders', 'paid_orders', 'delivered_orders', 'cancelled_orders', 'returned_orders',
+    'gross_revenue', 'net_revenue', 'units_sold'
+]
+# Производные метрики: (числитель, знаменатель, множитель, знаков после запятой) —
+# формулы как в сводке KPI
+RATIO_METRICS = {
+    'aov': ('net_revenue', 'paid_orders', 1, 2),
+    'payment_conversion_rate': ('paid_orders', 'total_orders', 100, 2),
+    'return_rate': ('returned_orders', 'total_orders', 100, 2),
+    'cancellation_rate': ('cancelled_orders', 'total_orders', 100, 2),
+    'avg_units_per_order': ('units_sold', 'paid_orders', 1, 1),
+}
+DEFAULT_QUERY_METRICS = ('total_orders', 'aov', 'payment_conversion_rate', 'return_rate')
+
+CUBE_PARTITION_QUERY = f"""
+WITH order_totals AS (
+    SELECT
+        o.id,
+        o.customer_id,
+        o.order_date,
+        o.created_at,
+        o.shipping_address,
+        o.status,
+        o.payment_status,
+        COALESCE(SUM(oi.quantity * oi.unit_price), 0) as amount,
+        COALESCE(SUM(oi.quantity), 0) as units
+    FROM orders o
+    LEFT JOIN order_items oi ON o.id = oi.order_id
+    WHERE o.order_date >= %(start_date)s AND o.order_date < %(end_date)s
+    GROUP BY o.id
+),
+customer_totals AS (
+    -- Сегмент по всей истории клиента на момент построения партиции
+    SELECT
+        o.customer_id,
+        COUNT(*) as total_orders,
+        SUM(CASE WHEN o.payment_status = 'paid' THEN
+            (SELECT SUM(oi.quantity * oi.unit_price) FROM order_items oi WHERE oi.order_id = o.id)
+        ELSE 0 END) as total_spent
+    FROM orders o
+    WHERE o.customer_id IN (SELECT customer_id FROM order_totals)
+    GROUP BY o.customer_id
+)
+SELECT
+    o.order_date::date as order_date,
+    {REGION_DIMENSION} as region,
+    {TIME_CHANNEL_DIMENSION} as time_channel,
+    {DAY_TYPE_DIMENSION} as day_type,
+    {CUSTOMER_TYPE_DIMENSION} as customer_type,
+    {CUSTOMER_SEGMENT_DIMENSION} as segment,
+    COUNT(*) as total_orders,
+    COUNT(*) FILTER (WHERE o.payment_status = 'paid') as paid_orders,
+    COUNT(*) FILTER (WHERE o.status = 'delivered') as delivered_orders,
+    COUNT(*) FILTER (WHERE o.status = 'cancelled') as cancelled_orders,
+    COUNT(*) FILTER (WHERE o.status = 'returned') as returned_orders,
+    SUM(o.amount) as gross_revenue,
+    COALESCE(SUM(o.amount) FILTER (WHERE o.payment_status = 'paid'), 0) as net_revenue,
+    SUM(o.units) as units_sold
+FROM order_totals o
+LEFT JOIN customers c ON o.customer_id = c.id
+LEFT JOIN customer_totals om ON o.customer_id = om.customer_id
+{REGION_JOIN}
+GROUP BY 1, 2, 3, 4, 5, 6
+"""
+
+ALL_MONTHS_QUERY = """
+SELECT DISTINCT DATE_TRUNC('month', order_date)::date FROM orders WHERE order_date IS NOT NULL
+"""
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+class KpiCube:
+    """
+    Многомерный куб KPI в колоночном формате.
+
+    Куб хранит только аддитивные метрики (заказы, выручка, единицы), поэтому
+    любой срез получается суммированием строк, а AOV и доли считаются из сумм.
+    Партиция — месяц: при инкрементальной сборке пересобираются только месяцы
+    с днями, затронутыми изменениями после водяной метки (как в daily_rollup.py).
+    Сегмент клиента фиксируется на момент сборки партиции; --full обновляет его везде.
+    """
+
+    def __init__(self, cube_dir=DEFAULT_CUBE_DIR, pool=None, lookback_days=DEFAULT_LOOKBACK_DAYS):
+        self.cube_dir = Path(cube_dir)
+        self._pool = pool
+        self.lookback_days = lookback_days
+        self._frame = None
+        self._frame_version = None
+
+    @property
+    def pool(self):
+        # Пул нужен только для сборки — запросы к кубу работают без БД
+        if self._pool is None:
+            self._pool = get_pool(application_name='databoard-kpi-cube')
+        return self._pool
+
+    def _partition_path(self, month):
+        return self.cube_dir / f"order_month={month:%Y-%m}" / PARTITION_FILE
+
+    def read_state(self):
+        """Состояние куба: водяная метка и список партиций (пустой словарь — куб не собран)"""
+        path = self.cube_dir / STATE_FILE
+        if not path.exists():
+            return {}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_state(self, state):
+        path = self.cube_dir / STATE_FILE
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, path)
+
+    def _months_to_build(self, conn, state, full):
+        with conn.cursor() as cur:
+            if full or not state.get('watermark'):
+                cur.execute(ALL_MONTHS_QUERY)
+                months = {row[0] for row in cur.fetchall()}
+                # Партиции месяцев, где заказов больше нет, будут удалены
+                months.update(date.fromisoformat(m + '-01') for m in state.get('partitions', {}))
+                return sorted(months)
+            cur.execute(TOUCHED_DAYS_QUERY, {'watermark': state['watermark'], 'lookback_days': self.lookback_days})
+            return sorted({_month_start(row[0]) for row in cur.fetchall() if row[0] is not None})
+
+    def _build_partition(self, conn, month):
+        """Агрегация месяца и атомарная замена файла партиции; возвращает число строк"""
+        with conn.cursor() as cur:
+            cur.execute(CUBE_PARTITION_QUERY, {'start_date': month, 'end_date': _next_month(month)})
+            columns = [desc[0] for desc in cur.description]
+            rows = cur.fetchall()
+
+        path = self._partition_path(month)
+        if not rows:
+            if path.exists():
+                path.unlink()
+            return 0
+
+        frame = pd.DataFrame(rows, columns=columns)
+        for col in ('gross_revenue', 'net_revenue'):
+            frame[col] = frame[col].astype('float64')
+        for col in ADDITIVE_METRICS:
+            if col not in ('gross_revenue', 'net_revenue'):
+                frame[col] = frame[col].astype('int32')
+        for col in DIMENSIONS:
+            frame[col] = frame[col].astype('category')
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+        return len(frame)
+
+    def build(self, full=False):
+        """Сборка куба: полная или только затронутых месячных партиций"""
+        started = time.perf_counter()
+        self.cube_dir.mkdir(parents=True, exist_ok=True)
+        state = self.read_state()
+        partitions = dict(state.get('partitions', {}))
+
+        prepare_region_mapping(self.pool)
+        with self.pool.connection() as conn:
+            # Метка снимается до чтения: изменения во время сборки попадут в следующий запуск
+            with conn.cursor() as cur:
+                cur.execute(CURRENT_WATERMARK_QUERY)
+                new_watermark = cur.fetchone()[0]
+
+            months = self._months_to_build(conn, state, full)
+            logger.info(f"🧊 KPI-куб: {len(months)} месячных партиций к сборке")
+            for month in months:
+                rows = self._build_partition(conn, month)
+                key = f"{month:%Y-%m}"
+                if rows:
+                    partitions[key] = {'rows': rows, 'built_at': datetime.now().isoformat()}
+                else:
+                    partitions.pop(key, None)
+                logger.info(f"   {key}: {rows:,} строк")
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        self._write_state({
+            'watermark': new_watermark or state.get('watermark'),
+            'built_at': datetime.now().isoformat(),
+            'dimensions': DIMENSIONS,
+            'metrics': ADDITIVE_METRICS,
+            'partitions': dict(sorted(partitions.items())),
+            'last_build': {'partitions_rebuilt': len(months), 'duration_ms': round(duration_ms, 1)}
+        })
+        self._frame = None
+        logger.info(f"✅ KPI-куб собран: {len(months)} партиций за {duration_ms:.0f} ms")
+        return {'partitions_rebuilt': len(months), 'duration_ms': round(duration_ms, 1)}
+
+    def load(self):
+        """Куб целиком в памяти (перечитывается после пересборки)"""
+        state = self.read_state()
+        if not state:
+            raise FileNotFoundError(f"KPI-куб не собран: {self.cube_dir} (cube build)")
+        if self._frame is not None and self._frame_version == state['built_at']:
+            return self._frame
+
+        tables = [pq.read_table(self._partition_path(date.fromisoformat(month + '-01')))
+                  for month in state['partitions']]
+        if tables:
+            frame = pa.concat_tables(tables).to_pandas()
+        else:
+            frame = pd.DataFrame(columns=['order_date'] + DIMENSIONS + ADDITIVE_METRICS)
+        frame['order_date'] = pd.to_datetime(frame['order_date'])
+        for col in DIMENSIONS:
+            frame[col] = frame[col].astype('category')
+
+        self._frame = frame
+        self._frame_version = state['built_at']
+        return frame
+
+    def query(self, metrics=DEFAULT_QUERY_METRICS, by=(), filters=None, start_date=None, end_date=None):
+        """
+        Срез куба.
+
+        metrics — аддитивные метрики и/или производные (aov, payment_conversion_rate, ...),
+        by — измерения группировки (также order_date и order_month),
+        filters — {измерение: значение или список значений}, период — включительно
+        """
+        frame = self.load()
+        by = list(by)
+        unknown = [m for m in metrics if m not in ADDITIVE_METRICS and m not in RATIO_METRICS]
+        unknown += [d for d in by if d not in DIMENSIONS + ['order_date', 'order_month']]
+        unknown += [d for d in (filters or {}) if d not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Неизвестные метрики или измерения: {', '.join(unknown)}")
+
+        mask = np.ones(len(frame), dtype=bool)
+        if start_date is not None:
+            mask &= (frame['order_date'] >= pd.Timestamp(start_date)).to_numpy()
+        if end_date is not None:
+            mask &= (frame['order_date'] <= pd.Timestamp(end_date)).to_numpy()
+        for dim, value in (filters or {}).items():
+            values = [value] if isinstance(value, str) else list(value)
+            mask &= frame[dim].isin(values).to_numpy()
+        selected = frame if mask.all() else frame[mask]
+
+        if 'order_month' in by:
+            selected = selected.assign(order_month=selected['order_date'].dt.to_period('M').astype(str))
+        if by:
+            result = selected.groupby(by, observed=True, sort=True)[ADDITIVE_METRICS].sum().reset_index()
+        else:
+            result = pd.DataFrame({col: [selected[col].sum()] for col in ADDITIVE_METRICS})
+
+        for metric in metrics:
+            if metric in RATIO_METRICS:
+                numerator, denominator, scale, digits = RATIO_METRICS[metric]
+                num = result[numerator].to_numpy(dtype='float64')
+                den = result[denominator].to_numpy(dtype='float64')
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    result[metric] = np.where(den > 0, np.round(num / den * scale, digits), 0.0)
+        return result[by + list(metrics)]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cube = KpiCube()
+    cube.build()
+    print(cube.query(by=['region']))
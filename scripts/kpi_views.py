@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Материализованные представления KPI
+Создание представлений по определениям KPI, обновление REFRESH ... CONCURRENTLY
+только при изменении исходных таблиц и журнал длительности обновлений
+"""
+
+import json
+import logging
+import time
+from datetime import datetime
+
+from database import get_pool
+from export_queries import KPI_SUMMARY_QUERY
+
+logger = logging.getLogger(__name__)
+
+REFRESH_LOG_TABLE = 'kpi_view_refresh_log'
+DEFAULT_REFRESH_INTERVAL_SECONDS = 300
+
+# Дневные агрегаты KPI: метрики за период считаются суммой по дням без сканирования orders
+KPI_DAILY_QUERY = """
+SELECT
+    o.order_date,
+    COUNT(DISTINCT o.id) as total_orders,
+    COUNT(DISTINCT CASE WHEN o.payment_status = 'paid' THEN o.id END) as paid_orders,
+    COUNT(DISTINCT CASE WHEN o.status = 'delivered' THEN o.id END) as delivered_orders,
+    COUNT(DISTINCT CASE WHEN o.status = 'cancelled' THEN o.id END) as cancelled_orders,
+    COUNT(DISTINCT CASE WHEN o.status = 'returned' THEN o.id END) as returned_orders,
+    COALESCE(SUM(oi.quantity * oi.unit_price), 0) as gross_revenue,
+    COALESCE(SUM(CASE WHEN o.payment_status = 'paid' THEN oi.quantity * oi.unit_price ELSE 0 END), 0) as net_paid_revenue,
+    COALESCE(SUM(oi.quantity), 0) as total_units,
+    COALESCE(SUM(CASE WHEN o.payment_status = 'paid' THEN oi.quantity ELSE 0 END), 0) as paid_units,
+    COUNT(DISTINCT o.customer_id) as unique_customers
+FROM orders o
+LEFT JOIN order_items oi ON o.id = oi.order_id
+WHERE o.order_date IS NOT NULL
+GROUP BY o.order_date
+"""
+
+# Представления KPI: исходные таблицы определяют, когда нужно обновление,
+# уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+KPI_VIEWS = {
+    'mv_kpi_summary': {
+        'description': 'Сводка KPI по всем данным (источник выгрузки kpi_summary)',
+        # report_date — дата последнего обновления; строка одна, поэтому ключ уникален
+        'query': KPI_SUMMARY_QUERY,
+        'unique_key': ['report_date'],
+        'sources': ['orders', 'order_items', 'customers', 'products']
+    },
+    'mv_kpi_daily': {
+        'description': 'Дневные агрегаты заказов, выручки и единиц для KPI за период',
+        'query': KPI_DAILY_QUERY,
+        'unique_key': ['order_date'],
+        'sources': ['orders', 'order_items']
+    }
+}
+
+# KPI за период по дневным агрегатам (формулы как в sql/kpi_calculations.sql)
+PERIOD_KPI_QUERY = """
+WITH current_period AS (
+    SELECT
+        COALESCE(SUM(total_orders), 0) as total_orders,
+        COALESCE(SUM(paid_orders), 0) as paid_orders,
+        COALESCE(SUM(returned_orders), 0) as returned_orders,
+        COALESCE(SUM(cancelled_orders), 0) as cancelled_orders,
+        COALESCE(SUM(gross_revenue), 0) as gross_revenue,
+        COALESCE(SUM(net_paid_revenue), 0) as net_paid_revenue,
+        COALESCE(SUM(total_units), 0) as total_units
+    FROM mv_kpi_daily
+    WHERE order_date BETWEEN %(start_date)s::date AND %(end_date)s::date
+),
+previous_period AS (
+    SELECT COALESCE(SUM(total_orders), 0) as prev_orders
+    FROM mv_kpi_daily
+    WHERE order_date >= %(start_date)s::date - (%(end_date)s::date - %(start_date)s::date)
+      AND order_date < %(start_date)s::date
+)
+SELECT
+    c.*,
+    ROUND(c.total_orders::numeric / GREATEST(%(end_date)s::date - %(start_date)s::date, 1), 2) as avg_orders_per_day,
+    CASE WHEN p.prev_orders > 0
+         THEN ROUND((c.total_orders - p.prev_orders) * 100.0 / p.prev_orders, 2) ELSE 0 END as orders_growth_percent,
+    CASE WHEN c.paid_orders > 0 THEN ROUND(c.net_paid_revenue / c.paid_orders, 2) ELSE 0 END as aov,
+    CASE WHEN c.total_orders > 0 THEN ROUND(c.paid_orders * 100.0 / c.total_orders, 2) ELSE 0 END as payment_conversion_rate,
+    CASE WHEN c.total_orders > 0 THEN ROUND(c.returned_orders * 100.0 / c.total_orders, 2) ELSE 0 END as return_rate,
+    CASE WHEN c.total_orders > 0 THEN ROUND(c.cancelled_orders * 100.0 / c.total_orders, 2) ELSE 0 END as cancellation_rate,
+    %(start_date)s::date as period_start,
+    %(end_date)s::date as period_end
+FROM current_period c, previous_period p
+"""
+
+
+class KpiViewManager:
+    """
+    Создание и обновление материализованных представлений KPI.
+
+    Перед обновлением версии исходных таблиц (DatabasePool.table_versions)
+    сравниваются с версиями, записанными при последнем успешном обновлении.
+    Представление обновляется только при расхождении. Заполненные представления
+    обновляются CONCURRENTLY, поэтому чтение из них не блокируется.
+    Каждое обновление записывается в kpi_view_refresh_log вместе с длительностью.
+    """
+
+    def __init__(self, pool=None, views=None):
+        self.pool = pool or get_pool(application_name='databoard-kpi-views')
+        self.views = views or KPI_VIEWS
+
+    def create_views(self, recreate=False):
+        """Создание журнала обновлений, представлений (WITH NO DATA) и уникальных индексов"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {REFRESH_LOG_TABLE} (
+                        id SERIAL PRIMARY KEY,
+                        view_name TEXT NOT NULL,
+                        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        duration_ms NUMERIC(12, 1) NOT NULL,
+                        concurrent BOOLEAN NOT NULL,
+                        row_count BIGINT,
+                        source_versions JSONB
+                    )
+                """)
+                cur.execute(
+                    f"CREATE INDEX IF NOT EXISTS {REFRESH_LOG_TABLE}_view_idx "
+                    f"ON {REFRESH_LOG_TABLE} (view_name, refreshed_at DESC)"
+                )
+
+                for name, view in self.views.items():
+                    if recreate:
+                        cur.execute(f"DROP MATERIALIZED VIEW IF EXISTS {name}")
+                    # Данные заполняются первым обновлением, чтобы создание было мгновенным
+                    cur.execute(
+                        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {view['query']} WITH NO DATA"
+                    )
+                    cur.execute(
+                        f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key "
+                        f"ON {name} ({', '.join(view['unique_key'])})"
+                    )
+                    logger.info(f"✅ Представление готово: {name}")
+            conn.commit()
+
+    def _last_versions(self, conn):
+        """Версии исходных таблиц на момент последнего обновления каждого представления"""
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT DISTINCT ON (view_name) view_name, source_versions
+                FROM {REFRESH_LOG_TABLE}
+                ORDER BY view_name, refreshed_at DESC
+            """)
+            return {name: versions for name, versions in cur.fetchall()}
+
+    def _is_populated(self, conn, name):
+        """Заполнено ли представление (CONCURRENTLY недоступно до первого обновления)"""
+        with conn.cursor() as cur:
+            cur.execute("SELECT ispopulated FROM pg_matviews WHERE matviewname = %s", (name,))
+            row = cur.fetchone()
+        if row is None:
+            raise ValueError(f"Представление {name} не создано (kpi-views create)")
+        return row[0]
+
+    def refresh_view(self, conn, name, source_versions):
+        """Обновление одного представления с записью в журнал; возвращает длительность, мс"""
+        concurrent = self._is_populated(conn, name)
+        mode = 'CONCURRENTLY ' if concurrent else ''
+
+        started = time.perf_counter()
+        with conn.cursor() as cur:
+            cur.execute(f"REFRESH MATERIALIZED VIEW {mode}{name}")
+            duration_ms = (time.perf_counter() - started) * 1000
+
+            cur.execute(f"SELECT COUNT(*) FROM {name}")
+            row_count = cur.fetchone()[0]
+            # Запись в журнал в той же транзакции: версии фиксируются только при успехе
+            cur.execute(
+                f"""
+                INSERT INTO {REFRESH_LOG_TABLE}
+                    (view_name, duration_ms, concurrent, row_count, source_versions)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (name, round(duration_ms, 1), concurrent, row_count, json.dumps(source_versions))
+            )
+        conn.commit()
+
+        logger.info(
+            f"🔄 {name}: обновлено за {duration_ms:.0f} ms "
+            f"({'CONCURRENTLY' if concurrent else 'первичное заполнение'}, {row_count:,} строк)"
+        )
+        return duration_ms
+
+    def refresh_stale(self, force=False):
+        """
+        Обновление представлений, исходные таблицы которых изменились.
+        Возвращает {имя представления: длительность в мс или None, если обновление не нужно}
+        """
+        results = {}
+        with self.pool.connection() as conn:
+            last_versions = self._last_versions(conn)
+            # Версии снимаются до обновления: изменения во время REFRESH вызовут следующее
+            current = self.pool.table_versions(
+                conn, {table for view in self.views.values() for table in view['sources']}
+            )
+            conn.commit()
+
+            for name, view in self.views.items():
+                versions = {table: current[table] for table in view['sources']}
+                if not force and last_versions.get(name) == versions and self._is_populated(conn, name):
+                    logger.info(f"⏭️ {name}: исходные таблицы не менялись")
+                    results[name] = None
+                    continue
+                try:
+                    results[name] = self.refresh_view(conn, name, versions)
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"❌ Ошибка обновления {name}: {e}")
+                    raise
+        return results
+
+    def run_scheduler(self, interval_seconds=DEFAULT_REFRESH_INTERVAL_SECONDS, iterations=None):
+        """Периодическая проверка и обновление представлений (iterations=None — бесконечно)"""
+        logger.info(f"⏰ Планировщик обновления KPI представлений: каждые {interval_seconds} с")
+        completed = 0
+        while iterations is None or completed < iterations:
+            started = time.monotonic()
+            try:
+                self.refresh_stale()
+            except Exception as e:
+                # Ошибка одного цикла не останавливает планировщик
+                logger.error(f"❌ Цикл обновления завершился с ошибкой: {e}")
+            completed += 1
+            if iterations is not None and completed >= iterations:
+                break
+            time.sleep(max(0.0, interval_seconds - (time.monotonic() - started)))
+
+    def refresh_history(self, limit=20):
+        """Последние записи журнала обновлений"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT view_name, refreshed_at, duration_ms, concurrent, row_count
+                    FROM {REFRESH_LOG_TABLE}
+                    ORDER BY refreshed_at DESC
+                    LIMIT %s
+                    """,
+                    (limit,)
+                )
+                return cur.fetchall()
+
+    def period_kpis(self, start_date, end_date):
+        """KPI за период по mv_kpi_daily (без сканирования orders и order_items)"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(PERIOD_KPI_QUERY, {'start_date': str(start_date), 'end_date': str(end_date)})
+                columns = [desc[0] for desc in cur.description]
+                return dict(zip(columns, cur.fetchone()))
+
+
+def print_refresh_history(manager, limit=20):
+    """Вывод журнала обновлений в консоль"""
+    print("📋 ЖУРНАЛ ОБНОВЛЕНИЙ KPI ПРЕДСТАВЛЕНИЙ")
+    print("=" * 80)
+    for view_name, refreshed_at, duration_ms, concurrent, row_count in manager.refresh_history(limit):
+        mode = 'CONCURRENTLY' if concurrent else 'полное'
+        when = refreshed_at.strftime('%Y-%m-%d %H:%M:%S') if isinstance(refreshed_at, datetime) else refreshed_at
+        print(f"{when} | {view_name:20} | {float(duration_ms):>10.0f} ms | {mode:12} | {row_count:,} строк")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    manager = KpiViewManager()
+    manager.create_views()
+    manager.refresh_stale()
+    print_refresh_history(manager)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Локальный слой аналитических запросов по выгруженным Parquet
+Таблицы последнего экспорта (export_manifest.json) регистрируются во встроенном
+DuckDB, выражения из sql/ выполняются по ним без обращения к рабочей БД
+"""
+
+import logging
+import statistics
+import time
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+from export_manifest import (
+    DEFAULT_EXPORT_ROOT, MANIFEST_NAME, find_latest_export, manifest_parquet_files, read_manifest
+)
+from sql_library import SqlLibrary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BENCHMARK_RUNS = 3
+
+
+class LocalAnalytics:
+    """
+    Встроенный DuckDB поверх выгруженных Parquet.
+
+    Каждая таблица манифеста становится представлением с тем же именем
+    (customers_analytics, kpi_summary, ...; снимки базовых таблиц из
+    'export --base-tables' — orders, order_items, ...). Данные читаются из файлов
+    при выполнении запроса, в память целиком не загружаются.
+    """
+
+    def __init__(self, export_dir=None, library=None, threads=None):
+        self.export_dir = Path(export_dir) if export_dir else find_latest_export()
+        if self.export_dir is None:
+            raise FileNotFoundError(f"Не найдено выгрузок с {MANIFEST_NAME} в {Path(DEFAULT_EXPORT_ROOT).absolute()}")
+        self.manifest = read_manifest(self.export_dir)
+        self.library = library or SqlLibrary()
+
+        self.con = duckdb.connect(database=':memory:')
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)}")
+        self.tables = {}
+        self.register_tables()
+
+    def register_tables(self):
+        """Регистрация Parquet-файлов манифеста как представлений"""
+        for table, path in manifest_parquet_files(self.export_dir, self.manifest).items():
+            # Parquet-набор параллельной выгрузки (export --sharded) — папка с файлами срезов
+            source = path.absolute() / '*.parquet' if path.is_dir() else path.absolute()
+            literal = str(source).replace("'", "''")
+            self.con.execute(f'CREATE OR REPLACE VIEW "{table}" AS SELECT * FROM read_parquet(\'{literal}\')')
+            self.tables[table] = path
+        logger.info(
+            f"🦆 Экспорт {self.export_dir.name} ({self.manifest.get('export_timestamp', '?')}): "
+            f"{len(self.tables)} таблиц — {', '.join(self.tables)}"
+        )
+
+    def query(self, sql, params=None):
+        """Произвольный запрос к локальным таблицам в виде DataFrame"""
+        return self.con.execute(sql, list(params or [])).fetchdf()
+
+    def missing_tables(self, name):
+        """Таблицы выражения, которых нет в выгрузке"""
+        return [table for table in self.library.get(name).tables if table not in self.tables]
+
+    def available_statements(self):
+        """Выражения библиотеки, все таблицы которых есть в выгрузке"""
+        return [name for name in self.library.names() if not self.missing_tables(name)]
+
+    def run(self, name, params=None):
+        """Результат выражения из sql/ по локальным таблицам"""
+        statement = self.library.get(name)
+        missing = self.missing_tables(name)
+        if missing:
+            raise ValueError(f"{name}: нет в выгрузке таблиц {', '.join(missing)}")
+
+        started = time.perf_counter()
+        frame = self.con.execute(statement.positional_sql, list(statement.bind(params))).fetchdf()
+        logger.info(f"🦆 {name}: {len(frame):,} строк за {(time.perf_counter() - started) * 1000:.0f} ms")
+        return frame
+
+    def close(self):
+        self.con.close()
+
+
+def _median_ms(func, runs):
+    """Медиана времени выполнения func и результат последнего запуска"""
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def benchmark(local, names=None, params=None, runs=DEFAULT_BENCHMARK_RUNS, pool=None):
+    """
+    Сравнение задержки выражений: DuckDB по Parquet против PostgreSQL.
+
+    Оба пути выполняются runs раз, в отчет идет медиана. На стороне PostgreSQL
+    кеш результатов SqlRunner не используется. Выражения без нужных таблиц
+    в выгрузке и завершившиеся ошибкой попадают в отчет со статусом.
+    """
+    from database import get_pool
+
+    pool = pool or get_pool(application_name='databoard-local-benchmark')
+    params = params or {}
+    rows = []
+    for name in names or local.library.names():
+        statement = local.library.get(name)
+        statement_params = {k: v for k, v in params.items() if k in statement.parameters}
+        row = {'statement': name}
+
+        missing = local.missing_tables(name)
+        if missing:
+            row['status'] = f"нет таблиц: {', '.join(missing)}"
+            rows.append(row)
+            continue
+
+        try:
+            row['local_ms'], frame = _median_ms(lambda: local.run(name, statement_params), runs)
+            row['local_rows'] = len(frame)
+
+            values = statement.bind(statement_params)
+            with pool.connection() as conn:
+                def fetch():
+                    result = pool.fetch_prepared(conn, statement.positional_sql, values)
+                    conn.commit()
+                    return result
+                row['postgres_ms'], (_, pg_rows) = _median_ms(fetch, runs)
+            row['postgres_rows'] = len(pg_rows)
+            row['speedup'] = round(row['postgres_ms'] / row['local_ms'], 1) if row['local_ms'] else None
+            row['status'] = 'ok'
+        except Exception as e:
+            row['status'] = f"ошибка: {str(e).splitlines()[0]}"
+            logger.warning(f"⚠️ {name}: {e}")
+        rows.append(row)
+
+    columns = ['statement', 'local_ms', 'postgres_ms', 'speedup', 'local_rows', 'postgres_rows', 'status']
+    report = pd.DataFrame(rows, columns=columns)
+    for col in ('local_ms', 'postgres_ms'):
+        report[col] = report[col].round(1)
+    for col in ('local_rows', 'postgres_rows'):
+        report[col] = report[col].astype('Int64')
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    local = LocalAnalytics()
+    print(benchmark(local, names=local.available_statements()).to_string(index=False))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Подбор настроек Parquet для каждой выгружаемой таблицы
+На выборке таблицы перебираются кодеки, словарное кодирование и размер row group;
+замеряются скорость записи, чтения и размер, выбранный профиль сохраняется
+и применяется при следующих выгрузках
+"""
+
+import io
+import json
+import logging
+import os
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from export_manifest import find_latest_export, manifest_parquet_files
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILES_FILE = os.getenv(
+    'PARQUET_PROFILES_FILE', str(Path(__file__).resolve().parent / 'parquet_profiles.json')
+)
+DEFAULT_SAMPLE_ROWS = 200000
+DEFAULT_REPEATS = 3
+
+# Настройки, с которыми писались все таблицы до подбора
+DEFAULT_PARQUET_OPTIONS = {
+    'compression': 'snappy',
+    'compression_level': None,
+    'use_dictionary': True,
+    'row_group_size': None
+}
+
+CODEC_CANDIDATES = [
+    ('snappy', None),
+    ('lz4', None),
+    ('zstd', 1),
+    ('zstd', 3),
+    ('zstd', 9),
+]
+ROW_GROUP_CANDIDATES = [65536, 262144, 1048576]
+
+# Вес критериев: файлы читаются чаще, чем пишутся, размер важен для хранения и передачи
+DEFAULT_WEIGHTS = {'size': 0.5, 'read': 0.35, 'write': 0.15}
+
+
+def load_profiles(path=DEFAULT_PROFILES_FILE):
+    """Сохраненные профили {table_name: профиль} (пустой словарь, если подбора не было)"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Профили Parquet не прочитаны ({path}): {e}")
+        return {}
+
+
+def parquet_options(profiles, table_name):
+    """Настройки записи для таблицы: сохраненный профиль или настройки по умолчанию"""
+    profile = profiles.get(table_name)
+    if not profile:
+        return dict(DEFAULT_PARQUET_OPTIONS)
+    return {key: profile.get(key, default) for key, default in DEFAULT_PARQUET_OPTIONS.items()}
+
+
+def _measure(table, options, repeats):
+    """Медианы времени записи/чтения (мс) и размер файла для одного набора настроек"""
+    write_times, read_times = [], []
+    payload = b''
+    for _ in range(repeats):
+        sink = io.BytesIO()
+        started = time.perf_counter()
+        pq.write_table(
+            table, sink,
+            compression=options['compression'],
+            compression_level=options['compression_level'],
+            use_dictionary=options['use_dictionary'],
+            row_group_size=options['row_group_size']
+        )
+        write_times.append((time.perf_counter() - started) * 1000)
+        payload = sink.getvalue()
+
+        started = time.perf_counter()
+        pq.read_table(pa.BufferReader(payload))
+        read_times.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'write_ms': round(statistics.median(write_times), 2),
+        'read_ms': round(statistics.median(read_times), 2),
+        'size_bytes': len(payload)
+    }
+
+
+class ParquetTuner:
+    """
+    Подбор профиля Parquet по выборке таблицы.
+
+    Сначала перебираются кодеки со словарным кодированием и без него при
+    размере row group по умолчанию, затем для лучшей пары — размеры row group.
+    Каждый вариант сравнивается с настройками по умолчанию (snappy): оценка —
+    взвешенная сумма отношений размера, времени чтения и записи, меньше — лучше.
+    """
+
+    def __init__(self, profiles_path=DEFAULT_PROFILES_FILE, weights=None, repeats=DEFAULT_REPEATS):
+        self.profiles_path = profiles_path
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.repeats = repeats
+        self.profiles = load_profiles(profiles_path)
+
+    def _score(self, metrics, baseline):
+        return sum(
+            weight * metrics[key] / max(baseline[key], 1e-9)
+            for weight, key in (
+                (self.weights['size'], 'size_bytes'),
+                (self.weights['read'], 'read_ms'),
+                (self.weights['write'], 'write_ms'),
+            )
+        )
+
+    def _evaluate(self, table, options, baseline, results):
+        metrics = _measure(table, options, self.repeats)
+        candidate = {**options, **metrics}
+        candidate['score'] = round(self._score(metrics, baseline), 4)
+        results.append(candidate)
+        return candidate
+
+    def tune_table(self, table_name, table):
+        """Подбор профиля по выборке (pyarrow.Table); профиль запоминается, но не сохраняется"""
+        if not isinstance(table, pa.Table):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        started = time.perf_counter()
+        results = []
+
+        # Прогрев: первая запись и чтение заметно медленнее и исказили бы базовую линию
+        _measure(table, DEFAULT_PARQUET_OPTIONS, 1)
+        baseline = _measure(table, DEFAULT_PARQUET_OPTIONS, self.repeats)
+        for compression, level in CODEC_CANDIDATES:
+            for use_dictionary in (True, False):
+                options = dict(DEFAULT_PARQUET_OPTIONS, compression=compression,
+                               compression_level=level, use_dictionary=use_dictionary)
+                self._evaluate(table, options, baseline, results)
+
+        best = min(results, key=lambda c: c['score'])
+        for row_group_size in ROW_GROUP_CANDIDATES:
+            options = {key: best[key] for key in DEFAULT_PARQUET_OPTIONS}
+            options['row_group_size'] = row_group_size
+            self._evaluate(table, options, baseline, results)
+        best = min(results, key=lambda c: c['score'])
+
+        profile = {key: best[key] for key in DEFAULT_PARQUET_OPTIONS}
+        profile.update({
+            'tuned_at': datetime.now().isoformat(),
+            'sample_rows': table.num_rows,
+            'metrics': {key: best[key] for key in ('write_ms', 'read_ms', 'size_bytes', 'score')},
+            'baseline': baseline,
+            'candidates': sorted(results, key=lambda c: c['score'])[:5]
+        })
+        self.profiles[table_name] = profile
+
+        level = f" (уровень {profile['compression_level']})" if profile['compression_level'] else ''
+        logger.info(
+            f"🎛️ {table_name}: {profile['compression']}{level}, словарь {'да' if profile['use_dictionary'] else 'нет'}, "
+            f"row group {profile['row_group_size'] or 'по умолчанию'} — размер "
+            f"{best['size_bytes'] / max(baseline['size_bytes'], 1):.0%}, чтение {best['read_ms'] / max(baseline['read_ms'], 1e-9):.0%} "
+            f"от snappy ({len(results)} вариантов за {time.perf_counter() - started:.1f} s)"
+        )
+        return profile
+
+    def save(self):
+        """Запись профилей в JSON (через временный файл)"""
+        path = Path(self.profiles_path)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.profiles, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, path)
+        logger.info(f"💾 Профили Parquet сохранены: {path}")
+
+
+def sample_parquet(path, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """
+    Выборка из готового Parquet-файла: row group'ы, равномерно распределенные
+    по файлу (первые строки отсортированной выгрузки нерепрезентативны).
+    Для Parquet-набора (папки срезов) выборка делится между файлами поровну
+    """
+    path = Path(path)
+    if path.is_dir():
+        parts = sorted(path.glob('*.parquet'))
+        return pa.concat_tables([sample_parquet(part, max(1, sample_rows // len(parts))) for part in parts])
+    parquet_file = pq.ParquetFile(path)
+    if parquet_file.metadata.num_rows <= sample_rows:
+        return parquet_file.read()
+
+    groups = parquet_file.num_row_groups
+    rows_per_group = parquet_file.metadata.num_rows / groups
+    needed = max(1, min(groups, round(sample_rows / rows_per_group)))
+    indices = sorted({int(i * groups / needed) for i in range(needed)})
+    table = parquet_file.read_row_groups(indices)
+    return table.slice(0, sample_rows)
+
+
+def tune_export(export_dir=None, table_names=None, sample_rows=DEFAULT_SAMPLE_ROWS, tuner=None):
+    """Подбор профилей по Parquet-файлам выгрузки (по умолчанию последней) и сохранение"""
+    export_dir = export_dir or find_latest_export()
+    if export_dir is None:
+        raise FileNotFoundError("Нет выгрузки для подбора: сначала выполните export")
+    tuner = tuner or ParquetTuner()
+    files = manifest_parquet_files(export_dir)
+    for table_name in table_names or files:
+        if table_name not in files:
+            logger.warning(f"⚠️ {table_name}: нет в выгрузке {export_dir}")
+            continue
+        tuner.tune_table(table_name, sample_parquet(files[table_name], sample_rows))
+    tuner.save()
+    return tuner.profiles
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    tune_export()
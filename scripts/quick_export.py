@@ -4,26 +4,15 @@
 Упрощенная версия для быстрого получения данных
 """
 
-import pandas as pd
-import psycopg2
-import os
 from datetime import datetime
-from dotenv import load_dotenv
 
-# Загрузка переменных окружения
-load_dotenv()
-
-# Конфигурация БД
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', '103.246.146.132'),
-    'port': os.getenv('DB_PORT', 5432),
-    'database': os.getenv('DB_NAME', 'hackathon'),
-    'user': os.getenv('DB_USER', 'user_db'),
-    'password': os.getenv('DB_PASSWORD', 'psql14182025')
-}
+from database import get_pool
 
 def export_table(conn, table_name, query=None):
     """Экспорт таблицы в CSV"""
+    # pandas импортируется лениво, чтобы не замедлять запуск скрипта
+    import pandas as pd
+    
     if query is None:
         query = f"SELECT * FROM {table_name}"
     
@@ -51,9 +40,12 @@ def main():
     print("🚀 Быстрый экспорт основных таблиц")
     print("=" * 40)
     
+    pool = None
+    conn = None
     try:
         # Подключение к БД
-        conn = psycopg2.connect(**DB_CONFIG)
+        pool = get_pool(application_name='databoard-quick-export')
+        conn = pool.getconn()
         print("✅ Подключение к БД установлено")
         
         # Список таблиц для экспорта
@@ -76,9 +68,9 @@ def main():
     except Exception as e:
         print(f"❌ Ошибка: {e}")
     finally:
-        if 'conn' in locals():
-            conn.close()
-            print("🔌 Соединение с БД закрыто")
+        if conn is not None:
+            pool.putconn(conn)
+            print("🔌 Соединение с БД возвращено в пул")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Определение региона заказа по адресу доставки
+Адреса сопоставляются с городами один раз (многошаблонный поиск по настраиваемым
+псевдонимам), результат хранится в address_regions по md5 адреса, выгрузки делают JOIN
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from pathlib import Path
+
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+MAPPING_TABLE = 'address_regions'
+DEFAULT_ALIASES_FILE = os.getenv(
+    'REGION_ALIASES_FILE', str(Path(__file__).resolve().parent / 'region_aliases.json')
+)
+DEFAULT_BATCH_SIZE = 10000
+
+# Адреса, которых еще нет в справочнике для текущей версии правил
+UNRESOLVED_ADDRESSES_QUERY = f"""
+SELECT DISTINCT o.shipping_address::text
+FROM orders o
+WHERE o.shipping_address IS NOT NULL
+  AND NOT EXISTS (
+      SELECT 1 FROM {MAPPING_TABLE} ar
+      WHERE ar.address_hash = md5(o.shipping_address::text)
+        AND ar.rules_version = %s
+  )
+"""
+
+
+def address_hash(address):
+    """Ключ справочника — md5 исходного текста адреса (совпадает с md5() в PostgreSQL)"""
+    return hashlib.md5(address.encode('utf-8')).hexdigest()
+
+
+def normalize_address(address):
+    """Нормализация для сопоставления: регистр, ё → е, пробелы"""
+    return re.sub(r'\s+', ' ', address.lower().replace('ё', 'е')).strip()
+
+
+def load_aliases(path=DEFAULT_ALIASES_FILE):
+    """Конфигурация псевдонимов городов (порядок регионов — приоритет совпадений)"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class RegionMatcher:
+    """
+    Многошаблонный поиск городов в адресе.
+
+    Все псевдонимы объединены в одно регулярное выражение, поэтому адрес
+    просматривается один раз. Если в адресе несколько городов, выигрывает
+    регион, стоящий выше в конфигурации (как порядок WHEN в прежнем CASE).
+    Псевдоним должен стоять отдельным словом: «Омск» не совпадает с «Томск».
+    """
+
+    def __init__(self, config=None):
+        config = config or load_aliases()
+        self.default_region = config['default_region']
+        self.version = hashlib.md5(
+            json.dumps(config, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:12]
+
+        self._aliases = {}
+        for priority, entry in enumerate(config['regions']):
+            for alias in entry['aliases']:
+                self._aliases.setdefault(normalize_address(alias), (priority, entry['region']))
+
+        # Длинные псевдонимы первыми: «ростов-на-дону» раньше «ростов»
+        alternatives = sorted(self._aliases, key=len, reverse=True)
+        self._pattern = re.compile(
+            r'(?<!\w)(?:' + '|'.join(re.escape(alias) for alias in alternatives) + r')(?!\w)'
+        )
+
+    def resolve(self, address):
+        """Регион для адреса (default_region, если город не найден)"""
+        if not address:
+            return self.default_region
+        best = None
+        for match in self._pattern.finditer(normalize_address(address)):
+            candidate = self._aliases[match.group(0)]
+            if best is None or candidate[0] < best[0]:
+                best = candidate
+                if best[0] == 0:
+                    break
+        return best[1] if best else self.default_region
+
+
+class RegionResolver:
+    """
+    Этап пайплайна: пополнение справочника address_regions.
+
+    Сопоставляются только адреса, которых нет в справочнике (новые или
+    измененные — у измененного адреса другой md5). При изменении конфигурации
+    псевдонимов меняется версия правил и все адреса сопоставляются заново.
+    """
+
+    def __init__(self, pool=None, matcher=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.pool = pool or get_pool(application_name='databoard-regions')
+        self.matcher = matcher or RegionMatcher()
+        self.batch_size = batch_size
+        # Кеш процесса: md5 адреса → регион
+        self._cache = {}
+
+    def ensure_table(self, conn):
+        """Создание справочника адресов"""
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {MAPPING_TABLE} (
+                    address_hash CHAR(32) PRIMARY KEY,
+                    region TEXT NOT NULL,
+                    rules_version TEXT NOT NULL,
+                    resolved_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+        conn.commit()
+
+    def resolve_address(self, address):
+        """Регион для одного адреса с кешированием по md5"""
+        key = address_hash(address)
+        region = self._cache.get(key)
+        if region is None:
+            region = self.matcher.resolve(address)
+            self._cache[key] = region
+        return key, region
+
+    def _store(self, conn, resolved):
+        hashes = [key for key, _ in resolved]
+        regions = [region for _, region in resolved]
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO {MAPPING_TABLE} (address_hash, region, rules_version, resolved_at)
+                SELECT address_hash, region, %s, NOW()
+                FROM unnest(%s::text[], %s::text[]) AS t(address_hash, region)
+                ON CONFLICT (address_hash) DO UPDATE SET
+                    region = EXCLUDED.region,
+                    rules_version = EXCLUDED.rules_version,
+                    resolved_at = EXCLUDED.resolved_at
+                """,
+                (self.matcher.version, hashes, regions)
+            )
+        conn.commit()
+
+    def resolve_new(self):
+        """Сопоставление новых адресов; возвращает статистику запуска"""
+        started = time.perf_counter()
+        regions = Counter()
+        with self.pool.connection() as conn:
+            self.ensure_table(conn)
+            with conn.cursor() as cur:
+                cur.execute(UNRESOLVED_ADDRESSES_QUERY, (self.matcher.version,))
+                addresses = [row[0] for row in cur.fetchall()]
+            conn.commit()
+
+            for i in range(0, len(addresses), self.batch_size):
+                resolved = [self.resolve_address(address) for address in addresses[i:i + self.batch_size]]
+                regions.update(region for _, region in resolved)
+                self._store(conn, resolved)
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        if addresses:
+            logger.info(f"🗺️ Регионы: сопоставлено {len(addresses):,} новых адресов за {duration_ms:.0f} ms")
+        else:
+            logger.info("🗺️ Регионы: новых адресов нет")
+        return {
+            'addresses_resolved': len(addresses),
+            'rules_version': self.matcher.version,
+            'regions': dict(regions.most_common()),
+            'duration_ms': round(duration_ms, 1)
+        }
+
+
+def prepare_region_mapping(pool=None):
+    """Запуск этапа перед выгрузками; ошибка не прерывает экспорт"""
+    try:
+        return RegionResolver(pool=pool).resolve_new()
+    except Exception as e:
+        logger.warning(f"⚠️ Справочник регионов не обновлен: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(RegionResolver().resolve_new())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Параллельная выгрузка крупной таблицы срезами первичного ключа
+Диапазон ключа делится на N срезов (по гистограмме pg_stats или min/max), каждый срез
+читается своим соединением в одном снимке данных (pg_export_snapshot) и пишется
+отдельным файлом одного Parquet-набора
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import psycopg2.extras
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from artifact_writer import arrow_type_for_pg
+from database import ANALYTICS_WORK_MEM
+from parquet_tuning import DEFAULT_PARQUET_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARDS = int(os.getenv('EXPORT_SHARDS', 4))
+# Строк за одно обращение к серверному курсору среза
+SHARD_FETCH_ROWS = 50000
+# Соединения пула: координатор снимка, основное соединение экспорта и хотя бы один срез
+MIN_POOL_CONNECTIONS = 3
+
+HISTOGRAM_BOUNDS_QUERY = """
+SELECT histogram_bounds::text
+FROM pg_stats
+WHERE schemaname = current_schema() AND tablename = %s AND attname = %s
+"""
+PG_TYPE_NAMES_QUERY = "SELECT oid, typname FROM pg_type WHERE oid = ANY(%s)"
+
+
+def histogram_bounds(conn, table, column):
+    """Границы гистограммы pg_stats для целочисленного ключа (пусто, если ANALYZE не было)"""
+    with conn.cursor() as cur:
+        cur.execute(HISTOGRAM_BOUNDS_QUERY, (table, column))
+        row = cur.fetchone()
+    if not row or not row[0]:
+        return []
+    try:
+        return [int(value) for value in row[0].strip('{}').split(',')]
+    except ValueError:
+        return []
+
+
+def shard_bounds(conn, table, column, shards):
+    """
+    Срезы ключа [(key_from, key_to)] — полуинтервалы (key_from, key_to], у первого key_from = NULL.
+
+    Внутренние границы берутся из гистограммы pg_stats (равные по числу строк срезы
+    при неравномерном ключе), без статистики — равными отрезками между min и max.
+    Верхняя граница последнего среза — текущий max, поэтому строки, добавленные
+    после ANALYZE, тоже попадают в выгрузку. Возвращает (срезы, способ разбиения).
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT min({column}), max({column}) FROM {table}")
+        low, high = cur.fetchone()
+    if high is None:
+        return [], 'empty'
+    if not isinstance(high, int):
+        raise ValueError(f"{table}.{column}: срезы поддерживаются только для целочисленного ключа")
+
+    histogram = histogram_bounds(conn, table, column)
+    if len(histogram) > shards:
+        method = 'pg_stats'
+        inner = [histogram[round(i * (len(histogram) - 1) / shards)] for i in range(1, shards)]
+    else:
+        method = 'min/max'
+        inner = [low + (high - low) * i // shards for i in range(1, shards)]
+    cuts = sorted({bound for bound in inner if low <= bound < high})
+    edges = [None] + cuts + [high]
+    return list(zip(edges[:-1], edges[1:])), method
+
+
+def result_schema(conn, query):
+    """
+    Схема Arrow результата запроса среза по типам колонок PostgreSQL.
+
+    Общая схема нужна, чтобы файлы всех срезов совпадали: по данным одного среза
+    тип не выводится (колонка целиком NULL, целые с NULL в pandas — float).
+    Несопоставленные типы пишутся текстом.
+    """
+    with conn.cursor() as cur:
+        # key_to = NULL: запрос планируется и возвращает описание колонок без строк
+        cur.execute(query, {'key_from': None, 'key_to': None})
+        description = cur.description
+        cur.execute(PG_TYPE_NAMES_QUERY, (list({column.type_code for column in description}),))
+        type_names = dict(cur.fetchall())
+    return pa.schema([
+        pa.field(column.name, arrow_type_for_pg(type_names.get(column.type_code)) or pa.string())
+        for column in description
+    ])
+
+
+def _text_columns(schema):
+    return [field.name for field in schema if pa.types.is_string(field.type)]
+
+
+def extract_shard(pool, snapshot_id, query, key_from, key_to, part_path, schema,
+                  parquet_options=None, fetch_rows=SHARD_FETCH_ROWS):
+    """
+    Выгрузка одного среза в Parquet-файл своим соединением в снимке snapshot_id.
+    Строки читаются серверным курсором, файл пишется через временный и переименовывается.
+    """
+    options = dict(DEFAULT_PARQUET_OPTIONS, **(parquet_options or {}))
+    text_columns = _text_columns(schema)
+    started = time.perf_counter()
+    rows = 0
+    tmp_path = part_path.with_suffix('.tmp')
+
+    conn = pool.getconn(work_mem=ANALYTICS_WORK_MEM)
+    psycopg2.extras.register_default_jsonb(conn, loads=lambda value: value)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+
+        with pq.ParquetWriter(
+            tmp_path, schema,
+            compression=options['compression'],
+            compression_level=options['compression_level'],
+            use_dictionary=options['use_dictionary']
+        ) as writer, conn.cursor(name=f"export_{part_path.stem.replace('-', '_')}") as cur:
+            cur.itersize = fetch_rows
+            cur.execute(query, {'key_from': key_from, 'key_to': key_to})
+            while True:
+                records = cur.fetchmany(fetch_rows)
+                if not records:
+                    break
+                df = pd.DataFrame.from_records(records, columns=schema.names, coerce_float=True)
+                for col in text_columns:
+                    # Несопоставленные типы (uuid, interval, массивы) — текстом
+                    df[col] = df[col].map(lambda value: value if value is None or isinstance(value, str) else str(value))
+                table = pa.Table.from_pandas(df, schema=schema, preserve_index=False, safe=False)
+                writer.write_table(table, row_group_size=options['row_group_size'])
+                rows += len(df)
+        conn.commit()
+        os.replace(tmp_path, part_path)
+    except Exception:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    finally:
+        pool.putconn(conn)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"🧱 {part_path.name}: ключ ({key_from}, {key_to}] — {rows:,} строк за {elapsed:.1f} s")
+    return {
+        'part': part_path.name,
+        'key_from': key_from,
+        'key_to': key_to,
+        'rows': rows,
+        'seconds': round(elapsed, 2)
+    }
+
+
+def extract_sharded(pool, keyset, dataset_dir, shards=DEFAULT_SHARDS, parquet_options=None):
+    """
+    Выгрузка таблицы срезами ключа keyset (см. EXPORT_SPECS) в Parquet-набор dataset_dir.
+
+    Координирующее соединение открывает транзакцию REPEATABLE READ и экспортирует
+    ее снимок; соединения срезов импортируют его (SET TRANSACTION SNAPSHOT), поэтому
+    все срезы видят одни и те же данные. Транзакция координатора держится до конца
+    выгрузки: снимок можно импортировать, только пока она открыта.
+    Возвращает сведения о срезах для метаданных.
+    """
+    if pool.maxconn < MIN_POOL_CONNECTIONS:
+        # Иначе соединение среза ждало бы свободного места в пуле бесконечно
+        raise ValueError(
+            f"Для выгрузки срезами нужно не меньше {MIN_POOL_CONNECTIONS} соединений пула "
+            f"(DB_POOL_MAX={pool.maxconn})"
+        )
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    coordinator = pool.getconn()
+    try:
+        with coordinator.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cur.execute("SELECT pg_export_snapshot()")
+            snapshot_id = cur.fetchone()[0]
+        bounds, method = shard_bounds(coordinator, keyset['table'], keyset['column'], shards)
+        schema = result_schema(coordinator, keyset['range_query'])
+
+        # Координатор и основное соединение экспорта тоже занимают пул
+        workers = max(1, min(len(bounds), pool.maxconn - 2))
+        logger.info(
+            f"🧱 {keyset['table']}.{keyset['column']}: {len(bounds)} срезов ({method}), "
+            f"{workers} соединений, снимок {snapshot_id}"
+        )
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export-shard') as executor:
+            futures = [
+                executor.submit(
+                    extract_shard, pool, snapshot_id, keyset['range_query'], key_from, key_to,
+                    dataset_dir / f"part-{i:05d}.parquet", schema, parquet_options
+                )
+                for i, (key_from, key_to) in enumerate(bounds)
+            ]
+            try:
+                parts = [future.result() for future in futures]
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        pool.putconn(coordinator)
+
+    return {
+        'shards': len(bounds),
+        'workers': workers,
+        'bounds_method': method,
+        'key_column': keyset['column'],
+        'seconds': round(time.perf_counter() - started, 2),
+        'parts': parts
+    }
+
+
+def iter_dataset_frames(dataset_dir, batch_size=SHARD_FETCH_ROWS):
+    """DataFrame'ы Parquet-набора порциями, файлы срезов — в порядке ключа"""
+    for part_path in sorted(dataset_dir.glob('part-*.parquet')):
+        for batch in pq.ParquetFile(part_path).iter_batches(batch_size=batch_size):
+            yield batch.to_pandas()
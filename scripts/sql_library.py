@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Библиотека параметризованных запросов из sql/*.sql
+Разбирает файлы на именованные выражения, безопасно связывает параметры
+(:name и $name), выполняет их через prepared statements и кеширует результаты
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+from database import get_pool
+
+logger = logging.getLogger(__name__)
+
+SQL_DIR = Path(__file__).resolve().parent.parent / 'sql'
+
+DEFAULT_CACHE_DIR = os.getenv('SQL_CACHE_DIR', '.sql_cache')
+DEFAULT_CACHE_TTL_SECONDS = 15 * 60
+DEFAULT_MEMORY_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+_IDENTIFIER_START = re.compile(r'[A-Za-z_]')
+_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_DOLLAR_QUOTE = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)?\$')
+_NAME_ANNOTATION = re.compile(r'^\s*--\s*name:\s*([\w.]+)', re.IGNORECASE)
+_SEPARATOR_COMMENT = re.compile(r'^\s*--\s*[=\-]{3,}\s*$')
+_SECTION_COMMENT = re.compile(r'^\s*--\s*\d+\.\s')
+_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)\b(?!\s*\.)', re.IGNORECASE)
+_EXTRACT_FROM = re.compile(r'\bEXTRACT\s*\(\s*\w+\s+FROM\b', re.IGNORECASE)
+_CTE_NAME = re.compile(r'(?:\bWITH|,)\s*([A-Za-z_][A-Za-z0-9_]*)\s+AS\s*\(', re.IGNORECASE)
+_WITH_START = re.compile(r'\s*WITH\s+(?!RECURSIVE\b)', re.IGNORECASE)
+_CTE_DEFINITION = re.compile(
+    r'\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\([^)]*\)\s*)?AS\s*(?:(?:NOT\s+)?MATERIALIZED\s*)?\(', re.IGNORECASE
+)
+_CTE_SEPARATOR = re.compile(r'\s*,')
+
+
+def _skip_literal(sql, i):
+    """
+    Если в позиции i начинается строка, идентификатор в кавычках, комментарий
+    или dollar quoting — индекс сразу за ним, иначе None
+    """
+    n = len(sql)
+    ch = sql[i]
+    nxt = sql[i + 1] if i + 1 < n else ''
+
+    if ch in ("'", '"'):
+        j = i + 1
+        while j < n:
+            if sql[j] == ch:
+                if j + 1 < n and sql[j + 1] == ch:
+                    j += 2
+                    continue
+                break
+            j += 1
+        return min(j + 1, n)
+    if ch == '-' and nxt == '-':
+        j = sql.find('\n', i)
+        return n if j == -1 else j
+    if ch == '/' and nxt == '*':
+        j = sql.find('*/', i + 2)
+        return n if j == -1 else j + 2
+    if ch == '$':
+        quote = _DOLLAR_QUOTE.match(sql, i)
+        if quote:
+            j = sql.find(quote.group(0), quote.end())
+            return n if j == -1 else j + len(quote.group(0))
+    return None
+
+
+def _strip_comments(sql):
+    """Текст без комментариев (для проверки, есть ли в фрагменте код)"""
+    out = []
+    i = 0
+    while i < len(sql):
+        end = _skip_literal(sql, i)
+        if end is None:
+            out.append(sql[i])
+            i += 1
+        else:
+            if sql[i] in ("'", '"', '$'):
+                out.append(sql[i:end])
+            i = end
+    return ''.join(out)
+
+
+def _with_clause(sql):
+    """
+    Список CTE ведущего WITH без самого слова ('a AS (...), b AS (...)') и имена CTE.
+    (None, []) — выражение не начинается с WITH (или WITH RECURSIVE, который не переносится)
+    """
+    start = _WITH_START.match(sql)
+    if not start:
+        return None, []
+    names = []
+    i = start.end()
+    while True:
+        definition = _CTE_DEFINITION.match(sql, i)
+        if not definition:
+            return None, []
+        names.append(definition.group(1).lower())
+        i = definition.end()
+        depth = 1
+        while i < len(sql) and depth:
+            end = _skip_literal(sql, i)
+            if end is not None:
+                i = end
+                continue
+            if sql[i] == '(':
+                depth += 1
+            elif sql[i] == ')':
+                depth -= 1
+            i += 1
+        if depth:
+            return None, []
+        separator = _CTE_SEPARATOR.match(sql, i)
+        if not separator:
+            return sql[start.end():i], names
+        i = separator.end()
+
+
+def _inline_ctes(body, shared_ctes):
+    """
+    Выражение, которое читает CTE предыдущего выражения файла (как в руководствах:
+    WITH x AS (...) SELECT ...; SELECT ... FROM x), получает его WITH целиком —
+    иначе такое выражение не выполняется отдельно
+    """
+    _, own_names = _with_clause(body)
+    clauses = []
+    for table in SqlStatement._referenced_tables(body):
+        clause, names = shared_ctes.get(table, (None, []))
+        if clause is not None and clause not in clauses and not set(names) & set(own_names):
+            clauses.append(clause)
+    if not clauses:
+        return body
+    prefix = 'WITH ' + ',\n'.join(clauses)
+    own = _WITH_START.match(body)
+    if own:
+        return prefix + ',\n' + body[own.end():]
+    return prefix + '\n' + body
+
+
+def _slugify(text):
+    """Имя выражения из комментария (латиница, цифры, подчеркивания)"""
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+class SqlStatement:
+    """
+    Одно именованное выражение из SQL-файла.
+
+    Параметры в исходном тексте (:start_date, $limit) заменяются
+    позиционными $1..$n; один и тот же параметр получает один номер.
+    """
+
+    def __init__(self, name, source_file, description, sql):
+        self.name = name
+        self.source_file = source_file
+        self.description = description
+        self.sql = sql
+        self.positional_sql, self.parameters = self._compile(sql)
+        self.tables = self._referenced_tables(self.positional_sql)
+        self.fingerprint = hashlib.sha256(self.positional_sql.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _compile(sql):
+        """Замена именованных параметров на позиционные вне строк и комментариев"""
+        out = []
+        parameters = []
+        i = 0
+        n = len(sql)
+        while i < n:
+            ch = sql[i]
+            nxt = sql[i + 1] if i + 1 < n else ''
+
+            # Строки, комментарии и dollar quoting копируются без изменений
+            literal_end = _skip_literal(sql, i)
+            if literal_end is not None:
+                out.append(sql[i:literal_end])
+                i = literal_end
+                continue
+
+            # :name (но не приведение типа ::type) и $name
+            is_colon_param = (ch == ':' and nxt != ':' and (i == 0 or sql[i - 1] != ':')
+                              and _IDENTIFIER_START.match(nxt))
+            is_dollar_param = ch == '$' and _IDENTIFIER_START.match(nxt)
+            if is_colon_param or is_dollar_param:
+                ident = _IDENTIFIER.match(sql, i + 1).group(0)
+                if ident not in parameters:
+                    parameters.append(ident)
+                out.append(f'${parameters.index(ident) + 1}')
+                i += 1 + len(ident)
+                continue
+
+            out.append(ch)
+            i += 1
+        return ''.join(out), parameters
+
+    @staticmethod
+    def _referenced_tables(sql):
+        """Таблицы из FROM/JOIN без имен CTE — используются для инвалидации кеша"""
+        ctes = {name.lower() for name in _CTE_NAME.findall(sql)}
+        # EXTRACT(field FROM expr) — не ссылка на таблицу
+        sql = _EXTRACT_FROM.sub('EXTRACT(', sql)
+        tables = {name.lower() for name in _TABLE_REFERENCE.findall(sql)}
+        return sorted(tables - ctes)
+
+    def bind(self, params=None):
+        """Позиционные значения параметров; не переданные параметры равны NULL (фильтр не применяется)"""
+        params = dict(params or {})
+        unknown = set(params) - set(self.parameters)
+        if unknown:
+            raise ValueError(f"Неизвестные параметры для {self.name}: {', '.join(sorted(unknown))}")
+        return tuple(params.get(name) for name in self.parameters)
+
+
+class SqlLibrary:
+    """Именованные выражения из всех файлов каталога sql/"""
+
+    def __init__(self, sql_dir=SQL_DIR):
+        self.sql_dir = Path(sql_dir)
+        self.statements = OrderedDict()
+        for path in sorted(self.sql_dir.glob('*.sql')):
+            for statement in self.parse_file(path):
+                self.statements[statement.name] = statement
+
+    @staticmethod
+    def _split_statements(text):
+        """Разбиение файла по ';' вне строк, комментариев и dollar quoting"""
+        chunks = []
+        start = 0
+        i = 0
+        n = len(text)
+        while i < n:
+            literal_end = _skip_literal(text, i)
+            if literal_end is not None:
+                i = literal_end
+            elif text[i] == ';':
+                chunks.append(text[start:i])
+                start = i + 1
+                i += 1
+            else:
+                i += 1
+        chunks.append(text[start:])
+        return chunks
+
+    @classmethod
+    def parse_file(cls, path):
+        """Выражения одного файла с именами вида <файл> или <файл>.<описание>"""
+        path = Path(path)
+        text = path.read_text(encoding='utf-8')
+        parsed = []
+
+        for chunk in cls._split_statements(text):
+            if not _strip_comments(chunk).strip():
+                # Только комментарии (заголовки, примеры параметров) — не выражение
+                continue
+            lines = chunk.strip('\n').splitlines()
+            explicit_name = None
+            comments = []
+            body_start = 0
+            # Ведущие комментарии: аннотация "-- name:" и описание выражения
+            for idx, line in enumerate(lines):
+                stripped = line.strip()
+                if not stripped:
+                    continue
+                if stripped.startswith('--'):
+                    annotation = _NAME_ANNOTATION.match(stripped)
+                    if annotation:
+                        explicit_name = annotation.group(1)
+                    elif not _SEPARATOR_COMMENT.match(stripped) and not _SECTION_COMMENT.match(stripped):
+                        comments.append(stripped.lstrip('-').strip())
+                    continue
+                body_start = idx
+                break
+
+            body = '\n'.join(lines[body_start:]).strip()
+            description = comments[-1] if comments else ''
+            parsed.append((explicit_name, description, body))
+
+        statements = []
+        used = set()
+        # CTE уже разобранных выражений файла: имя → (список CTE его WITH, имена)
+        shared_ctes = {}
+        for index, (explicit_name, description, body) in enumerate(parsed, start=1):
+            if explicit_name:
+                name = explicit_name
+            elif len(parsed) == 1:
+                name = path.stem
+            else:
+                slug = _slugify(description)
+                name = f"{path.stem}.{slug}" if slug else f"{path.stem}.{index}"
+            if name in used:
+                name = f"{name}_{index}"
+            used.add(name)
+            body = _inline_ctes(body, shared_ctes)
+            clause, names = _with_clause(body)
+            if clause is not None:
+                shared_ctes.update({cte: (clause, names) for cte in names})
+            statements.append(SqlStatement(name, path.name, description, body))
+        return statements
+
+    def get(self, name):
+        """Выражение по имени"""
+        try:
+            return self.statements[name]
+        except KeyError:
+            raise KeyError(f"Выражение не найдено: {name}") from None
+
+    def names(self):
+        return list(self.statements)
+
+
+class ResultCache:
+    """
+    Двухуровневый кеш результатов: LRU в памяти и файлы на диске.
+
+    Ключ — имя выражения, отпечаток его текста и значения параметров.
+    Запись устаревает по TTL или при изменении версии любой из таблиц,
+    которые читает выражение. Оба уровня ограничены по размеру в байтах.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl_seconds=DEFAULT_CACHE_TTL_SECONDS,
+                 max_memory_bytes=DEFAULT_MEMORY_CACHE_BYTES, max_disk_bytes=DEFAULT_DISK_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(statement, params):
+        payload = json.dumps(
+            {'name': statement.name, 'sql': statement.fingerprint, 'params': params},
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _is_valid(self, entry, table_versions):
+        return entry['expires_at'] > time.time() and entry['table_versions'] == table_versions
+
+    def get(self, key, table_versions):
+        """Результат из кеша или None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._is_valid(entry, table_versions):
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return entry['frame']
+                self._evict_memory(key)
+                self.stats['invalidations'] += 1
+
+        path = self._disk_path(key)
+        if path is not None and path.exists():
+            try:
+                with open(path, 'rb') as f:
+                    entry = pickle.load(f)
+            except Exception as e:
+                logger.warning(f"⚠️ Поврежденная запись кеша {path.name}: {e}")
+                entry = None
+            if entry is not None and self._is_valid(entry, table_versions):
+                os.utime(path)
+                self._remember(key, entry)
+                self.stats['disk_hits'] += 1
+                return entry['frame']
+            path.unlink(missing_ok=True)
+            self.stats['invalidations'] += 1
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, frame, table_versions, ttl_seconds=None):
+        """Сохранение результата в памяти и на диске"""
+        entry = {
+            'created_at': time.time(),
+            'expires_at': time.time() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds),
+            'table_versions': table_versions,
+            'frame': frame
+        }
+        self._remember(key, entry)
+
+        path = self._disk_path(key)
+        if path is not None:
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+
+    def clear(self):
+        """Полная очистка кеша"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.cache_dir:
+            for path in self.cache_dir.glob('*.pkl'):
+                path.unlink(missing_ok=True)
+
+    def _remember(self, key, entry):
+        size = int(entry['frame'].memory_usage(deep=True).sum())
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._evict_memory(key)
+            entry['size'] = size
+            self._memory[key] = entry
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                self._evict_memory(next(iter(self._memory)))
+
+    def _evict_memory(self, key):
+        entry = self._memory.pop(key)
+        self._memory_bytes -= entry.get('size', 0)
+
+    def _disk_path(self, key):
+        return self.cache_dir / f"{key}.pkl" if self.cache_dir else None
+
+    def _trim_disk(self):
+        """Удаление самых давно использованных файлов при превышении лимита"""
+        files = sorted(self.cache_dir.glob('*.pkl'), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+
+
+class SqlRunner:
+    """Выполнение выражений библиотеки через пул соединений с кешированием результатов"""
+
+    def __init__(self, library=None, cache=None, pool=None, timeout_ms=None):
+        self.library = library or SqlLibrary()
+        self.cache = cache if cache is not None else ResultCache()
+        self.pool = pool or get_pool(application_name='databoard-sql-runner')
+        self.timeout_ms = timeout_ms
+
+    def run(self, name, params=None, use_cache=True, ttl_seconds=None):
+        """Результат выражения в виде DataFrame"""
+        statement = self.library.get(name)
+        values = statement.bind(params)
+        key = ResultCache.make_key(statement, dict(zip(statement.parameters, values)))
+
+        with self.pool.connection() as conn:
+            versions = self.pool.table_versions(conn, statement.tables) if use_cache else None
+            if use_cache:
+                cached = self.cache.get(key, versions)
+                if cached is not None:
+                    logger.info(f"⚡ {name}: результат из кеша ({len(cached):,} строк)")
+                    return cached
+
+            started = time.perf_counter()
+            columns, rows = self.pool.fetch_prepared(
+                conn, statement.positional_sql, values, timeout_ms=self.timeout_ms
+            )
+            conn.commit()
+            frame = pd.DataFrame(rows, columns=columns)
+            logger.info(f"📊 {name}: {len(frame):,} строк за {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        if use_cache:
+            self.cache.put(key, frame, versions, ttl_seconds)
+        return frame
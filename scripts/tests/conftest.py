@@ -0,0 +1,6 @@
+"""Скрипты импортируются без пакета (как при запуске из scripts/): папка добавляется в sys.path"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
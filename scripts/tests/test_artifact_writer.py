@@ -0,0 +1,99 @@
+"""Потоковая запись артефактов таблицы: границы порций"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from artifact_writer import TableArtifactWriter
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    for folder in ('csv', 'parquet', 'json'):
+        (tmp_path / folder).mkdir()
+    return tmp_path
+
+
+def _chunks():
+    return [
+        pd.DataFrame({'id': [1, 2, 3], 'status': ['new', 'paid', 'new'], 'qty': [1, 2, 3],
+                      'cancelled_at': [None, None, None]}),
+        pd.DataFrame({'id': [4, 5], 'status': ['paid', None], 'qty': [70000, None],
+                      'cancelled_at': [pd.Timestamp('2024-03-01 12:00'), None]}),
+    ]
+
+
+def test_null_first_column_uses_schema_hint(output_dir):
+    writer = TableArtifactWriter(output_dir, 'orders', 'orders_t',
+                                 schema_hints={'cancelled_at': pa.timestamp('us')})
+    for chunk in _chunks():
+        writer.write(chunk)
+    metadata = writer.close()
+
+    table = pq.read_table(writer.parquet_path)
+    assert table.schema.field('cancelled_at').type == pa.timestamp('us')
+    assert table.column('cancelled_at').null_count == 4
+    assert metadata['record_count'] == 5
+
+
+def test_chunks_match_full_frame(output_dir):
+    expected_csv = ''.join(chunk.to_csv(index=False, header=i == 0) for i, chunk in enumerate(_chunks()))
+    writer = TableArtifactWriter(output_dir, 'orders', 'orders_t',
+                                 schema_hints={'cancelled_at': pa.timestamp('us')}, compact_dtypes=True)
+    for chunk in _chunks():
+        writer.write(chunk)
+    metadata = writer.close()
+
+    # Сжатые порции (uint8, затем uint32 и category) не меняют значений в файлах
+    assert writer.csv_path.read_text(encoding='utf-8') == expected_csv
+    result = pd.read_parquet(writer.parquet_path)
+    assert result['id'].dtype == np.int64
+    assert result['qty'].tolist()[:4] == [1, 2, 3, 70000]
+    assert result['status'].astype(object).where(result['status'].notna(), None).tolist() == \
+        ['new', 'paid', 'new', 'paid', None]
+
+    stats = {column['name']: column for column in metadata['columns']}
+    assert stats['status']['null_count'] == 1
+    assert stats['status']['unique_count'] == 2
+    assert stats['cancelled_at']['null_count'] == 4
+    assert metadata['dtype_compaction']['columns']['id'] == 'int64 → uint8'
+    assert json.loads(writer.metadata_path.read_text(encoding='utf-8'))['record_count'] == 5
+
+
+def test_excel_copy_and_abort(output_dir):
+    pytest.importorskip('xlsxwriter')
+    writer = TableArtifactWriter(output_dir, 'orders_analytics', 'orders_analytics_t',
+                                 schema_hints={'cancelled_at': pa.timestamp('us')}, excel=True)
+    for chunk in _chunks():
+        writer.write(chunk)
+    metadata = writer.close()
+    assert metadata['files']['xlsx'] == 'xlsx/orders_analytics_t.xlsx'
+    assert metadata['excel_sheets'] == [{'name': 'orders_analytics', 'rows': 5}]
+
+    writer = TableArtifactWriter(output_dir, 'orders_analytics', 'orders_analytics_u', excel=True)
+    writer.write(_chunks()[0])
+    writer.abort()
+    assert not writer.csv_path.exists()
+    assert not writer.parquet_path.exists()
+    assert not writer.excel_path.exists()
+
+
+def test_approximate_unique_counts_after_compaction(output_dir):
+    # Порции сжимаются по-разному (uint8, затем uint32; float32, затем float64),
+    # одинаковые значения должны попадать в один регистр скетча
+    chunks = [
+        pd.DataFrame({'qty': [1, 2, 3], 'price': [0.5, 1.5, 2.5]}),
+        pd.DataFrame({'qty': [1, 2, 70000], 'price': [0.5, 1.5, 0.1]}),
+    ]
+    writer = TableArtifactWriter(output_dir, 'orders', 'orders_t', stats_mode='approximate', compact_dtypes=True)
+    for chunk in chunks:
+        writer.write(chunk)
+    metadata = writer.close()
+
+    stats = {column['name']: column for column in metadata['columns']}
+    assert stats['qty']['unique_count'] == 4
+    assert stats['price']['unique_count'] == 4
@@ -0,0 +1,36 @@
+"""Метрики воркера очистки по очереди изменений"""
+
+import change_capture
+from change_capture import WorkerMetrics
+
+
+def test_snapshot_lags_and_rates(monkeypatch):
+    clock = iter([100.0, 110.0])
+    monkeypatch.setattr(change_capture.time, 'monotonic', lambda: next(clock))
+    metrics = WorkerMetrics()
+    metrics.record(keys=3, lags=[0.5, 1.0, 2.0], deleted={'orders': 1}, seconds=0.5)
+    metrics.record(keys=2, lags=[4.0, 0.0], deleted={'orders': 2, 'order_items': 5}, seconds=1.5)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['batches'] == 2
+    assert snapshot['keys'] == 5
+    assert snapshot['rows_deleted'] == {'orders': 3, 'order_items': 5}
+    assert snapshot['keys_per_second'] == 0.5
+    assert snapshot['keys_per_busy_second'] == 2.5
+    # Задержка — возраст ключа плюс время обработки его порции: 1.0, 1.5, 2.5, 5.5, 1.5
+    assert snapshot['lag_p50_seconds'] == 1.5
+    assert snapshot['lag_p95_seconds'] == 5.5
+    assert snapshot['lag_max_seconds'] == 5.5
+
+
+def test_lag_window_keeps_latest_keys():
+    metrics = WorkerMetrics(window=3)
+    metrics.record(keys=3, lags=[100.0, 100.0, 100.0], deleted={}, seconds=0.0)
+    metrics.record(keys=3, lags=[1.0, 2.0, 3.0], deleted={}, seconds=0.0)
+    assert metrics.snapshot()['lag_max_seconds'] == 3.0
+
+
+def test_empty_metrics():
+    snapshot = WorkerMetrics().snapshot()
+    assert snapshot['lag_p50_seconds'] is None
+    assert snapshot['keys_per_busy_second'] == 0.0
@@ -0,0 +1,101 @@
+"""Условия инкрементальной очистки по водяным меткам"""
+
+from datetime import datetime, timedelta, timezone
+
+from cleaning_scope import TOUCHED_KEYS_TABLE, CleaningScope
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def mogrify(self, query, params):
+        value = params[0]
+        return (f"'{value}'" if isinstance(value, str) else str(value)).encode()
+
+    def execute(self, query, params=None):
+        self.conn.executed.append(query)
+        if 'information_schema.columns' in query:
+            self.result = [(column,) for column in self.conn.timestamps.get(params[0], ())]
+        elif 'pg_index' in query:
+            key = self.conn.primary_keys.get(params[0].strip('"'))
+            self.result = [(key,)] if key else []
+        elif query.lstrip().startswith('SELECT MAX'):
+            table = query.rsplit('FROM', 1)[1].strip()
+            self.result = [(self.conn.maxima[table],)]
+        elif 'watermark_column, watermark, last_full_pass' in query:
+            self.result = self.conn.stored
+        else:
+            self.result = []
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Connection:
+    def __init__(self, stored=()):
+        self.timestamps = {'orders': ('created_at', 'updated_at')}
+        self.primary_keys = {'order_items': 'id'}
+        self.maxima = {'orders': '2024-05-02 00:00:00', 'order_items': '900'}
+        self.stored = list(stored)
+        self.executed = []
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        pass
+
+
+def _recent_marks():
+    recent = datetime.now(timezone.utc) - timedelta(days=1)
+    return [('orders', 'updated_at,created_at', '2024-05-01 00:00:00', recent),
+            ('order_items', 'id', '500', recent)]
+
+
+def test_incremental_conditions():
+    scope = CleaningScope(_Connection(_recent_marks()), 'clean', ['orders', 'order_items']).begin()
+
+    assert not scope.full
+    assert scope.rows('orders', 'o') == "GREATEST(o.updated_at, o.created_at) >= '2024-05-01 00:00:00'"
+    assert scope.rows('order_items') == "id > '500'"
+    assert scope.keys('orders', 'customer_id') == (
+        "customer_id IN (SELECT customer_id FROM orders "
+        "WHERE GREATEST(updated_at, created_at) >= '2024-05-01 00:00:00')"
+    )
+    assert scope.references('order_items', 'order_id', 'orders', 'oi') == (
+        f"(oi.id > '500' OR oi.order_id::text IN "
+        f"(SELECT key FROM {TOUCHED_KEYS_TABLE} WHERE table_name = 'orders'))"
+    )
+    assert scope.delete_sql('orders', 'total < 0', 'id') == (
+        "WITH deleted AS (DELETE FROM orders WHERE total < 0 RETURNING id) "
+        f"INSERT INTO {TOUCHED_KEYS_TABLE} SELECT 'orders', id::text FROM deleted"
+    )
+
+
+def test_full_pass_without_marks_or_when_stale():
+    scope = CleaningScope(_Connection(), 'clean', ['orders', 'order_items']).begin()
+    assert scope.full
+    assert scope.rows('orders') == scope.keys('orders', 'id') == 'TRUE'
+    assert scope.references('order_items', 'order_id', 'orders') == 'TRUE'
+    assert scope.delete_sql('orders', 'total < 0', 'id') == 'DELETE FROM orders WHERE total < 0'
+
+    stale = [(table, column, mark, last - timedelta(days=30)) for table, column, mark, last in _recent_marks()]
+    assert CleaningScope(_Connection(stale), 'clean', ['orders', 'order_items']).begin().full
+    assert CleaningScope(_Connection(_recent_marks()), 'clean', ['orders'], full=True).begin().full
+
+
+def test_changed_watermark_column_forces_full_pass():
+    marks = _recent_marks()
+    marks[0] = ('orders', 'created_at', '2024-05-01 00:00:00', marks[0][3])
+    assert CleaningScope(_Connection(marks), 'clean', ['orders', 'order_items']).begin().full
@@ -0,0 +1,38 @@
+"""Матрицы когорт: инкрементальное обновление совпадает с полным расчетом"""
+
+import numpy as np
+
+from cohorts import CohortEngine
+
+
+def _orders(order_ids, customers, months, amounts):
+    return {
+        'order_id': np.array(order_ids, dtype=np.int64),
+        'customer_id': np.array(customers, dtype=np.int64),
+        'month': np.array(months, dtype=np.int64),
+        'amount': np.array(amounts, dtype=np.float64),
+    }
+
+
+def _concat(*parts):
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def test_update_matches_build():
+    first = _orders([1, 2, 3], [10, 11, 10], [648, 648, 649], [5.0, 7.0, 3.0])
+    second = _orders([4, 5, 6], [12, 10, 11], [649, 649, 650], [1.0, 2.0, 4.0])
+
+    incremental = CohortEngine().build(first)
+    assert incremental.update(second)
+    full = CohortEngine().build(_concat(first, second))
+
+    np.testing.assert_array_equal(incremental.active, full.active)
+    np.testing.assert_array_equal(incremental.orders, full.orders)
+    np.testing.assert_allclose(incremental.revenue, full.revenue)
+    assert incremental.cohort_sizes().tolist() == [2, 1, 0]
+    assert incremental.last_order_id == 6
+
+
+def test_backdated_order_needs_full_rebuild():
+    engine = CohortEngine().build(_orders([1], [10], [649], [5.0]))
+    assert not engine.update(_orders([2], [10], [648], [1.0]))
@@ -0,0 +1,31 @@
+"""Метрики отчета о качестве данных по профилям таблиц"""
+
+import data_cleaning
+from data_cleaning import DataCleaningPipeline
+
+
+def _report(monkeypatch, orders_rows, incomplete, invalid, nulls, paid):
+    profiles = {
+        'orders': {'row_count': orders_rows, 'columns': {}, 'rule_violations': {'incomplete': incomplete}},
+        'payments': {'row_count': paid, 'columns': {}, 'rule_violations': {'paid': paid}},
+    }
+    monkeypatch.setattr(data_cleaning, 'profile_tables', lambda pool: profiles)
+    pipeline = DataCleaningPipeline.__new__(DataCleaningPipeline)
+    pipeline.pool = None
+    pipeline.cleaning_log = []
+    pipeline.integrity_checks = [{
+        'relationship': 'orders -> customers', 'invalid_references': invalid, 'null_references': nulls
+    }]
+    return pipeline.generate_data_quality_report()['data_quality_metrics']
+
+
+def test_null_customer_counted_once(monkeypatch):
+    # 10 заказов: 3 без customer_id (incomplete и null_references), 1 с удаленным клиентом
+    metrics = _report(monkeypatch, orders_rows=10, incomplete=3, invalid=4, nulls=3, paid=5)
+    assert metrics['complete_orders_percentage'] == 60.0
+    assert metrics['payment_completion_rate'] == 50.0
+
+
+def test_payment_rate_bounded_by_orders(monkeypatch):
+    metrics = _report(monkeypatch, orders_rows=4, incomplete=0, invalid=0, nulls=0, paid=6)
+    assert metrics['payment_completion_rate'] == 100.0
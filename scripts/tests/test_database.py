@@ -0,0 +1,57 @@
+"""Таймаут отдельного выражения не переходит на следующие выражения транзакции"""
+
+import pytest
+
+from database import _statement_timeout
+
+
+class _Cursor:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, query, params=None):
+        self.log.append((query, params))
+
+    def fetchone(self):
+        return ('10min',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Connection:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return _Cursor(self.log)
+
+
+def test_timeout_restored_after_statement():
+    conn = _Connection()
+    with _statement_timeout(conn, 30000):
+        conn.log.append(('COUNT', None))
+    assert conn.log == [
+        ("SELECT current_setting('statement_timeout')", None),
+        ("SELECT set_config('statement_timeout', %s, true)", ('30000',)),
+        ('COUNT', None),
+        ("SELECT set_config('statement_timeout', %s, true)", ('10min',)),
+    ]
+
+
+def test_no_timeout_runs_nothing_extra():
+    conn = _Connection()
+    with _statement_timeout(conn, None):
+        pass
+    assert conn.log == []
+
+
+def test_failed_statement_leaves_reset_to_rollback():
+    conn = _Connection()
+    with pytest.raises(RuntimeError):
+        with _statement_timeout(conn, 1000):
+            raise RuntimeError('canceling statement due to statement timeout')
+    assert len(conn.log) == 2
@@ -0,0 +1,42 @@
+"""Компактные типы колонок: значения не меняются"""
+
+import numpy as np
+import pandas as pd
+
+from dtype_compaction import compact_frame, compact_series, merge_reports
+
+
+def test_integers_take_smallest_type():
+    assert compact_series(pd.Series([0, 255])).dtype == np.uint8
+    assert compact_series(pd.Series([-1, 300])).dtype == np.int16
+    assert compact_series(pd.Series([1, None], dtype='Int64')).dtype == 'UInt8'
+
+
+def test_floats_only_without_loss():
+    assert compact_series(pd.Series([0.5, 2.25])).dtype == np.float32
+    assert compact_series(pd.Series([0.1, 2.5])).dtype == np.float64
+
+
+def test_strings_to_category_by_cardinality():
+    assert isinstance(compact_series(pd.Series(['a', 'b'] * 10)).dtype, pd.CategoricalDtype)
+    assert not isinstance(compact_series(pd.Series([f"id-{i}" for i in range(10)])).dtype, pd.CategoricalDtype)
+
+
+def test_frame_values_and_report():
+    df = pd.DataFrame({'qty': np.arange(1000), 'region': ['north', 'south'] * 500,
+                       'price': np.full(1000, 1.5)})
+    compacted = compact_frame(df, 'orders')
+
+    pd.testing.assert_frame_equal(compacted.astype(df.dtypes.to_dict()), df)
+    report = compacted.attrs['dtype_compaction']
+    assert report['memory_after_mb'] <= report['memory_before_mb']
+    assert set(report['columns']) == {'qty', 'region', 'price'}
+
+
+def test_merge_reports_sums_chunks():
+    first = {'memory_before_mb': 2.0, 'memory_after_mb': 1.0, 'reduction_percent': 50.0, 'columns': {'a': 'x'}}
+    second = {'memory_before_mb': 2.0, 'memory_after_mb': 0.0, 'reduction_percent': 100.0, 'columns': {'b': 'y'}}
+    total = merge_reports(merge_reports(None, first), second)
+    assert total['reduction_percent'] == 75.0
+    assert total['columns'] == {'a': 'x', 'b': 'y'}
+    assert first['columns'] == {'a': 'x'}
@@ -0,0 +1,72 @@
+"""Потоковая запись Excel: порции, NULL, деление на листы"""
+
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('xlsxwriter')
+openpyxl = pytest.importorskip('openpyxl')
+
+from excel_writer import ExcelStreamWriter  # noqa: E402
+
+
+def _read(path):
+    workbook = openpyxl.load_workbook(path)
+    return {sheet.title: list(sheet.values) for sheet in workbook}
+
+
+def test_null_first_column_resolved_by_later_chunk(tmp_path):
+    path = tmp_path / 'orders.xlsx'
+    writer = ExcelStreamWriter(path, 'orders')
+    writer.write(pd.DataFrame({'id': [1, 2], 'amount': [None, None], 'shipped': [None, None]}))
+    writer.write(pd.DataFrame({'id': [3, 4], 'amount': [1.5, None],
+                               'shipped': [dt.date(2024, 1, 2), None]}))
+    writer.write(pd.DataFrame({'id': [5], 'amount': [None], 'shipped': [None]}))
+    assert writer.close() == [{'name': 'orders', 'rows': 5}]
+
+    rows = _read(path)['orders']
+    assert rows[0] == ('id', 'amount', 'shipped')
+    assert rows[1] == (1, None, None)
+    assert rows[3] == (3, 1.5, dt.datetime(2024, 1, 2))
+    assert rows[5] == (5, None, None)
+
+
+def test_rows_split_across_sheets_at_chunk_boundaries(tmp_path):
+    path = tmp_path / 'customers.xlsx'
+    writer = ExcelStreamWriter(path, 'customers', rows_per_sheet=4)
+    for start in (0, 3, 6):
+        writer.write(pd.DataFrame({'id': range(start, start + 3), 'segment': ['a', None, 'b']}))
+    sheets = writer.close()
+
+    assert sheets == [{'name': 'customers', 'rows': 4}, {'name': 'customers_2', 'rows': 4},
+                      {'name': 'customers_3', 'rows': 1}]
+    content = _read(path)
+    assert [row[0] for sheet in content.values() for row in sheet[1:]] == list(range(9))
+    assert all(sheet[0] == ('id', 'segment') for sheet in content.values())
+
+
+def test_typed_cells(tmp_path):
+    path = tmp_path / 'typed.xlsx'
+    writer = ExcelStreamWriter(path, 'typed')
+    writer.write(pd.DataFrame({
+        'qty': pd.array([1, None], dtype='Int64'),
+        'price': pd.Series([0.25, 2.5], dtype='float32'),
+        'flag': [True, False],
+        'status': pd.Series(['new', 'paid'], dtype='category'),
+        'created_at': pd.to_datetime(['2024-01-01 10:00', None]).tz_localize('UTC'),
+    }))
+    writer.close()
+
+    assert _read(path)['typed'][1:] == [
+        (1, 0.25, True, 'new', dt.datetime(2024, 1, 1, 10, 0)),
+        (None, 2.5, False, 'paid', None),
+    ]
+
+
+def test_empty_export_has_header_less_sheet(tmp_path):
+    path = tmp_path / 'empty.xlsx'
+    writer = ExcelStreamWriter(path, 'empty')
+    writer.write(pd.DataFrame({'id': []}))
+    assert writer.close() == [{'name': 'empty', 'rows': 0}]
+    assert list(_read(path)) == ['empty']
@@ -0,0 +1,37 @@
+"""Контрольная точка выгрузки при отметках из нескольких потоков"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from export_checkpoint import ExportCheckpoint
+
+
+def test_concurrent_chunks_and_finished_tables(tmp_path):
+    checkpoint = ExportCheckpoint(tmp_path)
+    tables = [f"table_{i}" for i in range(6)]
+
+    def export(table_name):
+        checkpoint.start_table(table_name, 'id')
+        for chunk in range(20):
+            checkpoint.record_chunk(table_name, (chunk + 1) * 100, 100)
+        checkpoint.finish_table(table_name, {'record_count': 2000, 'columns': list(range(50))})
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(export, tables))
+
+    restored = ExportCheckpoint(tmp_path)
+    assert restored.load()
+    assert set(restored.done_tables()) == set(tables)
+    assert [path.name for path in tmp_path.iterdir()] == ['checkpoint.json']
+
+
+def test_resume_state(tmp_path):
+    checkpoint = ExportCheckpoint(tmp_path)
+    checkpoint.start_table('orders', 'id')
+    checkpoint.record_chunk('orders', 500, 500)
+
+    restored = ExportCheckpoint(tmp_path)
+    restored.load()
+    assert restored.table('orders') == {'status': 'in_progress', 'keyset': 'id', 'key_from': 500,
+                                        'chunks': 1, 'rows': 500}
+    assert not restored.is_done('orders')
+    assert restored.table('customers') == {}
@@ -0,0 +1,24 @@
+"""Проверка связей по отсортированным массивам ключей"""
+
+import numpy as np
+
+from integrity import compact_keys, missing_keys
+
+
+def test_compact_keys_sorts_and_counts_nulls():
+    keys, nulls = compact_keys([3, None, 1, 2.0])
+    assert keys.dtype == np.int64
+    assert keys.tolist() == [1, 2, 3]
+    assert nulls == 1
+
+    keys, _ = compact_keys(['b', 'a'])
+    assert keys.tolist() == ['a', 'b']
+
+
+def test_missing_keys():
+    parent = np.array([1, 3, 5], dtype=np.int64)
+    child = np.array([1, 2, 5, 6, 3, 3], dtype=np.int64)
+    assert missing_keys(child, parent).tolist() == [False, True, False, True, False, False]
+    assert missing_keys(child, np.empty(0, np.int64)).all()
+    # Целые против строк сравниваются по строковому представлению
+    assert missing_keys(np.array(['1', '4']), parent).tolist() == [False, True]
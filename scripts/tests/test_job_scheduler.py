@@ -0,0 +1,187 @@
+"""Планировщик заданий: порядок, повторы, лимиты таблиц и блокировка выгрузки"""
+
+import threading
+import time
+
+import pytest
+
+import job_scheduler
+from job_scheduler import Job, JobScheduler, PipelineCycle
+
+
+class FakeScheduler(JobScheduler):
+    """Без БД: advisory lock берется всегда (или по списку ответов locks)"""
+
+    def __init__(self, locks=None, **kwargs):
+        super().__init__(pool=object(), backoff_seconds=0, **kwargs)
+        self.locks = list(locks or [])
+
+    def _try_lock(self, job):
+        return self.locks.pop(0) if self.locks else True
+
+    def _unlock(self, job):
+        pass
+
+
+def recorder(log, name, result=None):
+    def run():
+        log.append(name)
+        return result
+    return run
+
+
+def test_dependencies_then_priority():
+    log = []
+    jobs = [
+        Job('export', recorder(log, 'export'), depends_on=['clean'], priority=100),
+        Job('clean', recorder(log, 'clean'), priority=10),
+        Job('report', recorder(log, 'report'), priority=50),
+        Job('rollup', recorder(log, 'rollup'), depends_on=['clean'], priority=80),
+    ]
+    results = FakeScheduler(max_parallel=1).run(jobs)
+    assert log == ['report', 'clean', 'export', 'rollup']
+    assert all(result['status'] == 'succeeded' for result in results.values())
+
+
+def test_validate_rejects_cycles_and_unknown_dependencies():
+    with pytest.raises(ValueError, match='Цикл'):
+        JobScheduler.validate([Job('a', None, depends_on=['b']), Job('b', None, depends_on=['a'])])
+    with pytest.raises(ValueError, match='неизвестные'):
+        JobScheduler.validate([Job('a', None, depends_on=['missing'])])
+
+
+def test_failed_attempts_are_retried():
+    outcomes = iter([RuntimeError('сбой'), False, None])
+
+    def flaky():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    results = FakeScheduler().run([Job('flaky', flaky, max_attempts=3)])
+    assert results['flaky']['status'] == 'succeeded'
+    assert results['flaky']['attempts'] == 3
+    assert results['flaky']['error'] is None
+
+
+def test_exhausted_job_blocks_dependents():
+    log = []
+    jobs = [
+        Job('clean', recorder(log, 'clean', False), max_attempts=2),
+        Job('export', recorder(log, 'export'), depends_on=['clean']),
+        Job('report', recorder(log, 'report')),
+    ]
+    results = FakeScheduler().run(jobs)
+    assert results['clean']['status'] == 'failed'
+    assert results['clean']['attempts'] == 2
+    assert results['export']['status'] == 'blocked'
+    assert 'export' not in log
+    assert results['report']['status'] == 'succeeded'
+
+
+def test_system_exit_is_a_failed_attempt():
+    def connect_failed():
+        raise SystemExit(1)
+
+    results = FakeScheduler().run([Job('clean', connect_failed, max_attempts=2)])
+    assert results['clean']['status'] == 'failed'
+    assert results['clean']['attempts'] == 2
+    assert 'кодом 1' in results['clean']['error']
+
+
+def test_retry_delay_grows_and_is_capped():
+    scheduler = FakeScheduler()
+    scheduler.backoff_seconds = 30
+    assert 30 <= scheduler._retry_delay(1) <= 33
+    assert 120 <= scheduler._retry_delay(3) <= 132
+    assert job_scheduler.MAX_BACKOFF_SECONDS <= scheduler._retry_delay(20) <= job_scheduler.MAX_BACKOFF_SECONDS * 1.1
+
+
+def test_writer_excludes_readers_of_its_tables():
+    lock = threading.Lock()
+    active = set()
+    overlaps = []
+
+    def work(name):
+        def run():
+            with lock:
+                overlaps.extend((name, other) for other in active)
+                active.add(name)
+            time.sleep(0.05)
+            with lock:
+                active.discard(name)
+        return run
+
+    jobs = [
+        Job('clean', work('clean'), tables=['orders', 'payments'], exclusive=True, priority=10),
+        Job('rollup', work('rollup'), tables=['orders']),
+        Job('payments', work('payments'), tables=['payments']),
+        Job('report', work('report'), tables=['customers']),
+    ]
+    results = FakeScheduler(max_parallel=4, default_table_limit=2).run(jobs)
+    assert all(result['status'] == 'succeeded' for result in results.values())
+    assert not [pair for pair in overlaps if 'clean' in pair and 'report' not in pair]
+    # Таблицы без писателя делят читатели до лимита
+    assert ('payments', 'rollup') in overlaps or ('rollup', 'payments') in overlaps
+
+
+def test_locked_job_waits_for_other_instance(monkeypatch):
+    monkeypatch.setattr(job_scheduler, 'LOCK_RETRY_SECONDS', 0.05)
+    log = []
+    results = FakeScheduler(locks=[False, False, True]).run([Job('clean', recorder(log, 'clean'))])
+    assert log == ['clean']
+    # Занятая блокировка не расходует попытки
+    assert results['clean']['attempts'] == 1
+
+
+class FakeLockConnection:
+    def __init__(self, locked):
+        self.locked = locked
+        self.closed = False
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeLockCursor(self.locked)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeLockCursor:
+    def __init__(self, locked):
+        self.locked = locked
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return (self.locked,)
+
+
+def test_export_run_lock_is_held_until_close(monkeypatch):
+    connections = []
+
+    def connect(**config):
+        connections.append(FakeLockConnection(locked=len(connections) == 0))
+        return connections[-1]
+
+    monkeypatch.setattr(job_scheduler.psycopg2, 'connect', connect)
+    owner, other = PipelineCycle(), PipelineCycle()
+
+    assert owner.lock_export_run()
+    # Повторная попытка export:prepare того же цикла сохраняет блокировку
+    assert owner.lock_export_run()
+    assert other.lock_export_run() is False
+    assert other.prepare_export() is False
+    assert len(connections) == 3
+    assert [conn.closed for conn in connections] == [False, True, True]
+
+    owner.close()
+    assert connections[0].closed
@@ -0,0 +1,48 @@
+"""Баллы RFM по квантилям и колонки для порции выгрузки клиентов"""
+
+import numpy as np
+import pandas as pd
+
+from rfm import NO_PURCHASES_SEGMENT, RFM_COLUMNS, quantile_scores, rfm_columns
+
+
+def test_quantile_scores_split_evenly():
+    values = np.arange(1, 11, dtype=np.float64)
+    assert quantile_scores(values).tolist() == [1, 1, 1, 2, 2, 3, 3, 4, 4, 5]
+    # Давность: меньше дней — выше балл
+    assert quantile_scores(values, higher_is_better=False).tolist() == [5, 5, 5, 4, 4, 3, 3, 2, 2, 1]
+
+
+def test_ties_on_edge_take_lower_score():
+    frequency = np.array([1, 1, 1, 1, 1, 1, 1, 2, 3, 9], dtype=np.int64)
+    scores = quantile_scores(frequency)
+    assert set(scores[:7].tolist()) == {1}
+    assert scores[-1] == 5
+    assert quantile_scores(np.empty(0, dtype=np.int64)).tolist() == []
+
+
+def test_rfm_columns_follow_chunk_order():
+    scores = pd.DataFrame({
+        'customer_id': np.array([10, 20, 30], dtype=np.int64),
+        'rfm_recency_days': [5.0, 40.0, 300.0],
+        'rfm_frequency': np.array([7, 2, 1], dtype=np.int64),
+        'rfm_monetary': [900.0, 150.0, 20.0],
+        'r_score': np.array([5, 3, 1], dtype=np.int64),
+        'f_score': np.array([5, 3, 1], dtype=np.int64),
+        'm_score': np.array([5, 3, 1], dtype=np.int64),
+        'rfm_score': ['555', '333', '111'],
+        'rfm_segment': ['Champions', 'Need Attention', 'Hibernating'],
+    })
+    columns = rfm_columns(scores, [30, 15, 10, 99])
+
+    assert list(columns.columns) == RFM_COLUMNS
+    assert columns['rfm_segment'].tolist() == ['Hibernating', NO_PURCHASES_SEGMENT, 'Champions', NO_PURCHASES_SEGMENT]
+    assert columns['r_score'].tolist() == [1, 0, 5, 0]
+    assert np.isnan(columns['rfm_recency_days'][1])
+    assert columns['rfm_monetary'].tolist()[2] == 900.0
+
+
+def test_rfm_columns_without_scores():
+    empty = pd.DataFrame({col: pd.Series(dtype='int64') for col in ['customer_id'] + RFM_COLUMNS})
+    columns = rfm_columns(empty, [1, 2])
+    assert columns['rfm_segment'].tolist() == [NO_PURCHASES_SEGMENT] * 2
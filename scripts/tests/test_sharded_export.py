@@ -0,0 +1,80 @@
+"""Срезы первичного ключа для параллельной выгрузки"""
+
+import pytest
+
+from sharded_export import extract_sharded, shard_bounds
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.row = None
+
+    def execute(self, query, params=None):
+        if 'histogram_bounds' in query:
+            self.row = (self.conn.histogram,) if self.conn.histogram else None
+        else:
+            self.row = self.conn.min_max
+
+    def fetchone(self):
+        return self.row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Connection:
+    def __init__(self, min_max, histogram=None):
+        self.min_max = min_max
+        self.histogram = histogram
+
+    def cursor(self):
+        return _Cursor(self)
+
+
+def _covers(bounds, low, high):
+    assert bounds[0][0] is None
+    assert bounds[-1][1] == high
+    assert all(previous[1] == current[0] for previous, current in zip(bounds, bounds[1:]))
+    assert all(key_from is None or low <= key_from < key_to for key_from, key_to in bounds)
+
+
+def test_equal_ranges_without_statistics():
+    bounds, method = shard_bounds(_Connection((1, 100)), 'orders', 'id', 4)
+    assert method == 'min/max'
+    assert bounds == [(None, 25), (25, 50), (50, 75), (75, 100)]
+
+
+def test_histogram_bounds_for_skewed_keys():
+    histogram = '{' + ','.join(str(value) for value in [1, 2, 3, 4, 5, 6, 7, 8, 1000, 5000, 10000]) + '}'
+    bounds, method = shard_bounds(_Connection((1, 12000), histogram), 'orders', 'id', 4)
+    assert method == 'pg_stats'
+    assert len(bounds) == 4
+    # Граница последнего среза — текущий max, а не последняя граница гистограммы
+    _covers(bounds, 1, 12000)
+
+
+def test_small_key_range_merges_duplicate_cuts():
+    bounds, _ = shard_bounds(_Connection((5, 6)), 'orders', 'id', 8)
+    _covers(bounds, 5, 6)
+    assert len(bounds) == 2
+
+
+def test_empty_table_and_text_key():
+    assert shard_bounds(_Connection((None, None)), 'orders', 'id', 4) == ([], 'empty')
+    with pytest.raises(ValueError):
+        shard_bounds(_Connection(('a', 'z')), 'orders', 'code', 4)
+
+
+def test_sharding_needs_three_pool_connections(tmp_path):
+    class Pool:
+        maxconn = 2
+
+        def getconn(self):
+            raise AssertionError('соединение не должно запрашиваться')
+
+    with pytest.raises(ValueError, match='DB_POOL_MAX=2'):
+        extract_sharded(Pool(), {'table': 'orders', 'column': 'id'}, tmp_path / 'orders')
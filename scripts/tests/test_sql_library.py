@@ -0,0 +1,42 @@
+"""Разбор sql/*.sql на именованные выражения"""
+
+from sql_library import SqlLibrary, _with_clause
+
+
+def _parse(tmp_path, text):
+    path = tmp_path / 'report.sql'
+    path.write_text(text, encoding='utf-8')
+    return {statement.name: statement for statement in SqlLibrary.parse_file(path)}
+
+
+def test_parameters_become_positional(tmp_path):
+    statement = _parse(tmp_path, "SELECT * FROM orders WHERE d >= :start::date AND d < :end AND c = :start")['report']
+    assert statement.positional_sql == "SELECT * FROM orders WHERE d >= $1::date AND d < $2 AND c = $1"
+    assert statement.bind({'start': 1}) == (1, None)
+
+
+def test_statement_reading_previous_cte_gets_its_with(tmp_path):
+    statements = _parse(tmp_path, """
+-- Totals
+WITH paid AS (SELECT order_id, (status = ')') AS ok FROM payments),
+     per_order AS (SELECT order_id FROM paid WHERE ok)
+SELECT COUNT(*) FROM per_order;
+
+-- By order
+WITH extra AS (SELECT 1 AS x)
+SELECT * FROM per_order JOIN orders USING (order_id), extra;
+""")
+    by_order = statements['report.by_order']
+    clause, names = _with_clause(by_order.sql)
+    assert names == ['paid', 'per_order', 'extra']
+    assert "status = ')'" in clause
+    assert by_order.tables == ['orders', 'payments']
+
+
+def test_library_statements_are_self_contained():
+    library = SqlLibrary()
+    ctes = set()
+    for statement in library.statements.values():
+        ctes.update(_with_clause(statement.sql)[1])
+    assert not [name for name, statement in library.statements.items() if set(statement.tables) & ctes]
+    assert 'payment_analysis' in _with_clause(library.get('kpi_calculations.payment_conversion_by_channel').sql)[1]
@@ -0,0 +1,54 @@
+"""Окна временных рядов по непрерывному календарю"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from time_series import TimeSeriesEngine
+
+
+def _frame():
+    # 2024-01-02 и 2024-01-04..05 без заказов: в дневных суммах этих строк нет
+    return pd.DataFrame({
+        'order_date': pd.to_datetime(['2024-01-01', '2024-01-03', '2024-01-06', '2024-01-01', '2024-01-06']),
+        'region': ['north', 'north', 'north', 'south', 'south'],
+        'total_orders': [1.0, 2.0, 4.0, 10.0, 20.0],
+    })
+
+
+def test_windows_count_calendar_days_not_rows():
+    result = TimeSeriesEngine(windows=(3,), wow_lag=2, yoy_lag=4).compute(_frame(), metrics=('total_orders',))
+
+    assert result['order_date'].dt.strftime('%m-%d').tolist() == ['01-01', '01-02', '01-03', '01-04', '01-05', '01-06']
+    assert result['total_orders'].tolist() == [11.0, 0.0, 2.0, 0.0, 0.0, 24.0]
+    # Окно 3 дня: первые два дня без полного окна — NaN, затем суммы по календарю
+    sums = result['total_orders_3d_sum'].tolist()
+    assert np.isnan(sums[:2]).all()
+    assert sums[2:] == [13.0, 2.0, 2.0, 24.0]
+    assert result['total_orders_3d_avg'].tolist()[2] == pytest.approx(4.33)
+
+
+def test_lag_changes_and_percent_without_base():
+    result = TimeSeriesEngine(windows=(1,), wow_lag=1, yoy_lag=5).compute(_frame(), metrics=('total_orders',))
+    wow = result['total_orders_wow'].tolist()
+    assert np.isnan(wow[0])
+    assert wow[1:] == [-11.0, 2.0, -2.0, 0.0, 24.0]
+    # База сравнения 0 — доля не определена
+    assert np.isnan(result['total_orders_wow_pct'].tolist()[2])
+    assert result['total_orders_yoy'].tolist()[5] == 13.0
+
+
+def test_groups_and_explicit_calendar_bounds():
+    result = TimeSeriesEngine(windows=(2,)).compute(
+        _frame(), metrics=('total_orders',), by='region', start_date='2024-01-03', end_date='2024-01-08'
+    )
+    assert result['group'].unique().tolist() == ['north', 'south']
+    north = result[result['group'] == 'north']
+    # Строки вне календаря отброшены, дни после последнего заказа — нули
+    assert north['total_orders'].tolist() == [2.0, 0.0, 0.0, 4.0, 0.0, 0.0]
+    assert north['total_orders_2d_sum'].tolist()[1:] == [2.0, 0.0, 4.0, 4.0, 0.0]
+
+
+def test_unknown_grouping_rejected():
+    with pytest.raises(ValueError):
+        TimeSeriesEngine().compute_groups(_frame(), metrics=('total_orders',), groupings=('planet',))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Временные ряды с окнами по полному календарю
+Дневные суммы раскладываются на непрерывный календарь (дни без заказов — нули),
+скользящие суммы и средние за 7/30/90 дней, изменения неделя к неделе и год к году
+считаются векторно через кумулятивные суммы — для всех групп (регионов, сегментов) сразу
+"""
+
+import logging
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from kpi_cube import ADDITIVE_METRICS, CUBE_PARTITION_QUERY, DIMENSIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOWS = (7, 30, 90)
+DEFAULT_SERIES_METRICS = ('total_orders', 'paid_orders', 'net_revenue', 'units_sold')
+# Сравнение по 7-дневным суммам: неделя назад и 52 недели назад (те же дни недели)
+WOW_LAG_DAYS = 7
+YOY_LAG_DAYS = 364
+# Период выгрузки рядов: год истории для сравнения год к году и год рядов с окнами
+DEFAULT_HISTORY_DAYS = 2 * 365
+TOTAL_GROUP = 'Все'
+
+
+def load_daily_frame(conn, start_date, end_date):
+    """
+    Дневные суммы по дате × измерениям KPI-куба (регион, сегмент, ...) одним запросом
+    за период [start_date, end_date]; группировка по любому измерению — в Python
+    """
+    with conn.cursor() as cur:
+        cur.execute(CUBE_PARTITION_QUERY, {'start_date': start_date, 'end_date': end_date + timedelta(days=1)})
+        columns = [desc[0] for desc in cur.description]
+        frame = pd.DataFrame(cur.fetchall(), columns=columns)
+    conn.commit()
+    for col in ADDITIVE_METRICS:
+        frame[col] = frame[col].astype('float64')
+    return frame
+
+
+def _lag_delta(values, lag):
+    """Разность с значением lag дней назад и ее доля в процентах (NaN без базы сравнения)"""
+    delta = np.full(values.shape, np.nan)
+    percent = np.full(values.shape, np.nan)
+    if lag < values.shape[1]:
+        previous = values[:, :-lag]
+        delta[:, lag:] = values[:, lag:] - previous
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent[:, lag:] = np.where(previous > 0, delta[:, lag:] / previous * 100, np.nan)
+    return delta, percent
+
+
+class TimeSeriesEngine:
+    """
+    Окна по непрерывному календарю.
+
+    Дни без заказов в агрегатах отсутствуют, поэтому окно «7 строк» в SQL
+    покрывает больше 7 дней. Здесь строки группы и даты кодируются целыми
+    индексами, суммы раскладываются в матрицу группа × день одним np.bincount,
+    а сумма любого окна — разность двух точек кумулятивной суммы: все окна
+    и все группы считаются за один проход без цикла по дням.
+    Окна, не поместившиеся в календарь (первые w-1 дней), — NaN.
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS, wow_lag=WOW_LAG_DAYS, yoy_lag=YOY_LAG_DAYS):
+        self.windows = tuple(sorted(windows))
+        self.wow_lag = wow_lag
+        self.yoy_lag = yoy_lag
+
+    def calendar(self, frame, metrics, by=None, start_date=None, end_date=None, date_col='order_date'):
+        """Матрицы группа × день по метрикам: (календарь, группы, {метрика: ndarray})"""
+        days = pd.to_datetime(frame[date_col]).to_numpy().astype('datetime64[D]')
+        start = np.datetime64(start_date, 'D') if start_date is not None else days.min()
+        end = np.datetime64(end_date, 'D') if end_date is not None else days.max()
+        n_days = int((end - start).astype(np.int64)) + 1
+
+        day_index = (days - start).astype(np.int64)
+        inside = (day_index >= 0) & (day_index < n_days)
+        if by:
+            codes, groups = pd.factorize(frame[by].astype(object).fillna('—'), sort=True)
+            groups = list(groups)
+        else:
+            codes, groups = np.zeros(len(frame), dtype=np.int64), [TOTAL_GROUP]
+        flat = codes[inside] * n_days + day_index[inside]
+
+        size = len(groups) * n_days
+        matrices = {
+            metric: np.bincount(
+                flat, weights=frame[metric].to_numpy(dtype='float64')[inside], minlength=size
+            ).reshape(len(groups), n_days)
+            for metric in metrics
+        }
+        return start + np.arange(n_days), groups, matrices
+
+    def window_sums(self, values, window):
+        """Скользящая сумма за window дней по кумулятивной сумме"""
+        cumulative = np.zeros((values.shape[0], values.shape[1] + 1))
+        np.cumsum(values, axis=1, out=cumulative[:, 1:])
+        sums = np.full(values.shape, np.nan)
+        if window <= values.shape[1]:
+            sums[:, window - 1:] = cumulative[:, window:] - cumulative[:, :-window]
+        return sums
+
+    def compute(self, frame, metrics=DEFAULT_SERIES_METRICS, by=None, start_date=None, end_date=None):
+        """
+        Ряды с окнами в длинном формате: group_by, group, order_date, дневное значение
+        метрики, {метрика}_{w}d_sum / _{w}d_avg, изменения _wow / _yoy и их доли в % (_pct)
+        """
+        calendar, groups, matrices = self.calendar(frame, metrics, by, start_date, end_date)
+        n_groups, n_days = len(groups), len(calendar)
+
+        columns = {
+            'group_by': np.full(n_groups * n_days, by or 'total', dtype=object),
+            'group': np.repeat(np.asarray(groups, dtype=object), n_days),
+            'order_date': np.tile(calendar, n_groups)
+        }
+        for metric, values in matrices.items():
+            columns[metric] = values.ravel()
+            sums = {window: self.window_sums(values, window) for window in set(self.windows) | {self.wow_lag}}
+            for window in self.windows:
+                columns[f'{metric}_{window}d_sum'] = sums[window].ravel()
+                columns[f'{metric}_{window}d_avg'] = (sums[window] / window).ravel()
+
+            weekly = sums[self.wow_lag]
+            for suffix, lag in (('wow', self.wow_lag), ('yoy', self.yoy_lag)):
+                delta, percent = _lag_delta(weekly, lag)
+                columns[f'{metric}_{suffix}'] = delta.ravel()
+                columns[f'{metric}_{suffix}_pct'] = percent.ravel()
+
+        result = pd.DataFrame(columns)
+        value_columns = result.columns[3:]
+        result[value_columns] = result[value_columns].round(2)
+        return result
+
+    def compute_groups(self, frame, metrics=DEFAULT_SERIES_METRICS, groupings=(None, 'region', 'segment'),
+                       start_date=None, end_date=None):
+        """Ряды по нескольким группировкам (None — итог) из одних дневных сумм"""
+        unknown = [by for by in groupings if by is not None and by not in DIMENSIONS]
+        unknown += [metric for metric in metrics if metric not in ADDITIVE_METRICS]
+        if unknown:
+            raise ValueError(f"Неизвестные метрики или измерения: {', '.join(unknown)}")
+        return pd.concat(
+            [self.compute(frame, metrics, by, start_date, end_date) for by in groupings],
+            ignore_index=True
+        )
+
+
+def time_series_frame(conn, groupings=(None, 'region', 'segment'), metrics=DEFAULT_SERIES_METRICS,
+                      windows=DEFAULT_WINDOWS, history_days=DEFAULT_HISTORY_DAYS, end_date=None):
+    """Ряды с окнами за последние history_days дней по календарю до end_date (по умолчанию сегодня)"""
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=history_days - 1)
+    frame = load_daily_frame(conn, start_date, end_date)
+    result = TimeSeriesEngine(windows).compute_groups(frame, metrics, groupings, start_date, end_date)
+    logger.info(
+        f"📈 Временные ряды: {len(frame):,} дневных строк → {len(result):,} строк календаря "
+        f"({', '.join(by or 'total' for by in groupings)}; окна {', '.join(map(str, windows))} дн.)"
+    )
+    return result
@@ -3,20 +3,8 @@
 
 WITH geographic_analysis AS (
   SELECT 
-    -- Извлечение региона из адреса доставки
-    CASE 
-      WHEN o.shipping_address LIKE '%Москва%' OR o.shipping_address LIKE '%Moscow%' THEN 'Москва'
-      WHEN o.shipping_address LIKE '%Санкт-Петербург%' OR o.shipping_address LIKE '%СПб%' THEN 'Санкт-Петербург'
-      WHEN o.shipping_address LIKE '%Екатеринбург%' THEN 'Екатеринбург'
-      WHEN o.shipping_address LIKE '%Новосибирск%' THEN 'Новосибирск'
-      WHEN o.shipping_address LIKE '%Казань%' THEN 'Казань'
-      WHEN o.shipping_address LIKE '%Нижний Новгород%' THEN 'Нижний Новгород'
-      WHEN o.shipping_address LIKE '%Челябинск%' THEN 'Челябинск'
-      WHEN o.shipping_address LIKE '%Самара%' THEN 'Самара'
-      WHEN o.shipping_address LIKE '%Омск%' THEN 'Омск'
-      WHEN o.shipping_address LIKE '%Ростов%' THEN 'Ростов-на-Дону'
-      ELSE 'Другие регионы'
-    END as region,
+    -- Регион из справочника address_regions (scripts/region_resolver.py, города — region_aliases.json)
+    COALESCE(ar.region, 'Другие регионы') as region,
     
     -- Определение канала (условно, по времени заказа или другим признакам)
     CASE 
@@ -53,6 +41,7 @@ WITH geographic_analysis AS (
 
   FROM orders o
   LEFT JOIN customers c ON o.customer_id = c.id
+  LEFT JOIN address_regions ar ON ar.address_hash = md5(o.shipping_address::text)
   WHERE 1=1
     AND ($start_date IS NULL OR o.order_date >= $start_date::date)
     AND ($end_date IS NULL OR o.order_date <= $end_date::date)